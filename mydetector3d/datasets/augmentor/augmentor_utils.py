@@ -118,6 +118,71 @@ def global_scaling_with_roi_boxes(gt_boxes, roi_boxes, points, scale_range, retu
     return gt_boxes, roi_boxes, points
 
 
+def get_global_affine(steps):
+    """
+    Composes the global augmentations into one transform
+    Args:
+        steps: list of (name, value) in the order they are applied: ('flip_x', enable), ('flip_y', enable),
+            ('rotation', angle), ('scaling', scale), ('translation', (1, 3) array)
+    Returns:
+        lidar_aug_matrix: (4, 4), augmented = lidar_aug_matrix @ [x, y, z, 1]
+        heading_sign, heading_offset: augmented heading = heading_sign * heading + heading_offset
+        extra_scale: scale of the box columns after the heading (velocity and extra attributes)
+    """
+    lidar_aug_matrix = np.eye(4)
+    heading_sign, heading_offset, extra_scale = 1.0, 0.0, 1.0
+    for name, value in steps:
+        step_matrix = np.eye(4)
+        if name == 'flip_x':
+            if not value:
+                continue
+            step_matrix[1, 1] = -1
+            heading_sign, heading_offset = -heading_sign, -heading_offset
+        elif name == 'flip_y':
+            if not value:
+                continue
+            step_matrix[0, 0] = -1
+            heading_sign, heading_offset = -heading_sign, -(heading_offset + np.pi)
+        elif name == 'rotation':
+            cosa, sina = np.cos(value), np.sin(value)
+            step_matrix[:2, :2] = [[cosa, -sina], [sina, cosa]]
+            heading_offset += value
+        elif name == 'scaling':
+            step_matrix[:3, :3] *= value
+            extra_scale *= value
+        elif name == 'translation':
+            step_matrix[:3, 3] = np.asarray(value, dtype=np.float64).reshape(3)
+        else:
+            raise NotImplementedError(name)
+        lidar_aug_matrix = step_matrix @ lidar_aug_matrix
+    return lidar_aug_matrix, heading_sign, heading_offset, extra_scale
+
+
+def global_affine(gt_boxes, points, steps):
+    """
+    Flip / rotation / scaling / translation of the scene with one matmul for the points and the boxes,
+    the same result as random_flip_along_x/y, global_rotation, global_scaling and the translation applied in turn
+    Args:
+        gt_boxes: (N, 7 + C), [x, y, z, dx, dy, dz, heading, [vx], [vy], ...]
+        points: (M, 3 + C)
+        steps: see get_global_affine
+    Returns:
+        gt_boxes, points, lidar_aug_matrix (4, 4)
+    """
+    lidar_aug_matrix, heading_sign, heading_offset, extra_scale = get_global_affine(steps)
+    linear = lidar_aug_matrix[:3, :3]
+    points[:, :3] = points[:, :3] @ linear.T.astype(points.dtype) + lidar_aug_matrix[:3, 3].astype(points.dtype)
+    if gt_boxes.shape[0] > 0:
+        gt_boxes[:, :3] = gt_boxes[:, :3] @ linear.T.astype(gt_boxes.dtype) + lidar_aug_matrix[:3, 3].astype(gt_boxes.dtype)
+        gt_boxes[:, 3:6] *= extra_scale
+        gt_boxes[:, 6] = heading_sign * gt_boxes[:, 6] + heading_offset
+        if gt_boxes.shape[1] > 7:
+            #velocity: flips and rotation act on (vx, vy) like on (x, y), the scaling on all the extra columns
+            gt_boxes[:, 7:9] = gt_boxes[:, 7:9] @ linear[:2, :2].T.astype(gt_boxes.dtype)
+            gt_boxes[:, 9:] *= extra_scale
+    return gt_boxes, points, lidar_aug_matrix
+
+
 def random_image_flip_horizontal(image, depth_map, gt_boxes, calib):
     """
     Performs random horizontal flip augmentation
@@ -474,6 +539,182 @@ def get_points_in_box(points, gt_box):
     return points, mask
 
 
+def get_points_box_idxs(points, gt_boxes, margin=1e-1, cell_size=1.0):
+    """
+    Box of each point in one pass, the same test as get_points_in_box: the points are bucketed once on a bev grid
+    over the extent of the boxes, each box only tests the points of the grid cells under its rotated bev rectangle
+    Args:
+        points: (M, 3 + C)
+        gt_boxes: (N, 7 + C), [x, y, z, dx, dy, dz, heading, ...]
+        cell_size: bev grid cell (m)
+    Returns:
+        box_idxs: (M), index of the first box containing the point, -1 for the points outside all the boxes
+    """
+    box_idxs = np.full(points.shape[0], -1, dtype=np.int64)
+    if gt_boxes.shape[0] == 0 or points.shape[0] == 0:
+        return box_idxs
+    heading = gt_boxes[:, 6].astype(np.float64)
+    cosa, sina = np.abs(np.cos(heading)), np.abs(np.sin(heading))
+    half_x = gt_boxes[:, 3] / 2.0 + margin
+    half_y = gt_boxes[:, 4] / 2.0 + margin
+    half_extent = np.stack([half_x * cosa + half_y * sina, half_x * sina + half_y * cosa], axis=1)
+    box_min, box_max = gt_boxes[:, 0:2] - half_extent, gt_boxes[:, 0:2] + half_extent
+    grid_min = box_min.min(axis=0) - cell_size
+    grid_shape = np.ceil((box_max.max(axis=0) + cell_size - grid_min) / cell_size).astype(np.int64)
+
+    #cell of the points within the grid (nan coordinates fail the range check)
+    cell_xy = np.floor((points[:, 0:2] - grid_min) / cell_size)
+    valid = (cell_xy[:, 0] >= 0) & (cell_xy[:, 0] < grid_shape[0]) & (cell_xy[:, 1] >= 0) & (cell_xy[:, 1] < grid_shape[1])
+    valid_points = np.flatnonzero(valid)
+    cell_xy = cell_xy[valid].astype(np.int64)
+    keys = cell_xy[:, 0] * grid_shape[1] + cell_xy[:, 1]
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    #one contiguous key range per box and grid column
+    box_cell_min = np.floor((box_min - grid_min) / cell_size).astype(np.int64)
+    box_cell_max = np.floor((box_max - grid_min) / cell_size).astype(np.int64)
+    num_columns = box_cell_max[:, 0] - box_cell_min[:, 0] + 1
+    column_boxes = np.repeat(np.arange(gt_boxes.shape[0]), num_columns)
+    column_x = box_cell_min[column_boxes, 0] + \
+        np.arange(num_columns.sum()) - np.repeat(np.cumsum(num_columns) - num_columns, num_columns)
+    starts = np.searchsorted(sorted_keys, column_x * grid_shape[1] + box_cell_min[column_boxes, 1], side='left')
+    ends = np.searchsorted(sorted_keys, column_x * grid_shape[1] + box_cell_max[column_boxes, 1], side='right')
+    counts = ends - starts
+    if counts.sum() == 0:
+        return box_idxs
+
+    #(point, box) candidate pairs, grouped by box
+    cand_boxes = np.repeat(column_boxes, counts)
+    cand_offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cand_points = valid_points[order[np.repeat(starts, counts) + cand_offsets]]
+
+    boxes = gt_boxes[cand_boxes]
+    cosa = np.cos(-boxes[:, 6].astype(np.float64)).astype(points.dtype)
+    sina = np.sin(-boxes[:, 6].astype(np.float64)).astype(points.dtype)
+    shift = points[cand_points, :3] - boxes[:, :3]
+    local_x = shift[:, 0] * cosa + shift[:, 1] * (-sina)
+    local_y = shift[:, 0] * sina + shift[:, 1] * cosa
+    inside = (np.abs(shift[:, 2]) <= boxes[:, 5] / 2.0) & \
+             (np.abs(local_x) <= boxes[:, 3] / 2.0 + margin) & (np.abs(local_y) <= boxes[:, 4] / 2.0 + margin)
+    cand_points, cand_boxes = cand_points[inside], cand_boxes[inside]
+
+    #pairs are in box order, return_index gives the first box of each point
+    unique_points, first = np.unique(cand_points, return_index=True)
+    box_idxs[unique_points] = cand_boxes[first]
+    return box_idxs
+
+
+def random_local_translation_batched(gt_boxes, points, offset_range, along_axis_list, box_idxs=None):
+    """
+    random_local_translation_along_x / y / z for all the boxes at once, one offset per box and axis
+    (drawn in the same order as the per-box loops)
+    Args:
+        gt_boxes: (N, 7), [x, y, z, dx, dy, dz, heading, [vx], [vy]]
+        points: (M, 3 + C),
+        offset_range: [min max]]
+        along_axis_list: e.g. ['x', 'y', 'z']
+        box_idxs: optional (M), get_points_box_idxs
+    Returns:
+    """
+    if box_idxs is None:
+        box_idxs = get_points_box_idxs(points, gt_boxes)
+    in_box = box_idxs >= 0
+    point_boxes = box_idxs[in_box]
+    for cur_axis in along_axis_list:
+        axis = ['x', 'y', 'z'].index(cur_axis)
+        offsets = np.random.uniform(offset_range[0], offset_range[1], gt_boxes.shape[0])
+        points[in_box, axis] += offsets[point_boxes].astype(points.dtype)
+        gt_boxes[:, axis] += offsets.astype(gt_boxes.dtype)
+    return gt_boxes, points
+
+
+def local_scaling_batched(gt_boxes, points, scale_range, box_idxs=None):
+    """
+    local_scaling for all the boxes at once: the points of each box are scaled around its center
+    Args:
+        gt_boxes: (N, 7), [x, y, z, dx, dy, dz, heading]
+        points: (M, 3 + C),
+        scale_range: [min, max]
+        box_idxs: optional (M), get_points_box_idxs
+    Returns:
+    """
+    if scale_range[1] - scale_range[0] < 1e-3:
+        return gt_boxes, points
+    noise_scale = np.random.uniform(scale_range[0], scale_range[1], gt_boxes.shape[0])
+    if box_idxs is None:
+        box_idxs = get_points_box_idxs(points, gt_boxes)
+    in_box = box_idxs >= 0
+    point_boxes = box_idxs[in_box]
+    centers = gt_boxes[point_boxes, 0:3].astype(points.dtype)
+    points[in_box, :3] = (points[in_box, :3] - centers) * noise_scale[point_boxes, np.newaxis].astype(points.dtype) + centers
+    gt_boxes[:, 3:6] *= noise_scale[:, np.newaxis].astype(gt_boxes.dtype)
+    return gt_boxes, points
+
+
+def local_rotation_batched(gt_boxes, points, rot_range, box_idxs=None):
+    """
+    local_rotation for all the boxes at once: the points of each box are rotated around its center
+    Args:
+        gt_boxes: (N, 7), [x, y, z, dx, dy, dz, heading, [vx], [vy]]
+        points: (M, 3 + C),
+        rot_range: [min, max]
+        box_idxs: optional (M), get_points_box_idxs
+    Returns:
+    """
+    noise_rotation = np.random.uniform(rot_range[0], rot_range[1], gt_boxes.shape[0])
+    if box_idxs is None:
+        box_idxs = get_points_box_idxs(points, gt_boxes)
+    in_box = box_idxs >= 0
+    point_boxes = box_idxs[in_box]
+    cosa = np.cos(noise_rotation).astype(points.dtype)
+    sina = np.sin(noise_rotation).astype(points.dtype)
+
+    shift = points[in_box, 0:2] - gt_boxes[point_boxes, 0:2].astype(points.dtype)
+    point_cosa, point_sina = cosa[point_boxes], sina[point_boxes]
+    points[in_box, 0] = shift[:, 0] * point_cosa - shift[:, 1] * point_sina + gt_boxes[point_boxes, 0]
+    points[in_box, 1] = shift[:, 0] * point_sina + shift[:, 1] * point_cosa + gt_boxes[point_boxes, 1]
+
+    gt_boxes[:, 6] += noise_rotation.astype(gt_boxes.dtype)
+    if gt_boxes.shape[1] > 8:
+        vx, vy = gt_boxes[:, 7].copy(), gt_boxes[:, 8].copy()
+        gt_boxes[:, 7] = vx * cosa - vy * sina
+        gt_boxes[:, 8] = vx * sina + vy * cosa
+    return gt_boxes, points
+
+
+def local_frustum_dropout_batched(gt_boxes, points, intensity_range, direction, box_idxs=None):
+    """
+    local_frustum_dropout_top / bottom / left / right for all the boxes at once
+    Args:
+        gt_boxes: (N, 7), [x, y, z, dx, dy, dz, heading, [vx], [vy]],
+        points: (M, 3 + C),
+        intensity_range: [min, max]
+        direction: top, bottom, left or right
+        box_idxs: optional (M), get_points_box_idxs
+    Returns:
+        gt_boxes, points, box_idxs of the kept points
+    """
+    if box_idxs is None:
+        box_idxs = get_points_box_idxs(points, gt_boxes)
+    intensity = np.random.uniform(intensity_range[0], intensity_range[1], gt_boxes.shape[0])
+    axis, size_axis = (2, 5) if direction in ['top', 'bottom'] else (1, 4)
+    if direction in ['top', 'left']:
+        threshold = (gt_boxes[:, axis] + gt_boxes[:, size_axis] / 2) - intensity * gt_boxes[:, size_axis]
+    else:
+        threshold = (gt_boxes[:, axis] - gt_boxes[:, size_axis] / 2) + intensity * gt_boxes[:, size_axis]
+
+    in_box = box_idxs >= 0
+    point_threshold = threshold[box_idxs[in_box]]
+    if direction in ['top', 'left']:
+        dropped = points[in_box, axis] >= point_threshold
+    else:
+        dropped = points[in_box, axis] <= point_threshold
+    keep = np.ones(points.shape[0], dtype=np.bool_)
+    keep[np.flatnonzero(in_box)[dropped]] = False
+    return gt_boxes, points[keep], box_idxs[keep]
+
+
 def get_pyramids(boxes):
     pyramid_orders = np.array([
         [0, 1, 5, 4],
@@ -515,57 +756,130 @@ def points_in_pyramids_mask(points, pyramids):
     return flags
 
 
-def local_pyramid_dropout(gt_boxes, points, dropout_prob, pyramids=None):
-    if pyramids is None:
-        pyramids = get_pyramids(gt_boxes).reshape([-1, 6, 5, 3])  # each six surface of boxes: [num_boxes, 6, 15=3*5]
-    drop_pyramid_indices = np.random.randint(0, 6, (pyramids.shape[0]))
-    drop_pyramid_one_hot = one_hot(drop_pyramid_indices, num_class=6)
-    drop_box_mask = np.random.uniform(0, 1, (pyramids.shape[0])) <= dropout_prob
+#pyramid of get_pyramids for the (axis, side) of the largest normalized local coordinate
+PYRAMID_OF_FACE = np.array([[2, 0], [4, 5], [3, 1]])  # [axis x / y / z, negative / positive side]
+
+
+def get_points_pyramid_idxs(points, gt_boxes):
+    """
+    Pyramid of each point in one pass, without the Delaunay hulls of points_in_pyramids_mask: the points are
+    assigned to a box (get_points_box_idxs without margin), the face of the pyramid is the axis of the largest
+    |local coordinate| / half size in the frame of the box, its sign the side
+    Args:
+        points: (M, 3 + C)
+        gt_boxes: (N, 7 + C), [x, y, z, dx, dy, dz, heading, ...]
+    Returns:
+        pyramid_idxs: (M), box_idx * 6 + pyramid index of get_pyramids, -1 for the points outside all the boxes
+    """
+    box_idxs = get_points_box_idxs(points, gt_boxes, margin=0.0)
+    pyramid_idxs = np.full(points.shape[0], -1, dtype=np.int64)
+    in_box = np.flatnonzero(box_idxs >= 0)
+    if in_box.shape[0] == 0:
+        return pyramid_idxs
+    point_boxes = box_idxs[in_box]
+    boxes = gt_boxes[point_boxes].astype(np.float64)
+    shift = points[in_box, 0:3].astype(np.float64) - boxes[:, 0:3]
+    cosa, sina = np.cos(boxes[:, 6]), np.sin(boxes[:, 6])
+    local = np.stack([
+        shift[:, 0] * cosa + shift[:, 1] * sina,
+        -shift[:, 0] * sina + shift[:, 1] * cosa,
+        shift[:, 2]], axis=1) / np.maximum(boxes[:, 3:6] / 2.0, 1e-6)
+    axis = np.abs(local).argmax(axis=1)
+    side = (local[np.arange(local.shape[0]), axis] > 0).astype(np.int64)
+    pyramid_idxs[in_box] = point_boxes * 6 + PYRAMID_OF_FACE[axis, side]
+    return pyramid_idxs
+
+
+def get_pyramid_point_indices(pyramid_idxs, query_pyramid_idxs):
+    """
+    Returns:
+        point_indices: list of the indices (in point order) of the points of each queried pyramid
+    """
+    order = np.argsort(pyramid_idxs, kind='stable')
+    sorted_idxs = pyramid_idxs[order]
+    starts = np.searchsorted(sorted_idxs, query_pyramid_idxs, side='left')
+    ends = np.searchsorted(sorted_idxs, query_pyramid_idxs, side='right')
+    return [order[start:end] for start, end in zip(starts, ends)]
+
+
+def local_pyramid_dropout(gt_boxes, points, dropout_prob, pyramid_idxs=None, box_indices=None):
+    """
+    Args:
+        gt_boxes: (N, 7 + C)
+        points: (M, 3 + C)
+        dropout_prob: probability to drop the points of one random pyramid of a box
+        pyramid_idxs: optional (M), get_points_pyramid_idxs
+        box_indices: optional, indices of the boxes taking part (all by default)
+    Returns:
+        gt_boxes, points, pyramid_idxs of the kept points, box_indices without the dropped boxes
+    """
+    if pyramid_idxs is None:
+        pyramid_idxs = get_points_pyramid_idxs(points, gt_boxes)
+    if box_indices is None:
+        box_indices = np.arange(gt_boxes.shape[0])
+    drop_pyramid_indices = np.random.randint(0, 6, (box_indices.shape[0]))
+    drop_box_mask = np.random.uniform(0, 1, (box_indices.shape[0])) <= dropout_prob
     if np.sum(drop_box_mask) != 0:
-        drop_pyramid_mask = (np.tile(drop_box_mask[:, None], [1, 6]) * drop_pyramid_one_hot) > 0
-        drop_pyramids = pyramids[drop_pyramid_mask]
-        point_masks = points_in_pyramids_mask(points, drop_pyramids)
-        points = points[np.logical_not(point_masks.any(-1))]
+        drop_flags = np.zeros(gt_boxes.shape[0] * 6 + 1, dtype=np.bool_)  # last entry: points outside the boxes
+        drop_flags[box_indices[drop_box_mask] * 6 + drop_pyramid_indices[drop_box_mask]] = True
+        keep = np.logical_not(drop_flags[pyramid_idxs])
+        points, pyramid_idxs = points[keep], pyramid_idxs[keep]
     # print(drop_box_mask)
-    pyramids = pyramids[np.logical_not(drop_box_mask)]
-    return gt_boxes, points, pyramids
+    box_indices = box_indices[np.logical_not(drop_box_mask)]
+    return gt_boxes, points, pyramid_idxs, box_indices
 
 
-def local_pyramid_sparsify(gt_boxes, points, prob, max_num_pts, pyramids=None):
-    if pyramids is None:
-        pyramids = get_pyramids(gt_boxes).reshape([-1, 6, 5, 3])  # each six surface of boxes: [num_boxes, 6, 15=3*5]
-    if pyramids.shape[0] > 0:
+def local_pyramid_sparsify(gt_boxes, points, prob, max_num_pts, pyramid_idxs=None, box_indices=None):
+    """
+    Args:
+        gt_boxes: (N, 7 + C)
+        points: (M, 3 + C)
+        prob: probability to keep only max_num_pts points of one random pyramid of a box
+        pyramid_idxs, box_indices: see local_pyramid_dropout
+    Returns:
+        gt_boxes, points, pyramid_idxs of the points, box_indices without the sparsified boxes
+    """
+    if pyramid_idxs is None:
+        pyramid_idxs = get_points_pyramid_idxs(points, gt_boxes)
+    if box_indices is None:
+        box_indices = np.arange(gt_boxes.shape[0])
+    if box_indices.shape[0] > 0:
         sparsity_prob, sparsity_num = prob, max_num_pts
-        sparsify_pyramid_indices = np.random.randint(0, 6, (pyramids.shape[0]))
-        sparsify_pyramid_one_hot = one_hot(sparsify_pyramid_indices, num_class=6)
-        sparsify_box_mask = np.random.uniform(0, 1, (pyramids.shape[0])) <= sparsity_prob
-        sparsify_pyramid_mask = (np.tile(sparsify_box_mask[:, None], [1, 6]) * sparsify_pyramid_one_hot) > 0
+        sparsify_pyramid_indices = np.random.randint(0, 6, (box_indices.shape[0]))
+        sparsify_box_mask = np.random.uniform(0, 1, (box_indices.shape[0])) <= sparsity_prob
         # print(sparsify_box_mask)
-        
-        pyramid_sampled = pyramids[sparsify_pyramid_mask]  # (-1,6,5,3)[(num_sample,6)]
-        # print(pyramid_sampled.shape)
-        pyramid_sampled_point_masks = points_in_pyramids_mask(points, pyramid_sampled)
-        pyramid_sampled_points_num = pyramid_sampled_point_masks.sum(0)  # the number of points in each surface pyramid
-        valid_pyramid_sampled_mask = pyramid_sampled_points_num > sparsity_num  # only much than sparsity_num should be sparse
-        
+
+        pyramid_sampled = box_indices[sparsify_box_mask] * 6 + sparsify_pyramid_indices[sparsify_box_mask]
+        pyramid_points_num = np.bincount(pyramid_idxs + 1, minlength=gt_boxes.shape[0] * 6 + 1)[1:]
+        valid_pyramid_sampled_mask = pyramid_points_num[pyramid_sampled] > sparsity_num  # only much than sparsity_num should be sparse
+
         sparsify_pyramids = pyramid_sampled[valid_pyramid_sampled_mask]
         if sparsify_pyramids.shape[0] > 0:
-            point_masks = pyramid_sampled_point_masks[:, valid_pyramid_sampled_mask]
-            remain_points = points[
-                np.logical_not(point_masks.any(-1))]  # points which outside the down sampling pyramid
-            to_sparsify_points = [points[point_masks[:, i]] for i in range(point_masks.shape[1])]
-            
-            sparsified_points = []
-            for sample in to_sparsify_points:
-                sampled_indices = np.random.choice(sample.shape[0], size=sparsity_num, replace=False)
-                sparsified_points.append(sample[sampled_indices])
-            sparsified_points = np.concatenate(sparsified_points, axis=0)
-            points = np.concatenate([remain_points, sparsified_points], axis=0)
-        pyramids = pyramids[np.logical_not(sparsify_box_mask)]
-    return gt_boxes, points, pyramids
+            sparsify_flags = np.zeros(gt_boxes.shape[0] * 6 + 1, dtype=np.bool_)
+            sparsify_flags[sparsify_pyramids] = True
+            remain_mask = np.logical_not(sparsify_flags[pyramid_idxs])  # points which outside the down sampling pyramid
+
+            sparsified_points, sparsified_idxs = [points[remain_mask]], [pyramid_idxs[remain_mask]]
+            for cur_pyramid, point_indices in zip(sparsify_pyramids, get_pyramid_point_indices(pyramid_idxs, sparsify_pyramids)):
+                sampled_indices = np.random.choice(point_indices.shape[0], size=sparsity_num, replace=False)
+                sparsified_points.append(points[point_indices[sampled_indices]])
+                sparsified_idxs.append(np.full(sparsity_num, cur_pyramid, dtype=np.int64))
+            points = np.concatenate(sparsified_points, axis=0)
+            pyramid_idxs = np.concatenate(sparsified_idxs, axis=0)
+        box_indices = box_indices[np.logical_not(sparsify_box_mask)]
+    return gt_boxes, points, pyramid_idxs, box_indices
 
 
-def local_pyramid_swap(gt_boxes, points, prob, max_num_pts, pyramids=None):
+def local_pyramid_swap(gt_boxes, points, prob, max_num_pts, pyramid_idxs=None, box_indices=None):
+    """
+    Args:
+        gt_boxes: (N, 7 + C)
+        points: (M, 3 + C)
+        prob: probability to swap the points of one random pyramid of a box with the same pyramid of another box
+        pyramid_idxs, box_indices: see local_pyramid_dropout
+    Returns:
+        gt_boxes, points
+    """
     def get_points_ratio(points, pyramid):
         surface_center = (pyramid[3:6] + pyramid[6:9] + pyramid[9:12] + pyramid[12:]) / 4.0
         vector_0, vector_1, vector_2 = pyramid[6:9] - pyramid[3:6], pyramid[12:] - pyramid[3:6], pyramid[0:3] - surface_center
@@ -585,14 +899,17 @@ def local_pyramid_swap(gt_boxes, points, prob, max_num_pts, pyramids=None):
         return points_intensity_ratio * (max_intensity - min_intensity) + min_intensity
     
     # swap partition
-    if pyramids is None:
-        pyramids = get_pyramids(gt_boxes).reshape([-1, 6, 5, 3])  # each six surface of boxes: [num_boxes, 6, 15=3*5]
+    if pyramid_idxs is None:
+        pyramid_idxs = get_points_pyramid_idxs(points, gt_boxes)
+    if box_indices is None:
+        box_indices = np.arange(gt_boxes.shape[0])
     swap_prob, num_thres = prob, max_num_pts
-    swap_pyramid_mask = np.random.uniform(0, 1, (pyramids.shape[0])) <= swap_prob
+    swap_pyramid_mask = np.random.uniform(0, 1, (box_indices.shape[0])) <= swap_prob
     
     if swap_pyramid_mask.sum() > 0:
-        point_masks = points_in_pyramids_mask(points, pyramids)
-        point_nums = point_masks.sum(0).reshape(pyramids.shape[0], -1)  # [N, 6]
+        pyramids = get_pyramids(gt_boxes[box_indices]).reshape([-1, 6, 5, 3])  # each six surface of boxes: [num_boxes, 6, 15=3*5]
+        pyramid_points_num = np.bincount(pyramid_idxs + 1, minlength=gt_boxes.shape[0] * 6 + 1)[1:]
+        point_nums = pyramid_points_num[box_indices[:, None] * 6 + np.arange(6)[None, :]]  # [N, 6]
         non_zero_pyramids_mask = point_nums > num_thres  # ingore dropout pyramids or highly occluded pyramids
         selected_pyramids = non_zero_pyramids_mask * swap_pyramid_mask[:,
                                                      None]  # selected boxes and all their valid pyramids
@@ -617,9 +934,13 @@ def local_pyramid_swap(gt_boxes, points, prob, max_num_pts, pyramids=None):
                 swapped_indicies[:, 0].astype(np.int32), swapped_indicies[:, 1].astype(np.int32)]
             
             # concat to_swap&swapped pyramids
-            swap_pyramids = np.concatenate([to_swap_pyramids, swapped_pyramids], axis=0)
-            swap_point_masks = points_in_pyramids_mask(points, swap_pyramids)
-            remain_points = points[np.logical_not(swap_point_masks.any(-1))]
+            to_swap_idxs = box_indices[index_i] * 6 + index_j
+            swapped_idxs = box_indices[swapped_indicies[:, 0].astype(np.int64)] * 6 + index_j
+            swap_point_indices = get_pyramid_point_indices(pyramid_idxs, np.concatenate([to_swap_idxs, swapped_idxs]))
+            swap_flags = np.zeros(gt_boxes.shape[0] * 6 + 1, dtype=np.bool_)
+            swap_flags[to_swap_idxs] = True
+            swap_flags[swapped_idxs] = True
+            remain_points = points[np.logical_not(swap_flags[pyramid_idxs])]
             
             # swap pyramids
             points_res = []
@@ -628,8 +949,8 @@ def local_pyramid_swap(gt_boxes, points, prob, max_num_pts, pyramids=None):
                 to_swap_pyramid = to_swap_pyramids[i]
                 swapped_pyramid = swapped_pyramids[i]
                 
-                to_swap_points = points[swap_point_masks[:, i]]
-                swapped_points = points[swap_point_masks[:, i + num_swapped_pyramids]]
+                to_swap_points = points[swap_point_indices[i]]
+                swapped_points = points[swap_point_indices[i + num_swapped_pyramids]]
                 # for intensity transform
                 to_swap_points_intensity_ratio = (to_swap_points[:, -1:] - to_swap_points[:, -1:].min()) / \
                                                  np.clip(
@@ -1,6 +1,7 @@
 from functools import partial
 
 import numpy as np
+from easydict import EasyDict
 from PIL import Image
 
 from ...utils import common_utils
@@ -16,6 +17,7 @@ class DataAugmentor(object):
         self.data_augmentor_queue = []
         aug_config_list = augmentor_configs if isinstance(augmentor_configs, list) \
             else augmentor_configs.AUG_CONFIG_LIST
+        aug_config_list = self.fuse_global_augmentations(augmentor_configs, aug_config_list)
 
         for cur_cfg in aug_config_list:
             if not isinstance(augmentor_configs, list):
@@ -28,6 +30,7 @@ class DataAugmentor(object):
         self.data_augmentor_queue = []
         aug_config_list = augmentor_configs if isinstance(augmentor_configs, list) \
             else augmentor_configs.AUG_CONFIG_LIST
+        aug_config_list = self.fuse_global_augmentations(augmentor_configs, aug_config_list)
 
         for cur_cfg in aug_config_list:
             if not isinstance(augmentor_configs, list):
@@ -35,7 +38,27 @@ class DataAugmentor(object):
                     continue
             cur_augmentor = getattr(self, cur_cfg.NAME)(config=cur_cfg)
             self.data_augmentor_queue.append(cur_augmentor)
-             
+
+    GLOBAL_AUG_NAMES = ['random_world_flip', 'random_world_rotation', 'random_world_scaling', 'random_world_translation']
+
+    def fuse_global_augmentations(self, augmentor_configs, aug_config_list):
+        """
+        FUSE_GLOBAL_AUG: True replaces each run of consecutive random_world_flip / rotation / scaling / translation
+        configs by one random_world_affine (same random draws, one matmul for points and boxes)
+        """
+        if isinstance(augmentor_configs, list) or not augmentor_configs.get('FUSE_GLOBAL_AUG', False):
+            return aug_config_list
+        disable_list = augmentor_configs.get('DISABLE_AUG_LIST', [])
+        fused_list = []
+        for cur_cfg in aug_config_list:
+            if cur_cfg.NAME not in self.GLOBAL_AUG_NAMES or cur_cfg.NAME in disable_list:
+                fused_list.append(cur_cfg)
+                continue
+            if len(fused_list) == 0 or fused_list[-1].NAME != 'random_world_affine':
+                fused_list.append(EasyDict({'NAME': 'random_world_affine', 'AUG_LIST': []}))
+            fused_list[-1].AUG_LIST.append(cur_cfg)
+        return fused_list
+
     def gt_sampling(self, config=None):
         db_sampler = database_sampler.DataBaseSampler(
             root_path=self.root_path,
@@ -155,6 +178,64 @@ class DataAugmentor(object):
         data_dict['noise_translate'] = noise_translate
         return data_dict
 
+    def random_world_affine(self, data_dict=None, config=None):
+        """
+        random_world_flip / rotation / scaling / translation of config.AUG_LIST in one pass: the parameters are
+        drawn in the order and with the same np.random calls as the separate augmentations, composed to a 4x4
+        matrix and applied once to points and boxes. Sets flip_*, noise_* and lidar_aug_matrix.
+        """
+        if data_dict is None:
+            return partial(self.random_world_affine, config=config)
+        if 'roi_boxes' in data_dict.keys():
+            #sequences with roi_boxes use the separate augmentations
+            for cur_cfg in config['AUG_LIST']:
+                data_dict = getattr(self, cur_cfg['NAME'])(data_dict=data_dict, config=cur_cfg)
+            return data_dict
+
+        steps = []
+        for cur_cfg in config['AUG_LIST']:
+            name = cur_cfg['NAME']
+            if name == 'random_world_flip':
+                for cur_axis in cur_cfg['ALONG_AXIS_LIST']:
+                    assert cur_axis in ['x', 'y']
+                    enable = np.random.choice([False, True], replace=False, p=[0.5, 0.5])
+                    steps.append(('flip_%s' % cur_axis, enable))
+                    data_dict['flip_%s' % cur_axis] = enable
+            elif name == 'random_world_rotation':
+                rot_range = cur_cfg['WORLD_ROT_ANGLE']
+                if not isinstance(rot_range, list):
+                    rot_range = [-rot_range, rot_range]
+                noise_rot = np.random.uniform(rot_range[0], rot_range[1])
+                steps.append(('rotation', noise_rot))
+                data_dict['noise_rot'] = noise_rot
+            elif name == 'random_world_scaling':
+                scale_range = cur_cfg['WORLD_SCALE_RANGE']
+                if scale_range[1] - scale_range[0] < 1e-3:
+                    continue
+                noise_scale = np.random.uniform(scale_range[0], scale_range[1])
+                steps.append(('scaling', noise_scale))
+                data_dict['noise_scale'] = noise_scale
+            elif name == 'random_world_translation':
+                noise_translate_std = cur_cfg['NOISE_TRANSLATE_STD']
+                assert len(noise_translate_std) == 3
+                noise_translate = np.array([
+                    np.random.normal(0, noise_translate_std[0], 1),
+                    np.random.normal(0, noise_translate_std[1], 1),
+                    np.random.normal(0, noise_translate_std[2], 1),
+                ], dtype=np.float32).T
+                steps.append(('translation', noise_translate))
+                data_dict['noise_translate'] = noise_translate
+            else:
+                raise NotImplementedError(name)
+
+        gt_boxes, points, lidar_aug_matrix = augmentor_utils.global_affine(
+            data_dict['gt_boxes'], data_dict['points'], steps
+        )
+        data_dict['gt_boxes'] = gt_boxes
+        data_dict['points'] = points
+        data_dict['lidar_aug_matrix'] = lidar_aug_matrix
+        return data_dict
+
     def random_local_translation(self, data_dict=None, config=None):
         """
         Please check the correctness of it before using.
@@ -163,11 +244,18 @@ class DataAugmentor(object):
             return partial(self.random_local_translation, config=config)
         offset_range = config['LOCAL_TRANSLATION_RANGE']
         gt_boxes, points = data_dict['gt_boxes'], data_dict['points']
-        for cur_axis in config['ALONG_AXIS_LIST']:
-            assert cur_axis in ['x', 'y', 'z']
-            gt_boxes, points = getattr(augmentor_utils, 'random_local_translation_along_%s' % cur_axis)(
-                gt_boxes, points, offset_range,
+        if config.get('BATCHED', False):
+            #points assigned to the boxes once, all the boxes moved together
+            assert all([cur_axis in ['x', 'y', 'z'] for cur_axis in config['ALONG_AXIS_LIST']])
+            gt_boxes, points = augmentor_utils.random_local_translation_batched(
+                gt_boxes, points, offset_range, config['ALONG_AXIS_LIST']
             )
+        else:
+            for cur_axis in config['ALONG_AXIS_LIST']:
+                assert cur_axis in ['x', 'y', 'z']
+                gt_boxes, points = getattr(augmentor_utils, 'random_local_translation_along_%s' % cur_axis)(
+                    gt_boxes, points, offset_range,
+                )
 
         data_dict['gt_boxes'] = gt_boxes
         data_dict['points'] = points
@@ -182,7 +270,9 @@ class DataAugmentor(object):
         rot_range = config['LOCAL_ROT_ANGLE']
         if not isinstance(rot_range, list):
             rot_range = [-rot_range, rot_range]
-        gt_boxes, points = augmentor_utils.local_rotation(
+        local_rotation = augmentor_utils.local_rotation_batched if config.get('BATCHED', False) \
+            else augmentor_utils.local_rotation
+        gt_boxes, points = local_rotation(
             data_dict['gt_boxes'], data_dict['points'], rot_range=rot_range
         )
 
@@ -196,7 +286,9 @@ class DataAugmentor(object):
         """
         if data_dict is None:
             return partial(self.random_local_scaling, config=config)
-        gt_boxes, points = augmentor_utils.local_scaling(
+        local_scaling = augmentor_utils.local_scaling_batched if config.get('BATCHED', False) \
+            else augmentor_utils.local_scaling
+        gt_boxes, points = local_scaling(
             data_dict['gt_boxes'], data_dict['points'], config['LOCAL_SCALE_RANGE']
         )
 
@@ -232,11 +324,18 @@ class DataAugmentor(object):
 
         intensity_range = config['INTENSITY_RANGE']
         gt_boxes, points = data_dict['gt_boxes'], data_dict['points']
+        box_idxs = None
         for direction in config['DIRECTION']:
             assert direction in ['top', 'bottom', 'left', 'right']
-            gt_boxes, points = getattr(augmentor_utils, 'local_frustum_dropout_%s' % direction)(
-                gt_boxes, points, intensity_range,
-            )
+            if config.get('BATCHED', False):
+                #the point to box assignment is computed once and filtered with the points
+                gt_boxes, points, box_idxs = augmentor_utils.local_frustum_dropout_batched(
+                    gt_boxes, points, intensity_range, direction, box_idxs=box_idxs
+                )
+            else:
+                gt_boxes, points = getattr(augmentor_utils, 'local_frustum_dropout_%s' % direction)(
+                    gt_boxes, points, intensity_range,
+                )
 
         data_dict['gt_boxes'] = gt_boxes
         data_dict['points'] = points
@@ -252,15 +351,16 @@ class DataAugmentor(object):
 
         gt_boxes, points = data_dict['gt_boxes'], data_dict['points']
 
-        gt_boxes, points, pyramids = augmentor_utils.local_pyramid_dropout(gt_boxes, points, config['DROP_PROB'])
-        gt_boxes, points, pyramids = augmentor_utils.local_pyramid_sparsify(gt_boxes, points,
+        #pyramid of each point computed once, carried through the three steps with the boxes still taking part
+        gt_boxes, points, pyramid_idxs, box_indices = augmentor_utils.local_pyramid_dropout(gt_boxes, points, config['DROP_PROB'])
+        gt_boxes, points, pyramid_idxs, box_indices = augmentor_utils.local_pyramid_sparsify(gt_boxes, points,
                                                                             config['SPARSIFY_PROB'],
                                                                             config['SPARSIFY_MAX_NUM'],
-                                                                            pyramids)
+                                                                            pyramid_idxs, box_indices)
         gt_boxes, points = augmentor_utils.local_pyramid_swap(gt_boxes, points,
                                                                  config['SWAP_PROB'],
                                                                  config['SWAP_MAX_NUM'],
-                                                                 pyramids)
+                                                                 pyramid_idxs, box_indices)
         data_dict['gt_boxes'] = gt_boxes
         data_dict['points'] = points
         return data_dict
@@ -9,7 +9,7 @@ import SharedArray
 import torch.distributed as dist
 
 from ...ops.iou3d_nms import iou3d_nms_utils
-from ...utils import box_utils, common_utils, calibration_kitti
+from ...utils import box_utils, common_utils, calibration_kitti, frame_store_utils
 from mydetector3d.datasets.kitti.kitti_object_eval_python import kitti_common
 
 class DataBaseSampler(object):
@@ -27,6 +27,9 @@ class DataBaseSampler(object):
             self.db_infos[class_name] = []
 
         self.use_shared_memory = sampler_cfg.get('USE_SHARED_MEMORY', False)
+        self.db_backend = sampler_cfg.get('DB_BACKEND', 'file')
+        self.batched_placement = sampler_cfg.get('BATCHED_PLACEMENT', False) #one collision pass for all the classes
+        self.remove_points_grid_size = sampler_cfg.get('REMOVE_POINTS_GRID_SIZE', 1.0)
 
         for db_info_path in sampler_cfg.DB_INFO_PATH:
             db_info_path = self.root_path.resolve() / db_info_path
@@ -45,6 +48,7 @@ class DataBaseSampler(object):
             self.db_infos = getattr(self, func_name)(self.db_infos, val)
 
         self.gt_database_data_key = self.load_db_to_shared_memory() if self.use_shared_memory else None
+        self.gt_database_store = self.load_packed_gt_database() if self.db_backend == 'packed' else None
 
         self.sample_groups = {}
         self.sample_class_num = {}
@@ -98,6 +102,141 @@ class DataBaseSampler(object):
         self.logger.info('GT database has been saved to shared memory')
         return sa_key
 
+    def load_packed_gt_database(self):
+        """
+        Pack the gt_database/*.bin object files of every DB_INFO_PATH into one memory-mapped file with an offset
+        index (frame_store_utils format, keyed by the object path), converted once from the dbinfos pkl
+        """
+        cur_rank, world_size, num_gpus = common_utils.get_dist_info(return_gpu_per_machine=True)
+        store_prefixes = []
+        for db_info_path in self.sampler_cfg.DB_INFO_PATH:
+            db_info_path = self.root_path.resolve() / db_info_path
+            store_prefix = db_info_path.parent / (db_info_path.stem + '_packed')
+            _, index_file = frame_store_utils.get_store_files(store_prefix)
+            need_update = not frame_store_utils.is_store_complete(store_prefix) or \
+                os.path.getmtime(index_file) < os.path.getmtime(db_info_path)
+            if cur_rank % max(num_gpus, 1) == 0 and need_update:
+                if self.logger is not None:
+                    self.logger.info('Packing GT database of %s' % db_info_path)
+                with open(str(db_info_path), 'rb') as f:
+                    infos = pickle.load(f)
+                obj_infos = [info for cur_infos in infos.values() for info in cur_infos]
+                frame_store_utils.write_packed_frame_store(
+                    store_prefix, keys=[info['path'] for info in obj_infos],
+                    points_files=[self.root_path / info['path'] for info in obj_infos],
+                    num_features=self.sampler_cfg.NUM_POINT_FEATURES,
+                    num_points_list=[info['num_points_in_gt'] for info in obj_infos]
+                )
+            store_prefixes.append(store_prefix)
+
+        if world_size > 1:
+            dist.barrier()
+        gt_database_store = frame_store_utils.PackedFrameStore(store_prefixes)
+        if self.logger is not None:
+            self.logger.info('Total objects in packed GT database: %d' % len(gt_database_store))
+        return gt_database_store
+
+    def load_packed_object_points(self, total_valid_sampled_dict, mv_height=None):
+        """
+        Gather the memory-mapped object points with a single copy and move them to their boxes in one pass
+        """
+        obj_points_list = [self.gt_database_store.get(info['path']) for info in total_valid_sampled_dict]
+        num_points = np.array([x.shape[0] for x in obj_points_list])
+        assert all([x == info['num_points_in_gt'] for x, info in zip(num_points, total_valid_sampled_dict)])
+
+        obj_points = np.concatenate(obj_points_list, axis=0)
+        obj_centers = np.stack([info['box3d_lidar'][:3] for info in total_valid_sampled_dict], axis=0)
+        obj_points[:, :3] += np.repeat(obj_centers.astype(np.float32), num_points, axis=0)
+        if self.sampler_cfg.get('USE_ROAD_PLANE', False):
+            # mv height
+            obj_points[:, 2] -= np.repeat(mv_height, num_points, axis=0)
+        return obj_points
+
+    @staticmethod
+    def boxes_bev_overlap_mask(boxes_a, boxes_b):
+        """
+        Args:
+            boxes_a: (N, 7) [x, y, z, dx, dy, dz, heading]
+            boxes_b: (M, 7) [x, y, z, dx, dy, dz, heading]
+        Returns:
+            overlap_mask: (N, M) bev iou > 0, the rotated iou is only computed for the rows and columns
+                that have a pair with overlapping axis aligned boxes
+        """
+        def get_half_extents(boxes):
+            cosa, sina = np.abs(np.cos(boxes[:, 6])), np.abs(np.sin(boxes[:, 6]))
+            return np.stack([boxes[:, 3] * cosa + boxes[:, 4] * sina, boxes[:, 3] * sina + boxes[:, 4] * cosa], axis=-1) / 2
+
+        extents_a, extents_b = get_half_extents(boxes_a), get_half_extents(boxes_b)
+        candidates = np.all(np.abs(boxes_a[:, None, 0:2] - boxes_b[None, :, 0:2]) <=
+                            extents_a[:, None, :] + extents_b[None, :, :] + 1e-3, axis=-1) #(N, M)
+        rows, cols = candidates.any(axis=1).nonzero()[0], candidates.any(axis=0).nonzero()[0]
+
+        overlap_mask = np.zeros(candidates.shape, dtype=bool)
+        if rows.shape[0] > 0:
+            iou = iou3d_nms_utils.boxes_bev_iou_cpu(boxes_a[rows], boxes_b[cols])
+            overlap_mask[np.ix_(rows, cols)] = iou > 0
+        return overlap_mask
+
+    def sample_with_collision_check(self, data_dict):
+        """
+        Same sampled set as the per-class loop of __call__ (the random state is only used by sample_with_fixed_number),
+        the boxes of all the classes are checked against the scene and each other in one iou pass
+        Returns:
+            existed_boxes: (N + M, 7 + C) gt_boxes followed by the valid sampled boxes
+            total_valid_sampled_dict, sampled_gt_boxes2d, sampled_mv_height: as in __call__
+        """
+        gt_boxes = data_dict['gt_boxes']
+        gt_names = data_dict['gt_names'].astype(str)
+        total_valid_sampled_dict = []
+        sampled_mv_height = []
+        sampled_gt_boxes2d = []
+
+        class_sampled_dicts = []
+        for class_name, sample_group in self.sample_groups.items():
+            if self.limit_whole_scene:
+                num_gt = np.sum(class_name == gt_names)
+                sample_group['sample_num'] = str(int(self.sample_class_num[class_name]) - num_gt)
+            if int(sample_group['sample_num']) > 0:
+                class_sampled_dicts.append(self.sample_with_fixed_number(class_name, sample_group))
+        if len(class_sampled_dicts) == 0:
+            return gt_boxes, total_valid_sampled_dict, sampled_gt_boxes2d, sampled_mv_height
+
+        assert not self.sampler_cfg.get('DATABASE_WITH_FAKELIDAR', False), 'Please use latest codes to generate GT_DATABASE'
+
+        sampled_dict = [x for cur_sampled_dict in class_sampled_dicts for x in cur_sampled_dict]
+        sampled_boxes = np.stack([x['box3d_lidar'] for x in sampled_dict], axis=0).astype(np.float32)
+        class_ends = np.cumsum([len(x) for x in class_sampled_dicts])
+        num_sampled = sampled_boxes.shape[0]
+
+        #(S, S + N): sampled vs sampled and sampled vs gt boxes
+        overlap_mask = self.boxes_bev_overlap_mask(
+            sampled_boxes[:, 0:7], np.concatenate([sampled_boxes[:, 0:7], gt_boxes[:, 0:7].astype(np.float32)], axis=0)
+        )
+        overlap_mask[range(num_sampled), range(num_sampled)] = False
+        sampled_overlap_mask = overlap_mask[:, :num_sampled]
+        no_gt_overlap = ~overlap_mask[:, num_sampled:].any(axis=1)
+
+        accepted_mask = np.zeros(num_sampled, dtype=bool)
+        class_starts = class_ends - np.array([len(x) for x in class_sampled_dicts])
+        for cur_start, cur_end in zip(class_starts, class_ends):
+            #all the other boxes of the same class count, of the previous classes only the accepted ones
+            cur_overlap_mask = sampled_overlap_mask[cur_start:cur_end]
+            valid_mask = no_gt_overlap[cur_start:cur_end] & ~cur_overlap_mask[:, cur_start:cur_end].any(axis=1) & \
+                ~cur_overlap_mask[:, accepted_mask].any(axis=1)
+
+            if self.img_aug_type is not None:
+                sampled_boxes2d, mv_height, valid_mask = self.sample_gt_boxes_2d(data_dict, sampled_boxes[cur_start:cur_end], valid_mask)
+                sampled_gt_boxes2d.append(sampled_boxes2d)
+                if mv_height is not None:
+                    sampled_mv_height.append(mv_height)
+
+            accepted_mask[cur_start:cur_end] = valid_mask
+
+        valid_mask = accepted_mask.nonzero()[0]
+        total_valid_sampled_dict = [sampled_dict[x] for x in valid_mask]
+        existed_boxes = np.concatenate((gt_boxes, sampled_boxes[valid_mask][:, :gt_boxes.shape[-1]]), axis=0)
+        return existed_boxes, total_valid_sampled_dict, sampled_gt_boxes2d, sampled_mv_height
+
     def filter_by_difficulty(self, db_infos, removed_difficulty):
         new_db_infos = {}
         for key, dinfos in db_infos.items():
@@ -385,33 +524,38 @@ class DataBaseSampler(object):
         else:
             gt_database_data = None
 
-        for idx, info in enumerate(total_valid_sampled_dict):
-            if self.use_shared_memory:
-                start_offset, end_offset = info['global_data_offset']
-                obj_points = copy.deepcopy(gt_database_data[start_offset:end_offset])
-            else:
-                file_path = self.root_path / info['path']
-
-                obj_points = np.fromfile(str(file_path), dtype=np.float32).reshape(
-                    [-1, self.sampler_cfg.NUM_POINT_FEATURES])
-                if obj_points.shape[0] != info['num_points_in_gt']:
-                    obj_points = np.fromfile(str(file_path), dtype=np.float64).reshape(-1, self.sampler_cfg.NUM_POINT_FEATURES)
-
-            assert obj_points.shape[0] == info['num_points_in_gt']
-            obj_points[:, :3] += info['box3d_lidar'][:3].astype(np.float32)
-
-            if self.sampler_cfg.get('USE_ROAD_PLANE', False):
-                # mv height
-                obj_points[:, 2] -= mv_height[idx]
+        if self.gt_database_store is not None and self.img_aug_type is None:
+            obj_points = self.load_packed_object_points(total_valid_sampled_dict, mv_height)
+        else:
+            for idx, info in enumerate(total_valid_sampled_dict):
+                if self.gt_database_store is not None:
+                    obj_points = self.gt_database_store.get(info['path'], copy=True) #modified in place by the image aug
+                elif self.use_shared_memory:
+                    start_offset, end_offset = info['global_data_offset']
+                    obj_points = copy.deepcopy(gt_database_data[start_offset:end_offset])
+                else:
+                    file_path = self.root_path / info['path']
+
+                    obj_points = np.fromfile(str(file_path), dtype=np.float32).reshape(
+                        [-1, self.sampler_cfg.NUM_POINT_FEATURES])
+                    if obj_points.shape[0] != info['num_points_in_gt']:
+                        obj_points = np.fromfile(str(file_path), dtype=np.float64).reshape(-1, self.sampler_cfg.NUM_POINT_FEATURES)
+
+                assert obj_points.shape[0] == info['num_points_in_gt']
+                obj_points[:, :3] += info['box3d_lidar'][:3].astype(np.float32)
+
+                if self.sampler_cfg.get('USE_ROAD_PLANE', False):
+                    # mv height
+                    obj_points[:, 2] -= mv_height[idx]
 
-            if self.img_aug_type is not None:
-                img_aug_gt_dict, obj_points = self.collect_image_crops(
-                    img_aug_gt_dict, info, data_dict, obj_points, sampled_gt_boxes, sampled_gt_boxes2d, idx
-                )
+                if self.img_aug_type is not None:
+                    img_aug_gt_dict, obj_points = self.collect_image_crops(
+                        img_aug_gt_dict, info, data_dict, obj_points, sampled_gt_boxes, sampled_gt_boxes2d, idx
+                    )
 
-            obj_points_list.append(obj_points)
+                obj_points_list.append(obj_points)
 
-        obj_points = np.concatenate(obj_points_list, axis=0)
+            obj_points = np.concatenate(obj_points_list, axis=0)
         sampled_gt_names = np.array([x['name'] for x in total_valid_sampled_dict])
 
         if self.sampler_cfg.get('FILTER_OBJ_POINTS_BY_TIMESTAMP', False) or obj_points.shape[-1] != points.shape[-1]:
@@ -429,7 +573,9 @@ class DataBaseSampler(object):
         large_sampled_gt_boxes = box_utils.enlarge_box3d(
             sampled_gt_boxes[:, 0:7], extra_width=self.sampler_cfg.REMOVE_EXTRA_WIDTH
         )
-        points = box_utils.remove_points_in_boxes3d(points, large_sampled_gt_boxes)
+        points = box_utils.remove_points_in_boxes3d(
+            points, large_sampled_gt_boxes, grid_size=self.remove_points_grid_size if self.batched_placement else None
+        )
         points = np.concatenate([obj_points[:, :points.shape[-1]], points], axis=0)
         gt_names = np.concatenate([gt_names, sampled_gt_names], axis=0)
         gt_boxes = np.concatenate([gt_boxes, sampled_gt_boxes], axis=0)
@@ -452,41 +598,45 @@ class DataBaseSampler(object):
 
         """
         gt_boxes = data_dict['gt_boxes']
-        gt_names = data_dict['gt_names'].astype(str)
-        existed_boxes = gt_boxes
-        total_valid_sampled_dict = []
-        sampled_mv_height = []
-        sampled_gt_boxes2d = []
-
-        for class_name, sample_group in self.sample_groups.items():
-            if self.limit_whole_scene:
-                num_gt = np.sum(class_name == gt_names)
-                sample_group['sample_num'] = str(int(self.sample_class_num[class_name]) - num_gt)
-            if int(sample_group['sample_num']) > 0:
-                sampled_dict = self.sample_with_fixed_number(class_name, sample_group)
-
-                sampled_boxes = np.stack([x['box3d_lidar'] for x in sampled_dict], axis=0).astype(np.float32)
-
-                assert not self.sampler_cfg.get('DATABASE_WITH_FAKELIDAR', False), 'Please use latest codes to generate GT_DATABASE'
-
-                iou1 = iou3d_nms_utils.boxes_bev_iou_cpu(sampled_boxes[:, 0:7], existed_boxes[:, 0:7])
-                iou2 = iou3d_nms_utils.boxes_bev_iou_cpu(sampled_boxes[:, 0:7], sampled_boxes[:, 0:7])
-                iou2[range(sampled_boxes.shape[0]), range(sampled_boxes.shape[0])] = 0
-                iou1 = iou1 if iou1.shape[1] > 0 else iou2
-                valid_mask = ((iou1.max(axis=1) + iou2.max(axis=1)) == 0)
-
-                if self.img_aug_type is not None:
-                    sampled_boxes2d, mv_height, valid_mask = self.sample_gt_boxes_2d(data_dict, sampled_boxes, valid_mask)
-                    sampled_gt_boxes2d.append(sampled_boxes2d)
-                    if mv_height is not None:
-                        sampled_mv_height.append(mv_height)
-
-                valid_mask = valid_mask.nonzero()[0]
-                valid_sampled_dict = [sampled_dict[x] for x in valid_mask]
-                valid_sampled_boxes = sampled_boxes[valid_mask]
-
-                existed_boxes = np.concatenate((existed_boxes, valid_sampled_boxes[:, :existed_boxes.shape[-1]]), axis=0)
-                total_valid_sampled_dict.extend(valid_sampled_dict)
+        if self.batched_placement:
+            existed_boxes, total_valid_sampled_dict, sampled_gt_boxes2d, sampled_mv_height = \
+                self.sample_with_collision_check(data_dict)
+        else:
+            gt_names = data_dict['gt_names'].astype(str)
+            existed_boxes = gt_boxes
+            total_valid_sampled_dict = []
+            sampled_mv_height = []
+            sampled_gt_boxes2d = []
+
+            for class_name, sample_group in self.sample_groups.items():
+                if self.limit_whole_scene:
+                    num_gt = np.sum(class_name == gt_names)
+                    sample_group['sample_num'] = str(int(self.sample_class_num[class_name]) - num_gt)
+                if int(sample_group['sample_num']) > 0:
+                    sampled_dict = self.sample_with_fixed_number(class_name, sample_group)
+
+                    sampled_boxes = np.stack([x['box3d_lidar'] for x in sampled_dict], axis=0).astype(np.float32)
+
+                    assert not self.sampler_cfg.get('DATABASE_WITH_FAKELIDAR', False), 'Please use latest codes to generate GT_DATABASE'
+
+                    iou1 = iou3d_nms_utils.boxes_bev_iou_cpu(sampled_boxes[:, 0:7], existed_boxes[:, 0:7])
+                    iou2 = iou3d_nms_utils.boxes_bev_iou_cpu(sampled_boxes[:, 0:7], sampled_boxes[:, 0:7])
+                    iou2[range(sampled_boxes.shape[0]), range(sampled_boxes.shape[0])] = 0
+                    iou1 = iou1 if iou1.shape[1] > 0 else iou2
+                    valid_mask = ((iou1.max(axis=1) + iou2.max(axis=1)) == 0)
+
+                    if self.img_aug_type is not None:
+                        sampled_boxes2d, mv_height, valid_mask = self.sample_gt_boxes_2d(data_dict, sampled_boxes, valid_mask)
+                        sampled_gt_boxes2d.append(sampled_boxes2d)
+                        if mv_height is not None:
+                            sampled_mv_height.append(mv_height)
+
+                    valid_mask = valid_mask.nonzero()[0]
+                    valid_sampled_dict = [sampled_dict[x] for x in valid_mask]
+                    valid_sampled_boxes = sampled_boxes[valid_mask]
+
+                    existed_boxes = np.concatenate((existed_boxes, valid_sampled_boxes[:, :existed_boxes.shape[-1]]), axis=0)
+                    total_valid_sampled_dict.extend(valid_sampled_dict)
 
         sampled_gt_boxes = existed_boxes[gt_boxes.shape[0]:, :]
 
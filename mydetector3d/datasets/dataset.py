@@ -1,11 +1,12 @@
 from collections import defaultdict #when key not exist, return defaultdict not key error
+from functools import partial
 from pathlib import Path
 
 import numpy as np
 import torch
 import torch.utils.data as torch_data
 
-from ..utils import common_utils
+from ..utils import common_utils, frame_store_utils
 from .augmentor.data_augmentor import DataAugmentor
 from .processor.data_processor import DataProcessor
 from .processor.point_feature_encoder import PointFeatureEncoder
@@ -20,6 +21,7 @@ class DatasetTemplate(torch_data.Dataset):
         self.logger = logger
         self.root_path = root_path if root_path is not None else Path(self.dataset_cfg.DATA_PATH)
         self.logger = logger
+        self.lidar_store = None
         if self.dataset_cfg is None or class_names is None:
             return
 
@@ -48,11 +50,34 @@ class DatasetTemplate(torch_data.Dataset):
             self.depth_downsample_factor = self.data_processor.depth_downsample_factor
         else:
             self.depth_downsample_factor = None
-            
+
+        #LIDAR_BACKEND: 'packed' reads points from the memory-mapped frame store instead of one file per frame
+        self.lidar_store = self.include_packed_lidar(self.mode)
+
+        #PREALLOCATED_COLLATE: dataset.collate_batch writes each sample once into preallocated buffers
+        if self.dataset_cfg.get('PREALLOCATED_COLLATE', False):
+            self.collate_batch = partial(
+                self.collate_batch_preallocated, pin_memory=self.dataset_cfg.get('COLLATE_PIN_MEMORY', True)
+            )
+
     @property
     def mode(self):
         return 'train' if self.training else 'test'
 
+    def include_packed_lidar(self, mode):
+        if self.dataset_cfg.get('LIDAR_BACKEND', 'file') != 'packed':
+            return None
+        '''
+        PACKED_LIDAR_PATH: {
+        'train': [kitti_packed_train],
+        'test': [kitti_packed_val],}
+        '''
+        store_prefixes = [self.root_path / store_prefix for store_prefix in self.dataset_cfg.PACKED_LIDAR_PATH[mode]]
+        lidar_store = frame_store_utils.PackedFrameStore(store_prefixes)
+        if self.logger is not None:
+            self.logger.info('Total packed lidar frames: %d' % len(lidar_store))
+        return lidar_store
+
     def __getstate__(self):
         d = dict(self.__dict__)
         del d['logger']
@@ -85,10 +110,7 @@ class DatasetTemplate(torch_data.Dataset):
             }
             return ret_dict
 
-        def generate_single_sample_dict(box_dict):
-            pred_scores = box_dict['pred_scores'].cpu().numpy()
-            pred_boxes = box_dict['pred_boxes'].cpu().numpy()
-            pred_labels = box_dict['pred_labels'].cpu().numpy()
+        def generate_single_sample_dict(pred_boxes, pred_scores, pred_labels):
             pred_dict = get_template_prediction(pred_scores.shape[0])
             if pred_scores.shape[0] == 0:
                 return pred_dict
@@ -100,9 +122,21 @@ class DatasetTemplate(torch_data.Dataset):
 
             return pred_dict
 
+        #boxes, scores and labels of all frames in one tensor, copied to the host once per batch
+        num_boxes = [box_dict['pred_scores'].shape[0] for box_dict in pred_dicts]
+        box_dim = pred_dicts[0]['pred_boxes'].shape[1] if len(pred_dicts) > 0 else 0
+        preds = torch.cat([torch.cat([
+            box_dict['pred_boxes'], box_dict['pred_scores'][:, None].to(box_dict['pred_boxes'].dtype),
+            box_dict['pred_labels'][:, None].to(box_dict['pred_boxes'].dtype)
+        ], dim=1) for box_dict in pred_dicts], dim=0).cpu().numpy() if len(pred_dicts) > 0 else None
+        offsets = np.concatenate([[0], np.cumsum(num_boxes)]).astype(np.int64)
+
         annos = []
         for index, box_dict in enumerate(pred_dicts):
-            single_pred_dict = generate_single_sample_dict(box_dict)
+            cur_preds = preds[offsets[index]:offsets[index + 1]]
+            single_pred_dict = generate_single_sample_dict(
+                cur_preds[:, :box_dim], cur_preds[:, box_dim], cur_preds[:, box_dim + 1].astype(np.int64)
+            )
             single_pred_dict['frame_id'] = batch_dict['frame_id'][index]
             if 'metadata' in batch_dict:
                 single_pred_dict['metadata'] = batch_dict['metadata'][index]
@@ -138,6 +172,9 @@ class DatasetTemplate(torch_data.Dataset):
         """
             Get lidar augment matrix (4 x 4), which are used to recover orig point coordinates.
         """
+        if 'lidar_aug_matrix' in data_dict:
+            #recorded by random_world_affine
+            return data_dict
         lidar_aug_matrix = np.eye(4)
         if 'flip_y' in data_dict.keys():
             flip_x = data_dict['flip_x']
@@ -346,4 +383,73 @@ class DatasetTemplate(torch_data.Dataset):
                 raise TypeError
 
         ret['batch_size'] = batch_size * batch_size_ratio
-        return ret
\ No newline at end of file
+        return ret
+
+    @staticmethod
+    def new_collate_buffer(shape, dtype, pin_memory=False):
+        """
+        Zero initialized numpy buffer, backed by pinned torch memory when collating in the main process
+        (the DataLoader workers are forked and can not allocate CUDA host memory, their batches are pinned by
+        prefetch_utils.pin_batch_dict in the DataPrefetcher thread)
+        """
+        if pin_memory and torch.cuda.is_available() and torch_data.get_worker_info() is None:
+            torch_dtype = torch.from_numpy(np.empty(0, dtype=dtype)).dtype
+            return torch.zeros(shape, dtype=torch_dtype, pin_memory=True).numpy()
+        return np.zeros(shape, dtype=dtype)
+
+    @staticmethod
+    def collate_batch_preallocated(batch_list, pin_memory=False):
+        """
+        Same output as collate_batch, the batch sizes are computed first and every sample is written once into
+        its slice of a preallocated buffer, the batch index column of points / voxel_coords is filled in place
+        """
+        data_dict = defaultdict(list)
+        for cur_sample in batch_list:
+            for key, val in cur_sample.items():
+                data_dict[key].append(val)
+        batch_size = len(batch_list)
+        ret = {}
+        batch_size_ratio = 1
+        new_buffer = partial(DatasetTemplate.new_collate_buffer, pin_memory=pin_memory)
+
+        other_keys = []
+        for key, val in data_dict.items():
+            if key in ['voxels', 'voxel_num_points', 'points', 'voxel_coords'] and isinstance(val[0], list):
+                batch_size_ratio = len(val[0]) if key in ['voxels', 'voxel_num_points'] else batch_size_ratio
+                val = [i for item in val for i in item]
+
+            if key in ['voxels', 'voxel_num_points']:
+                ret[key] = np.concatenate(val, axis=0, out=new_buffer(
+                    (sum([len(x) for x in val]),) + val[0].shape[1:], np.result_type(*val)))
+            elif key in ['points', 'voxel_coords']:
+                batch_data = new_buffer((sum([len(x) for x in val]), val[0].shape[-1] + 1), np.result_type(*val))
+                start = 0
+                for i, coor in enumerate(val):
+                    batch_data[start:start + len(coor), 0] = i
+                    batch_data[start:start + len(coor), 1:] = coor
+                    start += len(coor)
+                ret[key] = batch_data
+            elif key in ['gt_boxes', 'gt_boxes2d']:
+                max_boxes = max([len(x) for x in val])
+                batch_boxes = new_buffer((batch_size, max_boxes, val[0].shape[-1]), np.float32)
+                for k in range(batch_size):
+                    if val[k].size > 0:
+                        batch_boxes[k, :len(val[k])] = val[k]
+                ret[key] = batch_boxes
+            elif key in ['images', 'depth_maps']:
+                max_h = max([image.shape[0] for image in val])
+                max_w = max([image.shape[1] for image in val])
+                batch_images = new_buffer((batch_size, max_h, max_w) + val[0].shape[2:], np.result_type(*val))
+                for k, image in enumerate(val):
+                    batch_images[k, :image.shape[0], :image.shape[1]] = image #padded at the end as collate_batch
+                ret[key] = batch_images
+            else:
+                other_keys.append(key)
+
+        if len(other_keys) > 0:
+            other_ret = DatasetTemplate.collate_batch([{key: x[key] for key in other_keys if key in x} for x in batch_list])
+            other_ret.pop('batch_size')
+            ret.update(other_ret)
+
+        ret['batch_size'] = batch_size * batch_size_ratio
+        return ret
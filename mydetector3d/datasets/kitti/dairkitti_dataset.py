@@ -9,7 +9,7 @@ import json
 from mydetector3d.datasets.kitti import kitti_utils
 #from . import kitti_utils
 from mydetector3d.ops.roiaware_pool3d import roiaware_pool3d_utils
-from mydetector3d.utils import box_utils, calibration_kitti, common_utils, object3d_custom #object3d_kitti
+from mydetector3d.utils import box_utils, calibration_kitti, common_utils, dataset_prep_utils, frame_store_utils, numba_utils, object3d_custom #object3d_kitti
 from mydetector3d.datasets.dataset import DatasetTemplate
 
 
@@ -104,9 +104,13 @@ class DairKittiDataset(DatasetTemplate):
 
     def get_lidar(self, idx):
         v_binfilename = '%s.bin' % idx
-        lidar_file = self.root_split_path / 'velodyne' / v_binfilename
-        assert lidar_file.exists()
-        v_points = np.fromfile(str(lidar_file), dtype=np.float32).reshape(-1, 4)
+        if self.lidar_store is not None and idx in self.lidar_store:
+            #zero-copy view of the packed vehicle frame, copy in training since augmentation modifies points in place
+            v_points = self.lidar_store.get(idx, copy=self.training)
+        else:
+            lidar_file = self.root_split_path / 'velodyne' / v_binfilename
+            assert lidar_file.exists()
+            v_points = np.fromfile(str(lidar_file), dtype=np.float32).reshape(-1, 4)
         if self.dataset_cfg.Early_Fusion == True and self.dataset_cfg.Lidar_Fusion:
             if v_binfilename in self.i2vmap.keys():
                 i_binfilename=self.i2vmap[v_binfilename]
@@ -255,8 +259,6 @@ class DairKittiDataset(DatasetTemplate):
         return pts_valid_flag
 
     def get_infos(self, num_workers=4, has_label=True, count_inside_pts=True, sample_id_list=None):
-        import concurrent.futures as futures
-
         def process_single_scene(sample_idx): #for each idx in the list
             print('%s sample_idx: %s' % (self.split, sample_idx))
             info = {}
@@ -343,19 +345,13 @@ class DairKittiDataset(DatasetTemplate):
                     fov_flag = self.get_fov_flag(pts_rect, info['image']['image_shape'], calib) #True/False list of points inside the camera fov
                     pts_fov = points[fov_flag] #only select points inside the camera FOV
 
-                    # gt_boxes_lidar is (N,7)  [x, y, z, dx, dy, dz, heading], (x, y, z) is the box center
-                    # returned corners_lidar（N,8,3）:8 point box for each box (each point is the coordinate)
-                    corners_lidar = box_utils.boxes_to_corners_3d(gt_boxes_lidar)
-
                     # num_gt is the total number object in the current frame，
                     # initialize num_points_in_gt=array([-1, -1, -1, -1, -1, -1, -1, -1, -1, -1], dtype=int32)
                     num_points_in_gt = -np.ones(num_gt, dtype=np.int32)
-                    #num_objects is effective object numbers
-                    for k in range(num_objects):
-                        #corners_lidar the 8 point box of the k-th gt, pts_fov is the lidar points inside the camera FOV
-                        #is_hull check whether the point cloud is inside the bbox or not, use 0:3 means only check 2D box (x,y)
-                        flag = box_utils.in_hull(pts_fov[:, 0:3], corners_lidar[k])
-                        num_points_in_gt[k] = flag.sum() #calculate the points inside the box
+                    # gt_boxes_lidar is (N,7)  [x, y, z, dx, dy, dz, heading], (x, y, z) is the box center
+                    #points of the num_objects effective boxes counted in one pass, same counts as box_utils.in_hull on the box corners
+                    num_points_in_gt[:num_objects] = roiaware_pool3d_utils.count_points_in_boxes_cpu(
+                        pts_fov[:, 0:3], gt_boxes_lidar[:num_objects])
                     annotations['num_points_in_gt'] = num_points_in_gt
                 elif count_inside_pts and num_gt==0:
                     annotations['num_points_in_gt'] =  np.array([]) #np.zeros()
@@ -363,12 +359,22 @@ class DairKittiDataset(DatasetTemplate):
             return info
 
         sample_id_list = sample_id_list if sample_id_list is not None else self.sample_id_list
-        with futures.ThreadPoolExecutor(num_workers) as executor:
-            infos = executor.map(process_single_scene, sample_id_list) #process train or val sample id list
-        return list(infos)
+        #process train or val sample id list, processes instead of threads as the point counting holds the GIL
+        return common_utils.process_map(process_single_scene, sample_id_list, num_workers=num_workers)
+
+    def create_packed_lidar(self, info_path, save_prefix):
+        """
+        Pack the velodyne files of all frames in info_path into one memory-mapped frame store
+        (used with LIDAR_BACKEND: 'packed' and PACKED_LIDAR_PATH in the dataset config)
+        """
+        with open(info_path, 'rb') as f:
+            infos = pickle.load(f)
+        sample_id_list = ['{:06d}'.format(int(info['image']['image_idx'])) for info in infos]
+        lidar_files = [self.root_split_path / 'velodyne' / ('%s.bin' % idx) for idx in sample_id_list]
+        frame_store_utils.write_packed_frame_store(save_prefix, sample_id_list, lidar_files, num_features=4)
 
     #use groundtruth in trainfile to generate groundtruth_database folder
-    def create_groundtruth_database(self, info_path=None, used_classes=None, split='train'):
+    def create_groundtruth_database(self, info_path=None, used_classes=None, split='train', num_workers=4):
         #create gt_database folder
         database_save_path = Path(self.root_path) / ('gt_database' if split == 'train' else ('gt_database_%s' % split))
         #save kitti_dbinfos_train file under kitti folder
@@ -380,7 +386,7 @@ class DairKittiDataset(DatasetTemplate):
         with open(info_path, 'rb') as f:
             infos = pickle.load(f) #load pkl file: kitti_infos_train.pkl
 
-        for k in range(len(infos)): #read every info (each frame) in infos array
+        def process_single_frame(k): #read every info (each frame) in infos array
             print('gt_database sample: %d/%d' % (k + 1, len(infos)))
             info = infos[k]
             sample_idx = info['point_cloud']['lidar_idx']#get index list in train.txt
@@ -394,14 +400,13 @@ class DairKittiDataset(DatasetTemplate):
 
             num_obj = gt_boxes.shape[0]
             if num_obj >0:
-                point_indices = roiaware_pool3d_utils.points_in_boxes_cpu(
-                    torch.from_numpy(points[:, 0:3]), torch.from_numpy(gt_boxes)
-                ).numpy()  # (nboxes, npoints)
+                box_starts, point_idxs = roiaware_pool3d_utils.points_in_boxes_pairs_cpu(points[:, 0:3], gt_boxes)
 
+            db_infos = []
             for i in range(num_obj):
                 filename = '%s_%s_%d.bin' % (sample_idx, names[i], i)
                 filepath = database_save_path / filename
-                gt_points = points[point_indices[i] > 0]
+                gt_points = points[point_idxs[box_starts[i]:box_starts[i + 1]]]
 
                 gt_points[:, :3] -= gt_boxes[i, :3]
                 with open(filepath, 'w') as f:
@@ -412,10 +417,16 @@ class DairKittiDataset(DatasetTemplate):
                     db_info = {'name': names[i], 'path': db_path, 'image_idx': sample_idx, 'gt_idx': i,
                                'box3d_lidar': gt_boxes[i], 'num_points_in_gt': gt_points.shape[0],
                                'difficulty': difficulty[i], 'bbox': bbox[i], 'score': annos['score'][i]}
-                    if names[i] in all_db_infos:
-                        all_db_infos[names[i]].append(db_info)
-                    else:
-                        all_db_infos[names[i]] = [db_info]
+                    db_infos.append(db_info)
+            return db_infos
+
+        #frames are cropped in worker processes, the db infos are merged in frame order
+        for db_infos in common_utils.process_map(process_single_frame, range(len(infos)), num_workers=num_workers):
+            for db_info in db_infos:
+                if db_info['name'] in all_db_infos:
+                    all_db_infos[db_info['name']].append(db_info)
+                else:
+                    all_db_infos[db_info['name']] = [db_info]
         for k, v in all_db_infos.items():
             print('Database %s: %d' % (k, len(v)))
 
@@ -438,66 +449,9 @@ class DairKittiDataset(DatasetTemplate):
         Returns:
 
         """
-        def get_template_prediction(num_samples):
-            ret_dict = {
-                'name': np.zeros(num_samples), 'truncated': np.zeros(num_samples),
-                'occluded': np.zeros(num_samples), 'alpha': np.zeros(num_samples),
-                'bbox': np.zeros([num_samples, 4]), 'dimensions': np.zeros([num_samples, 3]),
-                'location': np.zeros([num_samples, 3]), 'rotation_y': np.zeros(num_samples),
-                'score': np.zeros(num_samples), 'boxes_lidar': np.zeros([num_samples, 7])
-            }
-            return ret_dict
-
-        def generate_single_sample_dict(batch_index, box_dict):
-            pred_scores = box_dict['pred_scores'].cpu().numpy()
-            pred_boxes = box_dict['pred_boxes'].cpu().numpy()
-            pred_labels = box_dict['pred_labels'].cpu().numpy()
-            pred_dict = get_template_prediction(pred_scores.shape[0])
-            if pred_scores.shape[0] == 0:
-                return pred_dict
-
-            calib = batch_dict['calib'][batch_index]
-            image_shape = batch_dict['image_shape'][batch_index].cpu().numpy()
-            pred_boxes_camera = box_utils.boxes3d_lidar_to_kitti_camera(pred_boxes, calib)
-            pred_boxes_img = box_utils.boxes3d_kitti_camera_to_imageboxes(
-                pred_boxes_camera, calib, image_shape=image_shape
-            )
-
-            pred_dict['name'] = np.array(class_names)[pred_labels - 1]
-            pred_dict['alpha'] = -np.arctan2(-pred_boxes[:, 1], pred_boxes[:, 0]) + pred_boxes_camera[:, 6]
-            pred_dict['bbox'] = pred_boxes_img
-            pred_dict['dimensions'] = pred_boxes_camera[:, 3:6]
-            pred_dict['location'] = pred_boxes_camera[:, 0:3]
-            pred_dict['rotation_y'] = pred_boxes_camera[:, 6]
-            pred_dict['score'] = pred_scores
-            pred_dict['boxes_lidar'] = pred_boxes
-
-            return pred_dict
-
-        annos = []
-        for index, box_dict in enumerate(pred_dicts):
-            frame_id = batch_dict['frame_id'][index]
-
-            single_pred_dict = generate_single_sample_dict(index, box_dict)
-            single_pred_dict['frame_id'] = frame_id
-            annos.append(single_pred_dict)
-
-            if output_path is not None:
-                cur_det_file = output_path / ('%s.txt' % frame_id)
-                with open(cur_det_file, 'w') as f:
-                    bbox = single_pred_dict['bbox']
-                    loc = single_pred_dict['location']
-                    dims = single_pred_dict['dimensions']  # lhw -> hwl
-
-                    for idx in range(len(bbox)):
-                        print('%s -1 -1 %.4f %.4f %.4f %.4f %.4f %.4f %.4f %.4f %.4f %.4f %.4f %.4f %.4f'
-                              % (single_pred_dict['name'][idx], single_pred_dict['alpha'][idx],
-                                 bbox[idx][0], bbox[idx][1], bbox[idx][2], bbox[idx][3],
-                                 dims[idx][1], dims[idx][2], dims[idx][0], loc[idx][0],
-                                 loc[idx][1], loc[idx][2], single_pred_dict['rotation_y'][idx],
-                                 single_pred_dict['score'][idx]), file=f)
-
-        return annos
+        return kitti_utils.generate_prediction_dicts_batch(
+            batch_dict, pred_dicts, class_names, output_path=output_path
+        )
 
     def evaluation(self, det_annos, class_names, **kwargs):
         if 'annos' not in self.kitti_infos[0].keys():
@@ -506,12 +460,26 @@ class DairKittiDataset(DatasetTemplate):
         from .kitti_object_eval_python import eval as kitti_eval
 
         eval_det_annos = copy.deepcopy(det_annos)
-        eval_gt_annos = [copy.deepcopy(info['annos']) for info in self.kitti_infos]
-        
-        ap_result_str, ap_dict = kitti_eval.get_official_eval_result(eval_gt_annos, eval_det_annos, class_names)
+        if getattr(self, 'eval_session_infos', None) is not self.kitti_infos:
+            #gt side of the evaluation is computed once and reused for every epoch / checkpoint
+            eval_gt_annos = [copy.deepcopy(info['annos']) for info in self.kitti_infos]
+            self.eval_session = kitti_eval.EvalSession(eval_gt_annos, cache_path=self.dataset_cfg.get('EVAL_GT_CACHE', None))
+            self.eval_session_infos = self.kitti_infos
+        ap_result_str, ap_dict = kitti_eval.get_official_eval_result(
+            self.eval_session.gt_annos, eval_det_annos, class_names, session=self.eval_session)
 
         return ap_result_str, ap_dict
 
+    def get_stream_evaluator(self, class_names, **kwargs):
+        """StreamingEvaluator consuming the annos of generate_prediction_dicts batch by batch"""
+        if 'annos' not in self.kitti_infos[0].keys():
+            return None
+
+        from .kitti_object_eval_python.stream_eval import StreamingEvaluator
+
+        frame_idx = {'{:06d}'.format(int(info['image']['image_idx'])): i for i, info in enumerate(self.kitti_infos)}
+        return StreamingEvaluator(class_names, lambda frame_id: self.kitti_infos[frame_idx[frame_id]]['annos'])
+
     def __len__(self):
         if self._merge_all_iters_to_one_epoch:
             return len(self.kitti_infos) * self.total_epochs
@@ -553,6 +521,9 @@ class DairKittiDataset(DatasetTemplate):
         """
             Get lidar augment matrix (4 x 4), which are used to recover orig point coordinates.
         """
+        if 'lidar_aug_matrix' in data_dict:
+            #recorded by random_world_affine
+            return data_dict
         lidar_aug_matrix = np.eye(4)
         if 'flip_y' in data_dict.keys():
             flip_x = data_dict['flip_x']
@@ -683,11 +654,29 @@ def create_kitti_infos(dataset_cfg, class_names, data_path, save_path, workers=4
 
     print('---------------Start create groundtruth database for data augmentation---------------')
     dataset.set_split(train_split)
-    dataset.create_groundtruth_database(train_filename, split=train_split)
+    dataset.create_groundtruth_database(train_filename, split=train_split, num_workers=workers)
 
     print('---------------Data preparation Done---------------')
 
 
+def create_kitti_infos_sharded(dataset_cfg, class_names, data_path, save_path, workers=4, chunk_size=256):
+    """
+    create_kitti_infos on a process pool with resumable chunks (save_path/prep_shards), the gt database is written
+    to the packed store of the dbinfos instead of object files (DB_BACKEND: 'packed' in the gt_sampling config)
+    """
+    dataset = DairKittiDataset(dataset_cfg=dataset_cfg, class_names=class_names, root_path=data_path, training=False)
+    dataset_prep_utils.create_kitti_format_infos(dataset, save_path, chunk_size=chunk_size, num_workers=workers)
+
+
+def create_kitti_packed_lidar(dataset_cfg, class_names, data_path, save_path):
+    dataset = DairKittiDataset(dataset_cfg=dataset_cfg, class_names=class_names, root_path=data_path, training=False)
+    for split in ['train', 'val']:
+        dataset.set_split(split)
+        info_filename = save_path / ('kitti_infos_%s.pkl' % split)
+        dataset.create_packed_lidar(info_filename, save_prefix=save_path / ('dairkitti_packed_%s' % split))
+    print('---------------Packed lidar frame store Done---------------')
+
+
 def checklabelfiles(root_path, folder):
     path_list = [path for path in glob(os.path.join(root_path, folder, "*.txt"))]
     print(len(path_list))#12424
@@ -746,6 +735,7 @@ if __name__ == '__main__':
     parser.add_argument('--outputfolder', type=str, default='/data/cmpe249-fa22/DAIR-C/single-vehicle-side-point-cloud-kitti/', help='')
 
     args = parser.parse_args()
+    numba_utils.set_fork_safe_threading_layer() #the infos / gt database are built on a process pool
 
     ROOT_DIR = (Path(__file__).resolve().parent / '../../../').resolve()
     try:
@@ -765,6 +755,20 @@ if __name__ == '__main__':
             data_path=Path(args.inputfolder),
             save_path=Path(args.outputfolder)
         )
+    elif args.func == 'create_infos_sharded':
+        create_kitti_infos_sharded(
+            dataset_cfg=dataset_cfg,
+            class_names=['Car', 'Pedestrian', 'Cyclist', 'Other'],
+            data_path=Path(args.inputfolder),
+            save_path=Path(args.outputfolder)
+        )
+    elif args.func == 'create_packed_lidar':
+        create_kitti_packed_lidar(
+            dataset_cfg=dataset_cfg,
+            class_names=['Car', 'Pedestrian', 'Cyclist', 'Other'],
+            data_path=Path(args.inputfolder),
+            save_path=Path(args.outputfolder)
+        )
     elif args.func == 'checklabelfiles':
         classname_count = checklabelfiles(trainingfolder, 'label_2')
         print(classname_count)
@@ -2,12 +2,13 @@ import copy
 import pickle
 
 import numpy as np
+import torch.distributed as dist
 from skimage import io
 from pathlib import Path
 
 from . import kitti_utils
 from ...ops.roiaware_pool3d import roiaware_pool3d_utils
-from ...utils import box_utils, calibration_kitti, common_utils, object3d_kitti
+from ...utils import box_utils, calibration_kitti, common_utils, dataset_prep_utils, frame_store_utils, info_store_utils, numba_utils, object3d_kitti
 from ..dataset import DatasetTemplate
 
 
@@ -42,6 +43,25 @@ class KittiDataset(DatasetTemplate):
         'train': [kitti_infos_train.pkl],
         'test': [kitti_infos_val.pkl],}
         '''
+        if self.dataset_cfg.get('INFO_BACKEND', 'pkl') == 'indexed':
+            #memory-mapped info store converted once from each pkl file, infos are decoded on access.
+            #Built on the local rank 0, the other ranks wait at the barrier and only open the stores
+            cur_rank, world_size, num_gpus = common_utils.get_dist_info(return_gpu_per_machine=True)
+            store_dirs = []
+            for info_path in self.dataset_cfg.INFO_PATH[mode]:
+                info_path = self.root_path / info_path
+                if not info_path.exists():
+                    continue
+                if cur_rank % max(num_gpus, 1) == 0:
+                    info_store_utils.create_info_store_from_pkl(info_path)
+                store_dirs.append(info_store_utils.get_info_store_dir(info_path))
+            if world_size > 1:
+                dist.barrier()
+            self.kitti_infos = info_store_utils.InfoStore(store_dirs)
+            if self.logger is not None:
+                self.logger.info('Total samples for KITTI dataset: %d' % (len(self.kitti_infos)))
+            return
+
         #kitti_infos_train.pkl
         for info_path in self.dataset_cfg.INFO_PATH[mode]:
             info_path = self.root_path / info_path
@@ -67,6 +87,9 @@ class KittiDataset(DatasetTemplate):
         self.sample_id_list = [x.strip() for x in open(split_dir).readlines()] if split_dir.exists() else None
 
     def get_lidar(self, idx):
+        if self.lidar_store is not None and idx in self.lidar_store:
+            #zero-copy view of the packed frame, copy in training since augmentation modifies points in place
+            return self.lidar_store.get(idx, copy=self.training)
         lidar_file = self.root_split_path / 'velodyne' / ('%s.bin' % idx)
         assert lidar_file.exists()
         return np.fromfile(str(lidar_file), dtype=np.float32).reshape(-1, 4)
@@ -154,8 +177,6 @@ class KittiDataset(DatasetTemplate):
         return pts_valid_flag
 
     def get_infos(self, num_workers=4, has_label=True, count_inside_pts=True, sample_id_list=None):
-        import concurrent.futures as futures
-
         def process_single_scene(sample_idx):
             print('%s sample_idx: %s' % (self.split, sample_idx))
             info = {}
@@ -220,24 +241,30 @@ class KittiDataset(DatasetTemplate):
 
                     fov_flag = self.get_fov_flag(pts_rect, info['image']['image_shape'], calib)
                     pts_fov = points[fov_flag]
-                    corners_lidar = box_utils.boxes_to_corners_3d(gt_boxes_lidar)
                     num_points_in_gt = -np.ones(num_gt, dtype=np.int32)
-
-                    for k in range(num_objects):
-                        flag = box_utils.in_hull(pts_fov[:, 0:3], corners_lidar[k])
-                        num_points_in_gt[k] = flag.sum()
+                    #all boxes in one pass, same counts as box_utils.in_hull on the box corners
+                    num_points_in_gt[:num_objects] = roiaware_pool3d_utils.count_points_in_boxes_cpu(
+                        pts_fov[:, 0:3], gt_boxes_lidar)
                     annotations['num_points_in_gt'] = num_points_in_gt
 
             return info
 
         sample_id_list = sample_id_list if sample_id_list is not None else self.sample_id_list
-        with futures.ThreadPoolExecutor(num_workers) as executor:
-            infos = executor.map(process_single_scene, sample_id_list)
-        return list(infos)
+        #processes instead of threads, the point counting holds the GIL
+        return common_utils.process_map(process_single_scene, sample_id_list, num_workers=num_workers)
 
-    def create_groundtruth_database(self, info_path=None, used_classes=None, split='train'):
-        import torch
+    def create_packed_lidar(self, info_path, save_prefix):
+        """
+        Pack the velodyne files of all frames in info_path into one memory-mapped frame store
+        (used with LIDAR_BACKEND: 'packed' and PACKED_LIDAR_PATH in the dataset config)
+        """
+        with open(info_path, 'rb') as f:
+            infos = pickle.load(f)
+        sample_id_list = [info['point_cloud']['lidar_idx'] for info in infos]
+        lidar_files = [self.root_split_path / 'velodyne' / ('%s.bin' % idx) for idx in sample_id_list]
+        frame_store_utils.write_packed_frame_store(save_prefix, sample_id_list, lidar_files, num_features=4)
 
+    def create_groundtruth_database(self, info_path=None, used_classes=None, split='train', num_workers=4):
         database_save_path = Path(self.root_path) / ('gt_database' if split == 'train' else ('gt_database_%s' % split))
         db_info_save_path = Path(self.root_path) / ('kitti_dbinfos_%s.pkl' % split)
 
@@ -247,7 +274,7 @@ class KittiDataset(DatasetTemplate):
         with open(info_path, 'rb') as f:
             infos = pickle.load(f)
 
-        for k in range(len(infos)):
+        def process_single_frame(k):
             print('gt_database sample: %d/%d' % (k + 1, len(infos)))
             info = infos[k]
             sample_idx = info['point_cloud']['lidar_idx']
@@ -259,14 +286,13 @@ class KittiDataset(DatasetTemplate):
             gt_boxes = annos['gt_boxes_lidar']
 
             num_obj = gt_boxes.shape[0]
-            point_indices = roiaware_pool3d_utils.points_in_boxes_cpu(
-                torch.from_numpy(points[:, 0:3]), torch.from_numpy(gt_boxes)
-            ).numpy()  # (nboxes, npoints)
+            box_starts, point_idxs = roiaware_pool3d_utils.points_in_boxes_pairs_cpu(points[:, 0:3], gt_boxes)
 
+            db_infos = []
             for i in range(num_obj):
                 filename = '%s_%s_%d.bin' % (sample_idx, names[i], i)
                 filepath = database_save_path / filename
-                gt_points = points[point_indices[i] > 0]
+                gt_points = points[point_idxs[box_starts[i]:box_starts[i + 1]]]
 
                 gt_points[:, :3] -= gt_boxes[i, :3]
                 with open(filepath, 'w') as f:
@@ -277,10 +303,16 @@ class KittiDataset(DatasetTemplate):
                     db_info = {'name': names[i], 'path': db_path, 'image_idx': sample_idx, 'gt_idx': i,
                                'box3d_lidar': gt_boxes[i], 'num_points_in_gt': gt_points.shape[0],
                                'difficulty': difficulty[i], 'bbox': bbox[i], 'score': annos['score'][i]}
-                    if names[i] in all_db_infos:
-                        all_db_infos[names[i]].append(db_info)
-                    else:
-                        all_db_infos[names[i]] = [db_info]
+                    db_infos.append(db_info)
+            return db_infos
+
+        #frames are cropped in worker processes, the db infos are merged in frame order
+        for db_infos in common_utils.process_map(process_single_frame, range(len(infos)), num_workers=num_workers):
+            for db_info in db_infos:
+                if db_info['name'] in all_db_infos:
+                    all_db_infos[db_info['name']].append(db_info)
+                else:
+                    all_db_infos[db_info['name']] = [db_info]
         for k, v in all_db_infos.items():
             print('Database %s: %d' % (k, len(v)))
 
@@ -303,66 +335,9 @@ class KittiDataset(DatasetTemplate):
         Returns:
 
         """
-        def get_template_prediction(num_samples):
-            ret_dict = {
-                'name': np.zeros(num_samples), 'truncated': np.zeros(num_samples),
-                'occluded': np.zeros(num_samples), 'alpha': np.zeros(num_samples),
-                'bbox': np.zeros([num_samples, 4]), 'dimensions': np.zeros([num_samples, 3]),
-                'location': np.zeros([num_samples, 3]), 'rotation_y': np.zeros(num_samples),
-                'score': np.zeros(num_samples), 'boxes_lidar': np.zeros([num_samples, 7])
-            }
-            return ret_dict
-
-        def generate_single_sample_dict(batch_index, box_dict):
-            pred_scores = box_dict['pred_scores'].cpu().numpy()
-            pred_boxes = box_dict['pred_boxes'].cpu().numpy() #[8,7] 8 is number of objects, 7 is the bounding box
-            pred_labels = box_dict['pred_labels'].cpu().numpy()
-            pred_dict = get_template_prediction(pred_scores.shape[0]) #initialize dict with multiple keys, each section is [N,x], N is number of detected boxes
-            if pred_scores.shape[0] == 0:
-                return pred_dict
-
-            calib = batch_dict['calib'][batch_index] #calibration_kitti.Calibration object with P2, R0 V2C
-            image_shape = batch_dict['image_shape'][batch_index].cpu().numpy() #[370, 1224]
-            pred_boxes_camera = box_utils.boxes3d_lidar_to_kitti_camera(pred_boxes, calib) #Lidar [N,7](xyz,whl,heading) to camera coordinate [N,7] [x, y, z, l, h, w, r] in rect camera coords
-            pred_boxes_img = box_utils.boxes3d_kitti_camera_to_imageboxes(
-                pred_boxes_camera, calib, image_shape=image_shape
-            )#box3d to 2d (N,4)
-            #convert to Kitti format
-            pred_dict['name'] = np.array(class_names)[pred_labels - 1]
-            pred_dict['alpha'] = -np.arctan2(-pred_boxes[:, 1], pred_boxes[:, 0]) + pred_boxes_camera[:, 6]
-            pred_dict['bbox'] = pred_boxes_img #2d box
-            pred_dict['dimensions'] = pred_boxes_camera[:, 3:6]
-            pred_dict['location'] = pred_boxes_camera[:, 0:3]
-            pred_dict['rotation_y'] = pred_boxes_camera[:, 6]
-            pred_dict['score'] = pred_scores
-            pred_dict['boxes_lidar'] = pred_boxes
-
-            return pred_dict
-
-        annos = []
-        for index, box_dict in enumerate(pred_dicts): #box_dict{'pred_boxes'[N,7],'pred_scores'[N],'pred_labels'[N]}
-            frame_id = batch_dict['frame_id'][index] #'000000'
-
-            single_pred_dict = generate_single_sample_dict(index, box_dict) #Convert 3D pred box to 2D and add to Kitti annotation-like format dict
-            single_pred_dict['frame_id'] = frame_id
-            annos.append(single_pred_dict)
-
-            if output_path is not None: #save to txt file
-                cur_det_file = output_path / ('%s.txt' % frame_id)
-                with open(cur_det_file, 'w') as f:
-                    bbox = single_pred_dict['bbox']
-                    loc = single_pred_dict['location']
-                    dims = single_pred_dict['dimensions']  # lhw -> hwl
-
-                    for idx in range(len(bbox)):
-                        print('%s -1 -1 %.4f %.4f %.4f %.4f %.4f %.4f %.4f %.4f %.4f %.4f %.4f %.4f %.4f'
-                              % (single_pred_dict['name'][idx], single_pred_dict['alpha'][idx],
-                                 bbox[idx][0], bbox[idx][1], bbox[idx][2], bbox[idx][3],
-                                 dims[idx][1], dims[idx][2], dims[idx][0], loc[idx][0],
-                                 loc[idx][1], loc[idx][2], single_pred_dict['rotation_y'][idx],
-                                 single_pred_dict['score'][idx]), file=f)
-
-        return annos
+        return kitti_utils.generate_prediction_dicts_batch(
+            batch_dict, pred_dicts, class_names, output_path=output_path
+        )
 
     def evaluation(self, det_annos, class_names, **kwargs):
         if 'annos' not in self.kitti_infos[0].keys(): #kitti_infos contain 'annos' dict
@@ -371,11 +346,26 @@ class KittiDataset(DatasetTemplate):
         from .kitti_object_eval_python import eval as kitti_eval
 
         eval_det_annos = copy.deepcopy(det_annos) #total 1497 files
-        eval_gt_annos = [copy.deepcopy(info['annos']) for info in self.kitti_infos] #1497 files in kitti_infos, annotation dictionary
-        ap_result_str, ap_dict = kitti_eval.get_official_eval_result(eval_gt_annos, eval_det_annos, class_names)
+        if getattr(self, 'eval_session_infos', None) is not self.kitti_infos:
+            #gt side of the evaluation is computed once and reused for every epoch / checkpoint
+            eval_gt_annos = [copy.deepcopy(info['annos']) for info in self.kitti_infos] #1497 files in kitti_infos, annotation dictionary
+            self.eval_session = kitti_eval.EvalSession(eval_gt_annos, cache_path=self.dataset_cfg.get('EVAL_GT_CACHE', None))
+            self.eval_session_infos = self.kitti_infos
+        ap_result_str, ap_dict = kitti_eval.get_official_eval_result(
+            self.eval_session.gt_annos, eval_det_annos, class_names, session=self.eval_session)
 
         return ap_result_str, ap_dict
 
+    def get_stream_evaluator(self, class_names, **kwargs):
+        """StreamingEvaluator consuming the annos of generate_prediction_dicts batch by batch"""
+        if 'annos' not in self.kitti_infos[0].keys():
+            return None
+
+        from .kitti_object_eval_python.stream_eval import StreamingEvaluator
+
+        frame_idx = {info['point_cloud']['lidar_idx']: i for i, info in enumerate(self.kitti_infos)}
+        return StreamingEvaluator(class_names, lambda frame_id: self.kitti_infos[frame_idx[frame_id]]['annos'])
+
     def __len__(self):
         if self._merge_all_iters_to_one_epoch:
             return len(self.kitti_infos) * self.total_epochs
@@ -477,13 +467,43 @@ def create_kitti_infos(dataset_cfg, class_names, data_path, save_path, workers=4
 
     print('---------------Start create groundtruth database for data augmentation---------------')
     dataset.set_split(train_split)
-    dataset.create_groundtruth_database(train_filename, split=train_split)
+    dataset.create_groundtruth_database(train_filename, split=train_split, num_workers=workers)
 
     print('---------------Data preparation Done---------------')
 
 
+def create_kitti_infos_sharded(dataset_cfg, class_names, data_path, save_path, workers=4, chunk_size=256):
+    """
+    create_kitti_infos on a process pool with resumable chunks (save_path/prep_shards), the gt database is written
+    to the packed store of the dbinfos instead of object files (DB_BACKEND: 'packed' in the gt_sampling config)
+    """
+    dataset = KittiDataset(dataset_cfg=dataset_cfg, class_names=class_names, root_path=data_path, training=False)
+    dataset_prep_utils.create_kitti_format_infos(dataset, save_path, chunk_size=chunk_size, num_workers=workers)
+
+
+def create_kitti_packed_lidar(dataset_cfg, class_names, data_path, save_path):
+    dataset = KittiDataset(dataset_cfg=dataset_cfg, class_names=class_names, root_path=data_path, training=False)
+    for split in ['train', 'val']:
+        dataset.set_split(split)
+        info_filename = save_path / ('kitti_infos_%s.pkl' % split)
+        dataset.create_packed_lidar(info_filename, save_prefix=save_path / ('kitti_packed_%s' % split))
+    print('---------------Packed lidar frame store Done---------------')
+
+
 if __name__ == '__main__':
     import sys
+    numba_utils.set_fork_safe_threading_layer() #the infos / gt database are built on a process pool
+    if sys.argv.__len__() > 2 and sys.argv[1] == 'create_kitti_packed_lidar':
+        import yaml
+        from easydict import EasyDict
+        dataset_cfg = EasyDict(yaml.safe_load(open(sys.argv[2])))
+        ROOT_DIR = (Path(__file__).resolve().parent / '../../../').resolve()
+        create_kitti_packed_lidar(
+            dataset_cfg=dataset_cfg,
+            class_names=['Car', 'Pedestrian', 'Cyclist'],
+            data_path=ROOT_DIR / 'data' / 'kitti',
+            save_path=ROOT_DIR / 'data' / 'kitti'
+        )
     if sys.argv.__len__() > 1 and sys.argv[1] == 'create_kitti_infos':
         import yaml
         from pathlib import Path
@@ -495,4 +515,15 @@ if __name__ == '__main__':
             class_names=['Car', 'Pedestrian', 'Cyclist'],
             data_path=ROOT_DIR / 'data' / 'kitti',
             save_path=ROOT_DIR / 'data' / 'kitti'
-        )
\ No newline at end of file
+        )
+    if sys.argv.__len__() > 2 and sys.argv[1] == 'create_kitti_infos_sharded':
+        import yaml
+        from easydict import EasyDict
+        dataset_cfg = EasyDict(yaml.safe_load(open(sys.argv[2])))
+        ROOT_DIR = (Path(__file__).resolve().parent / '../../../').resolve()
+        create_kitti_infos_sharded(
+            dataset_cfg=dataset_cfg,
+            class_names=['Car', 'Pedestrian', 'Cyclist'],
+            data_path=ROOT_DIR / 'data' / 'kitti',
+            save_path=ROOT_DIR / 'data' / 'kitti'
+        )
@@ -1,9 +1,26 @@
+import hashlib
 import io as sysio
+import os
+import pickle
 
 import numba
 import numpy as np
 
-from .rotate_iou import rotate_iou_gpu_eval
+from numba import cuda
+
+from .rotate_iou_cpu import rotate_iou_cpu_eval
+
+try:
+    from .rotate_iou import rotate_iou_gpu_eval
+except Exception: #numba.cuda compiles the device functions at import, this fails without a driver / device
+    rotate_iou_gpu_eval = None
+
+
+def rotate_iou_eval(boxes, query_boxes, criterion=-1):
+    """rotated box iou on the gpu when a CUDA device is present, otherwise with the numba cpu version"""
+    if rotate_iou_gpu_eval is not None and cuda.is_available():
+        return rotate_iou_gpu_eval(boxes, query_boxes, criterion)
+    return rotate_iou_cpu_eval(boxes, query_boxes, criterion)
 
 
 @numba.jit
@@ -27,15 +44,16 @@ def get_thresholds(scores: np.ndarray, num_gt, num_sample_pts=41):
     return thresholds
 
 
-def clean_data(gt_anno, dt_anno, current_class, difficulty):
-    CLASS_NAMES = ['car', 'pedestrian', 'cyclist', 'van', 'person_sitting', 'truck']
-    MIN_HEIGHT = [40, 25, 25]
-    MAX_OCCLUSION = [0, 1, 2]
-    MAX_TRUNCATION = [0.15, 0.3, 0.5]
-    dc_bboxes, ignored_gt, ignored_dt = [], [], []
+CLASS_NAMES = ['car', 'pedestrian', 'cyclist', 'van', 'person_sitting', 'truck']
+MIN_HEIGHT = [40, 25, 25]
+MAX_OCCLUSION = [0, 1, 2]
+MAX_TRUNCATION = [0.15, 0.3, 0.5]
+
+
+def clean_gt_data(gt_anno, current_class, difficulty):
+    dc_bboxes, ignored_gt = [], []
     current_cls_name = CLASS_NAMES[current_class].lower()
     num_gt = len(gt_anno["name"])
-    num_dt = len(dt_anno["name"])
     num_valid_gt = 0
     for i in range(num_gt):
         bbox = gt_anno["bbox"][i]
@@ -67,6 +85,13 @@ def clean_data(gt_anno, dt_anno, current_class, difficulty):
     # for i in range(num_gt):
         if gt_anno["name"][i] == "DontCare":
             dc_bboxes.append(gt_anno["bbox"][i])
+    return num_valid_gt, ignored_gt, dc_bboxes
+
+
+def clean_dt_data(dt_anno, current_class, difficulty):
+    ignored_dt = []
+    current_cls_name = CLASS_NAMES[current_class].lower()
+    num_dt = len(dt_anno["name"])
     for i in range(num_dt):
         if (dt_anno["name"][i].lower() == current_cls_name):
             valid_class = 1
@@ -79,7 +104,12 @@ def clean_data(gt_anno, dt_anno, current_class, difficulty):
             ignored_dt.append(0)
         else:
             ignored_dt.append(-1)
+    return ignored_dt
 
+
+def clean_data(gt_anno, dt_anno, current_class, difficulty):
+    num_valid_gt, ignored_gt, dc_bboxes = clean_gt_data(gt_anno, current_class, difficulty)
+    ignored_dt = clean_dt_data(dt_anno, current_class, difficulty)
     return num_valid_gt, ignored_gt, ignored_dt, dc_bboxes
 
 
@@ -114,7 +144,7 @@ def image_box_overlap(boxes, query_boxes, criterion=-1):
 
 
 def bev_box_overlap(boxes, qboxes, criterion=-1):
-    riou = rotate_iou_gpu_eval(boxes, qboxes, criterion)
+    riou = rotate_iou_eval(boxes, qboxes, criterion)
     return riou
 
 
@@ -148,8 +178,8 @@ def d3_box_overlap_kernel(boxes, qboxes, rinc, criterion=-1):
 
 
 def d3_box_overlap(boxes, qboxes, criterion=-1):
-    rinc = rotate_iou_gpu_eval(boxes[:, [0, 2, 3, 5, 6]],
-                               qboxes[:, [0, 2, 3, 5, 6]], 2)
+    rinc = rotate_iou_eval(boxes[:, [0, 2, 3, 5, 6]],
+                           qboxes[:, [0, 2, 3, 5, 6]], 2)
     d3_box_overlap_kernel(boxes, qboxes, rinc, criterion)
     return rinc
 
@@ -337,69 +367,50 @@ def fused_compute_statistics(overlaps,
         dc_num += dc_nums[i]
 
 
-def calculate_iou_partly(gt_annos, dt_annos, metric, num_parts=50):
-    """fast iou algorithm. this function can be used independently to
-    do result analysis. Must be used in CAMERA coordinate system.
-    Args:
-        gt_annos: dict, must from get_label_annos() in kitti_common.py
-        dt_annos: dict, must from get_label_annos() in kitti_common.py
-        metric: eval type. 0: bbox, 1: bev, 2: 3d
-        num_parts: int. a parameter for fast calculate algorithm
-    """
-    assert len(gt_annos) == len(dt_annos)
-    total_dt_num = np.stack([len(a["name"]) for a in dt_annos], 0)
-    total_gt_num = np.stack([len(a["name"]) for a in gt_annos], 0)
-    num_examples = len(gt_annos)
-    split_parts = get_split_parts(num_examples, num_parts)
-    parted_overlaps = []
+def get_boxes_partly(annos, metric, split_parts):
+    """concatenated boxes of each part. metric: 0: bbox, 1: bev, 2: 3d"""
+    boxes_parts = []
     example_idx = 0
-
     for num_part in split_parts:
-        gt_annos_part = gt_annos[example_idx:example_idx + num_part]
-        dt_annos_part = dt_annos[example_idx:example_idx + num_part]
+        annos_part = annos[example_idx:example_idx + num_part]
         if metric == 0:
-            gt_boxes = np.concatenate([a["bbox"] for a in gt_annos_part], 0)
-            dt_boxes = np.concatenate([a["bbox"] for a in dt_annos_part], 0)
-            overlap_part = image_box_overlap(gt_boxes, dt_boxes)
+            boxes = np.concatenate([a["bbox"] for a in annos_part], 0)
         elif metric == 1:
             loc = np.concatenate(
-                [a["location"][:, [0, 2]] for a in gt_annos_part], 0)
+                [a["location"][:, [0, 2]] for a in annos_part], 0)
             dims = np.concatenate(
-                [a["dimensions"][:, [0, 2]] for a in gt_annos_part], 0)
-            rots = np.concatenate([a["rotation_y"] for a in gt_annos_part], 0)
-            gt_boxes = np.concatenate(
+                [a["dimensions"][:, [0, 2]] for a in annos_part], 0)
+            rots = np.concatenate([a["rotation_y"] for a in annos_part], 0)
+            boxes = np.concatenate(
                 [loc, dims, rots[..., np.newaxis]], axis=1)
-            loc = np.concatenate(
-                [a["location"][:, [0, 2]] for a in dt_annos_part], 0)
-            dims = np.concatenate(
-                [a["dimensions"][:, [0, 2]] for a in dt_annos_part], 0)
-            rots = np.concatenate([a["rotation_y"] for a in dt_annos_part], 0)
-            dt_boxes = np.concatenate(
-                [loc, dims, rots[..., np.newaxis]], axis=1)
-            overlap_part = bev_box_overlap(gt_boxes, dt_boxes).astype(
-                np.float64)
         elif metric == 2:
-            loc = np.concatenate([a["location"] for a in gt_annos_part], 0)
-            dims = np.concatenate([a["dimensions"] for a in gt_annos_part], 0)
-            rots = np.concatenate([a["rotation_y"] for a in gt_annos_part], 0)
-            gt_boxes = np.concatenate(
+            loc = np.concatenate([a["location"] for a in annos_part], 0)
+            dims = np.concatenate([a["dimensions"] for a in annos_part], 0)
+            rots = np.concatenate([a["rotation_y"] for a in annos_part], 0)
+            boxes = np.concatenate(
                 [loc, dims, rots[..., np.newaxis]], axis=1)
-            loc = np.concatenate([a["location"] for a in dt_annos_part], 0)
-            dims = np.concatenate([a["dimensions"] for a in dt_annos_part], 0)
-            rots = np.concatenate([a["rotation_y"] for a in dt_annos_part], 0)
-            dt_boxes = np.concatenate(
-                [loc, dims, rots[..., np.newaxis]], axis=1)
-            overlap_part = d3_box_overlap(gt_boxes, dt_boxes).astype(
-                np.float64)
         else:
             raise ValueError("unknown metric")
-        parted_overlaps.append(overlap_part)
+        boxes_parts.append(boxes)
         example_idx += num_part
+    return boxes_parts
+
+
+def box_overlap(boxes, qboxes, metric):
+    if metric == 0:
+        return image_box_overlap(boxes, qboxes)
+    elif metric == 1:
+        return bev_box_overlap(boxes, qboxes).astype(np.float64)
+    elif metric == 2:
+        return d3_box_overlap(boxes, qboxes).astype(np.float64)
+    raise ValueError("unknown metric")
+
+
+def split_overlaps_partly(parted_overlaps, split_parts, total_gt_num, total_dt_num):
+    """per frame [num_gt, num_dt] views of the overlaps of each part"""
     overlaps = []
     example_idx = 0
     for j, num_part in enumerate(split_parts):
-        gt_annos_part = gt_annos[example_idx:example_idx + num_part]
-        dt_annos_part = dt_annos[example_idx:example_idx + num_part]
         gt_num_idx, dt_num_idx = 0, 0
         for i in range(num_part):
             gt_box_num = total_gt_num[example_idx + i]
@@ -410,21 +421,40 @@ def calculate_iou_partly(gt_annos, dt_annos, metric, num_parts=50):
             gt_num_idx += gt_box_num
             dt_num_idx += dt_box_num
         example_idx += num_part
+    return overlaps
+
+
+def calculate_iou_partly(gt_annos, dt_annos, metric, num_parts=50):
+    """fast iou algorithm. this function can be used independently to
+    do result analysis. Must be used in CAMERA coordinate system.
+    Args:
+        gt_annos: dict, must from get_label_annos() in kitti_common.py
+        dt_annos: dict, must from get_label_annos() in kitti_common.py
+        metric: eval type. 0: bbox, 1: bev, 2: 3d
+        num_parts: int. a parameter for fast calculate algorithm
+    """
+    assert len(gt_annos) == len(dt_annos)
+    total_dt_num = np.stack([len(a["name"]) for a in dt_annos], 0)
+    total_gt_num = np.stack([len(a["name"]) for a in gt_annos], 0)
+    num_examples = len(gt_annos)
+    split_parts = get_split_parts(num_examples, num_parts)
+    gt_boxes_parts = get_boxes_partly(gt_annos, metric, split_parts)
+    dt_boxes_parts = get_boxes_partly(dt_annos, metric, split_parts)
+    parted_overlaps = [box_overlap(gt_boxes, dt_boxes, metric)
+                       for gt_boxes, dt_boxes in zip(gt_boxes_parts, dt_boxes_parts)]
+    overlaps = split_overlaps_partly(parted_overlaps, split_parts, total_gt_num, total_dt_num)
 
     return overlaps, parted_overlaps, total_gt_num, total_dt_num
 
 
-def _prepare_data(gt_annos, dt_annos, current_class, difficulty):
+def _prepare_gt_data(gt_annos, current_class, difficulty):
     gt_datas_list = []
-    dt_datas_list = []
     total_dc_num = []
-    ignored_gts, ignored_dets, dontcares = [], [], []
+    ignored_gts, dontcares = [], []
     total_num_valid_gt = 0
     for i in range(len(gt_annos)):
-        rets = clean_data(gt_annos[i], dt_annos[i], current_class, difficulty)
-        num_valid_gt, ignored_gt, ignored_det, dc_bboxes = rets
+        num_valid_gt, ignored_gt, dc_bboxes = clean_gt_data(gt_annos[i], current_class, difficulty)
         ignored_gts.append(np.array(ignored_gt, dtype=np.int64))
-        ignored_dets.append(np.array(ignored_det, dtype=np.int64))
         if len(dc_bboxes) == 0:
             dc_bboxes = np.zeros((0, 4)).astype(np.float64)
         else:
@@ -434,17 +464,152 @@ def _prepare_data(gt_annos, dt_annos, current_class, difficulty):
         total_num_valid_gt += num_valid_gt
         gt_datas = np.concatenate(
             [gt_annos[i]["bbox"], gt_annos[i]["alpha"][..., np.newaxis]], 1)
+        gt_datas_list.append(gt_datas)
+    total_dc_num = np.stack(total_dc_num, axis=0)
+    return gt_datas_list, ignored_gts, dontcares, total_dc_num, total_num_valid_gt
+
+
+def _prepare_dt_data(dt_annos, current_class, difficulty):
+    dt_datas_list = []
+    ignored_dets = []
+    for i in range(len(dt_annos)):
+        ignored_det = clean_dt_data(dt_annos[i], current_class, difficulty)
+        ignored_dets.append(np.array(ignored_det, dtype=np.int64))
         dt_datas = np.concatenate([
             dt_annos[i]["bbox"], dt_annos[i]["alpha"][..., np.newaxis],
             dt_annos[i]["score"][..., np.newaxis]
         ], 1)
-        gt_datas_list.append(gt_datas)
         dt_datas_list.append(dt_datas)
-    total_dc_num = np.stack(total_dc_num, axis=0)
+    return dt_datas_list, ignored_dets
+
+
+def _prepare_data(gt_annos, dt_annos, current_class, difficulty):
+    gt_datas_list, ignored_gts, dontcares, total_dc_num, total_num_valid_gt = _prepare_gt_data(
+        gt_annos, current_class, difficulty)
+    dt_datas_list, ignored_dets = _prepare_dt_data(dt_annos, current_class, difficulty)
     return (gt_datas_list, dt_datas_list, ignored_gts, ignored_dets, dontcares,
             total_dc_num, total_num_valid_gt)
 
 
+def concat_partly(datas_list, split_parts):
+    datas_parts = []
+    idx = 0
+    for num_part in split_parts:
+        datas_parts.append(np.concatenate(datas_list[idx:idx + num_part], 0))
+        idx += num_part
+    return datas_parts
+
+
+class EvalSession(object):
+    """
+    Caches what eval_class recomputes for every metric, class, difficulty and min_overlap:
+    the gt side (ignore masks, dontcare boxes, box data, per part concatenations and gt boxes of each metric)
+    for the lifetime of the session, and the detection side plus the overlaps of each metric for the current
+    set of detections. Evaluating several checkpoints against the same gt only redoes the detection side.
+    The gt side can be persisted with cache_path and is reused by later runs with the same gt annos.
+    """
+    def __init__(self, gt_annos, num_parts=100, cache_path=None):
+        """
+        Args:
+            gt_annos: list of dict, must from get_label_annos() in kitti_common.py
+            num_parts: int. a parameter for fast calculate algorithm
+            cache_path: optional pickle file of the gt side, loaded if it matches gt_annos, written by save_gt_cache()
+        """
+        self.gt_annos = gt_annos
+        self.num_parts = num_parts
+        self.split_parts = get_split_parts(len(gt_annos), num_parts)
+        self.total_gt_num = np.array([len(a["name"]) for a in gt_annos], dtype=np.int64)
+        self.fingerprint = self.get_fingerprint(gt_annos, num_parts)
+        self.cache_path = cache_path
+        self.gt_cache = {}
+        self.gt_cache_updated = False
+        if cache_path is not None and os.path.exists(cache_path):
+            self.load_gt_cache(cache_path)
+        self.set_detections(None)
+
+    @staticmethod
+    def get_fingerprint(gt_annos, num_parts):
+        sha = hashlib.sha1(str(num_parts).encode())
+        for anno in gt_annos:
+            sha.update(('|'.join(anno["name"]) + '#').encode())
+            for key in ["bbox", "alpha", "location", "dimensions", "rotation_y", "truncated", "occluded"]:
+                sha.update(np.ascontiguousarray(anno[key]).tobytes())
+        return sha.hexdigest()
+
+    def load_gt_cache(self, cache_path):
+        with open(cache_path, 'rb') as f:
+            cache = pickle.load(f)
+        if cache.get('fingerprint') == self.fingerprint:
+            self.gt_cache = cache['gt_cache']
+
+    def save_gt_cache(self, cache_path=None):
+        cache_path = self.cache_path if cache_path is None else cache_path
+        if cache_path is None or not self.gt_cache_updated:
+            return
+        with open(cache_path, 'wb') as f:
+            pickle.dump({'fingerprint': self.fingerprint, 'gt_cache': self.gt_cache}, f)
+        self.gt_cache_updated = False
+
+    def set_detections(self, dt_annos):
+        if dt_annos is not None and dt_annos is self.dt_annos:
+            return
+        if dt_annos is not None:
+            assert len(self.gt_annos) == len(dt_annos)
+        self.dt_annos = dt_annos
+        self.dt_cache = {}
+
+    def get_gt_data(self, current_class, difficulty):
+        key = ('data', current_class, difficulty)
+        if key not in self.gt_cache:
+            gt_datas_list, ignored_gts, dontcares, total_dc_num, total_num_valid_gt = _prepare_gt_data(
+                self.gt_annos, current_class, difficulty)
+            self.gt_cache[key] = {
+                'gt_datas_list': gt_datas_list,
+                'ignored_gts': ignored_gts,
+                'dontcares': dontcares,
+                'total_dc_num': total_dc_num,
+                'total_num_valid_gt': total_num_valid_gt,
+                'gt_datas_parts': concat_partly(gt_datas_list, self.split_parts),
+                'ignored_gts_parts': concat_partly(ignored_gts, self.split_parts),
+                'dc_datas_parts': concat_partly(dontcares, self.split_parts),
+            }
+            self.gt_cache_updated = True
+        return self.gt_cache[key]
+
+    def get_dt_data(self, current_class, difficulty):
+        key = ('data', current_class, difficulty)
+        if key not in self.dt_cache:
+            dt_datas_list, ignored_dets = _prepare_dt_data(self.dt_annos, current_class, difficulty)
+            self.dt_cache[key] = {
+                'dt_datas_list': dt_datas_list,
+                'ignored_dets': ignored_dets,
+                'dt_datas_parts': concat_partly(dt_datas_list, self.split_parts),
+                'ignored_dets_parts': concat_partly(ignored_dets, self.split_parts),
+            }
+        return self.dt_cache[key]
+
+    def get_overlaps(self, metric):
+        """
+        Returns:
+            overlaps: per frame [num_dt, num_gt], parted_overlaps, total_dt_num, total_gt_num
+            (the order of calculate_iou_partly(dt_annos, gt_annos, metric) used by eval_class)
+        """
+        key = ('overlaps', metric)
+        if key not in self.dt_cache:
+            gt_key = ('boxes', metric)
+            if gt_key not in self.gt_cache:
+                self.gt_cache[gt_key] = get_boxes_partly(self.gt_annos, metric, self.split_parts)
+                self.gt_cache_updated = True
+            gt_boxes_parts = self.gt_cache[gt_key]
+            dt_boxes_parts = get_boxes_partly(self.dt_annos, metric, self.split_parts)
+            total_dt_num = np.array([len(a["name"]) for a in self.dt_annos], dtype=np.int64)
+            parted_overlaps = [box_overlap(dt_boxes, gt_boxes, metric)
+                               for dt_boxes, gt_boxes in zip(dt_boxes_parts, gt_boxes_parts)]
+            overlaps = split_overlaps_partly(parted_overlaps, self.split_parts, total_dt_num, self.total_gt_num)
+            self.dt_cache[key] = (overlaps, parted_overlaps, total_dt_num, self.total_gt_num)
+        return self.dt_cache[key]
+
+
 def eval_class(gt_annos,
                dt_annos,
                current_classes,
@@ -452,7 +617,8 @@ def eval_class(gt_annos,
                metric,
                min_overlaps,
                compute_aos=False,
-               num_parts=100):
+               num_parts=100,
+               session=None):
     """Kitti eval. support 2d/bev/3d/aos eval. support 0.5:0.05:0.95 coco AP.
     Args:
         gt_annos: dict, must from get_label_annos() in kitti_common.py
@@ -462,16 +628,17 @@ def eval_class(gt_annos,
         metric: eval type. 0: bbox, 1: bev, 2: 3d
         min_overlaps: float, min overlap. format: [num_overlap, metric, class].
         num_parts: int. a parameter for fast calculate algorithm
+        session: EvalSession of gt_annos sharing the cached data between calls, num_parts of the session is used
 
     Returns:
         dict of recall, precision and aos
     """
-    assert len(gt_annos) == len(dt_annos)
-    num_examples = len(gt_annos)
-    split_parts = get_split_parts(num_examples, num_parts)
+    if session is None:
+        session = EvalSession(gt_annos, num_parts)
+    session.set_detections(dt_annos)
+    split_parts = session.split_parts
 
-    rets = calculate_iou_partly(dt_annos, gt_annos, metric, num_parts)
-    overlaps, parted_overlaps, total_dt_num, total_gt_num = rets
+    overlaps, parted_overlaps, total_dt_num, total_gt_num = session.get_overlaps(metric)
     N_SAMPLE_PTS = 41
     num_minoverlap = len(min_overlaps)
     num_class = len(current_classes)
@@ -483,9 +650,11 @@ def eval_class(gt_annos,
     aos = np.zeros([num_class, num_difficulty, num_minoverlap, N_SAMPLE_PTS])
     for m, current_class in enumerate(current_classes):
         for l, difficulty in enumerate(difficultys):
-            rets = _prepare_data(gt_annos, dt_annos, current_class, difficulty)
-            (gt_datas_list, dt_datas_list, ignored_gts, ignored_dets,
-             dontcares, total_dc_num, total_num_valid_gt) = rets
+            gt_data = session.get_gt_data(current_class, difficulty)
+            dt_data = session.get_dt_data(current_class, difficulty)
+            gt_datas_list, ignored_gts, dontcares = gt_data['gt_datas_list'], gt_data['ignored_gts'], gt_data['dontcares']
+            total_dc_num, total_num_valid_gt = gt_data['total_dc_num'], gt_data['total_num_valid_gt']
+            dt_datas_list, ignored_dets = dt_data['dt_datas_list'], dt_data['ignored_dets']
             for k, min_overlap in enumerate(min_overlaps[:, metric, m]):
                 thresholdss = []
                 for i in range(len(gt_annos)):
@@ -508,27 +677,17 @@ def eval_class(gt_annos,
                 pr = np.zeros([len(thresholds), 4])
                 idx = 0
                 for j, num_part in enumerate(split_parts):
-                    gt_datas_part = np.concatenate(
-                        gt_datas_list[idx:idx + num_part], 0)
-                    dt_datas_part = np.concatenate(
-                        dt_datas_list[idx:idx + num_part], 0)
-                    dc_datas_part = np.concatenate(
-                        dontcares[idx:idx + num_part], 0)
-                    ignored_dets_part = np.concatenate(
-                        ignored_dets[idx:idx + num_part], 0)
-                    ignored_gts_part = np.concatenate(
-                        ignored_gts[idx:idx + num_part], 0)
                     fused_compute_statistics(
                         parted_overlaps[j],
                         pr,
                         total_gt_num[idx:idx + num_part],
                         total_dt_num[idx:idx + num_part],
                         total_dc_num[idx:idx + num_part],
-                        gt_datas_part,
-                        dt_datas_part,
-                        dc_datas_part,
-                        ignored_gts_part,
-                        ignored_dets_part,
+                        gt_data['gt_datas_parts'][j],
+                        dt_data['dt_datas_parts'][j],
+                        gt_data['dc_datas_parts'][j],
+                        gt_data['ignored_gts_parts'][j],
+                        dt_data['ignored_dets_parts'][j],
                         metric,
                         min_overlap=min_overlap,
                         thresholds=thresholds,
@@ -581,11 +740,15 @@ def do_eval(gt_annos,
             current_classes, #[0, 1, 2]
             min_overlaps,
             compute_aos=False, #True
-            PR_detail_dict=None):
+            PR_detail_dict=None,
+            session=None):
     # min_overlaps: [num_minoverlap, metric, num_class]
     difficultys = [0, 1, 2]
+    if session is None:
+        session = EvalSession(gt_annos)
+    #the three metrics share the cached gt / detection data of the session
     ret = eval_class(gt_annos, dt_annos, current_classes, difficultys, 0,
-                     min_overlaps, compute_aos) #metric: eval type. 0: bbox, 1: bev, 2: 3d
+                     min_overlaps, compute_aos, session=session) #metric: eval type. 0: bbox, 1: bev, 2: 3d
     # ret: [num_class, num_diff, num_minoverlap, num_sample_points]
     mAP_bbox = get_mAP(ret["precision"])
     mAP_bbox_R40 = get_mAP_R40(ret["precision"])
@@ -602,7 +765,7 @@ def do_eval(gt_annos,
             PR_detail_dict['aos'] = ret['orientation']
 
     ret = eval_class(gt_annos, dt_annos, current_classes, difficultys, 1,
-                     min_overlaps) #1 means bev, metric: eval type. 0: bbox, 1: bev, 2: 3d
+                     min_overlaps, session=session) #1 means bev, metric: eval type. 0: bbox, 1: bev, 2: 3d
     mAP_bev = get_mAP(ret["precision"])
     mAP_bev_R40 = get_mAP_R40(ret["precision"])
 
@@ -610,7 +773,7 @@ def do_eval(gt_annos,
         PR_detail_dict['bev'] = ret['precision']
 
     ret = eval_class(gt_annos, dt_annos, current_classes, difficultys, 2,
-                     min_overlaps)#metric: eval type. 0: bbox, 1: bev, 2: 3d
+                     min_overlaps, session=session)#metric: eval type. 0: bbox, 1: bev, 2: 3d
     mAP_3d = get_mAP(ret["precision"])
     mAP_3d_R40 = get_mAP_R40(ret["precision"])
     if PR_detail_dict is not None:
@@ -619,14 +782,15 @@ def do_eval(gt_annos,
 
 
 def do_coco_style_eval(gt_annos, dt_annos, current_classes, overlap_ranges,
-                       compute_aos):
+                       compute_aos, session=None):
     # overlap_ranges: [range, metric, num_class]
     min_overlaps = np.zeros([10, *overlap_ranges.shape[1:]])
     for i in range(overlap_ranges.shape[1]):
         for j in range(overlap_ranges.shape[2]):
-            min_overlaps[:, i, j] = np.linspace(*overlap_ranges[:, i, j])
+            start, stop, num = overlap_ranges[:, i, j]
+            min_overlaps[:, i, j] = np.linspace(start, stop, int(num))
     mAP_bbox, mAP_bev, mAP_3d, mAP_aos = do_eval(
-        gt_annos, dt_annos, current_classes, min_overlaps, compute_aos)
+        gt_annos, dt_annos, current_classes, min_overlaps, compute_aos, session=session)[:4]
     # ret: [num_class, num_diff, num_minoverlap]
     mAP_bbox = mAP_bbox.mean(-1)
     mAP_bev = mAP_bev.mean(-1)
@@ -636,7 +800,11 @@ def do_coco_style_eval(gt_annos, dt_annos, current_classes, overlap_ranges,
     return mAP_bbox, mAP_bev, mAP_3d, mAP_aos
 
 
-def get_official_eval_result(gt_annos, dt_annos, current_classes, class_to_name=None, PR_detail_dict=None):
+def get_official_eval_setting(current_classes, class_to_name=None):
+    """
+    Returns:
+        current_classes: list of int, class_to_name, min_overlaps: [num_minoverlap, metric, num_class]
+    """
     overlap_0_7 = np.array([[0.7, 0.5, 0.5, 0.7,
                              0.5, 0.7], [0.7, 0.5, 0.5, 0.7, 0.5, 0.7],
                             [0.7, 0.5, 0.5, 0.7, 0.5, 0.7]])
@@ -664,7 +832,14 @@ def get_official_eval_result(gt_annos, dt_annos, current_classes, class_to_name=
             current_classes_int.append(curcls)
     current_classes = current_classes_int #[0,1,2]
     min_overlaps = min_overlaps[:, :, current_classes]
-    result = ''
+    return current_classes, class_to_name, min_overlaps
+
+
+def get_official_eval_result(gt_annos, dt_annos, current_classes, class_to_name=None, PR_detail_dict=None, session=None):
+    """
+    session: optional EvalSession of gt_annos, reused across calls (e.g. one per checkpoint) to skip the gt side
+    """
+    current_classes, class_to_name, min_overlaps = get_official_eval_setting(current_classes, class_to_name)
     # check whether alpha is valid
     compute_aos = False
     for anno in dt_annos:
@@ -673,8 +848,19 @@ def get_official_eval_result(gt_annos, dt_annos, current_classes, class_to_name=
                 compute_aos = True
             break
     mAPbbox, mAPbev, mAP3d, mAPaos, mAPbbox_R40, mAPbev_R40, mAP3d_R40, mAPaos_R40 = do_eval(
-        gt_annos, dt_annos, current_classes, min_overlaps, compute_aos, PR_detail_dict=PR_detail_dict)
+        gt_annos, dt_annos, current_classes, min_overlaps, compute_aos, PR_detail_dict=PR_detail_dict, session=session)
+    if session is not None:
+        session.save_gt_cache()
+
+    return format_official_eval_result(
+        current_classes, class_to_name, min_overlaps, compute_aos,
+        mAPbbox, mAPbev, mAP3d, mAPaos, mAPbbox_R40, mAPbev_R40, mAP3d_R40, mAPaos_R40)
 
+
+def format_official_eval_result(current_classes, class_to_name, min_overlaps, compute_aos,
+                                mAPbbox, mAPbev, mAP3d, mAPaos, mAPbbox_R40, mAPbev_R40, mAP3d_R40, mAPaos_R40):
+    # mAP result: [num_class, num_diff, num_minoverlap]
+    result = ''
     ret_dict = {}
     for j, curcls in enumerate(current_classes):
         # mAP threshold array: [num_minoverlap, metric, class]
@@ -747,7 +933,7 @@ def get_official_eval_result(gt_annos, dt_annos, current_classes, class_to_name=
     return result, ret_dict
 
 
-def get_coco_eval_result(gt_annos, dt_annos, current_classes):
+def get_coco_eval_result(gt_annos, dt_annos, current_classes, session=None):
     class_to_name = {
         0: 'Car',
         1: 'Pedestrian',
@@ -785,7 +971,9 @@ def get_coco_eval_result(gt_annos, dt_annos, current_classes):
                 compute_aos = True
             break
     mAPbbox, mAPbev, mAP3d, mAPaos = do_coco_style_eval(
-        gt_annos, dt_annos, current_classes, overlap_ranges, compute_aos)
+        gt_annos, dt_annos, current_classes, overlap_ranges, compute_aos, session=session)
+    if session is not None:
+        session.save_gt_cache()
     for j, curcls in enumerate(current_classes):
         # mAP threshold array: [num_minoverlap, metric, class]
         # mAP result: [num_class, num_diff, num_minoverlap]
@@ -2,7 +2,7 @@ import time
 
 import fire
 
-import .kitti_common as kitti
+from . import kitti_common as kitti
 from .eval import get_coco_eval_result, get_official_eval_result
 
 
@@ -17,12 +17,13 @@ def evaluate(label_path,
              label_split_file,
              current_class=0,
              coco=False,
-             score_thresh=-1):
-    dt_annos = kitti.get_label_annos(result_path)
+             score_thresh=-1,
+             use_cache=False):
+    dt_annos = kitti.get_label_annos(result_path, use_cache=use_cache)
     if score_thresh > 0:
         dt_annos = kitti.filter_annos_low_score(dt_annos, score_thresh)
     val_image_ids = _read_imageset_file(label_split_file)
-    gt_annos = kitti.get_label_annos(label_path, val_image_ids)
+    gt_annos = kitti.get_label_annos(label_path, val_image_ids, use_cache=use_cache)
     if coco:
         return get_coco_eval_result(gt_annos, dt_annos, current_class)
     else:
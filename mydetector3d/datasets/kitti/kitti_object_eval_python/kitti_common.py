@@ -2,6 +2,7 @@ import concurrent.futures as futures
 import os
 import pathlib
 import re
+import tempfile
 from collections import OrderedDict
 
 import numpy as np
@@ -291,7 +292,7 @@ def add_difficulty_to_annos(info):
     return diff
 
 
-def get_label_anno(label_path):
+def get_label_anno_slow(label_path):
     annotations = {}
     annotations.update({
         'name': [],
@@ -329,7 +330,170 @@ def get_label_anno(label_path):
         annotations['score'] = np.zeros([len(annotations['bbox'])])
     return annotations
 
-def get_label_annos(label_folder, image_ids=None):
+
+def get_empty_label_anno():
+    # same arrays as get_label_anno_slow on an empty file
+    return {
+        'name': np.array([]), 'truncated': np.array([]), 'occluded': np.array([]), 'alpha': np.array([]),
+        'bbox': np.zeros([0, 4]), 'dimensions': np.zeros([0, 3]), 'location': np.zeros([0, 3]),
+        'rotation_y': np.array([]), 'score': np.zeros([0])
+    }
+
+
+LABEL_NAME_PATTERN = re.compile(r'^[ \t]*(\S+)', re.M)
+
+
+def parse_label_texts(texts):
+    """
+    Parses the texts of KITTI label files: the names are taken off the lines with one regex per file and all the
+    numbers of all the files are converted by a single np.fromstring, the annotations of each file are slices of
+    the parsed columns.
+    Args:
+        texts: list of label file contents
+    Returns:
+        annos: list of annotations, same as get_label_anno_slow, None for the files whose lines have an
+            unexpected number of fields
+    """
+    file_names = [LABEL_NAME_PATTERN.findall(text) for text in texts]
+    num_objects = [len(names) for names in file_names]
+    num_lines = sum(num_objects)
+    if num_lines == 0:
+        return [get_empty_label_anno() for _ in texts]
+    first_text = texts[int(np.flatnonzero(num_objects)[0])]
+    num_fields = len(first_text.lstrip().split('\n', 1)[0].split()) - 1
+    if num_fields in [14, 15]:
+        values = np.fromstring(LABEL_NAME_PATTERN.sub(' ', '\n'.join(texts)), dtype=np.float64, sep=' ')
+        if values.shape[0] == num_lines * num_fields:
+            return split_label_values(num_objects, [name for names in file_names for name in names],
+                                      values.reshape(num_lines, num_fields))
+    if len(texts) == 1:
+        return [None]
+    # mixed files, e.g. with and without score, parsed one by one
+    return [parse_label_texts([text])[0] for text in texts]
+
+
+def split_label_values(num_objects, names, values):
+    """
+    Args:
+        num_objects: number of lines of each file
+        names: names of all lines
+        values: (num_lines, 14 or 15) numbers of all lines
+    """
+    columns = {
+        'name': np.array(names),
+        'truncated': values[:, 0].copy(),
+        'occluded': values[:, 1].astype(np.int64),
+        'alpha': values[:, 2].copy(),
+        'bbox': values[:, 3:7].copy(),
+        # dimensions will convert hwl format to standard lhw(camera) format.
+        'dimensions': values[:, [9, 7, 8]],
+        'location': values[:, 10:13].copy(),
+        'rotation_y': values[:, 13].copy(),
+        'score': values[:, 14].copy() if values.shape[1] == 15 else np.zeros([values.shape[0]])  # have score
+    }
+    annos = []
+    offsets = np.concatenate([[0], np.cumsum(num_objects)]).astype(np.int64)
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        if end == start:
+            annos.append(get_empty_label_anno())
+        else:
+            annos.append({key: val[start:end] for key, val in columns.items()})
+    return annos
+
+
+def get_label_anno(label_path):
+    with open(label_path, 'r') as f:
+        annotations = parse_label_texts([f.read()])[0]
+    if annotations is None:  # irregular file, parse line by line
+        annotations = get_label_anno_slow(label_path)
+    return annotations
+
+
+def read_label_annos(label_filenames, num_worker=8):
+    """reads the files in a thread pool (one chunk of files per thread) and parses them together"""
+    def read_texts(label_paths):
+        texts = []
+        for label_path in label_paths:
+            with open(label_path, 'r') as f:
+                texts.append(f.read())
+        return texts
+
+    if len(label_filenames) == 0:
+        return []
+    chunks = np.array_split(np.arange(len(label_filenames)), min(num_worker, len(label_filenames)))
+    with futures.ThreadPoolExecutor(num_worker) as executor:
+        texts = sum(executor.map(read_texts, [[label_filenames[i] for i in chunk] for chunk in chunks]), [])
+    annos = parse_label_texts(texts)
+    return [anno if anno is not None else get_label_anno_slow(label_path)
+            for anno, label_path in zip(annos, label_filenames)]
+
+
+LABEL_ANNO_CACHE_KEYS = ['truncated', 'occluded', 'alpha', 'bbox', 'dimensions', 'location', 'rotation_y', 'score']
+
+
+def load_label_anno_cache(cache_path):
+    """
+    Returns:
+        cache: dict image_idx -> ((mtime_ns, size) of the label file, annotations), empty if there is no valid cache
+    """
+    if not os.path.exists(cache_path):
+        return {}
+    try: #a truncated / corrupt cache (e.g. zipfile.BadZipFile) or missing keys are rebuilt
+        with np.load(cache_path, allow_pickle=False) as data:
+            data = {key: data[key] for key in data.files}
+        offsets = np.concatenate([[0], np.cumsum(data['num_objects'])]).astype(np.int64)
+        cache = {}
+        for i, idx in enumerate(data['image_ids'].tolist()):
+            start, end = offsets[i], offsets[i + 1]
+            if end == start:
+                annotations = get_empty_label_anno()
+            else:
+                annotations = {'name': data['name'][start:end]}
+                for key in LABEL_ANNO_CACHE_KEYS:
+                    annotations[key] = data[key][start:end]
+            cache[idx] = ((int(data['mtime_ns'][i]), int(data['size'][i])), annotations)
+    except Exception:
+        return {}
+    return cache
+
+
+def save_label_anno_cache(cache_path, cache):
+    image_ids = sorted(cache.keys())
+    annos = [cache[idx][1] for idx in image_ids]
+    data = {
+        'image_ids': np.array(image_ids, dtype=np.int64),
+        'mtime_ns': np.array([cache[idx][0][0] for idx in image_ids], dtype=np.int64),
+        'size': np.array([cache[idx][0][1] for idx in image_ids], dtype=np.int64),
+        'num_objects': np.array([len(anno['score']) for anno in annos], dtype=np.int64),
+        'name': np.concatenate([anno['name'].astype(str) for anno in annos] + [np.zeros(0, dtype=str)]),
+    }
+    for key in LABEL_ANNO_CACHE_KEYS:
+        values = [anno[key] for anno in annos if len(anno['score']) > 0]
+        data[key] = np.concatenate(values) if len(values) > 0 else np.zeros(0)
+    #unique tmp file in the same folder, several processes may write the cache at once
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(str(cache_path)) + '.', suffix='.tmp',
+                                    dir=os.path.dirname(os.path.abspath(str(cache_path))))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **data)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def get_label_annos(label_folder, image_ids=None, num_worker=8, use_cache=False, cache_path=None):
+    """
+    Args:
+        label_folder: folder of the label files, 000000.txt ...
+        image_ids: list of indices or number of files, all files of the folder if None
+        num_worker: threads reading and parsing the files
+        use_cache: keep the parsed annotations in an .npz file (label_folder/.label_annos_cache.npz by default),
+            entries are reused while the mtime and size of their label file are unchanged
+    Returns:
+        annos: list of annotations, see get_label_anno
+    """
     if image_ids is None:
         filepaths = pathlib.Path(label_folder).glob('*.txt')
         prog = re.compile(r'^\d{6}.txt$')
@@ -338,13 +502,32 @@ def get_label_annos(label_folder, image_ids=None):
         image_ids = sorted(image_ids)
     if not isinstance(image_ids, list):
         image_ids = list(range(image_ids))
-    annos = []
     label_folder = pathlib.Path(label_folder)
-    for idx in image_ids:
-        image_idx = get_image_index_str(idx)
-        label_filename = label_folder / (image_idx + '.txt')
-        annos.append(get_label_anno(label_filename))
-    return annos
+    label_filenames = [label_folder / (get_image_index_str(idx) + '.txt') for idx in image_ids]
+    if not use_cache:
+        return read_label_annos(label_filenames, num_worker=num_worker)
+
+    if cache_path is None:
+        cache_path = label_folder / '.label_annos_cache.npz'
+    cache = load_label_anno_cache(cache_path)
+
+    def get_file_stat(label_path):
+        stat = os.stat(label_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    with futures.ThreadPoolExecutor(num_worker) as executor:
+        file_stats = list(executor.map(get_file_stat, label_filenames))
+    stale = [i for i, idx in enumerate(image_ids) if idx not in cache or cache[idx][0] != file_stats[i]]
+    if len(stale) > 0:
+        stale_annos = read_label_annos([label_filenames[i] for i in stale], num_worker=num_worker)
+        for i, annotations in zip(stale, stale_annos):
+            cache[image_ids[i]] = (file_stats[i], annotations)
+        try:
+            save_label_anno_cache(cache_path, cache)
+        except OSError as e:  # e.g. read-only dataset folder
+            print('Label cache %s not saved: %s' % (cache_path, e))
+    return [cache[idx][1] for idx in image_ids]
+
 
 def area(boxes, add1=False):
     """Computes area of boxes.
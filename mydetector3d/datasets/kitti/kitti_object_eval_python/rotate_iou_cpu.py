@@ -0,0 +1,240 @@
+#####################
+# CPU (numba parallel) port of rotate_iou.py, used by the evaluator when no CUDA device is present.
+# The device functions are kept line by line with float32 work arrays, so the rounding matches the GPU kernel.
+#####################
+import math
+
+import numba
+import numpy as np
+
+
+@numba.jit(nopython=True, error_model='numpy')
+def trangle_area(a, b, c):
+    return ((a[0] - c[0]) * (b[1] - c[1]) - (a[1] - c[1]) *
+            (b[0] - c[0])) / 2.0
+
+
+@numba.jit(nopython=True, error_model='numpy')
+def area(int_pts, num_of_inter):
+    area_val = 0.0
+    for i in range(num_of_inter - 2):
+        area_val += abs(
+            trangle_area(int_pts[:2], int_pts[2 * i + 2:2 * i + 4],
+                         int_pts[2 * i + 4:2 * i + 6]))
+    return area_val
+
+
+@numba.jit(nopython=True, error_model='numpy')
+def sort_vertex_in_convex_polygon(int_pts, num_of_inter, work):
+    if num_of_inter > 0:
+        center = work[0:2]
+        center[:] = 0.0
+        for i in range(num_of_inter):
+            center[0] += int_pts[2 * i]
+            center[1] += int_pts[2 * i + 1]
+        center[0] /= num_of_inter
+        center[1] /= num_of_inter
+        v = work[2:4]
+        vs = work[4:20]
+        for i in range(num_of_inter):
+            v[0] = int_pts[2 * i] - center[0]
+            v[1] = int_pts[2 * i + 1] - center[1]
+            d = math.sqrt(v[0] * v[0] + v[1] * v[1])
+            v[0] = v[0] / d
+            v[1] = v[1] / d
+            if v[1] < 0:
+                v[0] = -2 - v[0]
+            vs[i] = v[0]
+        for i in range(1, num_of_inter):
+            if vs[i - 1] > vs[i]:
+                temp = vs[i]
+                tx = int_pts[2 * i]
+                ty = int_pts[2 * i + 1]
+                j = i
+                while j > 0 and vs[j - 1] > temp:
+                    vs[j] = vs[j - 1]
+                    int_pts[j * 2] = int_pts[j * 2 - 2]
+                    int_pts[j * 2 + 1] = int_pts[j * 2 - 1]
+                    j -= 1
+
+                vs[j] = temp
+                int_pts[j * 2] = tx
+                int_pts[j * 2 + 1] = ty
+
+
+@numba.jit(nopython=True, error_model='numpy')
+def line_segment_intersection(pts1, pts2, i, j, temp_pts):
+    # A, B are the points i, i + 1 of pts1 and C, D the points j, j + 1 of pts2
+    A0, A1 = pts1[2 * i], pts1[2 * i + 1]
+    B0, B1 = pts1[2 * ((i + 1) % 4)], pts1[2 * ((i + 1) % 4) + 1]
+    C0, C1 = pts2[2 * j], pts2[2 * j + 1]
+    D0, D1 = pts2[2 * ((j + 1) % 4)], pts2[2 * ((j + 1) % 4) + 1]
+    BA0 = B0 - A0
+    BA1 = B1 - A1
+    DA0 = D0 - A0
+    CA0 = C0 - A0
+    DA1 = D1 - A1
+    CA1 = C1 - A1
+    acd = DA1 * CA0 > CA1 * DA0
+    bcd = (D1 - B1) * (C0 - B0) > (C1 - B1) * (D0 - B0)
+    if acd != bcd:
+        abc = CA1 * BA0 > BA1 * CA0
+        abd = DA1 * BA0 > BA1 * DA0
+        if abc != abd:
+            DC0 = D0 - C0
+            DC1 = D1 - C1
+            ABBA = A0 * B1 - B0 * A1
+            CDDC = C0 * D1 - D0 * C1
+            DH = BA1 * DC0 - BA0 * DC1
+            Dx = ABBA * DC0 - BA0 * CDDC
+            Dy = ABBA * DC1 - BA1 * CDDC
+            temp_pts[0] = Dx / DH
+            temp_pts[1] = Dy / DH
+            return True
+    return False
+
+
+@numba.jit(nopython=True, error_model='numpy')
+def point_in_quadrilateral(pt_x, pt_y, corners):
+    ab0 = corners[2] - corners[0]
+    ab1 = corners[3] - corners[1]
+
+    ad0 = corners[6] - corners[0]
+    ad1 = corners[7] - corners[1]
+
+    ap0 = pt_x - corners[0]
+    ap1 = pt_y - corners[1]
+
+    abab = ab0 * ab0 + ab1 * ab1
+    abap = ab0 * ap0 + ab1 * ap1
+    adad = ad0 * ad0 + ad1 * ad1
+    adap = ad0 * ap0 + ad1 * ap1
+
+    return abab >= abap and abap >= 0 and adad >= adap and adap >= 0
+
+
+@numba.jit(nopython=True, error_model='numpy')
+def quadrilateral_intersection(pts1, pts2, int_pts, temp_pts):
+    num_of_inter = 0
+    for i in range(4):
+        if point_in_quadrilateral(pts1[2 * i], pts1[2 * i + 1], pts2):
+            int_pts[num_of_inter * 2] = pts1[2 * i]
+            int_pts[num_of_inter * 2 + 1] = pts1[2 * i + 1]
+            num_of_inter += 1
+        if point_in_quadrilateral(pts2[2 * i], pts2[2 * i + 1], pts1):
+            int_pts[num_of_inter * 2] = pts2[2 * i]
+            int_pts[num_of_inter * 2 + 1] = pts2[2 * i + 1]
+            num_of_inter += 1
+    for i in range(4):
+        for j in range(4):
+            has_pts = line_segment_intersection(pts1, pts2, i, j, temp_pts)
+            if has_pts:
+                int_pts[num_of_inter * 2] = temp_pts[0]
+                int_pts[num_of_inter * 2 + 1] = temp_pts[1]
+                num_of_inter += 1
+
+    return num_of_inter
+
+
+@numba.jit(nopython=True, error_model='numpy')
+def rbbox_to_corners(corners, rbbox, work):
+    # generate clockwise corners and rotate it clockwise
+    angle = rbbox[4]
+    a_cos = math.cos(angle)
+    a_sin = math.sin(angle)
+    center_x = rbbox[0]
+    center_y = rbbox[1]
+    x_d = rbbox[2]
+    y_d = rbbox[3]
+    corners_x = work[0:4]
+    corners_y = work[4:8]
+    corners_x[0] = -x_d / 2
+    corners_x[1] = -x_d / 2
+    corners_x[2] = x_d / 2
+    corners_x[3] = x_d / 2
+    corners_y[0] = -y_d / 2
+    corners_y[1] = y_d / 2
+    corners_y[2] = y_d / 2
+    corners_y[3] = -y_d / 2
+    for i in range(4):
+        corners[2 *
+                i] = a_cos * corners_x[i] + a_sin * corners_y[i] + center_x
+        corners[2 * i
+                + 1] = -a_sin * corners_x[i] + a_cos * corners_y[i] + center_y
+
+
+@numba.jit(nopython=True, error_model='numpy')
+def inter(rbbox1, rbbox2, work):
+    """
+    work: (72) float32 scratch array, replaces the cuda.local arrays
+    """
+    corners1 = work[0:8]
+    corners2 = work[8:16]
+    intersection_corners = work[16:48]  # room for 16 points, the gpu version only has 8
+    scratch = work[48:]
+
+    rbbox_to_corners(corners1, rbbox1, scratch)
+    rbbox_to_corners(corners2, rbbox2, scratch)
+
+    num_intersection = quadrilateral_intersection(corners1, corners2,
+                                                  intersection_corners, scratch)
+    sort_vertex_in_convex_polygon(intersection_corners, num_intersection, scratch)
+
+    return area(intersection_corners, num_intersection)
+
+
+@numba.jit(nopython=True, error_model='numpy')
+def devRotateIoUEval(rbox1, rbox2, criterion, work, skip_inter):
+    area1 = rbox1[2] * rbox1[3]
+    area2 = rbox2[2] * rbox2[3]
+    if skip_inter:
+        area_inter = 0.0
+    else:
+        area_inter = inter(rbox1, rbox2, work)
+    if criterion == -1:
+        return area_inter / (area1 + area2 - area_inter)
+    elif criterion == 0:
+        return area_inter / area1
+    elif criterion == 1:
+        return area_inter / area2
+    else:
+        return area_inter
+
+
+@numba.jit(nopython=True, parallel=True, error_model='numpy')
+def rotate_iou_kernel_eval_cpu(boxes, query_boxes, iou, criterion):
+    N, K = boxes.shape[0], query_boxes.shape[0]
+    # bounding circles, far apart pairs have no intersection points and get area_inter = 0 like on the GPU
+    radius = np.sqrt(boxes[:, 2].astype(np.float64) ** 2 + boxes[:, 3].astype(np.float64) ** 2) / 2
+    query_radius = np.sqrt(query_boxes[:, 2].astype(np.float64) ** 2 + query_boxes[:, 3].astype(np.float64) ** 2) / 2
+    for n in numba.prange(N):
+        work = np.empty(72, dtype=np.float32)
+        for k in range(K):
+            dx = np.float64(boxes[n, 0]) - query_boxes[k, 0]
+            dy = np.float64(boxes[n, 1]) - query_boxes[k, 1]
+            max_dist = (radius[n] + query_radius[k]) * 1.001 + 1e-3
+            skip_inter = dx * dx + dy * dy > max_dist * max_dist
+            iou[n, k] = devRotateIoUEval(query_boxes[k], boxes[n], criterion, work, skip_inter)
+
+
+def rotate_iou_cpu_eval(boxes, query_boxes, criterion=-1):
+    """rotated box iou on the cpu, same arguments and results as rotate_iou_gpu_eval.
+
+    Args:
+        boxes (float array: [N, 5]): rbboxes. format: centers, dims,
+            angles(clockwise when positive)
+        query_boxes (float array: [K, 5]): [description]
+        criterion: -1: iou, 0: overlap / area of boxes, 1: overlap / area of query_boxes, other: overlap area
+
+    Returns:
+        iou (float32 array: [N, K])
+    """
+    boxes = np.ascontiguousarray(boxes, dtype=np.float32)
+    query_boxes = np.ascontiguousarray(query_boxes, dtype=np.float32)
+    N = boxes.shape[0]
+    K = query_boxes.shape[0]
+    iou = np.zeros((N, K), dtype=np.float32)
+    if N == 0 or K == 0:
+        return iou
+    rotate_iou_kernel_eval_cpu(boxes, query_boxes, iou, criterion)
+    return iou
@@ -0,0 +1,184 @@
+import copy
+
+import numpy as np
+
+from .eval import (_prepare_data, calculate_iou_partly, compute_statistics_jit, format_official_eval_result,
+                   fused_compute_statistics, get_mAP, get_mAP_R40, get_official_eval_setting)
+
+
+class StreamingEvaluator(object):
+    """
+    Incremental version of get_official_eval_result: the detections of each batch are matched to their gt
+    with the same statistics as the official evaluator, accumulated at a fixed grid of score thresholds for
+    every metric, class, difficulty and min_overlap: tp / fp / fn / aos similarity, and the histogram of the
+    matched scores the official evaluator picks its thresholds from (get_thresholds). Memory does not grow
+    with the number of frames and the running AP is available at any time.
+    The thresholds of the 41 recall points are snapped to the grid, so the AP is an approximation for monitoring
+    a run (close to 1 AP off the official one on KITTI-sized annos, finer grids get closer), the results
+    to report come from get_official_eval_result.
+    """
+    def __init__(self, current_classes, get_gt_anno, class_to_name=None, transform_annos=None, num_score_thresh=101):
+        """
+        Args:
+            current_classes: list of class names or ints, as in get_official_eval_result
+            get_gt_anno: get_gt_anno(frame_id) returns the gt anno of the frame
+            class_to_name: dict, as in get_official_eval_result
+            transform_annos: optional transform_annos(annos, is_gt) converting copies of the annos to the kitti format
+            num_score_thresh: number of score thresholds in [0, 1]
+        """
+        self.current_classes, self.class_to_name, self.min_overlaps = get_official_eval_setting(
+            current_classes, class_to_name)
+        self.get_gt_anno = get_gt_anno
+        self.transform_annos = transform_annos
+        self.thresholds = np.linspace(0, 1, num_score_thresh)
+        self.difficultys = [0, 1, 2]
+        self.reset()
+
+    def reset(self):
+        # pr: [metric, num_class, num_difficulty, num_minoverlap, num_score_thresh, (tp, fp, fn, similarity)]
+        self.pr = np.zeros([3, len(self.current_classes), len(self.difficultys), self.min_overlaps.shape[0],
+                            len(self.thresholds), 4])
+        # score histogram of the matched detections (bin i: [thresholds[i], thresholds[i + 1])) and number of valid gt
+        self.tp_score_hist = np.zeros(self.pr.shape[:-1], dtype=np.int64)
+        self.num_valid_gt = np.zeros(self.pr.shape[1:3], dtype=np.int64)
+        self.compute_aos = None
+        self.frame_ids = set()
+
+    @property
+    def num_frames(self):
+        return len(self.frame_ids)
+
+    def add_batch(self, det_annos):
+        """
+        Args:
+            det_annos: annos of generate_prediction_dicts, each with its 'frame_id'
+        """
+        det_annos = [anno for anno in det_annos if anno['frame_id'] not in self.frame_ids] #frames added twice on this rank
+        if len(det_annos) == 0:
+            return
+        gt_annos = [copy.deepcopy(self.get_gt_anno(anno['frame_id'])) for anno in det_annos]
+        self.frame_ids.update([anno['frame_id'] for anno in det_annos])
+        if self.transform_annos is not None:
+            det_annos = self.transform_annos(copy.deepcopy(det_annos), False)
+            gt_annos = self.transform_annos(gt_annos, True)
+        self.add_frames(gt_annos, det_annos)
+
+    def add_frames(self, gt_annos, dt_annos):
+        """
+        Args:
+            gt_annos, dt_annos: kitti format annos of the same frames
+        """
+        assert len(gt_annos) == len(dt_annos)
+        if self.compute_aos is None:
+            # check whether alpha is valid, on the first frame with detections like the official evaluator
+            for anno in dt_annos:
+                if anno['alpha'].shape[0] != 0:
+                    self.compute_aos = anno['alpha'][0] != -10
+                    break
+
+        #one part for the whole batch, rows are detections
+        metric_overlaps = [calculate_iou_partly(dt_annos, gt_annos, metric, num_parts=1) for metric in range(3)]
+        for m, current_class in enumerate(self.current_classes):
+            for l, difficulty in enumerate(self.difficultys):
+                (gt_datas_list, dt_datas_list, ignored_gts_list, ignored_dets_list, dontcares,
+                 total_dc_num, num_valid_gt) = _prepare_data(gt_annos, dt_annos, current_class, difficulty)
+                self.num_valid_gt[m, l] += num_valid_gt
+                gt_datas = np.concatenate(gt_datas_list, 0)
+                dt_datas = np.concatenate(dt_datas_list, 0)
+                dc_datas = np.concatenate(dontcares, 0)
+                ignored_gts = np.concatenate(ignored_gts_list, 0)
+                ignored_dets = np.concatenate(ignored_dets_list, 0)
+                for metric, (overlaps, parted_overlaps, total_dt_num, total_gt_num) in enumerate(metric_overlaps):
+                    for k, min_overlap in enumerate(self.min_overlaps[:, metric, m]):
+                        for i in range(len(gt_annos)):
+                            tp_scores = compute_statistics_jit(
+                                overlaps[i],
+                                gt_datas_list[i],
+                                dt_datas_list[i],
+                                ignored_gts_list[i],
+                                ignored_dets_list[i],
+                                dontcares[i],
+                                metric,
+                                min_overlap=min_overlap,
+                                thresh=0.0,
+                                compute_fp=False)[-1]
+                            bins = np.searchsorted(self.thresholds, tp_scores, side='right') - 1
+                            np.add.at(self.tp_score_hist[metric, m, l, k], np.maximum(bins, 0), 1)
+                        fused_compute_statistics(
+                            parted_overlaps[0],
+                            self.pr[metric, m, l, k],
+                            total_gt_num,
+                            total_dt_num,
+                            total_dc_num,
+                            gt_datas,
+                            dt_datas,
+                            dc_datas,
+                            ignored_gts,
+                            ignored_dets,
+                            metric,
+                            min_overlap=min_overlap,
+                            thresholds=self.thresholds,
+                            compute_aos=bool(self.compute_aos) and metric == 0)
+
+    def state_dict(self):
+        return {'pr': self.pr, 'tp_score_hist': self.tp_score_hist, 'num_valid_gt': self.num_valid_gt,
+                'compute_aos': self.compute_aos, 'frame_ids': self.frame_ids}
+
+    def merge_state(self, state):
+        """adds the statistics of another evaluator (e.g. of another rank)"""
+        self.pr += state['pr']
+        self.tp_score_hist += state['tp_score_hist']
+        self.num_valid_gt += state['num_valid_gt']
+        if self.compute_aos is None:
+            self.compute_aos = state['compute_aos']
+        self.frame_ids.update(state['frame_ids'])
+
+    def get_precision(self):
+        """
+        Returns:
+            precision, orientation: [metric, num_class, num_difficulty, num_minoverlap, 41] like eval_class,
+            the 41 thresholds are picked from the matched scores as in get_thresholds
+        """
+        tp, fp, similarity = self.pr[..., 0], self.pr[..., 1], self.pr[..., 3]
+        precision = tp / np.maximum(tp + fp, 1)
+        aos = similarity / np.maximum(tp + fp, 1)
+
+        #number of matched scores above each threshold, and in total
+        num_matched = np.cumsum(self.tp_score_hist[..., ::-1], axis=-1)[..., ::-1]
+        total_matched = num_matched[..., :1]
+        #get_thresholds takes the c-th highest matched score for recall point k when c / num_gt is the closest to
+        #k / 40, at most one recall point per score, and always the last score
+        num_gt = self.num_valid_gt[np.newaxis, :, :, np.newaxis, np.newaxis]
+        k = np.arange(41)
+        first_count = np.maximum(np.ceil(k * num_gt / 40 - 0.5), 1)
+        counts = np.maximum.accumulate(first_count - k, axis=-1) + k
+        picked = counts <= total_matched
+        num_picked = picked.sum(-1, keepdims=True)
+        last_count = np.take_along_axis(counts, np.maximum(num_picked - 1, 0), axis=-1)
+        add_last = (total_matched > 0) & (num_picked < 41) & ((num_picked == 0) | (last_count != total_matched))
+        counts = np.where(add_last & (k == num_picked), total_matched, counts)
+        picked = picked | (add_last & (k == num_picked))
+
+        #highest grid threshold keeping the c highest matched scores
+        thresh_idx = (num_matched[..., np.newaxis, :] >= counts[..., np.newaxis]).sum(-1) - 1
+        thresh_idx = np.maximum(thresh_idx, 0)
+        precision = np.where(picked, np.take_along_axis(precision, thresh_idx, axis=-1), 0)
+        aos = np.where(picked, np.take_along_axis(aos, thresh_idx, axis=-1), 0)
+        precision = np.maximum.accumulate(precision[..., ::-1], axis=-1)[..., ::-1]
+        aos = np.maximum.accumulate(aos[..., ::-1], axis=-1)[..., ::-1]
+        return precision, aos
+
+    def get_result(self):
+        """
+        Returns:
+            result_str, ret_dict: same format as get_official_eval_result, for the frames added so far
+        """
+        precision, aos = self.get_precision()
+        mAPs = [get_mAP(precision[metric]) for metric in range(3)]
+        mAPs_R40 = [get_mAP_R40(precision[metric]) for metric in range(3)]
+        compute_aos = bool(self.compute_aos)
+        mAPaos = get_mAP(aos[0]) if compute_aos else None
+        mAPaos_R40 = get_mAP_R40(aos[0]) if compute_aos else None
+        return format_official_eval_result(
+            self.current_classes, self.class_to_name, self.min_overlaps, compute_aos,
+            mAPs[0], mAPs[1], mAPs[2], mAPaos, mAPs_R40[0], mAPs_R40[1], mAPs_R40[2], mAPaos_R40)
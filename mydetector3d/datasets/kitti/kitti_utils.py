@@ -1,5 +1,6 @@
 import numpy as np
-from ...utils import box_utils
+import torch
+from ...utils import box_utils, common_utils
 from glob import glob
 # def filter_otherobjects(annos, map_name_to_kitti):
 #     newannots=[]
@@ -135,6 +136,113 @@ def calib_to_intrinsics(calib):
     # self.b_x = self.P[0, 3] / (-self.f_u)  # relative
     # self.b_y = self.P[1, 3] / (-self.f_v)
 
+def calibs_to_batch_matricies(calibs):
+    """
+    Stacks the calibrations of a batch for the batched box conversions of box_utils
+    Args:
+        calibs: list of calibration.Calibration objects
+    Returns
+        V2R: (B, 4, 3), Lidar to rectified camera transformation (right-multiplied, as in calib.lidar_to_rect)
+        P2: (B, 3, 4), Camera projection matrix
+    """
+    V2R = np.stack([np.dot(calib.V2C.T, calib.R0.T) for calib in calibs])
+    P2 = np.stack([calib.P2 for calib in calibs])
+    return V2R, P2
+
+
+def get_kitti_label_text(name, label_values):
+    """
+    Args:
+        name: (N) class names
+        label_values: (N, 13) alpha, bbox, dimensions (hwl), location, rotation_y, score
+    Returns:
+        text of the KITTI label file
+    """
+    return ''.join(['%s -1 -1 %.4f %.4f %.4f %.4f %.4f %.4f %.4f %.4f %.4f %.4f %.4f %.4f %.4f\n' % ((cur_name,) + tuple(values))
+                    for cur_name, values in zip(name.tolist(), label_values.tolist())])
+
+
+def generate_prediction_dicts_batch(batch_dict, pred_dicts, class_names, output_path=None, projected_depth=False):
+    """
+    Batched generate_prediction_dicts of the KITTI style datasets: one device to host copy for the batch, the box
+    conversions run on the boxes of all frames with the stacked calibrations, the label files are written by
+    common_utils.AsyncFileWriter (common_utils.wait_async_file_writes() before reading them)
+    Args:
+        batch_dict:
+            frame_id, calib, image_shape
+        pred_dicts: list of pred_dicts
+            pred_boxes: (N, 7), Tensor
+            pred_scores: (N), Tensor
+            pred_labels: (N), Tensor
+        class_names:
+        output_path:
+        projected_depth: see box_utils.boxes3d_kitti_camera_to_imageboxes_batch
+    Returns:
+        annos: list of kitti format pred_dicts
+    """
+    def get_template_prediction(num_samples):
+        ret_dict = {
+            'name': np.zeros(num_samples), 'truncated': np.zeros(num_samples),
+            'occluded': np.zeros(num_samples), 'alpha': np.zeros(num_samples),
+            'bbox': np.zeros([num_samples, 4]), 'dimensions': np.zeros([num_samples, 3]),
+            'location': np.zeros([num_samples, 3]), 'rotation_y': np.zeros(num_samples),
+            'score': np.zeros(num_samples), 'boxes_lidar': np.zeros([num_samples, 7])
+        }
+        return ret_dict
+
+    #boxes, scores and labels of all frames in one tensor, copied once
+    num_boxes = [box_dict['pred_scores'].shape[0] for box_dict in pred_dicts]
+    box_dim = pred_dicts[0]['pred_boxes'].shape[1]
+    preds = torch.cat([torch.cat([
+        box_dict['pred_boxes'], box_dict['pred_scores'][:, None].to(box_dict['pred_boxes'].dtype),
+        box_dict['pred_labels'][:, None].to(box_dict['pred_boxes'].dtype)
+    ], dim=1) for box_dict in pred_dicts], dim=0).cpu().numpy()
+    pred_boxes = preds[:, :box_dim]
+    pred_scores = preds[:, box_dim]
+    pred_labels = preds[:, box_dim + 1].astype(np.int64)
+    batch_index = np.repeat(np.arange(len(pred_dicts)), num_boxes)
+
+    if preds.shape[0] > 0:
+        V2R, P2 = calibs_to_batch_matricies(batch_dict['calib'][:len(pred_dicts)])
+        image_shape = batch_dict['image_shape'].cpu().numpy()
+        pred_boxes_camera = box_utils.boxes3d_lidar_to_kitti_camera_batch(pred_boxes, V2R, batch_index)
+        pred_boxes_img = box_utils.boxes3d_kitti_camera_to_imageboxes_batch(
+            pred_boxes_camera, P2, batch_index, image_shape=image_shape, projected_depth=projected_depth
+        )
+        pred_alpha = -np.arctan2(-pred_boxes[:, 1], pred_boxes[:, 0]) + pred_boxes_camera[:, 6]
+        pred_names = np.array(class_names)[pred_labels - 1]
+
+    annos = []
+    offsets = np.concatenate([[0], np.cumsum(num_boxes)])
+    for index in range(len(pred_dicts)):
+        frame_id = batch_dict['frame_id'][index]
+        start, end = offsets[index], offsets[index + 1]
+        single_pred_dict = get_template_prediction(end - start)
+        if end > start:
+            single_pred_dict['name'] = pred_names[start:end]
+            single_pred_dict['alpha'] = pred_alpha[start:end]
+            single_pred_dict['bbox'] = pred_boxes_img[start:end]
+            single_pred_dict['dimensions'] = pred_boxes_camera[start:end, 3:6]
+            single_pred_dict['location'] = pred_boxes_camera[start:end, 0:3]
+            single_pred_dict['rotation_y'] = pred_boxes_camera[start:end, 6]
+            single_pred_dict['score'] = pred_scores[start:end]
+            single_pred_dict['boxes_lidar'] = pred_boxes[start:end]
+        single_pred_dict['frame_id'] = frame_id
+        annos.append(single_pred_dict)
+
+        if output_path is not None: #save to txt file in the background
+            dims = single_pred_dict['dimensions']  # lhw -> hwl
+            label_values = np.concatenate([
+                single_pred_dict['alpha'][:, None], single_pred_dict['bbox'], dims[:, [1, 2, 0]],
+                single_pred_dict['location'], single_pred_dict['rotation_y'][:, None], single_pred_dict['score'][:, None]
+            ], axis=1)
+            common_utils.get_async_file_writer().submit(
+                output_path / ('%s.txt' % frame_id), get_kitti_label_text, single_pred_dict['name'], label_values
+            )
+
+    return annos
+
+
 import pandas as pd
 import os
 from sklearn.model_selection import train_test_split
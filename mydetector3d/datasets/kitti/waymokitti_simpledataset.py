@@ -4,8 +4,9 @@ import pickle
 import numpy as np
 from skimage import io
 from mydetector3d.datasets.dataset import DatasetTemplate
+from mydetector3d.ops.roiaware_pool3d import roiaware_pool3d_utils
 #from ...utils import box_utils, calibration_waymokitti, common_utils, object3d_kitti
-from mydetector3d.utils import  box_utils, calibration_waymokitti, common_utils, object3d_kitti
+from mydetector3d.utils import  box_utils, calibration_waymokitti, common_utils, dataset_prep_utils, numba_utils, object3d_kitti
 
 class WaymoKittiDataset(DatasetTemplate):
     def __init__(self, dataset_cfg, class_names, training=True, root_path=None, logger=None):
@@ -60,6 +61,9 @@ class WaymoKittiDataset(DatasetTemplate):
         self.sample_id_list = [x.strip() for x in open(split_dir).readlines()] if split_dir.exists() else None
 
     def get_lidar(self, idx):
+        if self.lidar_store is not None and idx in self.lidar_store:
+            #zero-copy view of the packed frame, copy in training since augmentation modifies points in place
+            return self.lidar_store.get(idx, copy=self.training)
         lidar_file = self.root_split_path / 'velodyne' / ('%s.bin' % idx)
         assert lidar_file.exists()
         return np.fromfile(str(lidar_file), dtype=np.float32).reshape(-1, 4)
@@ -157,8 +161,6 @@ class WaymoKittiDataset(DatasetTemplate):
         return pts_valid_flag
 
     def get_infos(self, num_workers=4, has_label=True, count_inside_pts=True, sample_id_list=None):
-        import concurrent.futures as futures
-
         def process_single_scene(sample_idx): #for each idx in the list
             print('%s sample_idx: %s' % (self.split, sample_idx))
             info = {}
@@ -234,27 +236,30 @@ class WaymoKittiDataset(DatasetTemplate):
                     fov_flag = self.get_fov_flag(pts_rect, info['image']['image_shape'], calib) #True/False list of points inside the camera fov
                     pts_fov = points[fov_flag] #only select points inside the camera FOV
 
-                    # gt_boxes_lidar is (N,7)  [x, y, z, dx, dy, dz, heading], (x, y, z) is the box center
-                    # returned corners_lidar（N,8,3）:8 point box for each box (each point is the coordinate)
-                    corners_lidar = box_utils.boxes_to_corners_3d(gt_boxes_lidar)
-
                     # num_gt is the total number object in the current frame，
                     # initialize num_points_in_gt=array([-1, -1, -1, -1, -1, -1, -1, -1, -1, -1], dtype=int32)
                     num_points_in_gt = -np.ones(num_gt, dtype=np.int32)
-                    #num_objects is effective object numbers
-                    for k in range(num_objects):
-                        #corners_lidar the 8 point box of the k-th gt, pts_fov is the lidar points inside the camera FOV
-                        #is_hull check whether the point cloud is inside the bbox or not, use 0:3 means only check 2D box (x,y)
-                        flag = box_utils.in_hull(pts_fov[:, 0:3], corners_lidar[k])
-                        num_points_in_gt[k] = flag.sum() #calculate the points inside the box
+                    # gt_boxes_lidar is (N,7)  [x, y, z, dx, dy, dz, heading], (x, y, z) is the box center
+                    #points of the num_objects effective boxes counted in one pass, same counts as box_utils.in_hull on the box corners
+                    num_points_in_gt[:num_objects] = roiaware_pool3d_utils.count_points_in_boxes_cpu(
+                        pts_fov[:, 0:3], gt_boxes_lidar[:num_objects])
                     annotations['num_points_in_gt'] = num_points_in_gt
 
             return info
 
         sample_id_list = sample_id_list if sample_id_list is not None else self.sample_id_list
-        with futures.ThreadPoolExecutor(num_workers) as executor:
-            infos = executor.map(process_single_scene, sample_id_list) #process train or val sample id list
-        return list(infos)
+        #process train or val sample id list, processes instead of threads as the point counting holds the GIL
+        return common_utils.process_map(process_single_scene, sample_id_list, num_workers=num_workers)
+
+    def get_stream_evaluator(self, class_names, **kwargs):
+        """StreamingEvaluator consuming the annos of generate_prediction_dicts batch by batch"""
+        if 'annos' not in self.kitti_infos[0].keys():
+            return None
+
+        from .kitti_object_eval_python.stream_eval import StreamingEvaluator
+
+        frame_idx = {'{:06d}'.format(int(info['image']['image_idx'])): i for i, info in enumerate(self.kitti_infos)}
+        return StreamingEvaluator(class_names, lambda frame_id: self.kitti_infos[frame_idx[frame_id]]['annos'])
 
 
     def __len__(self):
@@ -405,4 +410,30 @@ class WaymoKittiDataset(DatasetTemplate):
                                  loc[idx][1], loc[idx][2], single_pred_dict['rotation_y'][idx],
                                  single_pred_dict['score'][idx]), file=f)
 
-        return annos
\ No newline at end of file
+        return annos
+
+
+def create_kitti_infos_sharded(dataset_cfg, class_names, data_path, save_path, workers=4, chunk_size=256):
+    """
+    create_kitti_infos on a process pool with resumable chunks (save_path/prep_shards), the gt database is written
+    to the packed store of the dbinfos instead of object files (DB_BACKEND: 'packed' in the gt_sampling config)
+    """
+    dataset = WaymoKittiDataset(dataset_cfg=dataset_cfg, class_names=class_names, root_path=data_path, training=False)
+    dataset_prep_utils.create_kitti_format_infos(dataset, save_path, chunk_size=chunk_size, num_workers=workers)
+
+
+if __name__ == '__main__':
+    import sys
+    numba_utils.set_fork_safe_threading_layer() #the infos / gt database are built on a process pool
+    if sys.argv.__len__() > 2 and sys.argv[1] == 'create_kitti_infos_sharded':
+        import yaml
+        from pathlib import Path
+        from easydict import EasyDict
+        dataset_cfg = EasyDict(yaml.safe_load(open(sys.argv[2])))
+        ROOT_DIR = (Path(__file__).resolve().parent / '../../../').resolve()
+        create_kitti_infos_sharded(
+            dataset_cfg=dataset_cfg,
+            class_names=['Car', 'Pedestrian', 'Cyclist'],
+            data_path=ROOT_DIR / 'data' / 'kitti',
+            save_path=ROOT_DIR / 'data' / 'kitti'
+        )
@@ -1,5 +1,6 @@
 from functools import partial
 
+import numba
 import numpy as np
 from skimage import transform
 import torch
@@ -13,8 +14,115 @@ except:
     pass
 
 
-class VoxelGeneratorWrapper():
+@numba.jit(nopython=True)
+def points_to_voxels_kernel(points, voxel_size, coors_range, grid_size, max_points, max_voxels, flip_signs):
+    """
+    Hash based voxelization with the spconv rules: voxels are numbered by the first point that falls in them,
+    points after max_points in a voxel and new voxels after max_voxels are dropped
+    Args:
+        points: (N, C)
+        voxel_size, coors_range: (3), (6) same dtype as the points
+        grid_size: (3) int64
+        flip_signs: (V, 2) signs of x and y, one voxelization for each row
+    Returns:
+        voxels: (V, K, max_points, C), coordinates: (V, K, 3) zyx, num_points: (V, K), num_voxels: (V)
+    """
+    num_variants, num_all_points, num_features = flip_signs.shape[0], points.shape[0], points.shape[1]
+    capacity = max(min(num_all_points, max_voxels), 1)
+    voxels = np.zeros((num_variants, capacity, max_points, num_features), dtype=points.dtype)
+    coordinates = np.zeros((num_variants, capacity, 3), dtype=np.int32)
+    num_points = np.zeros((num_variants, capacity), dtype=np.int32)
+    num_voxels = np.zeros(num_variants, dtype=np.int64)
+
+    table_size = 16
+    while table_size < 2 * capacity:
+        table_size *= 2
+    table_keys = np.full((num_variants, table_size), -1, dtype=np.int64) #open addressing, linear probing
+    table_values = np.zeros((num_variants, table_size), dtype=np.int64)
+    coor = np.zeros(3, dtype=np.int64)
+    for i in range(num_all_points):
+        for v in range(num_variants):
+            failed = False
+            for j in range(3):
+                value = points[i, j] * flip_signs[v, j] if j < 2 else points[i, j]
+                c = np.floor((value - coors_range[j]) / voxel_size[j])
+                if c < 0 or c >= grid_size[j]:
+                    failed = True
+                    break
+                coor[j] = int(c)
+            if failed:
+                continue
+
+            key = (coor[2] * grid_size[1] + coor[1]) * grid_size[0] + coor[0]
+            slot = (key * 2654435761) & (table_size - 1)
+            while table_keys[v, slot] != -1 and table_keys[v, slot] != key:
+                slot = (slot + 1) & (table_size - 1)
+            if table_keys[v, slot] == -1:
+                if num_voxels[v] >= max_voxels:
+                    continue
+                voxel_idx = num_voxels[v]
+                table_keys[v, slot] = key
+                table_values[v, slot] = voxel_idx
+                coordinates[v, voxel_idx, 0] = coor[2]
+                coordinates[v, voxel_idx, 1] = coor[1]
+                coordinates[v, voxel_idx, 2] = coor[0]
+                num_voxels[v] += 1
+            else:
+                voxel_idx = table_values[v, slot]
+
+            k = num_points[v, voxel_idx]
+            if k < max_points:
+                for j in range(num_features):
+                    voxels[v, voxel_idx, k, j] = points[i, j] * flip_signs[v, j] if j < 2 else points[i, j]
+                num_points[v, voxel_idx] = k + 1
+    return voxels, coordinates, num_points, num_voxels
+
+
+class PointToVoxel():
+    """
+    Built-in voxel generator (Numba), same (voxels, coordinates, num_points) output as spconv, used without spconv
+    """
     def __init__(self, vsize_xyz, coors_range_xyz, num_point_features, max_num_points_per_voxel, max_num_voxels):
+        self.vsize_xyz = np.array(vsize_xyz, dtype=np.float32)
+        self.coors_range_xyz = np.array(coors_range_xyz, dtype=np.float32)
+        grid_size = (self.coors_range_xyz[3:6] - self.coors_range_xyz[0:3]) / self.vsize_xyz
+        self.grid_size = np.round(grid_size).astype(np.int64)
+        self.num_point_features = num_point_features
+        self.max_num_points_per_voxel = max_num_points_per_voxel
+        self.max_num_voxels = max_num_voxels
+
+    def generate(self, points, flip_signs=((1, 1),)):
+        """
+        Args:
+            points: (N, C)
+            flip_signs: signs of x and y of each voxelization, e.g. ((1, 1), (1, -1), (-1, 1), (-1, -1)) for double flip
+        Returns:
+            (voxels, coordinates, num_points) for a single voxelization, otherwise a list of them
+        """
+        points = np.ascontiguousarray(points)
+        voxels, coordinates, num_points, num_voxels = points_to_voxels_kernel(
+            points, self.vsize_xyz.astype(points.dtype), self.coors_range_xyz.astype(points.dtype), self.grid_size,
+            self.max_num_points_per_voxel, self.max_num_voxels, np.array(flip_signs, dtype=points.dtype)
+        )
+        voxel_output = [(voxels[v, :num_voxels[v]], coordinates[v, :num_voxels[v]], num_points[v, :num_voxels[v]])
+                        for v in range(len(flip_signs))]
+        return voxel_output[0] if len(flip_signs) == 1 else voxel_output
+
+
+class VoxelGeneratorWrapper():
+    def __init__(self, vsize_xyz, coors_range_xyz, num_point_features, max_num_points_per_voxel, max_num_voxels,
+                 use_builtin=False):
+        if use_builtin:
+            self.spconv_ver = 0
+            self._voxel_generator = PointToVoxel(
+                vsize_xyz=vsize_xyz,
+                coors_range_xyz=coors_range_xyz,
+                num_point_features=num_point_features,
+                max_num_points_per_voxel=max_num_points_per_voxel,
+                max_num_voxels=max_num_voxels
+            )
+            return
+
         try:
             from spconv.utils import VoxelGeneratorV2 as VoxelGenerator
             self.spconv_ver = 1
@@ -23,8 +131,12 @@ class VoxelGeneratorWrapper():
                 from spconv.utils import VoxelGenerator
                 self.spconv_ver = 1
             except:
-                from spconv.utils import Point2VoxelCPU3d as VoxelGenerator
-                self.spconv_ver = 2
+                try:
+                    from spconv.utils import Point2VoxelCPU3d as VoxelGenerator
+                    self.spconv_ver = 2
+                except: #spconv is not installed
+                    VoxelGenerator = PointToVoxel
+                    self.spconv_ver = 0
 
         if self.spconv_ver == 1:
             self._voxel_generator = VoxelGenerator(
@@ -33,7 +145,7 @@ class VoxelGeneratorWrapper():
                 max_num_points=max_num_points_per_voxel,
                 max_voxels=max_num_voxels
             )
-        else:
+        else: #spconv 2.x or PointToVoxel
             self._voxel_generator = VoxelGenerator(
                 vsize_xyz=vsize_xyz,
                 coors_range_xyz=coors_range_xyz,
@@ -43,7 +155,9 @@ class VoxelGeneratorWrapper():
             )
 
     def generate(self, points):
-        if self.spconv_ver == 1:
+        if self.spconv_ver == 0:
+            voxels, coordinates, num_points = self._voxel_generator.generate(points)
+        elif self.spconv_ver == 1:
             voxel_output = self._voxel_generator.generate(points)
             if isinstance(voxel_output, dict):
                 voxels, coordinates, num_points = \
@@ -60,6 +174,14 @@ class VoxelGeneratorWrapper():
             num_points = tv_num_points.numpy()
         return voxels, coordinates, num_points
 
+    def generate_flips(self, points, flip_signs):
+        """
+        Returns:
+            voxel_output list of the points with x and y multiplied by each row of flip_signs, in a single pass
+        """
+        assert self.spconv_ver == 0, 'Only supported by the built-in PointToVoxel'
+        return self._voxel_generator.generate(points, flip_signs=flip_signs)
+
 
 class DataProcessor(object):
     def __init__(self, processor_configs, point_cloud_range, training, num_point_features):
@@ -146,10 +268,19 @@ class DataProcessor(object):
                 num_point_features=self.num_point_features,
                 max_num_points_per_voxel=config.MAX_POINTS_PER_VOXEL,
                 max_num_voxels=config.MAX_NUMBER_OF_VOXELS[self.mode],
+                use_builtin=config.get('BUILTIN_VOXELIZER', False)
             )
 
         points = data_dict['points']
-        voxel_output = self.voxel_generator.generate(points)
+        if config.get('DOUBLE_FLIP', False) and self.voxel_generator.spconv_ver == 0:
+            #the original and the three flipped voxelizations in one pass over the points
+            flip_voxel_outputs = self.voxel_generator.generate_flips(
+                points, flip_signs=((1, 1), (1, -1), (-1, 1), (-1, -1))
+            )
+            voxel_output = flip_voxel_outputs[0]
+        else:
+            flip_voxel_outputs = None
+            voxel_output = self.voxel_generator.generate(points)
         voxels, coordinates, num_points = voxel_output
 
         if not data_dict['use_lead_xyz']:
@@ -157,11 +288,13 @@ class DataProcessor(object):
 
         if config.get('DOUBLE_FLIP', False):
             voxels_list, voxel_coords_list, voxel_num_points_list = [voxels], [coordinates], [num_points]
-            points_yflip, points_xflip, points_xyflip = self.double_flip(points)
-            points_list = [points_yflip, points_xflip, points_xyflip]
+            if flip_voxel_outputs is None:
+                points_yflip, points_xflip, points_xyflip = self.double_flip(points)
+                points_list = [points_yflip, points_xflip, points_xyflip]
+                flip_voxel_outputs = [voxel_output] + [self.voxel_generator.generate(x) for x in points_list]
             keys = ['yflip', 'xflip', 'xyflip']
             for i, key in enumerate(keys):
-                voxel_output = self.voxel_generator.generate(points_list[i])
+                voxel_output = flip_voxel_outputs[i + 1]
                 voxels, coordinates, num_points = voxel_output
 
                 if not data_dict['use_lead_xyz']:
@@ -16,7 +16,7 @@ from pathlib import Path
 from functools import partial
 
 from mydetector3d.ops.roiaware_pool3d import roiaware_pool3d_utils
-from mydetector3d.utils import box_utils, common_utils
+from mydetector3d.utils import box_utils, common_utils, frame_store_utils, info_store_utils
 from mydetector3d.datasets import DatasetTemplate
 #from ...ops.roiaware_pool3d import roiaware_pool3d_utils
 # from ...utils import box_utils, common_utils
@@ -64,6 +64,11 @@ class WaymoDataset(DatasetTemplate):
         seq_name_to_infos = {}
 
         num_skipped_infos = 0
+        #INFO_BACKEND: 'indexed' converts the sequence pkls of the split once to a memory-mapped info store
+        use_info_store = self.dataset_cfg.get('INFO_BACKEND', 'pkl') == 'indexed'
+        store_dir = self.root_path / ('%s_infos_%s_store' % (self.dataset_cfg.PROCESSED_DATA_TAG, self.split))
+        sequence_list_file = store_dir / 'sequence_list.txt'
+        info_paths = []
         for k in range(len(self.sample_sequence_list)): #50 tfrecord files
             sequence_name = os.path.splitext(self.sample_sequence_list[k])[0] #remove .tfrecord
             info_path = self.data_path / sequence_name / ('%s.pkl' % sequence_name) #pkl file in processed folder
@@ -71,24 +76,55 @@ class WaymoDataset(DatasetTemplate):
             if not info_path.exists():
                 num_skipped_infos += 1
                 continue
-            with open(info_path, 'rb') as f:
-                infos = pickle.load(f) #size 50 dict array 200frame/downsamplerate(4)=50, each dict
-                waymo_infos.extend(infos)
+            info_paths.append(info_path)
+        if use_info_store:
+            #same rule as info_store_utils.create_info_store_from_pkl, the store is rebuilt when a sequence pkl is newer.
+            #Built on the local rank 0 in a tmp folder moved in place, the other ranks wait at the barrier
+            cur_rank, world_size, num_gpus = common_utils.get_dist_info(return_gpu_per_machine=True)
+            need_update = not sequence_list_file.exists() or \
+                sequence_list_file.read_text().split('\n') != self.sample_sequence_list or \
+                any([os.path.getmtime(sequence_list_file) < os.path.getmtime(x) for x in info_paths])
+            if cur_rank % max(num_gpus, 1) == 0 and need_update:
+                for info_path in info_paths:
+                    with open(info_path, 'rb') as f:
+                        waymo_infos.extend(pickle.load(f))
+                info_store_utils.write_info_store_atomic(
+                    store_dir, waymo_infos, extra_files={'sequence_list.txt': '\n'.join(self.sample_sequence_list)})
+            if world_size > 1:
+                dist.barrier()
+            waymo_infos = info_store_utils.InfoStore([store_dir])
+        else:
+            for info_path in info_paths:
+                with open(info_path, 'rb') as f:
+                    infos = pickle.load(f) #size 50 dict array 200frame/downsamplerate(4)=50, each dict
+                    waymo_infos.extend(infos)
 
-            seq_name_to_infos[infos[0]['point_cloud']['lidar_sequence']] = infos #save to one dict with sequence as the name
+                seq_name_to_infos[infos[0]['point_cloud']['lidar_sequence']] = infos #save to one dict with sequence as the name
 
-        self.infos.extend(waymo_infos[:]) #waymo_info contains 2492 dicts
+        use_sequence_data = self.dataset_cfg.get('SEQUENCE_CONFIG', None) is not None and self.dataset_cfg.SEQUENCE_CONFIG.ENABLED
+        if use_info_store:
+            self.infos = waymo_infos
+            if use_sequence_data: #views of the store for each sequence
+                seq_names = waymo_infos.get_field('point_cloud.lidar_sequence')
+                if seq_names is None:
+                    seq_names = np.array([info['point_cloud']['lidar_sequence'] for info in waymo_infos])
+                seq_name_to_infos = {seq_name: waymo_infos.take(np.flatnonzero(seq_names == seq_name))
+                                     for seq_name in np.unique(seq_names)}
+        else:
+            self.infos.extend(waymo_infos[:]) #waymo_info contains 2492 dicts
         self.logger.info('Total skipped info %s' % num_skipped_infos)
         self.logger.info('Total samples for Waymo dataset: %d' % (len(waymo_infos))) #2492
 
         if self.dataset_cfg.SAMPLED_INTERVAL[mode] > 1: #No
-            sampled_waymo_infos = []
-            for k in range(0, len(self.infos), self.dataset_cfg.SAMPLED_INTERVAL[mode]):
-                sampled_waymo_infos.append(self.infos[k])
-            self.infos = sampled_waymo_infos
+            if use_info_store:
+                self.infos = self.infos[::self.dataset_cfg.SAMPLED_INTERVAL[mode]] #view of the store
+            else:
+                sampled_waymo_infos = []
+                for k in range(0, len(self.infos), self.dataset_cfg.SAMPLED_INTERVAL[mode]):
+                    sampled_waymo_infos.append(self.infos[k])
+                self.infos = sampled_waymo_infos
             self.logger.info('Total sampled samples for Waymo dataset: %d' % len(self.infos))
             
-        use_sequence_data = self.dataset_cfg.get('SEQUENCE_CONFIG', None) is not None and self.dataset_cfg.SEQUENCE_CONFIG.ENABLED
         if not use_sequence_data:
             seq_name_to_infos = None #no use
         return seq_name_to_infos
@@ -197,15 +233,35 @@ class WaymoDataset(DatasetTemplate):
         return all_sequences_infos
 
     def get_lidar(self, sequence_name, sample_idx):
-        lidar_file = self.data_path / sequence_name / ('%04d.npy' % sample_idx) #lidar file name based on frame index
-        point_features = np.load(lidar_file)  # (N,6) (N, 6): [x, y, z, intensity, elongation, NLZ_flag (most==-1)]
+        store_key = f'{sequence_name}___{sample_idx}'
+        if self.lidar_store is not None and store_key in self.lidar_store:
+            point_features = self.lidar_store.get(store_key) #read-only view of the packed frame
+        else:
+            lidar_file = self.data_path / sequence_name / ('%04d.npy' % sample_idx) #lidar file name based on frame index
+            point_features = np.load(lidar_file)  # (N,6) (N, 6): [x, y, z, intensity, elongation, NLZ_flag (most==-1)]
         #Each scene may include an area that is not labeled, which is called a “No Label Zone” (NLZ)
         points_all, NLZ_flag = point_features[:, 0:5], point_features[:, 5]
         if not self.dataset_cfg.get('DISABLE_NLZ_FLAG_ON_POINTS', False): #not used
             points_all = points_all[NLZ_flag == -1]
+        elif not points_all.flags.writeable:
+            points_all = points_all.copy()
         points_all[:, 3] = np.tanh(points_all[:, 3]) #limit the intensity from -1 to 1
         return points_all #[N,5] [x, y, z, intensity, elongation]
 
+    def create_packed_lidar(self, save_prefix):
+        """
+        Pack the .npy lidar files of all loaded infos into one memory-mapped frame store
+        (used with LIDAR_BACKEND: 'packed' and PACKED_LIDAR_PATH in the dataset config)
+        """
+        store_keys, lidar_files = [], []
+        for info in self.infos:
+            pc_info = info['point_cloud']
+            sequence_name = pc_info['lidar_sequence']
+            sample_idx = pc_info['sample_idx']
+            store_keys.append(f'{sequence_name}___{sample_idx}')
+            lidar_files.append(self.data_path / sequence_name / ('%04d.npy' % sample_idx))
+        frame_store_utils.write_packed_frame_store(save_prefix, store_keys, lidar_files, num_features=6)
+
     @staticmethod
     def transform_prebox_to_current(pred_boxes3d, pose_pre, pose_cur):
         """
@@ -459,6 +515,37 @@ class WaymoDataset(DatasetTemplate):
 
         return ap_result_str, ap_dict
 
+    def get_stream_evaluator(self, class_names, **kwargs):
+        """
+        StreamingEvaluator of the kitti metric (eval_metric 'kitti'), consuming the annos of generate_prediction_dicts
+        batch by batch, e.g. for running results and early stops of long validation runs
+        """
+        if 'annos' not in self.infos[0].keys():
+            return None
+
+        from ..kitti.kitti_object_eval_python.stream_eval import StreamingEvaluator
+        from ..kitti import kitti_utils
+
+        map_name_to_kitti = {
+            'Vehicle': 'Car',
+            'Pedestrian': 'Pedestrian',
+            'Cyclist': 'Cyclist',
+            'Sign': 'Sign',
+            'Car': 'Car'
+        }
+
+        def transform_annos(annos, is_gt):
+            return kitti_utils.transform_annotations_to_kitti_format(
+                annos, map_name_to_kitti=map_name_to_kitti,
+                info_with_fakelidar=is_gt and self.dataset_cfg.get('INFO_WITH_FAKELIDAR', False)
+            )
+
+        frame_idx = {info['frame_id']: i for i, info in enumerate(self.infos)}
+        return StreamingEvaluator(
+            [map_name_to_kitti[x] for x in class_names], lambda frame_id: self.infos[frame_idx[frame_id]]['annos'],
+            transform_annos=transform_annos
+        )
+
     def create_groundtruth_database(self, info_path, save_path, used_classes=None, split='train', sampled_interval=10,
                                     processed_data_tag=None):
 
@@ -621,10 +708,9 @@ class WaymoDataset(DatasetTemplate):
                 torch.from_numpy(gt_boxes_crop[:, 0:7]).unsqueeze(dim=0).float().cuda()
             ).long().squeeze(dim=0).cpu().numpy()
         else:
-            box_point_mask = roiaware_pool3d_utils.points_in_boxes_cpu(
-                torch.from_numpy(points[:, 0:3]).float(),
-                torch.from_numpy(gt_boxes_crop[:, 0:7]).float()
-            ).long().numpy()  # (num_boxes, num_points)
+            box_starts, point_idxs = roiaware_pool3d_utils.points_in_boxes_pairs_cpu(
+                points[:, 0:3], gt_boxes_crop[:, 0:7]
+            )
 
         for i in range(num_obj):
             filename = '%s_%04d_%s_%d.bin' % (sequence_name, sample_idx, names[i], i)
@@ -632,7 +718,7 @@ class WaymoDataset(DatasetTemplate):
             if use_cuda:
                 gt_points = points[box_idxs_of_pts == i]
             else:
-                gt_points = points[box_point_mask[i] > 0]
+                gt_points = points[point_idxs[box_starts[i]:box_starts[i + 1]]]
 
             gt_points[:, :3] -= gt_boxes[i, :3]
 
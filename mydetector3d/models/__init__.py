@@ -67,10 +67,11 @@ def image_to_tensor(image, keepdim: bool = True):
 
     return tensor.unsqueeze(0) if not keepdim else tensor
 
-def load_data_to_gpu(batch_dict):
+def load_data_to_device(batch_dict, device):
+    #non_blocking: asynchronous copies from the pinned buffers of collate_batch_preallocated, a regular copy otherwise
     for key, val in batch_dict.items():
         if key == 'camera_imgs':
-            batch_dict[key] = val.cuda()
+            batch_dict[key] = val.to(device, non_blocking=True)
         elif not isinstance(val, np.ndarray):
             continue
         elif key in ['frame_id', 'metadata', 'calib', 'image_paths','ori_shape','img_process_infos']:
@@ -78,19 +79,23 @@ def load_data_to_gpu(batch_dict):
         elif key in ['images']:
             #batch_dict[key] = kornia.image_to_tensor(val).float().cuda().contiguous()
             #batch_dict[key] = image_to_tensor(val).float().cuda().contiguous()
-            batch_dict[key] = image_to_tensor(val).float().cuda()
+            batch_dict[key] = image_to_tensor(val).float().to(device, non_blocking=True)
             print(type(batch_dict[key]))
         elif key in ['image_shape']:
-            batch_dict[key] = torch.from_numpy(val).int().cuda()
+            batch_dict[key] = torch.from_numpy(val).int().to(device, non_blocking=True)
         else:
-            batch_dict[key] = torch.from_numpy(val).float().cuda()
+            batch_dict[key] = torch.from_numpy(val).float().to(device, non_blocking=True)
+
+
+def load_data_to_gpu(batch_dict):
+    load_data_to_device(batch_dict, torch.device('cuda'))
 
 
 def model_fn_decorator():
     ModelReturn = namedtuple('ModelReturn', ['loss', 'tb_dict', 'disp_dict']) #define a 'ModelReturn' tuple and contains properties of (loss, tb_dict, disp_dict)
 
     def model_func(model, batch_dict):
-        load_data_to_gpu(batch_dict)
+        load_data_to_device(batch_dict, next(model.parameters()).device) #cuda:<local rank>, or the cpu
         ret_dict, tb_dict, disp_dict = model(batch_dict)
 
         loss = ret_dict['loss'].mean()
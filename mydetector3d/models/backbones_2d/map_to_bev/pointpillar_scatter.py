@@ -10,8 +10,12 @@ class PointPillarScatter(nn.Module): #return pillar to the original location bas
         self.num_bev_features = self.model_cfg.NUM_BEV_FEATURES #64
         self.nx, self.ny, self.nz = grid_size # [432,496,1]
         assert self.nz == 1
+        self.batched_scatter = self.model_cfg.get('BATCHED_SCATTER', False) #single scatter for the whole batch
 
     def forward(self, batch_dict, **kwargs):
+        if self.batched_scatter:
+            return self.forward_batched(batch_dict)
+
         pillar_features, coords = batch_dict['pillar_features'], batch_dict['voxel_coords'] #[89196, 64] [89196, 4]
         batch_spatial_features = []
         batch_size = coords[:, 0].max().int().item() + 1
@@ -34,4 +38,24 @@ class PointPillarScatter(nn.Module): #return pillar to the original location bas
         batch_spatial_features = torch.stack(batch_spatial_features, 0) #16*[64, 214272] =>[16, 64, 214272]
         batch_spatial_features = batch_spatial_features.view(batch_size, self.num_bev_features * self.nz, self.ny, self.nx)
         batch_dict['spatial_features'] = batch_spatial_features #[16, 64, 496, 432]
-        return batch_dict
\ No newline at end of file
+        return batch_dict
+
+    def forward_batched(self, batch_dict):
+        """
+        Same output as the per-sample loop, the pillars of all samples are written into one preallocated buffer
+        """
+        pillar_features, coords = batch_dict['pillar_features'], batch_dict['voxel_coords'] #[89196, 64] [89196, 4]
+        batch_size = coords[:, 0].max().int().item() + 1
+        num_cells = self.nz * self.nx * self.ny #214272
+
+        coords = coords.long()
+        #flat index batch*nx*ny + y*nx + x of the [B, C, ny*nx] buffer, kept as the (batch, cell) pair so that
+        #all the C channels of a pillar are written by one advanced index instead of a [C, N] index tensor
+        batch_indices = coords[:, 0] #[89196]
+        cell_indices = coords[:, 1] + coords[:, 2] * self.nx + coords[:, 3] #[89196]
+
+        batch_spatial_features = pillar_features.new_zeros(batch_size, self.num_bev_features, num_cells) #[16, 64, 214272]
+        batch_spatial_features[batch_indices, :, cell_indices] = pillar_features #[89196, 64] written in one pass
+        batch_spatial_features = batch_spatial_features.view(batch_size, self.num_bev_features * self.nz, self.ny, self.nx)
+        batch_dict['spatial_features'] = batch_spatial_features #[16, 64, 496, 432]
+        return batch_dict
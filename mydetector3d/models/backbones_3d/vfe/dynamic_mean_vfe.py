@@ -1,6 +1,7 @@
 import torch
 
 from .vfe_template import VFETemplate
+from ....utils import common_utils
 
 try:
     import torch_scatter
@@ -16,9 +17,9 @@ class DynamicMeanVFE(VFETemplate):
         super().__init__(model_cfg=model_cfg)
         self.num_point_features = num_point_features
 
-        self.grid_size = torch.tensor(grid_size).cuda()
-        self.voxel_size = torch.tensor(voxel_size).cuda()
-        self.point_cloud_range = torch.tensor(point_cloud_range).cuda()
+        self.grid_size = common_utils.cuda_if_available(torch.tensor(grid_size))
+        self.voxel_size = common_utils.cuda_if_available(torch.tensor(voxel_size))
+        self.point_cloud_range = common_utils.cuda_if_available(torch.tensor(point_cloud_range))
 
         self.voxel_x = voxel_size[0]
         self.voxel_y = voxel_size[1]
@@ -9,6 +9,7 @@ except Exception as e:
     pass
 
 from .vfe_template import VFETemplate
+from ....utils import common_utils
 
 
 class PFNLayerV2(nn.Module):
@@ -80,9 +81,9 @@ class DynamicPillarVFE(VFETemplate):
         self.scale_xy = grid_size[0] * grid_size[1]
         self.scale_y = grid_size[1]
         
-        self.grid_size = torch.tensor(grid_size).cuda()
-        self.voxel_size = torch.tensor(voxel_size).cuda()
-        self.point_cloud_range = torch.tensor(point_cloud_range).cuda()
+        self.grid_size = common_utils.cuda_if_available(torch.tensor(grid_size))
+        self.voxel_size = common_utils.cuda_if_available(torch.tensor(voxel_size))
+        self.point_cloud_range = common_utils.cuda_if_available(torch.tensor(point_cloud_range))
 
     def get_output_feature_dim(self):
         return self.num_filters[-1]
@@ -180,9 +181,9 @@ class DynamicPillarVFESimple2D(VFETemplate):
         self.scale_xy = grid_size[0] * grid_size[1]
         self.scale_y = grid_size[1]
 
-        self.grid_size = torch.tensor(grid_size[:2]).cuda()
-        self.voxel_size = torch.tensor(voxel_size).cuda()
-        self.point_cloud_range = torch.tensor(point_cloud_range).cuda()
+        self.grid_size = common_utils.cuda_if_available(torch.tensor(grid_size[:2]))
+        self.voxel_size = common_utils.cuda_if_available(torch.tensor(voxel_size))
+        self.point_cloud_range = common_utils.cuda_if_available(torch.tensor(point_cloud_range))
 
     def get_output_feature_dim(self):
         return self.num_filters[-1]
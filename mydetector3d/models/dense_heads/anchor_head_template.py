@@ -28,7 +28,7 @@ class AnchorHeadTemplate(nn.Module):
             anchor_generator_cfg, grid_size=grid_size, point_cloud_range=point_cloud_range,
             anchor_ndim=self.box_coder.code_size #code_size=7
         ) #anchors: [1, 248 (gridsize-493/stride-2), 216 (gridsize-432/stride-2), 1, 2, 7] *3 num_anchors_per_location=[2, 2, 2]
-        self.anchors = [x.cuda() for x in anchors]
+        self.anchors = [common_utils.cuda_if_available(x) for x in anchors]
         self.target_assigner = self.get_target_assigner(anchor_target_cfg)
 
         self.forward_ret_dict = {}
@@ -5,7 +5,7 @@ import torch.nn as nn
 from torch.nn.init import kaiming_normal_
 from ..model_utils import model_nms_utils
 from ..model_utils import centernet_utils
-from ...utils import loss_utils
+from ...utils import common_utils, loss_utils
 
 
 class SeparateHead(nn.Module):
@@ -64,7 +64,8 @@ class CenterHead(nn.Module):
             self.class_names_each_head.append([x for x in cur_class_names if x in class_names])
             cur_class_id_mapping = torch.from_numpy(np.array(
                 [self.class_names.index(x) for x in cur_class_names if x in class_names]
-            )).cuda()
+            ))
+            cur_class_id_mapping = common_utils.cuda_if_available(cur_class_id_mapping)
             self.class_id_mapping_each_head.append(cur_class_id_mapping)
 
         total_classes = sum([len(x) for x in self.class_names_each_head])
@@ -253,7 +254,7 @@ class CenterHead(nn.Module):
 
     def generate_predicted_boxes(self, batch_size, pred_dicts):
         post_process_cfg = self.model_cfg.POST_PROCESSING
-        post_center_limit_range = torch.tensor(post_process_cfg.POST_CENTER_LIMIT_RANGE).cuda().float()
+        post_center_limit_range = common_utils.cuda_if_available(torch.tensor(post_process_cfg.POST_CENTER_LIMIT_RANGE)).float()
 
         ret_dict = [{
             'pred_boxes': [],
@@ -42,11 +42,11 @@ class AnchorGenerator(object):
             #all x coordinates from [0, 69.12m], 216points
             x_shifts = torch.arange(
                 self.anchor_range[0] + x_offset, self.anchor_range[3] + 1e-5, step=x_stride, dtype=torch.float32,
-            ).cuda()
+            )
             #all y coordinates from [0, 79.36], 248points
             y_shifts = torch.arange(
                 self.anchor_range[1] + y_offset, self.anchor_range[4] + 1e-5, step=y_stride, dtype=torch.float32,
-            ).cuda()
+            )
             #[-1.78]
             z_shifts = x_shifts.new_tensor(anchor_height)
 
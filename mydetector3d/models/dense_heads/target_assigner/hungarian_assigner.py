@@ -1,6 +1,6 @@
 import torch
 from scipy.optimize import linear_sum_assignment
-from mydetector3d.ops.iou3d_nms import iou3d_nms_cuda
+from mydetector3d.ops.iou3d_nms.iou3d_nms_utils import iou3d_nms_cuda #None when the CUDA op is not compiled
 
 
 def height_overlaps(boxes1, boxes2):
@@ -8,7 +8,7 @@ from ..model_utils.transfusion_utils import clip_sigmoid
 from ..model_utils.basic_block_2d import BasicBlock2D
 from ..model_utils.transfusion_utils import PositionEmbeddingLearned, TransformerDecoderLayer
 from .target_assigner.hungarian_assigner import HungarianAssigner3D
-from ...utils import loss_utils
+from ...utils import common_utils, loss_utils
 from ..model_utils import centernet_utils
 
 
@@ -399,7 +399,7 @@ class TransFusionHead(nn.Module):
         post_process_cfg = self.model_cfg.POST_PROCESSING
         score_thresh = post_process_cfg.SCORE_THRESH
         post_center_range = post_process_cfg.POST_CENTER_RANGE
-        post_center_range = torch.tensor(post_center_range).cuda().float()
+        post_center_range = common_utils.cuda_if_available(torch.tensor(post_center_range)).float()
         # class label
         final_preds = heatmap.max(1, keepdims=False).indices
         final_scores = heatmap.max(1, keepdims=False).values
@@ -4,7 +4,7 @@ import torch.nn as nn
 from torch.nn.init import kaiming_normal_
 from ..model_utils import centernet_utils
 from ..model_utils import model_nms_utils
-from ...utils import loss_utils
+from ...utils import common_utils, loss_utils
 from ...utils.spconv_utils import replace_feature, spconv
 import copy
 from easydict import EasyDict
@@ -54,8 +54,8 @@ class VoxelNeXtHead(nn.Module):
         self.model_cfg = model_cfg
         self.num_class = num_class
         self.grid_size = grid_size
-        self.point_cloud_range = torch.Tensor(point_cloud_range).cuda()
-        self.voxel_size = torch.Tensor(voxel_size).cuda()
+        self.point_cloud_range = common_utils.cuda_if_available(torch.Tensor(point_cloud_range))
+        self.voxel_size = common_utils.cuda_if_available(torch.Tensor(voxel_size))
         self.feature_map_stride = self.model_cfg.TARGET_ASSIGNER_CONFIG.get('FEATURE_MAP_STRIDE', None)
 
         self.class_names = class_names
@@ -78,7 +78,8 @@ class VoxelNeXtHead(nn.Module):
             self.class_names_each_head.append([x for x in cur_class_names if x in class_names])
             cur_class_id_mapping = torch.from_numpy(np.array(
                 [self.class_names.index(x) for x in cur_class_names if x in class_names]
-            )).cuda()
+            ))
+            cur_class_id_mapping = common_utils.cuda_if_available(cur_class_id_mapping)
             self.class_id_mapping_each_head.append(cur_class_id_mapping)
 
         total_classes = sum([len(x) for x in self.class_names_each_head])
@@ -417,7 +418,7 @@ class VoxelNeXtHead(nn.Module):
 
     def generate_predicted_boxes(self, batch_size, pred_dicts, voxel_indices, spatial_shape):
         post_process_cfg = self.model_cfg.POST_PROCESSING
-        post_center_limit_range = torch.tensor(post_process_cfg.POST_CENTER_LIMIT_RANGE).cuda().float()
+        post_center_limit_range = common_utils.cuda_if_available(torch.tensor(post_process_cfg.POST_CENTER_LIMIT_RANGE)).float()
 
         ret_dict = [{
             'pred_boxes': [],
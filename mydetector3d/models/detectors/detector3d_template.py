@@ -197,6 +197,10 @@ class Detector3DTemplate(nn.Module):
 
         """
         post_process_cfg = self.model_cfg.POST_PROCESSING
+        if post_process_cfg.get('BATCHED_NMS', False) and not (
+                isinstance(batch_dict['batch_cls_preds'], list) and batch_dict.get('batch_index', None) is not None):
+            return self.post_processing_batched(batch_dict)
+
         batch_size = batch_dict['batch_size']
         recall_dict = {}
         pred_dicts = []
@@ -288,6 +292,171 @@ class Detector3DTemplate(nn.Module):
 
         return pred_dicts, recall_dict
 
+    def post_processing_batched(self, batch_dict):
+        """
+        Same inputs and results as post_processing, the boxes of all frames (and classes) are filtered and
+        suppressed together: one NMS call with a group per (frame, class), recall counted in one pass
+        """
+        post_process_cfg = self.model_cfg.POST_PROCESSING
+        batch_size = batch_dict['batch_size']
+        box_preds = batch_dict['batch_box_preds']
+        if batch_dict.get('batch_index', None) is not None:
+            assert box_preds.shape.__len__() == 2
+            box_batch_index = batch_dict['batch_index'].long()
+            num_boxes = None
+        else:
+            assert box_preds.shape.__len__() == 3
+            num_boxes = box_preds.shape[1]
+            box_batch_index = torch.arange(batch_size, device=box_preds.device).repeat_interleave(num_boxes)
+            box_preds = box_preds.view(-1, box_preds.shape[-1]) #[B*321408, 7]
+
+        if not isinstance(batch_dict['batch_cls_preds'], list):
+            src_cls_preds = [batch_dict['batch_cls_preds']]
+            assert src_cls_preds[0].shape[-1] in [1, self.num_class]
+        else: #multi-head, (B, num_boxes_of_head, num_class_of_head) each
+            src_cls_preds = batch_dict['batch_cls_preds']
+        src_cls_preds = [x.view(-1, x.shape[-1]) for x in src_cls_preds]
+        cls_preds = src_cls_preds if batch_dict['cls_preds_normalized'] else [torch.sigmoid(x) for x in src_cls_preds]
+
+        if post_process_cfg.NMS_CONFIG.MULTI_CLASSES_NMS:
+            if not isinstance(batch_dict['batch_cls_preds'], list):
+                multihead_label_mapping = [torch.arange(1, self.num_class, device=cls_preds[0].device)]
+            else:
+                multihead_label_mapping = batch_dict['multihead_label_mapping']
+            num_groups_per_frame = sum([len(x) for x in multihead_label_mapping])
+
+            #one candidate for every (box, class) pair above the score threshold
+            cur_start_idx, cur_group_start = 0, 0
+            pair_box_index, pair_scores, pair_labels, pair_groups = [], [], [], []
+            for cur_cls_preds, cur_label_mapping in zip(cls_preds, multihead_label_mapping):
+                assert cur_cls_preds.shape[1] == len(cur_label_mapping)
+                if post_process_cfg.SCORE_THRESH is not None:
+                    row_index, class_index = (cur_cls_preds >= post_process_cfg.SCORE_THRESH).nonzero(as_tuple=True)
+                else:
+                    row_index, class_index = (torch.ones_like(cur_cls_preds, dtype=torch.bool)).nonzero(as_tuple=True)
+                if num_boxes is None:
+                    cur_box_index = row_index
+                else: #rows of this head are [B, num_boxes_of_head], boxes of the head start at cur_start_idx in a frame
+                    num_head_boxes = cur_cls_preds.shape[0] // batch_size
+                    cur_box_index = torch.div(row_index, num_head_boxes, rounding_mode='floor') * num_boxes + \
+                        cur_start_idx + row_index % num_head_boxes
+                    cur_start_idx += num_head_boxes
+                pair_box_index.append(cur_box_index)
+                pair_scores.append(cur_cls_preds[row_index, class_index])
+                pair_labels.append(cur_label_mapping[class_index])
+                pair_groups.append(box_batch_index[cur_box_index] * num_groups_per_frame + cur_group_start + class_index)
+                cur_group_start += len(cur_label_mapping)
+            pair_box_index = torch.cat(pair_box_index)
+            pair_scores = torch.cat(pair_scores)
+            pair_labels = torch.cat(pair_labels)
+            pair_groups = torch.cat(pair_groups)
+
+            selected = model_nms_utils.batched_nms(
+                box_scores=pair_scores, box_preds=box_preds[pair_box_index], group_ids=pair_groups,
+                nms_config=post_process_cfg.NMS_CONFIG, score_thresh=None
+            )
+            selected_box_index = pair_box_index[selected]
+            final_scores = pair_scores[selected]
+            final_labels = pair_labels[selected]
+        else:
+            cls_preds, label_preds = torch.max(cls_preds[0], dim=-1) #max prob in three classes [B*321408]
+            if batch_dict.get('has_class_labels', False):
+                label_key = 'roi_labels' if 'roi_labels' in batch_dict else 'batch_pred_labels'
+                if num_boxes is None:
+                    label_preds = torch.cat([batch_dict[label_key][index] for index in range(batch_size)], dim=0)
+                else:
+                    label_preds = batch_dict[label_key].view(-1)
+            else:
+                label_preds = label_preds + 1  #class starts with 1
+            selected_box_index = model_nms_utils.batched_nms(
+                box_scores=cls_preds, box_preds=box_preds, group_ids=box_batch_index,
+                nms_config=post_process_cfg.NMS_CONFIG, score_thresh=post_process_cfg.SCORE_THRESH
+            )
+
+            if post_process_cfg.OUTPUT_RAW_SCORE:
+                final_scores = torch.max(src_cls_preds[0][selected_box_index], dim=-1)[0]
+            else:
+                final_scores = cls_preds[selected_box_index]
+            final_labels = label_preds[selected_box_index]
+        final_boxes = box_preds[selected_box_index]
+        final_batch_index = box_batch_index[selected_box_index]
+
+        if 'rois' not in batch_dict:
+            recall_dict = self.generate_batch_recall_record(
+                box_preds=final_boxes, box_batch_index=final_batch_index, data_dict=batch_dict,
+                thresh_list=post_process_cfg.RECALL_THRESH_LIST
+            )
+        else:
+            recall_dict = self.generate_batch_recall_record(
+                box_preds=box_preds, box_batch_index=box_batch_index, data_dict=batch_dict,
+                thresh_list=post_process_cfg.RECALL_THRESH_LIST
+            )
+
+        #selected boxes are sorted by frame, split them back
+        num_selected = torch.bincount(final_batch_index, minlength=batch_size).tolist()
+        pred_dicts = []
+        for cur_boxes, cur_scores, cur_labels in zip(final_boxes.split(num_selected),
+                                                     final_scores.split(num_selected), final_labels.split(num_selected)):
+            record_dict = {
+                'pred_boxes': cur_boxes,
+                'pred_scores': cur_scores,
+                'pred_labels': cur_labels
+            }
+            pred_dicts.append(record_dict)
+
+        return pred_dicts, recall_dict
+
+    @staticmethod
+    def generate_batch_recall_record(box_preds, box_batch_index, data_dict=None, thresh_list=None):
+        """
+        Same counts as calling generate_recall_record on every frame
+        Args:
+            box_preds: (N, 7 + C) boxes of all frames
+            box_batch_index: (N) frame of each box
+        """
+        if 'gt_boxes' not in data_dict:
+            return {}
+
+        recall_dict = {'gt': 0}
+        for cur_thresh in thresh_list:
+            recall_dict['roi_%s' % (str(cur_thresh))] = 0
+            recall_dict['rcnn_%s' % (str(cur_thresh))] = 0
+
+        #valid gt boxes are the rows before the trailing all-zero padding of each frame
+        gt_boxes = data_dict['gt_boxes']
+        batch_size, max_gt = gt_boxes.shape[0], gt_boxes.shape[1]
+        row_index = torch.arange(1, max_gt + 1, device=gt_boxes.device)
+        num_gt = ((gt_boxes.sum(dim=-1) != 0).long() * row_index[None, :]).max(dim=1)[0] if max_gt > 0 \
+            else gt_boxes.new_zeros(batch_size, dtype=torch.long)
+        gt_mask = row_index[None, :] <= num_gt[:, None]
+        gt_batch_index = gt_mask.nonzero(as_tuple=True)[0]
+        cur_gt = gt_boxes[gt_mask]
+        if cur_gt.shape[0] == 0:
+            return recall_dict
+
+        if box_preds.shape[0] > 0:
+            iou3d_rcnn = iou3d_nms_utils.boxes_iou3d_gpu(box_preds[:, 0:7], cur_gt[:, 0:7])
+            iou3d_rcnn = iou3d_rcnn * (box_batch_index[:, None] == gt_batch_index[None, :]) #same frame only
+            rcnn_max_iou = iou3d_rcnn.max(dim=0)[0]
+        else:
+            rcnn_max_iou = None
+
+        if 'rois' in data_dict:
+            rois = data_dict['rois']
+            roi_batch_index = torch.arange(batch_size, device=rois.device).repeat_interleave(rois.shape[1])
+            iou3d_roi = iou3d_nms_utils.boxes_iou3d_gpu(rois.view(-1, rois.shape[-1])[:, 0:7], cur_gt[:, 0:7])
+            iou3d_roi = iou3d_roi * (roi_batch_index[:, None] == gt_batch_index[None, :])
+            roi_max_iou = iou3d_roi.max(dim=0)[0]
+
+        for cur_thresh in thresh_list:
+            if rcnn_max_iou is not None:
+                recall_dict['rcnn_%s' % str(cur_thresh)] += (rcnn_max_iou > cur_thresh).sum().item()
+            if 'rois' in data_dict:
+                recall_dict['roi_%s' % str(cur_thresh)] += (roi_max_iou > cur_thresh).sum().item()
+
+        recall_dict['gt'] += cur_gt.shape[0]
+        return recall_dict
+
     @staticmethod
     def generate_recall_record(box_preds, recall_dict, batch_index, data_dict=None, thresh_list=None):
         if 'gt_boxes' not in data_dict:
@@ -2,6 +2,9 @@ import torch
 
 from ...ops.iou3d_nms import iou3d_nms_utils
 
+#largest shifted x of batched_nms in one CUDA call, the float32 spacing there is 2 ** -9 (about 2 mm)
+MAX_GROUP_OFFSET = 2 ** 14
+
 
 def class_agnostic_nms(box_scores, box_preds, nms_config, score_thresh=None):
     src_box_scores = box_scores
@@ -64,3 +67,78 @@ def multi_classes_nms(cls_scores, box_preds, nms_config, score_thresh=None):
     pred_boxes = torch.cat(pred_boxes, dim=0)
 
     return pred_scores, pred_labels, pred_boxes
+
+
+def rank_in_sorted_groups(sorted_group_ids):
+    """
+    Args:
+        sorted_group_ids: (N) group id of each element, equal ids are contiguous
+    Returns:
+        ranks: (N) position of each element inside its group
+    """
+    counts = torch.unique_consecutive(sorted_group_ids, return_counts=True)[1]
+    starts = torch.cumsum(counts, dim=0) - counts
+    return torch.arange(sorted_group_ids.shape[0], device=sorted_group_ids.device) - starts.repeat_interleave(counts)
+
+
+def batched_nms(box_scores, box_preds, group_ids, nms_config, score_thresh=None):
+    """
+    One NMS call for many independent groups (e.g. frame x class), the selection of every group is the same as
+    class_agnostic_nms on that group alone, NMS_PRE_MAXSIZE and NMS_POST_MAXSIZE are applied per group
+    Args:
+        box_scores: (N)
+        box_preds: (N, 7 + C)
+        group_ids: (N) int64
+        nms_config:
+        score_thresh:
+
+    Returns:
+        selected: (K) indices of the kept boxes sorted by group id, then by descending score
+    """
+    if score_thresh is not None:
+        candidates = (box_scores >= score_thresh).nonzero().view(-1)
+    else:
+        candidates = torch.arange(box_scores.shape[0], device=box_scores.device)
+    if candidates.shape[0] == 0:
+        return candidates
+
+    #keep the NMS_PRE_MAXSIZE top boxes of each group, the sort is only needed when a group has more candidates
+    if torch.bincount(group_ids[candidates]).max() > nms_config.NMS_PRE_MAXSIZE:
+        order = box_scores[candidates].sort(descending=True, stable=True)[1]
+        order = order[group_ids[candidates][order].sort(stable=True)[1]]
+        candidates = candidates[order]
+        candidates = candidates[rank_in_sorted_groups(group_ids[candidates]) < nms_config.NMS_PRE_MAXSIZE]
+
+    scores_for_nms = box_scores[candidates]
+    boxes_for_nms = box_preds[candidates, 0:7]
+    cur_group_ids = group_ids[candidates]
+    if boxes_for_nms.is_cuda and iou3d_nms_utils.iou3d_nms_cuda is not None:
+        #move every group to its own x range, so boxes of different groups never overlap in the CUDA kernel.
+        #The offsets are computed in float64 from x_min, the float32 boxes of the kernel lose precision at large x
+        x = boxes_for_nms[:, 0].double()
+        span = x.max() - x.min() + boxes_for_nms[:, 3:5].double().norm(dim=1).max() + 1.0
+        shifted_x = x - x.min() + cur_group_ids.double() * span
+        if shifted_x.max() <= MAX_GROUP_OFFSET:
+            boxes_for_nms = boxes_for_nms.clone()
+            boxes_for_nms[:, 0] = shifted_x.to(boxes_for_nms.dtype)
+            keep_idx, _ = getattr(iou3d_nms_utils, nms_config.NMS_TYPE)(
+                boxes_for_nms, scores_for_nms, nms_config.NMS_THRESH, **nms_config
+            )
+        else: #one call per group
+            keep_idx = []
+            for group_id in torch.unique(cur_group_ids):
+                group_idx = (cur_group_ids == group_id).nonzero().view(-1)
+                cur_keep_idx, _ = getattr(iou3d_nms_utils, nms_config.NMS_TYPE)(
+                    boxes_for_nms[group_idx], scores_for_nms[group_idx], nms_config.NMS_THRESH, **nms_config
+                )
+                keep_idx.append(group_idx[cur_keep_idx])
+            keep_idx = torch.cat(keep_idx)
+    else: #iou3d_nms_cpu / *_torch fallback, groups are handled by the kernel
+        keep_idx, _ = getattr(iou3d_nms_utils, nms_config.NMS_TYPE)(
+            boxes_for_nms, scores_for_nms, nms_config.NMS_THRESH, group_ids=cur_group_ids, **nms_config
+        )
+
+    #keep_idx is in descending score order, a stable sort gives the group order, then NMS_POST_MAXSIZE per group
+    keep_idx = keep_idx[cur_group_ids[keep_idx].sort(stable=True)[1]]
+    keep_idx = keep_idx[rank_in_sorted_groups(cur_group_ids[keep_idx]) < nms_config.NMS_POST_MAXSIZE]
+    return candidates[keep_idx]
@@ -1,6 +1,9 @@
 import torch
 
-from . import bev_pool_ext
+try:
+    from . import bev_pool_ext
+except ImportError: #not compiled, bev_pool falls back to bev_pool_torch
+    bev_pool_ext = None
 
 __all__ = ["bev_pool"]
 
@@ -80,8 +83,26 @@ class QuickCumsumCuda(torch.autograd.Function):
         return x_grad, None, None, None, None, None, None
 
 
+def bev_pool_torch(feats, coords, B, D, H, W):
+    """
+    Sum pooling of bev_pool_ext with index_add_ (CPU tensors or without the CUDA extension)
+    Args:
+        feats: (N, C)
+        coords: (N, 4) [x, y, z, batch_idx]
+    Returns:
+        x: (B, D, H, W, C)
+    """
+    coords = coords.long()
+    index = ((coords[:, 3] * D + coords[:, 2]) * H + coords[:, 0]) * W + coords[:, 1]
+    x = feats.new_zeros((B * D * H * W, feats.shape[1])).index_add_(0, index, feats)
+    return x.view(B, D, H, W, feats.shape[1])
+
+
 def bev_pool(feats, coords, B, D, H, W):
     assert feats.shape[0] == coords.shape[0]
+    if bev_pool_ext is None or not feats.is_cuda:
+        x = bev_pool_torch(feats, coords, B, D, H, W)
+        return x.permute(0, 4, 1, 2, 3).contiguous()
 
     ranks = (
         coords[:, 0] * (W * D * B)
@@ -0,0 +1,256 @@
+"""
+Rotated BEV IoU, 3D IoU and rotated NMS on the CPU with Numba, used when iou3d_nms_cuda is not compiled.
+The intersection of two boxes is the first box clipped by the four edges of the second one (Sutherland-Hodgman).
+"""
+import numba
+import numpy as np
+
+EPS = 1e-8
+
+
+@numba.jit(nopython=True, cache=True)
+def box_corners_bev(box, origin_x, origin_y, corners):
+    """
+    box: (7) [x, y, z, dx, dy, dz, heading], corners: (4, 2) counter-clockwise, relative to the origin
+    """
+    cosa, sina = np.cos(box[6]), np.sin(box[6])
+    dx_half, dy_half = box[3] / 2, box[4] / 2
+    center_x, center_y = box[0] - origin_x, box[1] - origin_y
+    corners[0, 0] = dx_half * cosa - dy_half * sina + center_x
+    corners[0, 1] = dx_half * sina + dy_half * cosa + center_y
+    corners[1, 0] = -dx_half * cosa - dy_half * sina + center_x
+    corners[1, 1] = -dx_half * sina + dy_half * cosa + center_y
+    corners[2, 0] = -dx_half * cosa + dy_half * sina + center_x
+    corners[2, 1] = -dx_half * sina - dy_half * cosa + center_y
+    corners[3, 0] = dx_half * cosa + dy_half * sina + center_x
+    corners[3, 1] = dx_half * sina - dy_half * cosa + center_y
+
+
+@numba.jit(nopython=True, cache=True)
+def box_half_extents_bev(boxes):
+    """
+    Returns:
+        extents: (N, 2) half size of the axis aligned bev bounding box of every rotated box
+    """
+    extents = np.empty((boxes.shape[0], 2), dtype=np.float64)
+    for i in range(boxes.shape[0]):
+        cosa, sina = abs(np.cos(boxes[i, 6])), abs(np.sin(boxes[i, 6]))
+        extents[i, 0] = (boxes[i, 3] * cosa + boxes[i, 4] * sina) / 2
+        extents[i, 1] = (boxes[i, 3] * sina + boxes[i, 4] * cosa) / 2
+    return extents
+
+
+@numba.jit(nopython=True, cache=True)
+def box_overlap_bev(box_a, box_b, buffer):
+    """
+    Args:
+        box_a, box_b: (7) [x, y, z, dx, dy, dz, heading]
+        buffer: (4 + 2 * 16, 2) float64 scratch memory
+    Returns:
+        bev intersection area
+    """
+    clip = buffer[0:4]
+    subject = buffer[4:20]
+    clipped = buffer[20:36]
+    box_corners_bev(box_b, box_a[0], box_a[1], clip)
+    box_corners_bev(box_a, box_a[0], box_a[1], subject[0:4])
+    num_points = 4
+    for e in range(4):
+        c0x, c0y = clip[e, 0], clip[e, 1]
+        edge_x, edge_y = clip[(e + 1) % 4, 0] - c0x, clip[(e + 1) % 4, 1] - c0y
+        num_clipped = 0
+        for k in range(num_points):
+            px, py = subject[k, 0], subject[k, 1]
+            qx, qy = subject[(k + 1) % num_points, 0], subject[(k + 1) % num_points, 1]
+            side_p = edge_x * (py - c0y) - edge_y * (px - c0x) #>= 0: left of the edge, inside
+            side_q = edge_x * (qy - c0y) - edge_y * (qx - c0x)
+            if side_p >= 0:
+                clipped[num_clipped, 0] = px
+                clipped[num_clipped, 1] = py
+                num_clipped += 1
+            if (side_p >= 0) != (side_q >= 0):
+                t = side_p / (side_p - side_q)
+                clipped[num_clipped, 0] = px + t * (qx - px)
+                clipped[num_clipped, 1] = py + t * (qy - py)
+                num_clipped += 1
+        num_points = num_clipped
+        if num_points < 3:
+            return 0.0
+        for k in range(num_points):
+            subject[k, 0] = clipped[k, 0]
+            subject[k, 1] = clipped[k, 1]
+
+    area = 0.0
+    for k in range(num_points):
+        area += subject[k, 0] * subject[(k + 1) % num_points, 1] - subject[k, 1] * subject[(k + 1) % num_points, 0]
+    return abs(area) / 2
+
+
+@numba.jit(nopython=True, parallel=True, cache=True)
+def boxes_overlap(boxes_a, boxes_b, with_height):
+    """
+    Args:
+        boxes_a: (N, 7) [x, y, z, dx, dy, dz, heading]
+        boxes_b: (M, 7) [x, y, z, dx, dy, dz, heading]
+        with_height: multiply by the height overlap (3d intersection volume)
+
+    Returns:
+        overlaps: (N, M) bev intersection areas or 3d intersection volumes
+    """
+    num_a, num_b = boxes_a.shape[0], boxes_b.shape[0]
+    overlaps = np.zeros((num_a, num_b), dtype=np.float64)
+    extents_a = box_half_extents_bev(boxes_a)
+    extents_b = box_half_extents_bev(boxes_b)
+    for i in numba.prange(num_a):
+        buffer = np.empty((36, 2), dtype=np.float64)
+        for j in range(num_b):
+            #axis aligned pre-filter, most pairs are far apart
+            if abs(boxes_a[i, 0] - boxes_b[j, 0]) > extents_a[i, 0] + extents_b[j, 0] or \
+                    abs(boxes_a[i, 1] - boxes_b[j, 1]) > extents_a[i, 1] + extents_b[j, 1]:
+                continue
+            height = 1.0
+            if with_height:
+                height = min(boxes_a[i, 2] + boxes_a[i, 5] / 2, boxes_b[j, 2] + boxes_b[j, 5] / 2) - \
+                    max(boxes_a[i, 2] - boxes_a[i, 5] / 2, boxes_b[j, 2] - boxes_b[j, 5] / 2)
+                if height <= 0:
+                    continue
+            overlaps[i, j] = box_overlap_bev(boxes_a[i], boxes_b[j], buffer) * height
+    return overlaps
+
+
+@numba.jit(nopython=True, parallel=True, cache=True)
+def boxes_aligned_overlap_bev(boxes_a, boxes_b):
+    """
+    Args:
+        boxes_a: (N, 7) [x, y, z, dx, dy, dz, heading]
+        boxes_b: (N, 7) [x, y, z, dx, dy, dz, heading]
+
+    Returns:
+        overlaps: (N,) bev intersection area of boxes_a[i] and boxes_b[i]
+    """
+    overlaps = np.zeros(boxes_a.shape[0], dtype=np.float64)
+    for i in numba.prange(boxes_a.shape[0]):
+        buffer = np.empty((36, 2), dtype=np.float64)
+        overlaps[i] = box_overlap_bev(boxes_a[i], boxes_b[i], buffer)
+    return overlaps
+
+
+def boxes_iou_bev(boxes_a, boxes_b):
+    """
+    Args:
+        boxes_a: (N, 7) [x, y, z, dx, dy, dz, heading] numpy
+        boxes_b: (M, 7) [x, y, z, dx, dy, dz, heading] numpy
+
+    Returns:
+        ans_iou: (N, M) float32
+    """
+    boxes_a = np.ascontiguousarray(boxes_a, dtype=np.float64)
+    boxes_b = np.ascontiguousarray(boxes_b, dtype=np.float64)
+    overlaps = boxes_overlap(boxes_a, boxes_b, False)
+    area_a = (boxes_a[:, 3] * boxes_a[:, 4]).reshape(-1, 1)
+    area_b = (boxes_b[:, 3] * boxes_b[:, 4]).reshape(1, -1)
+    return (overlaps / np.maximum(area_a + area_b - overlaps, EPS)).astype(np.float32)
+
+
+def height_overlaps(boxes_a, boxes_b):
+    max_of_min = np.maximum(boxes_a[:, 2] - boxes_a[:, 5] / 2, boxes_b[:, 2] - boxes_b[:, 5] / 2)
+    min_of_max = np.minimum(boxes_a[:, 2] + boxes_a[:, 5] / 2, boxes_b[:, 2] + boxes_b[:, 5] / 2)
+    return np.clip(min_of_max - max_of_min, a_min=0, a_max=None)
+
+
+def boxes_iou3d(boxes_a, boxes_b):
+    """
+    Args:
+        boxes_a: (N, 7) [x, y, z, dx, dy, dz, heading] numpy
+        boxes_b: (M, 7) [x, y, z, dx, dy, dz, heading] numpy
+
+    Returns:
+        ans_iou: (N, M) float32
+    """
+    boxes_a = np.ascontiguousarray(boxes_a, dtype=np.float64)
+    boxes_b = np.ascontiguousarray(boxes_b, dtype=np.float64)
+    overlaps_3d = boxes_overlap(boxes_a, boxes_b, True)
+    vol_a = (boxes_a[:, 3] * boxes_a[:, 4] * boxes_a[:, 5]).reshape(-1, 1)
+    vol_b = (boxes_b[:, 3] * boxes_b[:, 4] * boxes_b[:, 5]).reshape(1, -1)
+    return (overlaps_3d / np.maximum(vol_a + vol_b - overlaps_3d, 1e-6)).astype(np.float32)
+
+
+def boxes_aligned_iou3d(boxes_a, boxes_b):
+    """
+    Args:
+        boxes_a: (N, 7) [x, y, z, dx, dy, dz, heading] numpy
+        boxes_b: (N, 7) [x, y, z, dx, dy, dz, heading] numpy
+
+    Returns:
+        ans_iou: (N, 1) float32
+    """
+    boxes_a = np.ascontiguousarray(boxes_a, dtype=np.float64)
+    boxes_b = np.ascontiguousarray(boxes_b, dtype=np.float64)
+    overlaps_3d = boxes_aligned_overlap_bev(boxes_a, boxes_b) * height_overlaps(boxes_a, boxes_b)
+    vol_a = boxes_a[:, 3] * boxes_a[:, 4] * boxes_a[:, 5]
+    vol_b = boxes_b[:, 3] * boxes_b[:, 4] * boxes_b[:, 5]
+    iou3d = overlaps_3d / np.maximum(vol_a + vol_b - overlaps_3d, 1e-6)
+    return iou3d.reshape(-1, 1).astype(np.float32)
+
+
+@numba.jit(nopython=True, cache=True)
+def nms_sorted_boxes(boxes, block_ends, thresh):
+    """
+    Greedy rotated NMS, the IoU of a pair is only computed while the lower score box is not suppressed yet
+    Args:
+        boxes: (N, 7) float64, contiguous blocks (groups) sorted by descending score
+        block_ends: (N) int64 end of the block of every box, boxes of different blocks never suppress each other
+    Returns:
+        keep: (K) indices into boxes
+    """
+    num_boxes = boxes.shape[0]
+    extents = box_half_extents_bev(boxes)
+    buffer = np.empty((36, 2), dtype=np.float64)
+    suppressed = np.zeros(num_boxes, dtype=np.bool_)
+    keep = np.empty(num_boxes, dtype=np.int64)
+    num_keep = 0
+    for i in range(num_boxes):
+        if suppressed[i]:
+            continue
+        keep[num_keep] = i
+        num_keep += 1
+        area_i = boxes[i, 3] * boxes[i, 4]
+        for j in range(i + 1, block_ends[i]):
+            if suppressed[j]:
+                continue
+            if abs(boxes[i, 0] - boxes[j, 0]) > extents[i, 0] + extents[j, 0] or \
+                    abs(boxes[i, 1] - boxes[j, 1]) > extents[i, 1] + extents[j, 1]:
+                continue
+            overlap = box_overlap_bev(boxes[i], boxes[j], buffer)
+            iou = overlap / max(area_i + boxes[j, 3] * boxes[j, 4] - overlap, EPS)
+            if iou > thresh:
+                suppressed[j] = True
+    return keep[:num_keep]
+
+
+def nms(boxes, thresh, group_ids=None):
+    """
+    Args:
+        boxes: (N, 7) [x, y, z, dx, dy, dz, heading] numpy, sorted by descending score
+        group_ids: optional (N), boxes of different groups never suppress each other
+    Returns:
+        keep: (K) int64 indices into boxes, in descending score order
+    """
+    boxes = np.ascontiguousarray(boxes, dtype=np.float64)
+    if group_ids is None:
+        return nms_sorted_boxes(boxes, np.full(boxes.shape[0], boxes.shape[0], dtype=np.int64), thresh)
+
+    group_order = np.argsort(group_ids, kind='stable') #keeps the score order inside a group
+    sorted_group_ids = np.asarray(group_ids)[group_order]
+    block_ends = np.searchsorted(sorted_group_ids, sorted_group_ids, side='right').astype(np.int64)
+    keep = nms_sorted_boxes(np.ascontiguousarray(boxes[group_order]), block_ends, thresh)
+    return np.sort(group_order[keep])
+
+
+def nms_normal(boxes, thresh, group_ids=None):
+    """
+    Axis aligned NMS, the heading is ignored as in nms_normal_gpu
+    """
+    boxes = np.array(boxes, dtype=np.float64)
+    boxes[:, 6] = 0
+    return nms(boxes, thresh, group_ids=group_ids)
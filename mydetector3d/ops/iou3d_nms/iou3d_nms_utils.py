@@ -3,10 +3,34 @@
 Written by Shaoshuai Shi
 All Rights Reserved 2019-2020.
 """
+import numpy as np
 import torch
 
 from ...utils import common_utils
-from . import iou3d_nms_cuda
+
+try:
+    from . import iou3d_nms_cuda
+except ImportError: #not compiled, the functions below fall back to iou3d_nms_cpu (Numba) or the *_torch versions
+    iou3d_nms_cuda = None
+
+try:
+    from . import iou3d_nms_cpu
+except ImportError: #numba is not installed
+    iou3d_nms_cpu = None
+
+
+def use_cuda_ext(*tensors):
+    return iou3d_nms_cuda is not None and all([x.is_cuda for x in tensors])
+
+
+def boxes_iou_fallback(cpu_func_name, torch_func, boxes_a, boxes_b):
+    """
+    Without the CUDA extension: Numba kernels of iou3d_nms_cpu for CPU tensors, the pure PyTorch version otherwise
+    """
+    if iou3d_nms_cpu is not None and not boxes_a.is_cuda:
+        ans_iou = getattr(iou3d_nms_cpu, cpu_func_name)(boxes_a.detach().numpy(), boxes_b.detach().numpy())
+        return torch.from_numpy(ans_iou)
+    return torch_func(boxes_a, boxes_b)
 
 
 def boxes_bev_iou_cpu(boxes_a, boxes_b):
@@ -22,6 +46,9 @@ def boxes_bev_iou_cpu(boxes_a, boxes_b):
     boxes_b, is_numpy = common_utils.check_numpy_to_torch(boxes_b)
     assert not (boxes_a.is_cuda or boxes_b.is_cuda), 'Only support CPU tensors'
     assert boxes_a.shape[1] == 7 and boxes_b.shape[1] == 7
+    if iou3d_nms_cuda is None:
+        ans_iou = boxes_iou_fallback('boxes_iou_bev', boxes_iou_bev_torch, boxes_a, boxes_b)
+        return ans_iou.numpy() if is_numpy else ans_iou
     ans_iou = boxes_a.new_zeros(torch.Size((boxes_a.shape[0], boxes_b.shape[0])))
     iou3d_nms_cuda.boxes_iou_bev_cpu(boxes_a.contiguous(), boxes_b.contiguous(), ans_iou)
 
@@ -38,6 +65,8 @@ def boxes_iou_bev(boxes_a, boxes_b):
         ans_iou: (N, M)
     """
     assert boxes_a.shape[1] == boxes_b.shape[1] == 7
+    if not use_cuda_ext(boxes_a, boxes_b):
+        return boxes_iou_fallback('boxes_iou_bev', boxes_iou_bev_torch, boxes_a, boxes_b)
     ans_iou = torch.cuda.FloatTensor(torch.Size((boxes_a.shape[0], boxes_b.shape[0]))).zero_()
 
     iou3d_nms_cuda.boxes_iou_bev_gpu(boxes_a.contiguous(), boxes_b.contiguous(), ans_iou)
@@ -55,6 +84,8 @@ def boxes_iou3d_gpu(boxes_a, boxes_b):
         ans_iou: (N, M)
     """
     assert boxes_a.shape[1] == boxes_b.shape[1] == 7
+    if not use_cuda_ext(boxes_a, boxes_b):
+        return boxes_iou_fallback('boxes_iou3d', boxes_iou3d_torch, boxes_a, boxes_b)
 
     # height overlap
     boxes_a_height_max = (boxes_a[:, 2] + boxes_a[:, 5] / 2).view(-1, 1)
@@ -91,6 +122,10 @@ def boxes_aligned_iou3d_gpu(boxes_a, boxes_b):
     """
     assert boxes_a.shape[0] == boxes_b.shape[0]
     assert boxes_a.shape[1] == boxes_b.shape[1] == 7
+    if not use_cuda_ext(boxes_a, boxes_b):
+        return boxes_iou_fallback(
+            'boxes_aligned_iou3d', boxes_aligned_iou3d_torch, boxes_a, boxes_b
+        )
 
     # height overlap
     boxes_a_height_max = (boxes_a[:, 2] + boxes_a[:, 5] / 2).view(-1, 1)
@@ -117,15 +152,34 @@ def boxes_aligned_iou3d_gpu(boxes_a, boxes_b):
     return iou3d
 
 
-def nms_gpu(boxes, scores, thresh, pre_maxsize=None, **kwargs):
+def nms_fallback(boxes, scores, thresh, pre_maxsize=None, group_ids=None, normal=False):
+    """
+    NMS without the CUDA extension: Numba kernel for CPU tensors, nms_torch otherwise
+    """
+    if iou3d_nms_cpu is None or boxes.is_cuda:
+        nms_func = nms_normal_torch if normal else nms_torch
+        return nms_func(boxes, scores, thresh, pre_maxsize=pre_maxsize, group_ids=group_ids)
+    order = scores.sort(dim=0, descending=True, stable=True)[1] #ties keep the index order on every backend
+    if pre_maxsize is not None:
+        order = order[:pre_maxsize]
+    cur_group_ids = group_ids[order].numpy() if group_ids is not None else None
+    nms_func = iou3d_nms_cpu.nms_normal if normal else iou3d_nms_cpu.nms
+    keep = nms_func(boxes[order].detach().numpy(), thresh, group_ids=cur_group_ids)
+    return order[torch.from_numpy(keep)].contiguous(), None
+
+
+def nms_gpu(boxes, scores, thresh, pre_maxsize=None, group_ids=None, **kwargs):
     """
     :param boxes: (N, 7) [x, y, z, dx, dy, dz, heading]
     :param scores: (N)
     :param thresh:
+    :param group_ids: optional (N), only supported by the fallback, boxes of different groups never suppress each other
     :return:
     """
     assert boxes.shape[1] == 7
-    order = scores.sort(0, descending=True)[1]
+    if not use_cuda_ext(boxes) or group_ids is not None:
+        return nms_fallback(boxes, scores, thresh, pre_maxsize=pre_maxsize, group_ids=group_ids)
+    order = scores.sort(dim=0, descending=True, stable=True)[1]
     if pre_maxsize is not None:
         order = order[:pre_maxsize]
 
@@ -135,18 +189,270 @@ def nms_gpu(boxes, scores, thresh, pre_maxsize=None, **kwargs):
     return order[keep[:num_out].cuda()].contiguous(), None
 
 
-def nms_normal_gpu(boxes, scores, thresh, **kwargs):
+def nms_normal_gpu(boxes, scores, thresh, group_ids=None, **kwargs):
     """
     :param boxes: (N, 7) [x, y, z, dx, dy, dz, heading]
     :param scores: (N)
     :param thresh:
+    :param group_ids: optional (N), only supported by the fallback
     :return:
     """
     assert boxes.shape[1] == 7
-    order = scores.sort(0, descending=True)[1]
+    if not use_cuda_ext(boxes) or group_ids is not None:
+        return nms_fallback(boxes, scores, thresh, group_ids=group_ids, normal=True)
+    order = scores.sort(dim=0, descending=True, stable=True)[1]
 
     boxes = boxes[order].contiguous()
 
     keep = torch.LongTensor(boxes.size(0))
     num_out = iou3d_nms_cuda.nms_normal_gpu(boxes, keep, thresh)
     return order[keep[:num_out].cuda()].contiguous(), None
+
+
+def boxes_to_bev_corners_torch(boxes, origin):
+    """
+    Args:
+        boxes: (N, 7) [x, y, z, dx, dy, dz, heading]
+        origin: (N, 2) the corners are relative to it, keeps the precision for far away boxes
+    Returns:
+        corners: (N, 4, 2) counter-clockwise
+    """
+    template = boxes.new_tensor([[0.5, 0.5], [-0.5, 0.5], [-0.5, -0.5], [0.5, -0.5]])
+    corners = boxes[:, None, 3:5] * template[None, :, :]
+    cosa, sina = torch.cos(boxes[:, 6:7]), torch.sin(boxes[:, 6:7])
+    center = boxes[:, 0:2] - origin
+    corners_x = corners[:, :, 0] * cosa - corners[:, :, 1] * sina + center[:, 0:1]
+    corners_y = corners[:, :, 0] * sina + corners[:, :, 1] * cosa + center[:, 1:2]
+    return torch.stack([corners_x, corners_y], dim=-1)
+
+
+def cross2d_torch(a, b):
+    return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+
+
+def points_in_convex_polygon_torch(points, polygons, eps=1e-5):
+    """
+    Args:
+        points: (P, K, 2)
+        polygons: (P, 4, 2) counter-clockwise
+    Returns:
+        mask: (P, K)
+    """
+    edges = polygons.roll(-1, dims=1) - polygons
+    rel = points[:, :, None, :] - polygons[:, None, :, :] #(P, K, 4, 2)
+    return (cross2d_torch(edges[:, None, :, :], rel) >= -eps).all(dim=-1)
+
+
+def boxes_pair_overlap_bev_torch(boxes_a, boxes_b, chunk_size=65536):
+    """
+    Rotated bev intersection area of aligned box pairs, the intersection polygon is built from the corners inside
+    the other box and the edge crossings, sorted by angle around its centroid (pure PyTorch, any device)
+    Args:
+        boxes_a: (P, 7) [x, y, z, dx, dy, dz, heading]
+        boxes_b: (P, 7) [x, y, z, dx, dy, dz, heading]
+    Returns:
+        overlaps: (P,)
+    """
+    overlaps = []
+    for start in range(0, boxes_a.shape[0], chunk_size):
+        cur_a, cur_b = boxes_a[start:start + chunk_size], boxes_b[start:start + chunk_size]
+        origin = cur_a[:, 0:2]
+        corners_a = boxes_to_bev_corners_torch(cur_a, origin)
+        corners_b = boxes_to_bev_corners_torch(cur_b, origin)
+        num_pairs = corners_a.shape[0]
+
+        a_in_b = points_in_convex_polygon_torch(corners_a, corners_b)
+        b_in_a = points_in_convex_polygon_torch(corners_b, corners_a)
+
+        #crossing of edge i of a and edge j of b: a0 + t * da = b0 + u * db
+        a0 = corners_a[:, :, None, :]
+        da = corners_a.roll(-1, dims=1)[:, :, None, :] - a0
+        b0 = corners_b[:, None, :, :]
+        db = corners_b.roll(-1, dims=1)[:, None, :, :] - b0
+        denom = cross2d_torch(da, db) #(P, 4, 4)
+        valid_denom = denom.abs() > 1e-8
+        denom = torch.where(valid_denom, denom, torch.ones_like(denom))
+        t = cross2d_torch(b0 - a0, db) / denom
+        u = cross2d_torch(b0 - a0, da) / denom
+        crossed = valid_denom & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+        crossings = a0 + t[..., None] * da #(P, 4, 4, 2)
+
+        points = torch.cat([corners_a, corners_b, crossings.view(num_pairs, 16, 2)], dim=1) #(P, 24, 2)
+        mask = torch.cat([a_in_b, b_in_a, crossed.view(num_pairs, 16)], dim=1)
+        points = torch.where(mask[..., None], points, torch.zeros_like(points))
+        num_points = mask.sum(dim=1)
+        centroid = points.sum(dim=1) / num_points.clamp(min=1)[:, None].to(points.dtype)
+        points = points - centroid[:, None, :]
+
+        angles = torch.atan2(points[..., 1], points[..., 0]).masked_fill(~mask, 10.0) #unused points go to the end
+        order = angles.argsort(dim=1)
+        points = torch.gather(points, 1, order[..., None].expand(-1, -1, 2))
+        mask = torch.gather(mask, 1, order)
+        points = torch.where(mask[..., None], points, points[:, 0:1, :]) #repeat the first point, adds zero area
+        area = 0.5 * cross2d_torch(points, points.roll(-1, dims=1)).sum(dim=1).abs()
+        overlaps.append(area * (num_points >= 3).to(area.dtype))
+    if len(overlaps) == 0:
+        return boxes_a.new_zeros((0,))
+    return torch.cat(overlaps, dim=0)
+
+
+def boxes_bev_candidate_pairs_torch(boxes_a, boxes_b, chunk_size=2048):
+    """
+    Returns:
+        index_a, index_b: (P,) pairs whose axis aligned bev bounding boxes overlap, the others have zero overlap
+    """
+    def get_half_extents(boxes):
+        cosa, sina = torch.cos(boxes[:, 6]).abs(), torch.sin(boxes[:, 6]).abs()
+        return torch.stack([boxes[:, 3] * cosa + boxes[:, 4] * sina, boxes[:, 3] * sina + boxes[:, 4] * cosa], dim=1) / 2
+
+    extents_a, extents_b = get_half_extents(boxes_a), get_half_extents(boxes_b)
+    index_a, index_b = [], []
+    for start in range(0, boxes_a.shape[0], chunk_size):
+        cur_a = slice(start, start + chunk_size)
+        overlap_x = (boxes_a[cur_a, None, 0] - boxes_b[None, :, 0]).abs() <= extents_a[cur_a, None, 0] + extents_b[None, :, 0]
+        overlap_y = (boxes_a[cur_a, None, 1] - boxes_b[None, :, 1]).abs() <= extents_a[cur_a, None, 1] + extents_b[None, :, 1]
+        pair_a, pair_b = (overlap_x & overlap_y).nonzero(as_tuple=True)
+        index_a.append(pair_a + start)
+        index_b.append(pair_b)
+    if len(index_a) == 0:
+        empty = torch.zeros((0,), dtype=torch.long, device=boxes_a.device)
+        return empty, empty
+    return torch.cat(index_a), torch.cat(index_b)
+
+
+def boxes_iou_bev_torch(boxes_a, boxes_b):
+    """
+    Args:
+        boxes_a: (N, 7) [x, y, z, dx, dy, dz, heading]
+        boxes_b: (M, 7) [x, y, z, dx, dy, dz, heading]
+
+    Returns:
+        ans_iou: (N, M)
+    """
+    assert boxes_a.shape[1] == boxes_b.shape[1] == 7
+    ans_iou = boxes_a.new_zeros((boxes_a.shape[0], boxes_b.shape[0]))
+    index_a, index_b = boxes_bev_candidate_pairs_torch(boxes_a, boxes_b)
+    overlaps = boxes_pair_overlap_bev_torch(boxes_a[index_a], boxes_b[index_b])
+    area_a = boxes_a[index_a, 3] * boxes_a[index_a, 4]
+    area_b = boxes_b[index_b, 3] * boxes_b[index_b, 4]
+    ans_iou[index_a, index_b] = overlaps / torch.clamp(area_a + area_b - overlaps, min=1e-6)
+    return ans_iou
+
+
+def boxes_iou3d_torch(boxes_a, boxes_b):
+    """
+    Same as boxes_iou3d_gpu without the CUDA extension
+    Args:
+        boxes_a: (N, 7) [x, y, z, dx, dy, dz, heading]
+        boxes_b: (M, 7) [x, y, z, dx, dy, dz, heading]
+
+    Returns:
+        ans_iou: (N, M)
+    """
+    assert boxes_a.shape[1] == boxes_b.shape[1] == 7
+    overlaps_3d = boxes_a.new_zeros((boxes_a.shape[0], boxes_b.shape[0]))
+    index_a, index_b = boxes_bev_candidate_pairs_torch(boxes_a, boxes_b)
+    overlaps_bev = boxes_pair_overlap_bev_torch(boxes_a[index_a], boxes_b[index_b])
+
+    # height overlap
+    max_of_min = torch.max(boxes_a[index_a, 2] - boxes_a[index_a, 5] / 2, boxes_b[index_b, 2] - boxes_b[index_b, 5] / 2)
+    min_of_max = torch.min(boxes_a[index_a, 2] + boxes_a[index_a, 5] / 2, boxes_b[index_b, 2] + boxes_b[index_b, 5] / 2)
+    overlaps_h = torch.clamp(min_of_max - max_of_min, min=0)
+    overlaps_3d[index_a, index_b] = overlaps_bev * overlaps_h
+
+    vol_a = (boxes_a[:, 3] * boxes_a[:, 4] * boxes_a[:, 5]).view(-1, 1)
+    vol_b = (boxes_b[:, 3] * boxes_b[:, 4] * boxes_b[:, 5]).view(1, -1)
+
+    iou3d = overlaps_3d / torch.clamp(vol_a + vol_b - overlaps_3d, min=1e-6)
+
+    return iou3d
+
+
+def boxes_aligned_iou3d_torch(boxes_a, boxes_b):
+    """
+    Same as boxes_aligned_iou3d_gpu without the CUDA extension
+    Args:
+        boxes_a: (N, 7) [x, y, z, dx, dy, dz, heading]
+        boxes_b: (N, 7) [x, y, z, dx, dy, dz, heading]
+
+    Returns:
+        ans_iou: (N, 1)
+    """
+    assert boxes_a.shape[0] == boxes_b.shape[0]
+    assert boxes_a.shape[1] == boxes_b.shape[1] == 7
+    overlaps_bev = boxes_pair_overlap_bev_torch(boxes_a, boxes_b)
+
+    max_of_min = torch.max(boxes_a[:, 2] - boxes_a[:, 5] / 2, boxes_b[:, 2] - boxes_b[:, 5] / 2)
+    min_of_max = torch.min(boxes_a[:, 2] + boxes_a[:, 5] / 2, boxes_b[:, 2] + boxes_b[:, 5] / 2)
+    overlaps_3d = overlaps_bev * torch.clamp(min_of_max - max_of_min, min=0)
+
+    vol_a = boxes_a[:, 3] * boxes_a[:, 4] * boxes_a[:, 5]
+    vol_b = boxes_b[:, 3] * boxes_b[:, 4] * boxes_b[:, 5]
+    iou3d = overlaps_3d / torch.clamp(vol_a + vol_b - overlaps_3d, min=1e-6)
+    return iou3d.view(-1, 1)
+
+
+def nms_torch(boxes, scores, thresh, pre_maxsize=None, group_ids=None, **kwargs):
+    """
+    Rotated NMS in pure PyTorch, same selection as nms_gpu
+    :param boxes: (N, 7) [x, y, z, dx, dy, dz, heading]
+    :param scores: (N)
+    :param thresh:
+    :param group_ids: optional (N), boxes of different groups never suppress each other
+    :return: kept indices sorted by descending score
+    """
+    assert boxes.shape[1] == 7
+    order = scores.sort(dim=0, descending=True, stable=True)[1]
+    if pre_maxsize is not None:
+        order = order[:pre_maxsize]
+    boxes = boxes[order]
+    num_boxes = boxes.shape[0]
+
+    #overlapping pairs (i, j), i < j in score order, only inside the same group
+    if group_ids is None:
+        blocks = [torch.arange(num_boxes, device=boxes.device)]
+    else:
+        sorted_groups, group_order = group_ids[order].sort(stable=True)
+        counts = torch.unique_consecutive(sorted_groups, return_counts=True)[1]
+        blocks = group_order.split(counts.tolist())
+    index_i, index_j = [], []
+    for block in blocks:
+        cur_i, cur_j = boxes_bev_candidate_pairs_torch(boxes[block], boxes[block])
+        cur_i, cur_j = block[cur_i], block[cur_j]
+        pair_mask = cur_i < cur_j
+        index_i.append(cur_i[pair_mask])
+        index_j.append(cur_j[pair_mask])
+    index_i, index_j = torch.cat(index_i), torch.cat(index_j)
+    overlaps = boxes_pair_overlap_bev_torch(boxes[index_i], boxes[index_j])
+    area_i = boxes[index_i, 3] * boxes[index_i, 4]
+    area_j = boxes[index_j, 3] * boxes[index_j, 4]
+    iou = overlaps / torch.clamp(area_i + area_j - overlaps, min=1e-6)
+    pair_mask = iou > thresh
+    index_i = index_i[pair_mask].cpu().numpy()
+    index_j = index_j[pair_mask].cpu().numpy()
+
+    #greedy pass, only the boxes with overlapping lower score boxes need a visit
+    pair_order = np.argsort(index_i, kind='stable')
+    index_i, index_j = index_i[pair_order], index_j[pair_order]
+    rows, row_starts = np.unique(index_i, return_index=True)
+    row_ends = np.append(row_starts[1:], index_i.shape[0])
+    suppressed = np.zeros(num_boxes, dtype=bool)
+    for row, start, end in zip(rows, row_starts, row_ends):
+        if not suppressed[row]:
+            suppressed[index_j[start:end]] = True
+    keep = torch.from_numpy(np.nonzero(~suppressed)[0]).to(order.device)
+    return order[keep].contiguous(), None
+
+
+def nms_normal_torch(boxes, scores, thresh, **kwargs):
+    """
+    Axis aligned NMS (heading ignored) in pure PyTorch, same selection as nms_normal_gpu
+    :param boxes: (N, 7) [x, y, z, dx, dy, dz, heading]
+    :param scores: (N)
+    :param thresh:
+    :return:
+    """
+    assert boxes.shape[1] == 7
+    boxes = boxes.clone()
+    boxes[:, 6] = 0
+    return nms_torch(boxes, scores, thresh, **kwargs)
@@ -4,7 +4,10 @@ import torch
 import torch.nn as nn
 from torch.autograd import Function, Variable
 
-from . import pointnet2_batch_cuda as pointnet2
+try:
+    from . import pointnet2_batch_cuda as pointnet2
+except ImportError: #not compiled, only the point-based modules (PointNet++ backbones) need it
+    pointnet2 = None
 
 
 class FarthestPointSampling(Function):
@@ -4,7 +4,10 @@ from torch.autograd import Function
 import torch.nn as nn
 from typing import List
 
-from . import pointnet2_stack_cuda as pointnet2
+try:
+    from . import pointnet2_stack_cuda as pointnet2
+except ImportError: #not compiled, only the voxel set abstraction modules need it
+    pointnet2 = None
 from . import pointnet2_utils
 
 class VoxelQuery(Function):
@@ -0,0 +1,182 @@
+"""
+Points in rotated 3D boxes on the CPU with Numba, same test as check_pt_in_box3d_cpu of roiaware_pool3d.cpp.
+The grid versions bucket the points into BEV cells once and only test the points in the cells covered by each box.
+"""
+import numba
+import numpy as np
+
+MARGIN = 1e-2
+
+
+@numba.jit(nopython=True)
+def check_pt_in_box3d(pt, box):
+    """
+    pt: (3) [x, y, z], box: (7) [x, y, z, dx, dy, dz, heading], (x, y, z) is the box center
+    """
+    if abs(pt[2] - box[2]) > box[5] / 2:
+        return False
+    cosa, sina = np.cos(-box[6]), np.sin(-box[6])
+    shift_x, shift_y = pt[0] - box[0], pt[1] - box[1]
+    local_x = shift_x * cosa - shift_y * sina
+    local_y = shift_x * sina + shift_y * cosa
+    return abs(local_x) < box[3] / 2 + MARGIN and abs(local_y) < box[4] / 2 + MARGIN
+
+
+@numba.jit(nopython=True, parallel=True)
+def points_in_boxes_dense(points, boxes):
+    """
+    Args:
+        points: (num_points, 3)
+        boxes: (N, 7) [x, y, z, dx, dy, dz, heading]
+    Returns:
+        point_indices: (N, num_points) int32
+    """
+    point_indices = np.zeros((boxes.shape[0], points.shape[0]), dtype=np.int32)
+    for i in numba.prange(boxes.shape[0]):
+        for j in range(points.shape[0]):
+            if check_pt_in_box3d(points[j], boxes[i]):
+                point_indices[i, j] = 1
+    return point_indices
+
+
+@numba.jit(nopython=True)
+def check_pt_in_box3d_closed(pt, box):
+    """
+    Closed box without margin, same result as box_utils.in_hull on the 8 corners of the box
+    """
+    if abs(pt[2] - box[2]) > box[5] / 2:
+        return False
+    cosa, sina = np.cos(-box[6]), np.sin(-box[6])
+    shift_x, shift_y = pt[0] - box[0], pt[1] - box[1]
+    local_x = shift_x * cosa - shift_y * sina
+    local_y = shift_x * sina + shift_y * cosa
+    return abs(local_x) <= box[3] / 2 and abs(local_y) <= box[4] / 2
+
+
+@numba.jit(nopython=True)
+def build_bev_grid(points, boxes, cell_size):
+    """
+    Counting sort of the points by bev cell, the grid covers the axis aligned bev bounds (+ MARGIN) of the boxes
+    Returns:
+        bounds: (N, 4) [x_min, y_min, x_max, y_max] of each box
+        grid: (x_min, y_min, cell_size, nx, ny)
+        cell_starts: (nx * ny + 1), the points of cell c are cell_points[cell_starts[c]:cell_starts[c + 1]]
+        cell_points: point indices, ascending within a cell
+    """
+    num_points, num_boxes = points.shape[0], boxes.shape[0]
+    bounds = np.empty((num_boxes, 4), dtype=np.float64)
+    for i in range(num_boxes):
+        cosa, sina = abs(np.cos(boxes[i, 6])), abs(np.sin(boxes[i, 6]))
+        half_x = (boxes[i, 3] * cosa + boxes[i, 4] * sina) / 2 + MARGIN
+        half_y = (boxes[i, 3] * sina + boxes[i, 4] * cosa) / 2 + MARGIN
+        bounds[i, 0], bounds[i, 1] = boxes[i, 0] - half_x, boxes[i, 1] - half_y
+        bounds[i, 2], bounds[i, 3] = boxes[i, 0] + half_x, boxes[i, 1] + half_y
+    x_min, y_min = bounds[:, 0].min(), bounds[:, 1].min()
+    x_max, y_max = bounds[:, 2].max(), bounds[:, 3].max()
+    #keep the number of cells bounded for boxes spread over a very large area
+    cell_size = max(cell_size, np.sqrt((x_max - x_min) * (y_max - y_min) / 4e6))
+    nx, ny = int((x_max - x_min) / cell_size) + 1, int((y_max - y_min) / cell_size) + 1
+
+    point_cells = np.full(num_points, -1, dtype=np.int64)
+    cell_starts = np.zeros(nx * ny + 1, dtype=np.int64)
+    for j in range(num_points):
+        ix = int(np.floor((points[j, 0] - x_min) / cell_size))
+        iy = int(np.floor((points[j, 1] - y_min) / cell_size))
+        if 0 <= ix < nx and 0 <= iy < ny:
+            point_cells[j] = iy * nx + ix
+            cell_starts[iy * nx + ix + 1] += 1
+    for c in range(nx * ny):
+        cell_starts[c + 1] += cell_starts[c]
+    cell_points = np.empty(cell_starts[nx * ny], dtype=np.int64)
+    cursor = cell_starts[:-1].copy()
+    for j in range(num_points):
+        if point_cells[j] >= 0:
+            cell_points[cursor[point_cells[j]]] = j
+            cursor[point_cells[j]] += 1
+    return bounds, (x_min, y_min, cell_size, nx, ny), cell_starts, cell_points
+
+
+@numba.jit(nopython=True)
+def get_box_cell_range(bounds, grid):
+    x_min, y_min, cell_size, nx, ny = grid
+    ix0, iy0 = int((bounds[0] - x_min) / cell_size), int((bounds[1] - y_min) / cell_size)
+    ix1, iy1 = min(int((bounds[2] - x_min) / cell_size), nx - 1), min(int((bounds[3] - y_min) / cell_size), ny - 1)
+    return ix0, iy0, ix1, iy1
+
+
+@numba.jit(nopython=True)
+def points_in_boxes_grid(points, boxes, cell_size):
+    """
+    Args:
+        points: (num_points, 3)
+        boxes: (N, 7) [x, y, z, dx, dy, dz, heading]
+        cell_size: bev cell size of the point buckets (meter)
+    Returns:
+        box_idxs_of_pts: (num_points) int32, index of the first box containing the point, -1 for background
+    """
+    num_points, num_boxes = points.shape[0], boxes.shape[0]
+    box_idxs_of_pts = np.full(num_points, -1, dtype=np.int32)
+    if num_boxes == 0 or num_points == 0:
+        return box_idxs_of_pts
+
+    bounds, grid, cell_starts, cell_points = build_bev_grid(points, boxes, cell_size)
+    nx = grid[3]
+    for i in range(num_boxes):
+        ix0, iy0, ix1, iy1 = get_box_cell_range(bounds[i], grid)
+        for iy in range(iy0, iy1 + 1):
+            for ix in range(ix0, ix1 + 1):
+                c = iy * nx + ix
+                for k in range(cell_starts[c], cell_starts[c + 1]):
+                    j = cell_points[k]
+                    if box_idxs_of_pts[j] < 0 and check_pt_in_box3d(points[j], boxes[i]):
+                        box_idxs_of_pts[j] = i
+    return box_idxs_of_pts
+
+
+@numba.jit(nopython=True)
+def points_in_boxes_pairs(points, boxes, cell_size, closed):
+    """
+    All (box, point) pairs with the point inside the box, overlapping boxes each get their points
+    Args:
+        points: (num_points, 3)
+        boxes: (N, 7) [x, y, z, dx, dy, dz, heading]
+        cell_size: bev cell size of the point buckets (meter)
+        closed: True: check_pt_in_box3d_closed (same as box_utils.in_hull), False: check_pt_in_box3d
+    Returns:
+        box_starts: (N + 1) int64, the points of box i are point_idxs[box_starts[i]:box_starts[i + 1]]
+        point_idxs: (num_pairs) int64, ascending within a box
+    """
+    num_points, num_boxes = points.shape[0], boxes.shape[0]
+    box_starts = np.zeros(num_boxes + 1, dtype=np.int64)
+    if num_boxes == 0 or num_points == 0:
+        return box_starts, np.zeros(0, dtype=np.int64)
+
+    bounds, grid, cell_starts, cell_points = build_bev_grid(points, boxes, cell_size)
+    nx = grid[3]
+    #two passes over the cells of each box: count, then fill
+    for step in range(2):
+        if step == 1:
+            for i in range(num_boxes):
+                box_starts[i + 1] += box_starts[i]
+            point_idxs = np.empty(box_starts[num_boxes], dtype=np.int64)
+        for i in range(num_boxes):
+            ix0, iy0, ix1, iy1 = get_box_cell_range(bounds[i], grid)
+            cnt = 0
+            for iy in range(iy0, iy1 + 1):
+                for ix in range(ix0, ix1 + 1):
+                    c = iy * nx + ix
+                    for k in range(cell_starts[c], cell_starts[c + 1]):
+                        j = cell_points[k]
+                        if closed:
+                            flag = check_pt_in_box3d_closed(points[j], boxes[i])
+                        else:
+                            flag = check_pt_in_box3d(points[j], boxes[i])
+                        if flag:
+                            if step == 1:
+                                point_idxs[box_starts[i] + cnt] = j
+                            cnt += 1
+            if step == 0:
+                box_starts[i + 1] = cnt
+            else:
+                point_idxs[box_starts[i]:box_starts[i + 1]].sort()
+    return box_starts, point_idxs
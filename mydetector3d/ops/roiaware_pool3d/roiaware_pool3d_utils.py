@@ -1,9 +1,26 @@
+import numpy as np
 import torch
 import torch.nn as nn
 from torch.autograd import Function
 
 from ...utils import common_utils
-from . import roiaware_pool3d_cuda
+
+try:
+    from . import roiaware_pool3d_cuda
+except ImportError: #not compiled, points_in_boxes_cpu falls back to roiaware_pool3d_cpu (Numba)
+    roiaware_pool3d_cuda = None
+
+try:
+    from . import roiaware_pool3d_cpu
+except ImportError: #numba is not installed
+    roiaware_pool3d_cpu = None
+
+
+def get_cpu_ext(func_name):
+    if roiaware_pool3d_cpu is None:
+        raise ImportError('%s needs numba for roiaware_pool3d_cpu%s' % (
+            func_name, ' or the compiled roiaware_pool3d_cuda' if func_name == 'points_in_boxes_cpu' else ''))
+    return roiaware_pool3d_cpu
 
 
 def points_in_boxes_cpu(points, boxes):
@@ -19,12 +36,69 @@ def points_in_boxes_cpu(points, boxes):
     points, is_numpy = common_utils.check_numpy_to_torch(points)
     boxes, is_numpy = common_utils.check_numpy_to_torch(boxes)
 
+    if roiaware_pool3d_cuda is None:
+        point_indices = torch.from_numpy(get_cpu_ext('points_in_boxes_cpu').points_in_boxes_dense(
+            points.float().numpy(), boxes.float().numpy()))
+        return point_indices.numpy() if is_numpy else point_indices
+
     point_indices = points.new_zeros((boxes.shape[0], points.shape[0]), dtype=torch.int)
     roiaware_pool3d_cuda.points_in_boxes_cpu(boxes.float().contiguous(), points.float().contiguous(), point_indices)
 
     return point_indices.numpy() if is_numpy else point_indices
 
 
+def points_in_boxes_grid_cpu(points, boxes, cell_size=1.0):
+    """
+    Same test as points_in_boxes_cpu, only the points in the bev grid cells covered by a box are checked
+    Args:
+        points: (num_points, 3)
+        boxes: [x, y, z, dx, dy, dz, heading], (x, y, z) is the box center
+        cell_size: bev cell size of the point buckets
+    Returns:
+        box_idxs_of_pts: (num_points), index of the first box containing the point, default background = -1
+    """
+    assert boxes.shape[1] == 7
+    assert points.shape[1] == 3
+    points, is_numpy = common_utils.check_numpy_to_torch(points)
+    boxes, _ = common_utils.check_numpy_to_torch(boxes)
+
+    box_idxs_of_pts = torch.from_numpy(get_cpu_ext('points_in_boxes_grid_cpu').points_in_boxes_grid(
+        points.float().numpy(), boxes.float().numpy(), float(cell_size)))
+    return box_idxs_of_pts.numpy() if is_numpy else box_idxs_of_pts
+
+
+def points_in_boxes_pairs_cpu(points, boxes, closed=False, cell_size=1.0):
+    """
+    Point indices of every box in one pass over a bev grid, boxes may overlap
+    Args:
+        points: (num_points, 3) numpy
+        boxes: (N, 7) numpy [x, y, z, dx, dy, dz, heading], (x, y, z) is the box center
+        closed: True: closed box without margin (same as box_utils.in_hull on the corners),
+            False: same test as points_in_boxes_cpu
+        cell_size: bev cell size of the point buckets
+    Returns:
+        box_starts: (N + 1), the points of box i are point_idxs[box_starts[i]:box_starts[i + 1]]
+        point_idxs: (num_pairs), ascending within a box
+    """
+    assert boxes.shape[1] == 7
+    assert points.shape[1] == 3
+    dtype = np.float64 if closed else np.float32  #in_hull runs in float64, points_in_boxes_cpu in float32
+    return get_cpu_ext('points_in_boxes_pairs_cpu').points_in_boxes_pairs(
+        np.ascontiguousarray(points, dtype=dtype), np.ascontiguousarray(boxes, dtype=dtype), float(cell_size), closed)
+
+
+def count_points_in_boxes_cpu(points, boxes, cell_size=1.0):
+    """
+    Args:
+        points: (num_points, 3) numpy
+        boxes: (N, 7) numpy [x, y, z, dx, dy, dz, heading]
+    Returns:
+        num_points_in_boxes: (N) int32, same counts as box_utils.in_hull per box
+    """
+    box_starts, _ = points_in_boxes_pairs_cpu(points, boxes, closed=True, cell_size=cell_size)
+    return np.diff(box_starts).astype(np.int32)
+
+
 def points_in_boxes_gpu(points, boxes):
     """
     :param points: (B, M, 3)
@@ -3,7 +3,10 @@ import torch.nn as nn
 from torch.autograd import Function
 
 from ...utils import box_utils
-from . import roipoint_pool3d_cuda
+try:
+    from . import roipoint_pool3d_cuda
+except ImportError: #not compiled, only the point-based roi heads need it
+    roipoint_pool3d_cuda = None
 
 
 class RoIPointPool3d(nn.Module):
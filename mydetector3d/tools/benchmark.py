@@ -0,0 +1,273 @@
+#End-to-end CPU throughput of the detectors of __modelall__ with random weights on synthetic batches
+#(no checkpoint, dataset or GPU needed, the compiled CUDA ops are optional but spconv has to be installed since
+#mydetector3d.models imports it), run from the directory the _BASE_CONFIG_ paths of the model configs refer to
+#python mydetector3d/tools/benchmark.py --cfg_files mydetector3d/tools/cfgs/kitti_models/pointpillar.yaml --batch_sizes 1 4
+#python mydetector3d/tools/benchmark.py --cfg_files cfg_a.yaml cfg_b.yaml --num_points 20000 60000 --save_json bench.json
+import argparse
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from pathlib import Path
+os.environ['CUDA_VISIBLE_DEVICES'] = '' #cpu only, also on machines with a gpu
+
+import numpy as np
+import torch
+from easydict import EasyDict
+
+from mydetector3d.config import cfg_from_yaml_file
+from mydetector3d.utils.profile_utils import ModuleProfiler
+from mydetector3d.tools.benchmark_data_pipeline import (DATASET_PROFILES, DEFAULT_PROFILE, SyntheticDataset,
+                                                        get_machine_info, prepare_benchmark_cfg)
+from mydetector3d.models.detectors.pointpillar import PointPillar
+from mydetector3d.models.detectors.second_net import SECONDNet
+from mydetector3d.models.detectors.voxelnext import VoxelNeXt
+from mydetector3d.models.detectors.my3dmodel import My3Dmodel
+from mydetector3d.models.detectors.my3dmodelv2 import My3Dmodelv2
+from mydetector3d.models.detectors.my3dmodelv2_compressor import My3Dmodelv2_compressor
+from mydetector3d.models.detectors.bevfusion import BevFusion
+from mydetector3d.models.detectors.centerpoint import CenterPoint
+from mydetector3d.models.detectors.centerpoint_second import SECONDCenterpoint
+
+__modelall__ = {
+     'SECONDNet': SECONDNet,
+     'SECONDCenterpoint': SECONDCenterpoint,
+     'PointPillar': PointPillar,
+     'CenterPoint': CenterPoint,
+     'My3Dmodel': My3Dmodel,
+     'My3Dmodelv2': My3Dmodelv2,
+     'My3Dmodelv2_compressor': My3Dmodelv2_compressor,
+     'VoxelNeXt': VoxelNeXt,
+     'BevFusion': BevFusion
+}
+
+NUM_CAMERAS = 6 #fixed by the DepthLSSTransform of BevFusion
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='arg parser')
+    parser.add_argument('--cfg_files', type=str, nargs='+', required=True, help='model configs (MODEL.NAME in __modelall__)')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 4], help='batch sizes to benchmark')
+    parser.add_argument('--num_points', type=int, nargs='+', default=None,
+                        help='points per frame (point density), default from DATASET_PROFILES of DATA_CONFIG.DATASET')
+    parser.add_argument('--num_gt', type=int, default=None, help='gt boxes per frame (used by --train)')
+    parser.add_argument('--warmup', type=int, default=3, help='untimed iterations before the steady state')
+    parser.add_argument('--iterations', type=int, default=10, help='timed steady state iterations')
+    parser.add_argument('--train', action='store_true', default=False, help='forward + backward of the training loss')
+    parser.add_argument('--threads', type=int, default=None, help='torch cpu threads')
+    parser.add_argument('--profile_modules', action='store_true', default=False, help='per-module latency of the steady state')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the weights and the synthetic data')
+    parser.add_argument('--save_json', type=str, default=None, help='write the results to this json file')
+    args = parser.parse_args()
+    return args
+
+
+class PeakRssSampler(object):
+    """peak resident memory of the process while running, sampled from /proc/self/statm by a background thread"""
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+    def get_rss(self):
+        try:
+            with open('/proc/self/statm', 'r') as f:
+                return int(f.read().split()[1]) * self.page_size
+        except (OSError, IndexError, ValueError): #not linux, the max rss of the process so far
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.peak = max(self.peak, self.get_rss())
+
+    def __enter__(self):
+        self.peak = self.get_rss()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop_event.set()
+        self.thread.join()
+        self.peak = max(self.peak, self.get_rss())
+
+
+def get_camera_inputs(batch_size, image_cfg, rng):
+    """
+    Synthetic inputs of the BevFusion image branch: normalized images of FINAL_DIM and the matrices of
+    NUM_CAMERAS cameras looking around the ego vehicle
+    """
+    height, width = image_cfg.FINAL_DIM
+    resize = float(np.mean(image_cfg.RESIZE_LIM_TEST))
+    intrinsics = np.eye(4, dtype=np.float32)
+    intrinsics[0, 0] = intrinsics[1, 1] = 1260 * resize
+    intrinsics[0, 2], intrinsics[1, 2] = width / 2, height / 2
+    camera2lidar = np.tile(np.eye(4, dtype=np.float32), (NUM_CAMERAS, 1, 1))
+    for k in range(NUM_CAMERAS):
+        yaw = 2 * np.pi * k / NUM_CAMERAS
+        #camera z (forward) along the yaw direction, camera x right, camera y down
+        forward = np.array([np.cos(yaw), np.sin(yaw), 0])
+        right = np.array([np.sin(yaw), -np.cos(yaw), 0])
+        camera2lidar[k, :3, :3] = np.stack([right, [0, 0, -1], forward], axis=1)
+        camera2lidar[k, :3, 3] = [0, 0, 1.6]
+    lidar2image = intrinsics @ np.linalg.inv(camera2lidar)
+
+    def repeat(matrix):
+        return torch.from_numpy(np.ascontiguousarray(np.broadcast_to(matrix, (batch_size,) + matrix.shape)))
+
+    return {
+        'camera_imgs': torch.from_numpy(rng.standard_normal((batch_size, NUM_CAMERAS, 3, height, width), dtype=np.float32)),
+        'camera_intrinsics': repeat(np.tile(intrinsics, (NUM_CAMERAS, 1, 1))),
+        'camera2lidar': repeat(camera2lidar),
+        'img_aug_matrix': repeat(np.tile(np.eye(4, dtype=np.float32), (NUM_CAMERAS, 1, 1))),
+        'lidar_aug_matrix': repeat(np.eye(4, dtype=np.float32)),
+        'lidar2image': repeat(lidar2image.astype(np.float32)),
+    }
+
+
+def batch_to_tensors(batch_dict):
+    #the conversions of load_data_to_gpu, on the cpu
+    for key, val in batch_dict.items():
+        if not isinstance(val, np.ndarray) or key in ['frame_id', 'metadata', 'calib', 'image_paths', 'ori_shape', 'img_process_infos']:
+            continue
+        elif key in ['image_shape']:
+            batch_dict[key] = torch.from_numpy(val).int()
+        else:
+            batch_dict[key] = torch.from_numpy(val).float()
+    return batch_dict
+
+
+def copy_batch(batch_dict):
+    #the detectors add keys to the batch_dict and some modify its tensors in place
+    return {key: val.clone() if isinstance(val, torch.Tensor) else val for key, val in batch_dict.items()}
+
+
+def build_synthetic_batch(dataset, cfg, batch_size, seed):
+    batch_dict = dataset.collate_batch([dataset[k] for k in range(batch_size)])
+    batch_dict = batch_to_tensors(batch_dict)
+    camera_cfg = cfg.DATA_CONFIG.get('CAMERA_CONFIG', None)
+    if camera_cfg is not None and camera_cfg.get('USE_CAMERA', False):
+        batch_dict.update(get_camera_inputs(batch_size, camera_cfg.IMAGE, np.random.default_rng(seed)))
+    return batch_dict
+
+
+def run_model(model, batch_dict, train):
+    if train:
+        ret_dict, tb_dict, disp_dict = model(batch_dict)
+        ret_dict['loss'].mean().backward()
+        model.zero_grad(set_to_none=True)
+    else:
+        with torch.no_grad():
+            model(batch_dict)
+
+
+def benchmark_setting(model, batch_dict, args, profiler=None):
+    """
+    Returns:
+        result: warm up iteration times, first iteration time, steady state latency (median / p90 / mean ms), frames/s and peak rss
+    """
+    warmup_times, times = [], []
+    with PeakRssSampler() as rss_sampler:
+        for i in range(args.warmup + args.iterations):
+            cur_batch = copy_batch(batch_dict)
+            if profiler is not None:
+                profiler.start_batch(enabled=i >= args.warmup)
+            start = time.perf_counter()
+            run_model(model, cur_batch, args.train)
+            elapsed = (time.perf_counter() - start) * 1000
+            if profiler is not None:
+                profiler.end_batch(cur_batch)
+            (warmup_times if i < args.warmup else times).append(elapsed)
+
+    batch_size = batch_dict['batch_size']
+    first_ms = (warmup_times + list(times))[0]  #--warmup 0: the first timed iteration
+    times = np.array(times)
+    return {
+        'batch_size': batch_size, 'num_points': int(batch_dict['points'].shape[0]) if 'points' in batch_dict else 0,
+        'num_voxels': int(batch_dict['voxels'].shape[0]) if 'voxels' in batch_dict else 0,
+        'warmup_ms': warmup_times, 'first_ms': first_ms, 'median_ms': float(np.median(times)), 'p90_ms': float(np.percentile(times, 90)),
+        'mean_ms': float(times.mean()), 'fps': batch_size * 1000 / float(np.median(times)),
+        'peak_rss_mb': rss_sampler.peak / 1024 ** 2,
+    }
+
+
+def benchmark_cfg(cfg_file, args):
+    cfg = cfg_from_yaml_file(cfg_file, EasyDict())
+    model_name = cfg.MODEL.NAME
+    assert model_name in __modelall__, '%s is not in __modelall__' % model_name
+    dataset_cfg, dropped = prepare_benchmark_cfg(cfg.DATA_CONFIG, EasyDict(no_gt_sampling=True))
+    dataset_cfg.DATA_AUGMENTOR.DISABLE_AUG_LIST = [x.NAME for x in dataset_cfg.DATA_AUGMENTOR.AUG_CONFIG_LIST]
+    profile = DATASET_PROFILES.get(dataset_cfg.DATASET, DEFAULT_PROFILE)
+    num_points_list = args.num_points if args.num_points is not None else [profile['num_points']]
+    num_gt = args.num_gt if args.num_gt is not None else profile['num_gt']
+
+    torch.manual_seed(args.seed)
+    #the dataset only provides the voxelization and the point features, the frames are generated below
+    dataset = SyntheticDataset(dataset_cfg, list(cfg.CLASS_NAMES), root_path=Path('.'), num_points=num_points_list[0],
+                               num_gt=num_gt, num_frames=max(args.batch_sizes), training=args.train, seed=args.seed)
+    start = time.perf_counter()
+    model = __modelall__[model_name](model_cfg=cfg.MODEL, num_class=len(cfg.CLASS_NAMES), dataset=dataset)
+    if args.train:
+        model.train()
+    else:
+        model.eval()
+    build_ms = (time.perf_counter() - start) * 1000
+    num_params = sum([p.numel() for p in model.parameters()])
+    print('\n%s (%s, %.2fM parameters, built in %.0f ms, %s)' % (
+        Path(cfg_file).stem, model_name, num_params / 1e6, build_ms, 'train' if args.train else 'inference'))
+    print('%8s %6s %10s %10s %12s %10s %10s %10s %12s' % (
+        'pts/frm', 'batch', 'points', 'voxels', 'first(ms)', 'p50(ms)', 'p90(ms)', 'frames/s', 'peak rss MB'))
+
+    settings = []
+    module_results = [] #printed after the table, so the rows stay together
+    for num_points in num_points_list:
+        dataset = SyntheticDataset(dataset_cfg, list(cfg.CLASS_NAMES), root_path=Path('.'), num_points=num_points,
+                                   num_gt=num_gt, num_frames=max(args.batch_sizes), training=args.train, seed=args.seed)
+        for batch_size in args.batch_sizes:
+            np.random.seed(args.seed)
+            batch_dict = build_synthetic_batch(dataset, cfg, batch_size, args.seed)
+            profiler = ModuleProfiler(model, device='cpu').attach() if args.profile_modules else None
+            result = benchmark_setting(model, batch_dict, args, profiler)
+            result['points_per_frame'] = num_points
+            if profiler is not None:
+                profiler.detach()
+                result['modules'] = profiler.summary()['stages']
+                module_results.append(('%d pts/frm, batch %d' % (num_points, batch_size), profiler.get_result_str()))
+            settings.append(result)
+            print('%8d %6d %10d %10d %12.1f %10.1f %10.1f %10.1f %12.1f' % (
+                num_points, batch_size, result['num_points'], result['num_voxels'], result['first_ms'],
+                result['median_ms'], result['p90_ms'], result['fps'], result['peak_rss_mb']))
+
+    for setting_str, result_str in module_results:
+        print('\n%s' % setting_str)
+        print(result_str)
+
+    return {
+        'model': model_name, 'dataset': dataset_cfg.DATASET, 'num_params': num_params, 'build_ms': build_ms,
+        'train': args.train, 'dropped': dropped, 'settings': settings,
+    }
+
+
+def main():
+    args = parse_config()
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    results = {}
+    for cfg_file in args.cfg_files:
+        results[Path(cfg_file).stem] = benchmark_cfg(cfg_file, args)
+
+    if args.save_json is not None:
+        with open(args.save_json, 'w') as f:
+            json.dump({'machine': get_machine_info(), 'args': vars(args), 'results': results}, f, indent=2)
+        print('\nResults saved to %s' % args.save_json)
+
+
+if __name__ == '__main__':
+    main()
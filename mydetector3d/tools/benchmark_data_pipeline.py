@@ -0,0 +1,492 @@
+#CPU benchmark of the data pipeline stages (augmentors incl. gt_sampling, point feature encoder, data processors,
+#prepare_data, collate_batch and the DataLoader workers) on synthetic KITTI / Waymo / nuScenes sized point clouds
+#python mydetector3d/tools/benchmark_data_pipeline.py --save_baseline data_pipeline_baseline.json
+#python mydetector3d/tools/benchmark_data_pipeline.py --baseline data_pipeline_baseline.json --max_regression 0.2
+import argparse
+import copy
+import json
+import os
+import pickle
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import torch
+from easydict import EasyDict
+from torch.utils.data import DataLoader, get_worker_info
+
+from mydetector3d.config import cfg_from_yaml_file
+from mydetector3d.datasets.dataset import DatasetTemplate
+from mydetector3d.utils import numba_utils
+
+DATASET_CONFIG_DIR = Path(__file__).resolve().parent / 'cfgs' / 'dataset_configs'
+
+#points per frame as read by the dataset (KITTI after FOV_POINTS_ONLY, nuScenes with 10 sweeps) and gt boxes per frame
+DATASET_PROFILES = {
+    'KittiDataset': {'num_points': 20000, 'num_gt': 8},
+    'DairKittiDataset': {'num_points': 40000, 'num_gt': 20},
+    'WaymoKittiDataset': {'num_points': 60000, 'num_gt': 20},
+    'WaymoDataset': {'num_points': 180000, 'num_gt': 40},
+    'NuScenesDataset': {'num_points': 270000, 'num_gt': 30},
+}
+DEFAULT_PROFILE = {'num_points': 100000, 'num_gt': 20}
+
+#mean box sizes (dx, dy, dz) of the synthetic boxes, matched by the lower case class name
+CLASS_SIZES = {
+    'car': [4.2, 1.8, 1.6], 'vehicle': [4.6, 2.0, 1.7], 'truck': [6.5, 2.5, 2.8], 'bus': [11.0, 2.9, 3.5],
+    'trailer': [12.0, 2.9, 3.9], 'construction_vehicle': [6.4, 2.8, 3.2], 'pedestrian': [0.8, 0.6, 1.7],
+    'cyclist': [1.8, 0.6, 1.7], 'bicycle': [1.7, 0.6, 1.3], 'motorcycle': [2.1, 0.8, 1.5],
+    'barrier': [0.5, 2.5, 1.0], 'traffic_cone': [0.4, 0.4, 1.1],
+}
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='arg parser')
+    parser.add_argument('--cfg_files', type=str, nargs='+', default=[
+        str(DATASET_CONFIG_DIR / 'kitti_dataset.yaml'), str(DATASET_CONFIG_DIR / 'waymo_dataset.yaml'),
+        str(DATASET_CONFIG_DIR / 'nuscenes_dataset.yaml')], help='dataset configs, or model configs with DATA_CONFIG')
+    parser.add_argument('--num_points', type=int, default=None, help='points per frame, default from DATASET_PROFILES')
+    parser.add_argument('--num_gt', type=int, default=None, help='gt boxes per frame, default from DATASET_PROFILES')
+    parser.add_argument('--num_frames', type=int, default=20, help='timed frames for each stage')
+    parser.add_argument('--alloc_frames', type=int, default=4, help='frames traced with tracemalloc (at least one batch)')
+    parser.add_argument('--batch_size', type=int, default=4, help='batch size of collate_batch and the DataLoader')
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2], help='DataLoader worker counts')
+    parser.add_argument('--worker_frames', type=int, default=32, help='frames loaded for each worker count')
+    parser.add_argument('--db_objects', type=int, default=200, help='objects of each class in the synthetic gt database')
+    parser.add_argument('--no_gt_sampling', action='store_true', default=False, help='disable gt_sampling')
+    parser.add_argument('--test_mode', action='store_true', default=False, help='benchmark the test pipeline (no augmentation)')
+    parser.add_argument('--threads', type=int, default=None, help='torch cpu threads')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the synthetic data and the augmentations')
+    parser.add_argument('--save_baseline', type=str, default=None, help='write the results to this json file')
+    parser.add_argument('--baseline', type=str, default=None, help='compare with this baseline json file')
+    parser.add_argument('--max_regression', type=float, default=0.2,
+                        help='allowed relative frames/s drop or allocation growth against the baseline')
+    args = parser.parse_args()
+    return args
+
+
+def load_dataset_cfg(cfg_file):
+    """
+    Returns:
+        dataset_cfg: DATA_CONFIG of a model config, or the dataset config itself
+        class_names: CLASS_NAMES of a model config, else the classes of the gt_sampling SAMPLE_GROUPS
+    """
+    cfg = cfg_from_yaml_file(cfg_file, EasyDict())
+    if 'DATA_CONFIG' in cfg:
+        return cfg.DATA_CONFIG, list(cfg.CLASS_NAMES)
+    class_names = []
+    for aug_cfg in cfg.get('DATA_AUGMENTOR', {}).get('AUG_CONFIG_LIST', []):
+        if aug_cfg.NAME == 'gt_sampling':
+            class_names = [x.split(':')[0] for x in aug_cfg.SAMPLE_GROUPS]
+    return cfg, class_names if len(class_names) > 0 else ['Car', 'Pedestrian', 'Cyclist']
+
+
+def prepare_benchmark_cfg(dataset_cfg, args):
+    """
+    Drops the stages that need files of a real dataset (image processors and augmentors, road planes) and
+    disables gt_sampling with --no_gt_sampling, returns the names of the dropped stages
+    """
+    dataset_cfg = copy.deepcopy(dataset_cfg)
+    dataset_cfg.LIDAR_BACKEND = 'file'
+    dataset_cfg.COLLATE_PIN_MEMORY = False
+    dropped = []
+    processor_cfgs = []
+    for cur_cfg in dataset_cfg.DATA_PROCESSOR:
+        if cur_cfg.NAME.startswith('image_') or cur_cfg.NAME == 'downsample_depth_map':
+            dropped.append(cur_cfg.NAME)
+        else:
+            processor_cfgs.append(cur_cfg)
+    dataset_cfg.DATA_PROCESSOR = processor_cfgs
+
+    augmentor_cfg = dataset_cfg.DATA_AUGMENTOR
+    disable_list = list(augmentor_cfg.get('DISABLE_AUG_LIST', []))
+    for cur_cfg in augmentor_cfg.AUG_CONFIG_LIST:
+        if cur_cfg.NAME in disable_list:
+            continue
+        if cur_cfg.NAME in ['imgaug', 'random_image_flip'] or (cur_cfg.NAME == 'gt_sampling' and args.no_gt_sampling):
+            disable_list.append(cur_cfg.NAME)
+            dropped.append(cur_cfg.NAME)
+        elif cur_cfg.NAME == 'gt_sampling':
+            if cur_cfg.get('USE_ROAD_PLANE', False):
+                cur_cfg.USE_ROAD_PLANE = False #no calib and road plane files
+                dropped.append('gt_sampling.USE_ROAD_PLANE')
+            cur_cfg.USE_SHARED_MEMORY = False
+            cur_cfg.pop('IMG_AUG_TYPE', None)
+    augmentor_cfg.DISABLE_AUG_LIST = disable_list
+    return dataset_cfg, dropped
+
+
+def get_class_size(class_name):
+    return np.array(CLASS_SIZES.get(class_name.lower(), [1.0, 1.0, 1.0]), dtype=np.float32)
+
+
+def get_box_dim(dataset_cfg):
+    return 9 if dataset_cfg.get('PRED_VELOCITY', False) or dataset_cfg.get('TRAIN_WITH_SPEED', False) else 7
+
+
+def generate_boxes(rng, class_names, num_boxes, point_cloud_range, box_dim):
+    """non-overlapping boxes on a grid inside the point cloud range, (N, box_dim) and (N) names"""
+    pc_range = np.array(point_cloud_range, dtype=np.float32)
+    cells_x = np.arange(pc_range[0] + 7, pc_range[3] - 7, 13.0)
+    cells_y = np.arange(pc_range[1] + 7, pc_range[4] - 7, 13.0)
+    cells = rng.permutation(len(cells_x) * len(cells_y))[:num_boxes]
+    names = np.array([class_names[i % len(class_names)] for i in range(len(cells))])
+    boxes = np.zeros((len(cells), box_dim), dtype=np.float32)
+    boxes[:, 0] = cells_x[cells // len(cells_y)] + rng.uniform(-1, 1, len(cells))
+    boxes[:, 1] = cells_y[cells % len(cells_y)] + rng.uniform(-1, 1, len(cells))
+    sizes = np.stack([get_class_size(name) for name in names], axis=0) if len(names) > 0 else np.zeros((0, 3))
+    boxes[:, 3:6] = sizes * rng.uniform(0.9, 1.1, (len(cells), 1))
+    boxes[:, 2] = pc_range[2] + 1.0 + boxes[:, 5] / 2
+    boxes[:, 6] = rng.uniform(-np.pi, np.pi, len(cells))
+    if box_dim > 7:
+        boxes[:, 7:9] = rng.normal(0, 2, (len(cells), 2))
+    return boxes, names
+
+
+def generate_points(rng, num_points, point_cloud_range, src_feature_list):
+    """uniform points in 1.1x the point cloud range (some are masked out by the processors)"""
+    pc_range = np.array(point_cloud_range, dtype=np.float32)
+    center, half = (pc_range[:3] + pc_range[3:]) / 2, (pc_range[3:] - pc_range[:3]) / 2 * 1.1
+    points = np.zeros((num_points, len(src_feature_list)), dtype=np.float32)
+    points[:, :3] = rng.uniform(center - half, center + half, (num_points, 3))
+    for k, feature in enumerate(src_feature_list[3:], start=3):
+        if feature == 'timestamp':
+            points[:, k] = rng.integers(0, 10, num_points) * 0.05 #sweeps 50 ms apart
+        else:
+            points[:, k] = rng.uniform(0, 1, num_points)
+    return points
+
+
+def create_gt_database(root_path, dataset_cfg, class_names, num_objects, seed):
+    """synthetic dbinfos pkl and gt_database/*.bin files for each DB_INFO_PATH of gt_sampling"""
+    sampler_cfg = None
+    for cur_cfg in dataset_cfg.DATA_AUGMENTOR.AUG_CONFIG_LIST:
+        if cur_cfg.NAME == 'gt_sampling' and cur_cfg.NAME not in dataset_cfg.DATA_AUGMENTOR.DISABLE_AUG_LIST:
+            sampler_cfg = cur_cfg
+    if sampler_cfg is None:
+        return
+    rng = np.random.default_rng(seed)
+    box_dim = get_box_dim(dataset_cfg)
+    num_features = sampler_cfg.NUM_POINT_FEATURES
+    database_dir = root_path / 'gt_database'
+    database_dir.mkdir(parents=True, exist_ok=True)
+    for db_info_path in sampler_cfg.DB_INFO_PATH:
+        db_infos = {}
+        for class_name in class_names:
+            db_infos[class_name] = []
+            for k in range(num_objects):
+                box, _ = generate_boxes(rng, [class_name], 1, dataset_cfg.POINT_CLOUD_RANGE, box_dim)
+                num_points = int(rng.integers(10, 400))
+                obj_points = np.zeros((num_points, num_features), dtype=np.float32)
+                obj_points[:, :3] = rng.uniform(-0.5, 0.5, (num_points, 3)) * box[0, 3:6] #relative to the box center
+                obj_points[:, 3:] = rng.uniform(0, 1, (num_points, num_features - 3))
+                path = 'gt_database/%s_%s_%d.bin' % (Path(db_info_path).stem, class_name, k)
+                obj_points.tofile(str(root_path / path))
+                db_infos[class_name].append({
+                    'name': class_name, 'path': path, 'image_idx': k, 'gt_idx': 0, 'box3d_lidar': box[0],
+                    'num_points_in_gt': num_points, 'difficulty': 0
+                })
+        with open(root_path / db_info_path, 'wb') as f:
+            pickle.dump(db_infos, f)
+
+
+class SyntheticDataset(DatasetTemplate):
+    """
+    Training (or test) dataset returning copies of a few synthetic frames through prepare_data, the frames are
+    generated once so that the loading cost is a memory copy
+    """
+    def __init__(self, dataset_cfg, class_names, root_path, num_points, num_gt, num_frames, training=True,
+                 num_unique_frames=4, seed=0):
+        super().__init__(dataset_cfg=dataset_cfg, class_names=class_names, training=training, root_path=root_path)
+        self.num_frames = num_frames
+        rng = np.random.default_rng(seed)
+        box_dim = get_box_dim(dataset_cfg)
+        self.frames = []
+        for k in range(num_unique_frames):
+            gt_boxes, gt_names = generate_boxes(rng, class_names, num_gt, dataset_cfg.POINT_CLOUD_RANGE, box_dim)
+            self.frames.append({
+                'frame_id': '%06d' % k,
+                'points': generate_points(rng, num_points, dataset_cfg.POINT_CLOUD_RANGE,
+                                          dataset_cfg.POINT_FEATURE_ENCODING.src_feature_list),
+                'gt_boxes': gt_boxes,
+                'gt_names': gt_names,
+            })
+
+    def __len__(self):
+        return self.num_frames
+
+    def get_frame(self, index):
+        return copy.deepcopy(self.frames[index % len(self.frames)])
+
+    def __getitem__(self, index):
+        data_dict = self.prepare_data(data_dict=self.get_frame(index))
+        if get_worker_info() is not None:
+            data_dict['worker_max_rss_mb'] = get_max_rss_mb()
+        return data_dict
+
+
+def get_max_rss_mb():
+    import resource
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 1024 ** 2 if sys.platform == 'darwin' else max_rss / 1024 #bytes on macOS, KB on linux
+
+
+def get_stage_name(func):
+    func = getattr(func, 'func', func) #partial of the augmentor / processor methods
+    return getattr(func, '__name__', func.__class__.__name__)
+
+
+class StageRecorder(object):
+    """
+    Wraps the stages of a dataset (augmentor queue, point feature encoder, processor queue, prepare_data and
+    collate_batch) with timers, or with tracemalloc peaks of the memory allocated in each stage (nested stages
+    fold their peaks into the enclosing ones)
+    """
+    def __init__(self):
+        self.times = {}  # stage -> list of ms
+        self.allocs = {}  # stage -> list of peak allocated bytes
+        self.stage_names = []
+        self.trace_alloc = False
+        self.stack = []
+
+    def wrap(self, name, func):
+        if name not in self.stage_names:
+            self.stage_names.append(name)
+
+        def wrapper(*args, **kwargs):
+            if self.trace_alloc:
+                self.fold_peak()
+                tracemalloc.reset_peak()
+                self.stack.append([tracemalloc.get_traced_memory()[0], 0])
+            start = time.perf_counter()
+            ret = func(*args, **kwargs)
+            elapsed = (time.perf_counter() - start) * 1000
+            if self.trace_alloc:
+                self.fold_peak()
+                start_mem, peak = self.stack.pop()
+                self.allocs.setdefault(name, []).append(max(peak - start_mem, 0))
+            else:
+                self.times.setdefault(name, []).append(elapsed)
+            return ret
+        return wrapper
+
+    def fold_peak(self):
+        peak = tracemalloc.get_traced_memory()[1]
+        for entry in self.stack:
+            entry[1] = max(entry[1], peak)
+
+    def attach(self, dataset):
+        if dataset.data_augmentor is not None:
+            queue = dataset.data_augmentor.data_augmentor_queue
+            queue[:] = [self.wrap('aug.' + self.get_aug_name(func), func) for func in queue]
+            dataset.data_augmentor.forward = self.wrap('data_augmentor', dataset.data_augmentor.forward)
+        encoder = dataset.point_feature_encoder
+        encoder.forward = self.wrap('point_feature_encoder', encoder.forward)
+        queue = dataset.data_processor.data_processor_queue
+        queue[:] = [self.wrap('proc.' + get_stage_name(func), func) for func in queue]
+        dataset.prepare_data = self.wrap('prepare_data', dataset.prepare_data)
+        dataset.collate_batch = self.wrap('collate_batch', dataset.collate_batch)
+
+    @staticmethod
+    def get_aug_name(func):
+        name = get_stage_name(func)
+        return 'gt_sampling' if name == 'DataBaseSampler' else name
+
+
+def run_stages(dataset, recorder, num_frames, batch_size, trace_alloc=False):
+    recorder.trace_alloc = trace_alloc
+    if trace_alloc:
+        tracemalloc.start()
+    samples = []
+    for index in range(num_frames):
+        samples.append(dataset[index])
+        if len(samples) == batch_size:
+            dataset.collate_batch(samples)
+            samples = []
+    if trace_alloc:
+        tracemalloc.stop()
+    recorder.trace_alloc = False
+
+
+def worker_init(worker_id, seed=0):
+    np.random.seed(seed + worker_id)
+
+
+def run_workers(dataset, num_workers, batch_size, seed):
+    """
+    Returns:
+        result: frames/s after the first batch, time to the first batch (worker start up) and the max rss of the
+            workers (of the main process without workers)
+    """
+    dataloader = DataLoader(
+        dataset, batch_size=batch_size, pin_memory=True, num_workers=num_workers, shuffle=False,
+        collate_fn=dataset.collate_batch, drop_last=False, worker_init_fn=partial(worker_init, seed=seed)
+    )
+    start = time.perf_counter()
+    first_batch_time, num_frames, max_rss = None, 0, 0.0
+    for batch_dict in dataloader:
+        if first_batch_time is None:
+            first_batch_time = time.perf_counter()
+        else:
+            num_frames += batch_dict['batch_size']
+        if 'worker_max_rss_mb' in batch_dict:
+            max_rss = max(max_rss, float(np.max(batch_dict['worker_max_rss_mb'])))
+    end = time.perf_counter()
+    return {
+        'fps': num_frames / max(end - first_batch_time, 1e-9),
+        'startup_ms': (first_batch_time - start) * 1000,
+        'max_rss_mb': max_rss if num_workers > 0 else get_max_rss_mb(),
+    }
+
+
+def setup_cfg(cfg_file, args, root_path):
+    """synthetic gt database of the config, returns the arguments of SyntheticDataset and the result header"""
+    dataset_cfg, class_names = load_dataset_cfg(cfg_file)
+    dataset_cfg, dropped = prepare_benchmark_cfg(dataset_cfg, args)
+    profile = DATASET_PROFILES.get(dataset_cfg.DATASET, DEFAULT_PROFILE)
+    num_points = args.num_points if args.num_points is not None else profile['num_points']
+    num_gt = args.num_gt if args.num_gt is not None else profile['num_gt']
+    training = not args.test_mode
+    if training:
+        create_gt_database(root_path, dataset_cfg, class_names, args.db_objects, args.seed)
+
+    dataset_args = {
+        'dataset_cfg': dataset_cfg, 'class_names': class_names, 'root_path': root_path, 'num_points': num_points,
+        'num_gt': num_gt, 'num_frames': args.worker_frames, 'training': training, 'seed': args.seed
+    }
+    result = {
+        'dataset': dataset_cfg.DATASET, 'num_points': num_points, 'num_gt': num_gt, 'training': training,
+        'class_names': class_names, 'dropped': dropped, 'stages': {}, 'workers': {},
+    }
+    return dataset_args, result
+
+
+def benchmark_workers(dataset_args, worker_counts, args):
+    workers = {}
+    dataset = SyntheticDataset(**dataset_args)
+    for num_workers in worker_counts:
+        np.random.seed(args.seed)
+        workers[str(num_workers)] = run_workers(dataset, num_workers, args.batch_size, args.seed)
+    return workers
+
+
+def benchmark_stages(dataset_args, args):
+    np.random.seed(args.seed)
+    dataset = SyntheticDataset(**dataset_args)
+    recorder = StageRecorder()
+    recorder.attach(dataset)
+    run_stages(dataset, recorder, min(2, args.num_frames), args.batch_size) #warm up (numba compilation)
+    recorder.times = {}
+    run_stages(dataset, recorder, args.num_frames, args.batch_size)
+    run_stages(dataset, recorder, max(args.alloc_frames, args.batch_size), args.batch_size, trace_alloc=True)
+
+    stages = {}
+    for name in recorder.stage_names:
+        if len(recorder.times.get(name, [])) == 0:
+            continue
+        times = np.array(recorder.times[name])
+        frames_per_call = args.batch_size if name == 'collate_batch' else 1
+        stages[name] = {
+            'ms': float(np.median(times)), 'p90_ms': float(np.percentile(times, 90)),
+            'fps': frames_per_call * 1000 / max(float(np.median(times)), 1e-6),
+            'alloc_mb': float(np.median(recorder.allocs[name])) / 1024 ** 2 if name in recorder.allocs else 0.0,
+        }
+    return stages
+
+
+def print_result(name, result):
+    print('\n%s (%s, %d points, %d boxes, %s)' % (
+        name, result['dataset'], result['num_points'], result['num_gt'], 'train' if result['training'] else 'test'))
+    if len(result['dropped']) > 0:
+        print('not benchmarked (need dataset files): %s' % ', '.join(result['dropped']))
+    print('%-40s %10s %10s %10s %12s' % ('stage', 'ms', 'p90 ms', 'frames/s', 'alloc MB'))
+    for stage, stats in result['stages'].items():
+        print('%-40s %10.2f %10.2f %10.1f %12.2f' % (stage, stats['ms'], stats['p90_ms'], stats['fps'], stats['alloc_mb']))
+    print('%-10s %12s %14s %16s' % ('workers', 'frames/s', 'startup ms', 'max rss MB'))
+    for num_workers, stats in result['workers'].items():
+        print('%-10s %12.1f %14.1f %16.1f' % (num_workers, stats['fps'], stats['startup_ms'], stats['max_rss_mb']))
+
+
+def get_machine_info():
+    return {
+        'platform': platform.platform(), 'processor': platform.processor(), 'cpu_count': os.cpu_count(),
+        'python': platform.python_version(), 'numpy': np.__version__, 'torch': torch.__version__,
+        'torch_threads': torch.get_num_threads(),
+    }
+
+
+def compare_with_baseline(results, baseline, max_regression):
+    """
+    Returns:
+        regressions: list of strings, frames/s below (1 - max_regression) x baseline or allocations above
+            (1 + max_regression) x baseline (+1 MB)
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline['results']:
+            continue
+        base_result = baseline['results'][name]
+        for stage, stats in result['stages'].items():
+            base_stats = base_result['stages'].get(stage, None)
+            if base_stats is None:
+                continue
+            if stats['fps'] < base_stats['fps'] * (1 - max_regression):
+                regressions.append('%s %s: %.1f frames/s, baseline %.1f' % (name, stage, stats['fps'], base_stats['fps']))
+            if stats['alloc_mb'] > base_stats['alloc_mb'] * (1 + max_regression) + 1:
+                regressions.append('%s %s: %.2f MB allocated, baseline %.2f' % (
+                    name, stage, stats['alloc_mb'], base_stats['alloc_mb']))
+        for num_workers, stats in result['workers'].items():
+            base_stats = base_result['workers'].get(num_workers, None)
+            if base_stats is not None and stats['fps'] < base_stats['fps'] * (1 - max_regression):
+                regressions.append('%s workers=%s: %.1f frames/s, baseline %.1f' % (
+                    name, num_workers, stats['fps'], base_stats['fps']))
+    return regressions
+
+
+def main():
+    args = parse_config()
+    #the DataLoader workers are forked after the in-process runs have started the numba parallel threads
+    numba_utils.set_fork_safe_threading_layer()
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    results = {}
+    root_path = Path(tempfile.mkdtemp(prefix='benchmark_data_pipeline_'))
+    try:
+        for cfg_file in args.cfg_files:
+            name = Path(cfg_file).stem
+            dataset_args, results[name] = setup_cfg(cfg_file, args, root_path / name)
+            results[name]['workers'] = benchmark_workers(dataset_args, args.workers, args)
+            results[name]['stages'] = benchmark_stages(dataset_args, args)
+            print_result(name, results[name])
+    finally:
+        shutil.rmtree(root_path, ignore_errors=True)
+
+    output = {'machine': get_machine_info(), 'args': vars(args), 'results': results}
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(output, f, indent=2)
+        print('\nBaseline saved to %s' % args.save_baseline)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if baseline['machine'] != output['machine']:
+            print('\nWarning: the baseline was recorded on a different machine / library versions:\n%s' % baseline['machine'])
+        regressions = compare_with_baseline(results, baseline, args.max_regression)
+        if len(regressions) > 0:
+            print('\n%d regressions (max_regression %.2f):' % (len(regressions), args.max_regression))
+            for regression in regressions:
+                print('  ' + regression)
+            sys.exit(1)
+        print('\nNo regressions against %s (max_regression %.2f)' % (args.baseline, args.max_regression))
+
+
+if __name__ == '__main__':
+    main()
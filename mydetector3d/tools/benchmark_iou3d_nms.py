@@ -0,0 +1,98 @@
+#CPU benchmark of the rotated IoU / NMS backends in iou3d_nms_utils: C++ kernel of iou3d_nms_cuda (if compiled),
+#Numba kernels of iou3d_nms_cpu and the pure PyTorch functions
+#python mydetector3d/tools/benchmark_iou3d_nms.py
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from mydetector3d.ops.iou3d_nms import iou3d_nms_cpu, iou3d_nms_utils
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='arg parser')
+    parser.add_argument('--num_sampled', type=int, nargs='+', default=[15, 40], help='sampled gt boxes per call (gt_sampling)')
+    parser.add_argument('--num_existed', type=int, nargs='+', default=[10, 60], help='boxes already in the scene')
+    parser.add_argument('--num_nms', type=int, nargs='+', default=[500, 4096], help='boxes before NMS')
+    parser.add_argument('--repeat', type=int, default=20, help='timed runs for each setting')
+    parser.add_argument('--threads', type=int, default=None, help='torch / numba cpu threads')
+    args = parser.parse_args()
+    return args
+
+
+def generate_boxes(num_boxes, area_size=70.0):
+    boxes = np.random.rand(num_boxes, 7).astype(np.float32)
+    boxes[:, 0:2] = boxes[:, 0:2] * area_size - area_size / 2
+    boxes[:, 2] = boxes[:, 2] * 2 - 1
+    boxes[:, 3:6] = boxes[:, 3:6] * np.array([4.0, 1.5, 1.0]) + np.array([0.5, 0.5, 1.0]) #pedestrian .. car sizes
+    boxes[:, 6] = (boxes[:, 6] - 0.5) * 2 * np.pi
+    return boxes
+
+
+def time_func(func, repeat):
+    result = func() #warm up, includes the numba compilation
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return np.median(times) * 1000, result
+
+
+def run_backends(backends, repeat):
+    results = {}
+    for name, func in backends.items():
+        if func is not None:
+            results[name] = time_func(func, repeat)
+    line = '  '.join(['%s %8.3fms' % (name, cur_time) for name, (cur_time, _) in results.items()])
+    return line, results
+
+
+def main():
+    args = parse_config()
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    np.random.seed(0)
+    has_cpp = iou3d_nms_utils.iou3d_nms_cuda is not None
+    print('C++ kernel: %s' % ('available' if has_cpp else 'not compiled, skipped'))
+
+    #gt_sampling: sampled vs existed boxes and sampled vs sampled boxes, as in DataBaseSampler.__call__
+    for num_sampled in args.num_sampled:
+        for num_existed in args.num_existed:
+            sampled = generate_boxes(num_sampled)
+            existed = generate_boxes(num_existed)
+            sampled_torch, existed_torch = torch.from_numpy(sampled), torch.from_numpy(existed)
+            backends = {
+                'cpp': (lambda: iou3d_nms_utils.iou3d_nms_cuda.boxes_iou_bev_cpu(
+                    sampled_torch, existed_torch, sampled_torch.new_zeros((num_sampled, num_existed)))) if has_cpp else None,
+                'numba': lambda: iou3d_nms_cpu.boxes_iou_bev(sampled, existed),
+                'torch': lambda: iou3d_nms_utils.boxes_iou_bev_torch(sampled_torch, existed_torch),
+            }
+            line, results = run_backends(backends, args.repeat)
+            max_diff = np.abs(results['numba'][1] - results['torch'][1].numpy()).max()
+            print('bev iou %4d x %4d: %s  (numba/torch max diff %.2e)' % (num_sampled, num_existed, line, max_diff))
+
+    for num_boxes in args.num_nms:
+        boxes = torch.from_numpy(generate_boxes(num_boxes))
+        scores = torch.rand(num_boxes)
+        backends = {
+            'numba': lambda: iou3d_nms_utils.nms_fallback(boxes, scores, 0.1),
+            'torch': lambda: iou3d_nms_utils.nms_torch(boxes, scores, 0.1),
+        }
+        line, results = run_backends(backends, args.repeat)
+        #the kept sets, the order of tied scores is not part of the NMS result
+        assert set(results['numba'][1][0].tolist()) == set(results['torch'][1][0].tolist())
+        print('nms %5d boxes: %s  (%d kept)' % (num_boxes, line, results['numba'][1][0].shape[0]))
+
+        boxes_b = torch.from_numpy(generate_boxes(num_boxes))
+        backends = {
+            'numba': lambda: iou3d_nms_cpu.boxes_iou3d(boxes.numpy(), boxes_b.numpy()),
+            'torch': lambda: iou3d_nms_utils.boxes_iou3d_torch(boxes, boxes_b),
+        }
+        line, _ = run_backends(backends, args.repeat)
+        print('3d iou %5d x %5d: %s' % (num_boxes, num_boxes, line))
+
+
+if __name__ == '__main__':
+    main()
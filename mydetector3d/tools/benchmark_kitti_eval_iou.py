@@ -0,0 +1,110 @@
+#Benchmark of the rotated IoU in the KITTI evaluator (calculate_iou_partly), numba cpu backend vs numba.cuda (if a device is present),
+#for the bev and 3d metrics and several num_parts, on the KITTI val set or on synthetic annos of the same size (3769 frames)
+#python mydetector3d/tools/benchmark_kitti_eval_iou.py --info_path data/kitti/kitti_infos_val.pkl --result_path output/.../result.pkl
+import argparse
+import pickle
+import time
+
+import numba
+import numpy as np
+
+from mydetector3d.datasets.kitti.kitti_object_eval_python import eval as kitti_eval
+from mydetector3d.datasets.kitti.kitti_object_eval_python.rotate_iou_cpu import rotate_iou_cpu_eval
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='arg parser')
+    parser.add_argument('--info_path', type=str, default=None, help='kitti_infos_val.pkl, synthetic gt annos if not given')
+    parser.add_argument('--result_path', type=str, default=None, help='result.pkl of the evaluation, jittered gt boxes if not given')
+    parser.add_argument('--num_frames', type=int, default=3769, help='number of synthetic frames (KITTI val)')
+    parser.add_argument('--num_parts', type=int, nargs='+', default=[10, 25, 50, 100, 200], help='num_parts of calculate_iou_partly')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs for each setting')
+    parser.add_argument('--threads', type=int, default=None, help='numba cpu threads')
+    args = parser.parse_args()
+    return args
+
+
+def generate_annos(num_frames, max_objects=20):
+    annos = []
+    for _ in range(num_frames):
+        num_obj = np.random.randint(0, max_objects + 1)
+        dims = np.random.rand(num_obj, 3) * np.array([3.5, 1.0, 1.2]) + np.array([0.5, 1.0, 0.5]) #l, h, w in camera
+        loc = np.stack([np.random.rand(num_obj) * 40 - 20, np.random.rand(num_obj) * 0.5 + 1.5,
+                        np.random.rand(num_obj) * 65 + 5], axis=1)
+        annos.append({
+            'name': np.array(['Car'] * num_obj),
+            'location': loc,
+            'dimensions': dims,
+            'rotation_y': (np.random.rand(num_obj) - 0.5) * 2 * np.pi,
+        })
+    return annos
+
+
+def jitter_annos(gt_annos, num_false=10):
+    #detections: noisy copies of the gt boxes plus false positives
+    dt_annos = []
+    for anno in gt_annos:
+        num_obj = len(anno['name'])
+        false_anno = generate_annos(1, num_false)[0]
+        dt_annos.append({
+            'name': np.concatenate([anno['name'], false_anno['name']]),
+            'location': np.concatenate([anno['location'] + np.random.randn(num_obj, 3) * 0.3, false_anno['location']]),
+            'dimensions': np.concatenate([anno['dimensions'] * (1 + np.random.randn(num_obj, 3) * 0.05), false_anno['dimensions']]),
+            'rotation_y': np.concatenate([anno['rotation_y'] + np.random.randn(num_obj) * 0.1, false_anno['rotation_y']]),
+        })
+    return dt_annos
+
+
+def time_iou(gt_annos, dt_annos, metric, num_parts, repeat):
+    kitti_eval.calculate_iou_partly(gt_annos[:num_parts], dt_annos[:num_parts], metric, num_parts) #warm up, numba compilation
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        overlaps = kitti_eval.calculate_iou_partly(gt_annos, dt_annos, metric, num_parts)[0]
+        times.append(time.perf_counter() - start)
+    return np.median(times), overlaps
+
+
+def main():
+    args = parse_config()
+    if args.threads is not None:
+        numba.set_num_threads(args.threads)
+    np.random.seed(0)
+
+    if args.info_path is not None:
+        with open(args.info_path, 'rb') as f:
+            gt_annos = [info['annos'] for info in pickle.load(f)]
+    else:
+        gt_annos = generate_annos(args.num_frames)
+    if args.result_path is not None:
+        with open(args.result_path, 'rb') as f:
+            dt_annos = pickle.load(f)
+    else:
+        dt_annos = jitter_annos(gt_annos)
+    print('%d frames, %d gt boxes, %d dt boxes, %d numba threads' % (
+        len(gt_annos), sum([len(a['name']) for a in gt_annos]), sum([len(a['name']) for a in dt_annos]),
+        numba.get_num_threads()))
+
+    backends = {'cpu': rotate_iou_cpu_eval}
+    if kitti_eval.rotate_iou_gpu_eval is not None and numba.cuda.is_available():
+        backends['gpu'] = kitti_eval.rotate_iou_gpu_eval
+    else:
+        print('numba.cuda: no device, gpu backend skipped')
+
+    default_eval = kitti_eval.rotate_iou_eval
+    for metric, metric_name in [(1, 'bev'), (2, '3d')]:
+        for num_parts in args.num_parts:
+            line, results = [], {}
+            for name, func in backends.items():
+                kitti_eval.rotate_iou_eval = lambda boxes, qboxes, criterion=-1: func(boxes, qboxes, criterion)
+                cur_time, results[name] = time_iou(gt_annos, dt_annos, metric, num_parts, args.repeat)
+                line.append('%s %8.1fms' % (name, cur_time * 1000))
+            kitti_eval.rotate_iou_eval = default_eval
+            if 'gpu' in results:
+                max_diff = max([np.abs(a - b).max() if a.size else 0 for a, b in zip(results['cpu'], results['gpu'])])
+                line.append('(cpu/gpu max diff %.2e)' % max_diff)
+            print('%s num_parts %4d: %s' % (metric_name, num_parts, '  '.join(line)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#CPU micro-benchmark of PointPillarScatter: per-sample loop vs. BATCHED_SCATTER
+#python mydetector3d/tools/benchmark_pillar_scatter.py --batch_sizes 1 2 4 8 16
+import argparse
+import time
+
+import numpy as np
+import torch
+from easydict import EasyDict
+
+from mydetector3d.models.backbones_2d.map_to_bev.pointpillar_scatter import PointPillarScatter
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='arg parser')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16], help='batch sizes to benchmark')
+    parser.add_argument('--grid_size', type=int, nargs=3, default=[432, 496, 1], help='nx ny nz of the pillar grid')
+    parser.add_argument('--num_bev_features', type=int, default=64, help='pillar feature channels')
+    parser.add_argument('--pillars_per_sample', type=int, default=12000, help='non-empty pillars in each sample')
+    parser.add_argument('--repeat', type=int, default=10, help='timed runs for each setting')
+    parser.add_argument('--threads', type=int, default=None, help='torch cpu threads')
+    args = parser.parse_args()
+    return args
+
+
+def generate_pillars(batch_size, grid_size, num_bev_features, pillars_per_sample):
+    nx, ny, nz = grid_size
+    coords = []
+    for batch_idx in range(batch_size):
+        cells = torch.randperm(nx * ny)[:pillars_per_sample] #unique pillar locations, as from the voxelizer
+        this_coords = torch.zeros((cells.shape[0], 4), dtype=torch.int32) #(batch_index,z,y,x)
+        this_coords[:, 0] = batch_idx
+        this_coords[:, 2] = cells // nx
+        this_coords[:, 3] = cells % nx
+        coords.append(this_coords)
+    coords = torch.cat(coords, dim=0)
+    pillar_features = torch.randn((coords.shape[0], num_bev_features), dtype=torch.float32)
+    return pillar_features, coords
+
+
+def time_scatter(module, pillar_features, coords, repeat):
+    with torch.no_grad():
+        module({'pillar_features': pillar_features, 'voxel_coords': coords}) #warm up
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            batch_dict = module({'pillar_features': pillar_features, 'voxel_coords': coords})
+            times.append(time.perf_counter() - start)
+    return np.array(times) * 1000, batch_dict['spatial_features']
+
+
+def main():
+    args = parse_config()
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+
+    loop_scatter = PointPillarScatter(EasyDict(NUM_BEV_FEATURES=args.num_bev_features, BATCHED_SCATTER=False), args.grid_size)
+    batched_scatter = PointPillarScatter(EasyDict(NUM_BEV_FEATURES=args.num_bev_features, BATCHED_SCATTER=True), args.grid_size)
+
+    print('%6s %10s %12s %12s %8s' % ('batch', 'pillars', 'loop(ms)', 'batched(ms)', 'speedup'))
+    for batch_size in args.batch_sizes:
+        pillar_features, coords = generate_pillars(batch_size, args.grid_size, args.num_bev_features, args.pillars_per_sample)
+        loop_times, loop_out = time_scatter(loop_scatter, pillar_features, coords, args.repeat)
+        batched_times, batched_out = time_scatter(batched_scatter, pillar_features, coords, args.repeat)
+        assert torch.equal(loop_out, batched_out), 'batched scatter output differs from the loop'
+        print('%6d %10d %12.2f %12.2f %7.2fx' % (batch_size, coords.shape[0], np.median(loop_times),
+                                                np.median(batched_times), np.median(loop_times) / np.median(batched_times)))
+
+
+if __name__ == '__main__':
+    main()
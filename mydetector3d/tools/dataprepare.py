@@ -1,12 +1,30 @@
+import argparse
 import yaml
 from pathlib import Path
 from easydict import EasyDict
-from mydetector3d.datasets.kitti.kitti_dataset import create_kitti_infos
+from mydetector3d.datasets.kitti.kitti_dataset import create_kitti_infos, create_kitti_infos_sharded
+from mydetector3d.utils import numba_utils
+
+parser = argparse.ArgumentParser(description='arg parser')
+parser.add_argument('--sharded', action='store_true', default=False,
+                    help='resumable chunks on a process pool, packed gt database (DB_BACKEND: packed)')
+parser.add_argument('--workers', type=int, default=4, help='processes of --sharded')
+args = parser.parse_args()
+numba_utils.set_fork_safe_threading_layer() #the infos / gt database are built on a process pool
 
 dataset_cfg = EasyDict(yaml.safe_load(open("mydetector3d/tools/cfgs/dataset_configs/kitti_dataset.yaml")))
-create_kitti_infos(
-        dataset_cfg=dataset_cfg,
-        class_names=['Car', 'Pedestrian', 'Cyclist'],
-        data_path=Path('/data/cmpe249-fa22/kitti'),
-        save_path=Path('/data/cmpe249-fa22/kitti')
-    )
\ No newline at end of file
+if args.sharded:
+    create_kitti_infos_sharded(
+            dataset_cfg=dataset_cfg,
+            class_names=['Car', 'Pedestrian', 'Cyclist'],
+            data_path=Path('/data/cmpe249-fa22/kitti'),
+            save_path=Path('/data/cmpe249-fa22/kitti'),
+            workers=args.workers
+        )
+else:
+    create_kitti_infos(
+            dataset_cfg=dataset_cfg,
+            class_names=['Car', 'Pedestrian', 'Cyclist'],
+            data_path=Path('/data/cmpe249-fa22/kitti'),
+            save_path=Path('/data/cmpe249-fa22/kitti')
+        )
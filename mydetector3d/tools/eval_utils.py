@@ -1,12 +1,15 @@
 import pickle
 import time
+from functools import partial
 
 import numpy as np
 import torch
 import tqdm
 
-from mydetector3d.models import load_data_to_gpu
+from mydetector3d.models import load_data_to_device
 from mydetector3d.utils import common_utils
+from mydetector3d.utils.prefetch_utils import DataPrefetcher
+from mydetector3d.utils.profile_utils import ModuleProfiler
 
 
 def statistics_info(cfg, ret_dict, metric, disp_dict):
@@ -19,6 +22,34 @@ def statistics_info(cfg, ret_dict, metric, disp_dict):
         '(%d, %d) / %d' % (metric['recall_roi_%s' % str(min_thresh)], metric['recall_rcnn_%s' % str(min_thresh)], metric['gt_num'])
 
 
+def get_stream_ap(result_dict):
+    #mean moderate 3d AP_R40 over the classes, used for the running results and the early stop
+    aps = [val for key, val in result_dict.items() if key.endswith('_3d/moderate_R40')]
+    return float(np.mean(aps)) if len(aps) > 0 else 0.0
+
+
+def drop_padded_samples(annos, num_prev_samples, num_samples, rank, world_size):
+    """
+    DistributedSampler pads the dataset with its first samples up to a multiple of world_size, the k-th sample of
+    a rank is at position rank + k * world_size of the padded list, positions >= num_samples are padding
+    Args:
+        annos: annos of the current batch of this rank
+        num_prev_samples: samples of this rank in the previous batches
+        num_samples: len(dataset)
+    """
+    return [anno for k, anno in enumerate(annos) if rank + (num_prev_samples + k) * world_size < num_samples]
+
+
+def merge_results(result_part, size, args, result_dir, packed=False):
+    #dist_merge: tmpdir (pickle files in result_dir), gather or gather_packed (chunked collective gather, packed annos)
+    dist_merge = getattr(args, 'dist_merge', 'tmpdir')
+    if dist_merge == 'tmpdir':
+        return common_utils.merge_results_dist(result_part, size, tmpdir=result_dir / 'tmpdir')
+    chunk_size = int(getattr(args, 'dist_merge_chunk_mb', 64) * 1024 * 1024)
+    return common_utils.merge_results_dist_gather(
+        result_part, size, chunk_size=chunk_size, packed=packed and dist_merge == 'gather_packed')
+
+
 def eval_one_epoch(cfg, args, model, dataloader, epoch_id, logger, dist_test=False, result_dir=None):
     result_dir.mkdir(parents=True, exist_ok=True)
 
@@ -36,12 +67,33 @@ def eval_one_epoch(cfg, args, model, dataloader, epoch_id, logger, dist_test=Fal
     dataset = dataloader.dataset
     class_names = dataset.class_names
     det_annos = []
+    total_pred_objects, num_det_frames = 0, 0
+
+    stream_evaluator = None
+    stream_eval_only = getattr(args, 'stream_eval_only', False)
+    if getattr(args, 'stream_eval', False) or stream_eval_only:
+        #running kitti metrics updated batch by batch, with stream_eval_only the det_annos are not kept
+        if hasattr(dataset, 'get_stream_evaluator'):
+            stream_evaluator = dataset.get_stream_evaluator(class_names)
+        if stream_evaluator is None:
+            logger.info('Streaming evaluation is not supported by %s' % type(dataset).__name__)
+            stream_eval_only = False
+    rank, world_size = common_utils.get_dist_info()
+    stream_eval_interval = getattr(args, 'stream_eval_interval', 100)
+    stream_eval_min_ap = getattr(args, 'stream_eval_min_ap', None)
+    aborted = False
 
     if getattr(args, 'infer_time', False):
         start_iter = int(len(dataloader) * 0.1)
         infer_time_meter = common_utils.AverageMeter()
 
     logger.info('*************** EPOCH %s EVALUATION *****************' % epoch_id)
+    profiler = None
+    if getattr(args, 'profile_modules', False):
+        #per-stage latency from forward hooks on model.module_list, the first batches are warm up
+        profiler = ModuleProfiler(model).attach()
+        profile_warmup = getattr(args, 'profile_warmup', 10)
+
     if dist_test:
         num_gpus = torch.cuda.device_count()
         local_rank = cfg.LOCAL_RANK % num_gpus
@@ -52,17 +104,26 @@ def eval_one_epoch(cfg, args, model, dataloader, epoch_id, logger, dist_test=Fal
         )
     model.eval()
 
+    device = next(model.parameters()).device
+    if getattr(args, 'prefetch', False):
+        #load_data_to_device of the next batch runs in the background, a no-op in the loop
+        dataloader = DataPrefetcher(dataloader, load_func=partial(load_data_to_device, device=device), device=device)
+
     if cfg.LOCAL_RANK == 0:
         progress_bar = tqdm.tqdm(total=len(dataloader), leave=True, desc='eval', dynamic_ncols=True)
     start_time = time.time()
     for i, batch_dict in enumerate(dataloader):
-        load_data_to_gpu(batch_dict)
+        load_data_to_device(batch_dict, device)
 
         if getattr(args, 'infer_time', False):
             start_time = time.time()
 
+        if profiler is not None:
+            profiler.start_batch(enabled=i >= profile_warmup)
         with torch.no_grad():
             pred_dicts, ret_dict = model(batch_dict) #batch size array of record_dict{'pred_boxes','pred_scores','pred_labels'}
+        if profiler is not None:
+            profiler.end_batch(batch_dict)
 
         disp_dict = {}
 
@@ -77,18 +138,57 @@ def eval_one_epoch(cfg, args, model, dataloader, epoch_id, logger, dist_test=Fal
             batch_dict, pred_dicts, class_names,
             output_path=final_output_dir if args.save_to_file else None
         )
-        det_annos += annos #annos array: batchsize(16) pred_dict in each batch; det_annos array: all objects in all frames in the dataset
+        if not stream_eval_only:
+            det_annos += annos #annos array: batchsize(16) pred_dict in each batch; det_annos array: all objects in all frames in the dataset
+        total_pred_objects += sum([len(anno['name']) for anno in annos])
+        num_det_frames += len(annos)
+
+        if stream_evaluator is not None:
+            #the padded samples belong to other ranks, counted twice when the states are summed
+            stream_evaluator.add_batch(drop_padded_samples(
+                annos, num_det_frames - len(annos), len(dataset), rank, world_size) if dist_test else annos)
+            if cfg.LOCAL_RANK == 0 and (i + 1) % stream_eval_interval == 0:
+                stream_result_str, stream_result_dict = stream_evaluator.get_result()
+                stream_ap = get_stream_ap(stream_result_dict)
+                logger.info('Running results of %d frames (moderate 3d AP_R40 %.4f):\n%s' % (
+                    stream_evaluator.num_frames, stream_ap, stream_result_str))
+                if stream_eval_min_ap is not None and not dist_test and stream_ap < stream_eval_min_ap:
+                    logger.info('Running moderate 3d AP_R40 %.4f < %.4f, evaluation stopped early' % (
+                        stream_ap, stream_eval_min_ap))
+                    aborted = True
         if cfg.LOCAL_RANK == 0:
             progress_bar.set_postfix(disp_dict)
             progress_bar.update()
+        if aborted:
+            break
 
     if cfg.LOCAL_RANK == 0:
         progress_bar.close()
+    common_utils.wait_async_file_writes() #label files of generate_prediction_dicts
+    if isinstance(dataloader, DataPrefetcher):
+        dataloader.close() #stops the background thread after an early stop
+        dataloader.log_stats(logger)
+    if profiler is not None:
+        profiler.detach()
+        if cfg.LOCAL_RANK == 0 and profiler.num_batches > 0:
+            logger.info(profiler.get_result_str())
+            profiler.save_json(result_dir / 'module_profile.json', meta={
+                'cfg_file': getattr(args, 'cfg_file', None), 'ckpt': getattr(args, 'ckpt', None),
+                'batch_size': getattr(args, 'batch_size', None), 'epoch_id': epoch_id})
+            from tensorboardX import SummaryWriter
+            tb_log = SummaryWriter(log_dir=str(result_dir / 'tensorboard_profile'))
+            profiler.add_to_tensorboard(tb_log)
+            tb_log.close()
 
     if dist_test:
-        rank, world_size = common_utils.get_dist_info()
-        det_annos = common_utils.merge_results_dist(det_annos, len(dataset), tmpdir=result_dir / 'tmpdir')
-        metric = common_utils.merge_results_dist([metric], world_size, tmpdir=result_dir / 'tmpdir')
+        det_annos = merge_results(det_annos, len(dataset), args, result_dir, packed=True)
+        metric = merge_results([metric], world_size, args, result_dir)
+        num_objects = merge_results([(total_pred_objects, num_det_frames)], world_size, args, result_dir)
+        if stream_evaluator is not None:
+            stream_states = merge_results([stream_evaluator.state_dict()], world_size, args, result_dir)
+            if cfg.LOCAL_RANK == 0:
+                for k in range(1, world_size):
+                    stream_evaluator.merge_state(stream_states[k])
 
     logger.info('*************** Performance of EPOCH %s *****************' % epoch_id)
     sec_per_example = (time.time() - start_time) / len(dataloader.dataset)
@@ -113,20 +213,25 @@ def eval_one_epoch(cfg, args, model, dataloader, epoch_id, logger, dist_test=Fal
         ret_dict['recall/roi_%s' % str(cur_thresh)] = cur_roi_recall
         ret_dict['recall/rcnn_%s' % str(cur_thresh)] = cur_rcnn_recall
 
-    total_pred_objects = 0
-    for anno in det_annos: #each frame's results
-        total_pred_objects += anno['name'].__len__()
+    if dist_test:
+        total_pred_objects = sum([num[0] for num in num_objects])
+        num_det_frames = min(sum([num[1] for num in num_objects]), len(dataset)) #without the padded samples
     logger.info('Average predicted number of objects(%d samples): %.3f'
-                % (len(det_annos), total_pred_objects / max(1, len(det_annos))))
-
-    with open(result_dir / 'result.pkl', 'wb') as f:
-        pickle.dump(det_annos, f)
-
-    result_str, result_dict = dataset.evaluation(
-        det_annos, class_names,
-        eval_metric=cfg.MODEL.POST_PROCESSING.EVAL_METRIC, #kitti
-        output_path=final_output_dir
-    )
+                % (num_det_frames, total_pred_objects / max(1, num_det_frames)))
+
+    if stream_eval_only or aborted:
+        #metrics of the streaming evaluator, the det_annos are missing or only cover part of the dataset
+        result_str, result_dict = stream_evaluator.get_result()
+        logger.info('Streaming evaluation (approximate AP) of %d frames' % stream_evaluator.num_frames)
+    else:
+        with open(result_dir / 'result.pkl', 'wb') as f:
+            pickle.dump(det_annos, f)
+
+        result_str, result_dict = dataset.evaluation(
+            det_annos, class_names,
+            eval_metric=cfg.MODEL.POST_PROCESSING.EVAL_METRIC, #kitti
+            output_path=final_output_dir
+        )
 
     logger.info(result_str)
     ret_dict.update(result_dict)
@@ -201,6 +201,7 @@ def rundetection(dataloader, model, device, args, eval_output_dir, logger):
                 with open(resultfile, 'wb') as f:
                     pickle.dump(save_dict, f)
         progress_bar.close()
+        common_utils.wait_async_file_writes() #label files of generate_prediction_dicts
 
         ret_dict = {}
         gt_num_cnt = metric['gt_num']
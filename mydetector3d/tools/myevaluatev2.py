@@ -80,7 +80,7 @@ __datasetall__ = {
 
 #newly created
 def load_data_to_device(batch_dict, device):
-    if type(batch_dict) is dict:
+    if isinstance(batch_dict, dict):
         for key, val in batch_dict.items():
             if not isinstance(val, np.ndarray):
                 continue
@@ -316,6 +316,7 @@ def rundetection(dataloader, model, device, cfg, args, eval_output_dir):
                 with open(args.output_dir / resultfile, 'wb') as f:
                     pickle.dump(save_dict, f)
         progress_bar.close()
+        common_utils.wait_async_file_writes() #label files of generate_prediction_dicts
 
         ret_dict = {}
         gt_num_cnt = metric['gt_num']
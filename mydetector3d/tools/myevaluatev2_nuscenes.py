@@ -86,7 +86,7 @@ __datasetall__ = {
 
 #newly created
 def load_data_to_device(batch_dict, device):
-    if type(batch_dict) is dict:
+    if isinstance(batch_dict, dict):
         for key, val in batch_dict.items():
             if key in ['frame_id', 'metadata', 'calib', 'image_paths', 'img_process_infos', 'ori_shape']:
                 continue
@@ -333,6 +333,7 @@ def rundetection(dataloader, model, device, cfg, args, eval_output_dir):
                 with open(args.output_dir / resultfile, 'wb') as f:
                     pickle.dump(save_dict, f)
         progress_bar.close()
+        common_utils.wait_async_file_writes() #label files of generate_prediction_dicts
 
         ret_dict = {}
         gt_num_cnt = metric['gt_num']
@@ -42,6 +42,10 @@ def torch_setgpu(gpuid):
 
 from mydetector3d.config import cfg_from_yaml_file, log_config_to_file #, cfg
 from mydetector3d.utils import common_utils
+from mydetector3d.utils.eval_shard_utils import ShardedDetAnnos, ShardedResultWriter, load_index, merge_shard_metric
+from mydetector3d.utils.prefetch_utils import DataPrefetcher
+from mydetector3d.utils.profile_utils import ModuleProfiler
+from mydetector3d.tools.eval_utils import get_stream_ap
 from mydetector3d.models.detectors.pointpillar import PointPillar
 from mydetector3d.models.detectors.second_net import SECONDNet
 from mydetector3d.models.detectors.voxelnext import VoxelNeXt
@@ -85,7 +89,7 @@ __datasetall__ = {
 
 #newly created
 def load_data_to_device(batch_dict, device, saving_dict):
-    if type(batch_dict) is dict:
+    if isinstance(batch_dict, dict):
         for key, val in batch_dict.items():
             # print('val: ', val)
             # print(type(val))
@@ -126,6 +130,17 @@ def parse_config():
     parser.add_argument('--eval_only', default=False, help='') #When detection result is available, set to True and just run the evaluation
     parser.add_argument('--savebatchidx', type=int, default=1, help='Save one batch data to pkl for visualization')
     parser.add_argument('--infer_time', default=True, help='calculate inference latency') #action='store_true' true if specified
+    parser.add_argument('--prefetch', action='store_true', default=False, help='load the next batch to the device while the current one runs')
+    parser.add_argument('--stream_eval', action='store_true', default=False, help='print running kitti metrics during the detection')
+    parser.add_argument('--stream_eval_only', action='store_true', default=False, help='only the approximate streaming metrics, do not keep det_annos / ret_dicts')
+    parser.add_argument('--stream_eval_interval', type=int, default=100, help='batches between two running results')
+    parser.add_argument('--stream_eval_min_ap', type=float, default=None, help='stop when the running moderate 3d AP_R40 is below this')
+    parser.add_argument('--profile_modules', action='store_true', default=False, help='per-module latency (json + tensorboard in the output dir)')
+    parser.add_argument('--profile_warmup', type=int, default=10, help='batches skipped by the module profiler')
+    parser.add_argument('--shard_size', type=int, default=None, help='write the results in shards of this many frames, a restart skips the finished shards')
+    parser.add_argument('--shard_dir', type=str, default=None, help='directory of the result shards, output_dir/shards by default')
+    parser.add_argument('--shard_rank', type=int, default=0, help='this process runs the shards with shard_id %% num_shard_workers == shard_rank')
+    parser.add_argument('--num_shard_workers', type=int, default=1, help='processes sharing the shard dir')
 
     args = parser.parse_args()
 
@@ -149,6 +164,8 @@ def parse_config():
     args.eval_output_dir = args.output_dir / 'txtresults' #'eval'
     args.eval_output_dir.mkdir(parents=True, exist_ok=True)
 
+    args.shard_dir = Path(args.shard_dir) if args.shard_dir is not None else args.output_dir / 'shards'
+
     np.random.seed(1024)
 
     return args, cfg
@@ -206,10 +223,23 @@ def main():
         training=False,
         logger=logger,
     )
-    dataloader = DataLoader(
-        dataset, batch_size=args.batch_size, pin_memory=True, num_workers=args.workers,
-        shuffle=None, collate_fn=dataset.collate_batch,
-        drop_last=False, sampler=None, timeout=0, worker_init_fn=None)
+    shard_writer = None
+    if args.shard_size is not None and not args.eval_only:
+        #only the frames of the unfinished shards of this worker are loaded, a batch never crosses a shard
+        shard_writer = ShardedResultWriter(
+            args.shard_dir, len(dataset), args.shard_size, meta={'cfg_file': args.cfg_file, 'ckpt': args.ckpt},
+            rank=args.shard_rank, num_workers=args.num_shard_workers)
+        print('Result shards in %s: %d shards, %d pending for worker %d/%d (%d frames)' % (
+            args.shard_dir, shard_writer.num_shards, len(shard_writer.pending_shards), args.shard_rank,
+            args.num_shard_workers, shard_writer.num_pending_frames))
+        dataloader = DataLoader(
+            dataset, batch_sampler=shard_writer.get_batch_sampler(args.batch_size), pin_memory=True,
+            num_workers=args.workers, collate_fn=dataset.collate_batch, timeout=0, worker_init_fn=None)
+    else:
+        dataloader = DataLoader(
+            dataset, batch_size=args.batch_size, pin_memory=True, num_workers=args.workers,
+            shuffle=None, collate_fn=dataset.collate_batch,
+            drop_last=False, sampler=None, timeout=0, worker_init_fn=None)
     
     if not args.eval_only:
         #Build Model
@@ -227,13 +257,36 @@ def main():
         model.to(device)
         model.eval()
 
-        det_annos, ret_dicts, ret_dict = rundetection(dataloader, model, device, cfg, args, args.eval_output_dir)
-        resultfile=args.output_dir / 'result.pkl'
-        with open(resultfile, 'wb') as f:
-            pickle.dump(det_annos, f)
-        with open(args.output_dir / 'ret_dicts.pkl', 'wb') as f:
-            pickle.dump(ret_dicts, f)
-        print("Finished detection:", ret_dict)
+        stream_evaluator = None
+        if args.stream_eval or args.stream_eval_only:
+            if hasattr(dataset, 'get_stream_evaluator'):
+                stream_evaluator = dataset.get_stream_evaluator(class_names)
+            if stream_evaluator is None:
+                print('Streaming evaluation is not supported by %s' % type(dataset).__name__)
+        det_annos, ret_dicts, ret_dict = rundetection(dataloader, model, device, cfg, args, args.eval_output_dir, stream_evaluator, shard_writer)
+        if stream_evaluator is not None and (args.stream_eval_only or ret_dict['stream_eval_stopped']):
+            result_str, result_dict = stream_evaluator.get_result()
+            print('Streaming evaluation (approximate AP) of %d frames' % stream_evaluator.num_frames)
+            print(result_str)
+            print(result_dict)
+            return
+        if shard_writer is not None:
+            print("Finished detection:", ret_dict)
+            det_annos = load_sharded_results(args.shard_dir, cfg)
+            if det_annos is None:
+                return
+        else:
+            resultfile=args.output_dir / 'result.pkl'
+            with open(resultfile, 'wb') as f:
+                pickle.dump(det_annos, f)
+            with open(args.output_dir / 'ret_dicts.pkl', 'wb') as f:
+                pickle.dump(ret_dicts, f)
+            print("Finished detection:", ret_dict)
+    elif load_index(args.shard_dir) is not None:
+        #results of a sharded detection run
+        det_annos = load_sharded_results(args.shard_dir, cfg)
+        if det_annos is None:
+            return
     else:
         #load previous saved pkl
         resultfile=args.output_dir / 'result.pkl'
@@ -247,7 +300,23 @@ def main():
     print(result_dict)
 
 
-def rundetection(dataloader, model, device, cfg, args, eval_output_dir):
+def load_sharded_results(shard_dir, cfg):
+    #lazy det_annos of all shards, None while shards of other workers (or of an interrupted run) are missing
+    shard_annos = None
+    try:
+        shard_annos = ShardedDetAnnos(shard_dir)
+    except RuntimeError as e:
+        print(e)
+    metric, total_pred_objects, num_det_frames = merge_shard_metric(shard_dir)
+    gt_num_cnt = metric.get('gt_num', 0)
+    for cur_thresh in cfg.MODEL.POST_PROCESSING.RECALL_THRESH_LIST:
+        print('recall_roi_%s (all shards): %f' % (cur_thresh, metric.get('recall_roi_%s' % str(cur_thresh), 0) / max(gt_num_cnt, 1)))
+        print('recall_rcnn_%s (all shards): %f' % (cur_thresh, metric.get('recall_rcnn_%s' % str(cur_thresh), 0) / max(gt_num_cnt, 1)))
+    print('Average predicted number of objects(%d samples, all shards): %.3f'
+                % (num_det_frames, total_pred_objects / max(1, num_det_frames)))
+    return shard_annos
+
+def rundetection(dataloader, model, device, cfg, args, eval_output_dir, stream_evaluator=None, shard_writer=None):
     metric = {
         'gt_num': 0,
     }
@@ -262,11 +331,29 @@ def rundetection(dataloader, model, device, cfg, args, eval_output_dir):
         det_annos = []
         ret_dicts = []
         saving_dict = {}
+        #with a shard_writer the det_annos are on disk, ret_dicts (with the model tensors) are not kept
+        keep_results = (stream_evaluator is None or not args.stream_eval_only) and shard_writer is None
+        total_pred_objects, num_det_frames = 0, 0
+        stream_eval_stopped = False
 
         if getattr(args, 'infer_time', False):
             start_iter = int(len(dataloader) * 0.1)
             infer_time_meter = common_utils.AverageMeter()
         
+        if args.prefetch:
+            #load_data_to_device runs in the background thread one batch ahead, keep the saving_dict of each batch
+            saving_dicts = {}
+            def load_func(batch_dict):
+                cur_saving_dict = {}
+                load_data_to_device(batch_dict, device, cur_saving_dict)
+                saving_dicts[id(batch_dict)] = cur_saving_dict
+            dataloader = DataPrefetcher(dataloader, load_func=load_func, device=device)
+
+        profiler = None
+        if getattr(args, 'profile_modules', False):
+            #per-stage latency from forward hooks on model.module_list, the first batches are warm up
+            profiler = ModuleProfiler(model, device=device).attach()
+
         start_time = time.time()
 
         # #batch_dict data:
@@ -277,13 +364,20 @@ def rundetection(dataloader, model, device, cfg, args, eval_output_dir):
         # Voxel_num_points: (89196,)
         for i, batch_dict in enumerate(dataloader):
             #load_data_to_gpu(batch_dict)
-            load_data_to_device(batch_dict, device, saving_dict) #dict cannot use .to(device)
+            if args.prefetch:
+                saving_dict = saving_dicts.pop(id(batch_dict))
+            else:
+                load_data_to_device(batch_dict, device, saving_dict) #dict cannot use .to(device)
 
             if getattr(args, 'infer_time', False):
                 start_time = time.time()
 
+            if profiler is not None:
+                profiler.start_batch(enabled=i >= args.profile_warmup)
             with torch.no_grad():
                 pred_dicts, ret_dict = model(batch_dict) #batch size array of record_dict{'pred_boxes'[N,7],'pred_scores'[N],'pred_labels'[N]}
+            if profiler is not None:
+                profiler.end_batch(batch_dict)
                 #ret_dict return: 'gt': 69, 'roi_0.3': 0, 'rcnn_0.3': 68, 'roi_0.5': 0, 'rcnn_0.5': 66, 'roi_0.7': 0, 'rcnn_0.7': 61
             disp_dict = {}
 
@@ -299,7 +393,8 @@ def rundetection(dataloader, model, device, cfg, args, eval_output_dir):
             ret_dict['infer_time'] = infer_time_meter.val
             ret_dict['pred_dicts'] = pred_dicts
             ret_dict['gt_boxes'] = batch_dict['gt_boxes']
-            ret_dicts.append(ret_dict)
+            if keep_results:
+                ret_dicts.append(ret_dict)
 
             #convert to Kitti format, save result to txt file
             annos = dataset.generate_prediction_dicts(
@@ -307,10 +402,28 @@ def rundetection(dataloader, model, device, cfg, args, eval_output_dir):
                 output_path=eval_output_dir if args.save_to_file else None
             )#batch_size array, each dict is the Kitti annotation-like format dict (2D box is converted from 3D pred box)
             #annos batch size=4 dict array, each contains 'name' array(335), 'score(335)', 'boxes_lidar(335,7)', 'pred_labels(335)'
-            det_annos += annos #annos array: batchsize(16) pred_dict in each batch; det_annos array: all objects in all frames in the dataset
+            if keep_results:
+                det_annos += annos #annos array: batchsize(16) pred_dict in each batch; det_annos array: all objects in all frames in the dataset
+            if shard_writer is not None:
+                shard_writer.add_batch(annos, ret_dict)
+            total_pred_objects += sum([len(anno['name']) for anno in annos])
+            num_det_frames += len(annos)
             progress_bar.set_postfix(disp_dict)
             progress_bar.update()
 
+            if stream_evaluator is not None:
+                #running metrics of the frames so far, optional early stop
+                stream_evaluator.add_batch(annos)
+                if (i + 1) % args.stream_eval_interval == 0:
+                    stream_result_str, stream_result_dict = stream_evaluator.get_result()
+                    stream_ap = get_stream_ap(stream_result_dict)
+                    print('Running results of %d frames (moderate 3d AP_R40 %.4f):' % (stream_evaluator.num_frames, stream_ap))
+                    print(stream_result_str)
+                    if args.stream_eval_min_ap is not None and stream_ap < args.stream_eval_min_ap:
+                        print('Running moderate 3d AP_R40 %.4f < %.4f, detection stopped early' % (stream_ap, args.stream_eval_min_ap))
+                        stream_eval_stopped = True
+                        break
+
             if args.savebatchidx is not None and i==args.savebatchidx:
                 #save the current batch data for later evaluation
                 load_data_to_device(batch_dict,'cpu', saving_dict)
@@ -345,6 +458,22 @@ def rundetection(dataloader, model, device, cfg, args, eval_output_dir):
                 with open(args.output_dir / resultfile, 'wb') as f:
                     pickle.dump(save_dict, f)
         progress_bar.close()
+        common_utils.wait_async_file_writes() #label files of generate_prediction_dicts
+        if args.prefetch:
+            dataloader.close() #stops the background thread after an early stop
+            stats = dataloader.get_stats()
+            print('Prefetch: data time %.2fs, waited %.2fs, hidden %.2fs (%.1f%%)' % (
+                stats['load_time'], stats['wait_time'], stats['hidden_time'], stats['hidden_ratio'] * 100))
+        if profiler is not None:
+            profiler.detach()
+            if profiler.num_batches > 0:
+                print(profiler.get_result_str())
+                profiler.save_json(args.output_dir / 'module_profile.json', meta={
+                    'cfg_file': args.cfg_file, 'ckpt': args.ckpt, 'batch_size': getattr(args, 'batch_size', None)})
+                from tensorboardX import SummaryWriter
+                tb_log = SummaryWriter(log_dir=str(args.output_dir / 'tensorboard_profile'))
+                profiler.add_to_tensorboard(tb_log)
+                tb_log.close()
 
         ret_dict = {}
         gt_num_cnt = metric['gt_num']
@@ -356,15 +485,13 @@ def rundetection(dataloader, model, device, cfg, args, eval_output_dir):
             ret_dict['recall/roi_%s' % str(cur_thresh)] = cur_roi_recall
             ret_dict['recall/rcnn_%s' % str(cur_thresh)] = cur_rcnn_recall
 
-        total_pred_objects = 0
-        for anno in det_annos: #each frame's results
-            total_pred_objects += anno['name'].__len__()
         print('Average predicted number of objects(%d samples): %.3f'
-                    % (len(det_annos), total_pred_objects / max(1, len(det_annos))))
+                    % (num_det_frames, total_pred_objects / max(1, num_det_frames)))
 
     ret_dict['infer_time']=infer_time_meter.avg
     ret_dict['total_pred_objects']=total_pred_objects
-    ret_dict['total_annos']=len(det_annos)
+    ret_dict['total_annos']=num_det_frames
+    ret_dict['stream_eval_stopped']=stream_eval_stopped
     return det_annos, ret_dicts, ret_dict
 
 def runevaluation(dataset, det_annos, class_names, final_output_dir, kittiformat=False):
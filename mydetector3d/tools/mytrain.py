@@ -14,8 +14,9 @@ from tensorboardX import SummaryWriter
 
 from mydetector3d.config import cfg, cfg_from_list, cfg_from_yaml_file, log_config_to_file
 from mydetector3d.datasets import build_dataloader
-from mydetector3d.models import build_network, model_fn_decorator
+from mydetector3d.models import build_network, model_fn_decorator, load_data_to_device
 from mydetector3d.utils import common_utils
+from mydetector3d.utils.prefetch_utils import DataPrefetcher
 from mydetector3d.tools.optimization import build_optimizer, build_scheduler
 from mydetector3d.tools.train_utils import train_model
 from torch.utils.data import DistributedSampler as DistributedSampler
@@ -113,6 +114,7 @@ def parse_config():
     parser.add_argument('--ckpt_save_time_interval', type=int, default=300, help='in terms of seconds')
     parser.add_argument('--wo_gpu_stat', action='store_true', help='')
     parser.add_argument('--use_amp', action='store_true', help='use mix precision training')
+    parser.add_argument('--prefetch', action='store_true', default=False, help='load the next batch to the gpu while the current one is trained')
     
 
     args = parser.parse_args()
@@ -271,6 +273,10 @@ def main():
     logger.info('**********************Start training %s/%s(%s)**********************'
                 % (cfg.EXP_GROUP_PATH, cfg.TAG, args.extra_tag))
 
+    if args.prefetch:
+        device = next(model.parameters()).device
+        train_loader = DataPrefetcher(train_loader, load_func=partial(load_data_to_device, device=device), device=device)
+
     torch.cuda.empty_cache()
     train_model(
         model,
@@ -55,6 +55,16 @@ def parse_config():
     parser.add_argument('--ckpt_dir', type=str, default=None, help='specify a ckpt directory to be evaluated if needed')
     parser.add_argument('--save_to_file', action='store_true', default=False, help='')
     parser.add_argument('--infer_time', action='store_true', default=False, help='calculate inference latency')
+    parser.add_argument('--prefetch', action='store_true', default=False, help='load the next batch to the gpu while the current one is evaluated')
+    parser.add_argument('--stream_eval', action='store_true', default=False, help='report running kitti metrics during the evaluation')
+    parser.add_argument('--stream_eval_only', action='store_true', default=False, help='only the approximate streaming metrics, do not keep the det_annos / result.pkl')
+    parser.add_argument('--stream_eval_interval', type=int, default=100, help='batches between two running results')
+    parser.add_argument('--stream_eval_min_ap', type=float, default=None, help='stop when the running moderate 3d AP_R40 is below this')
+    parser.add_argument('--dist_merge', choices=['tmpdir', 'gather', 'gather_packed'], default='tmpdir',
+                        help='merge of the results of the ranks: pickle files in a shared tmpdir or collective gather (packed annos)')
+    parser.add_argument('--dist_merge_chunk_mb', type=float, default=64, help='bytes per rank and round of the gather merge (MB)')
+    parser.add_argument('--profile_modules', action='store_true', default=False, help='per-module latency (json + tensorboard in the eval dir)')
+    parser.add_argument('--profile_warmup', type=int, default=10, help='batches skipped by the module profiler')
 
     args = parser.parse_args()
 
@@ -6,6 +6,7 @@ import time
 import glob
 from torch.nn.utils import clip_grad_norm_
 from mydetector3d.utils import common_utils, commu_utils
+from mydetector3d.utils.prefetch_utils import DataPrefetcher
 
 
 def train_one_epoch(model, optimizer, train_loader, model_func, lr_scheduler, accumulated_iter, optim_cfg,
@@ -192,6 +193,10 @@ def train_model(model, optimizer, train_loader, model_func, lr_scheduler, optim_
                 show_gpu_stat=show_gpu_stat,
                 use_amp=use_amp
             )
+            if isinstance(train_loader, DataPrefetcher):
+                if rank == 0 and logger is not None:
+                    train_loader.log_stats(logger, prefix='Epoch %d prefetch' % (cur_epoch + 1))
+                train_loader.reset_stats()
 
             # save trained model
             trained_epoch = cur_epoch + 1
@@ -2,6 +2,8 @@
 import numpy as np
 import torch
 
+from . import common_utils
+
 #Anchor and gt's code and decode in Loss function
 class ResidualCoder(object):
     def __init__(self, code_size=7, encode_angle_by_sincos=False, **kwargs):
@@ -157,7 +159,7 @@ class PointResidualCoder(object):
         self.code_size = code_size
         self.use_mean_size = use_mean_size
         if self.use_mean_size:
-            self.mean_size = torch.from_numpy(np.array(kwargs['mean_size'])).cuda().float()
+            self.mean_size = common_utils.cuda_if_available(torch.from_numpy(np.array(kwargs['mean_size']))).float()
             assert self.mean_size.min() > 0
 
     def encode_torch(self, gt_boxes, points, gt_classes=None):
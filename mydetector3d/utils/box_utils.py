@@ -115,17 +115,23 @@ def mask_boxes_outside_range_numpy(boxes, limit_range, min_num_corners=1, use_ce
     return mask
 
 
-def remove_points_in_boxes3d(points, boxes3d):
+def remove_points_in_boxes3d(points, boxes3d, grid_size=None):
     """
     Args:
         points: (num_points, 3 + C)
         boxes3d: (N, 7) [x, y, z, dx, dy, dz, heading], (x, y, z) is the box center, each box DO NOT overlaps
+        grid_size: bev cell size of the spatial index (points_in_boxes_grid_cpu), None for the dense points x boxes mask
 
     Returns:
 
     """
     boxes3d, is_numpy = common_utils.check_numpy_to_torch(boxes3d)
     points, is_numpy = common_utils.check_numpy_to_torch(points)
+    if grid_size is not None:
+        box_idxs_of_pts = roiaware_pool3d_utils.points_in_boxes_grid_cpu(points[:, 0:3], boxes3d, grid_size)
+        points = points[box_idxs_of_pts < 0]
+        return points.numpy() if is_numpy else points
+
     point_masks = roiaware_pool3d_utils.points_in_boxes_cpu(points[:, 0:3], boxes3d)
     points = points[point_masks.sum(dim=0) == 0]
 
@@ -289,6 +295,57 @@ def boxes3d_kitti_camera_to_imageboxes(boxes3d, calib, image_shape=None):
     return boxes2d_image
 
 
+def boxes3d_lidar_to_kitti_camera_batch(boxes3d_lidar, V2R, batch_index):
+    """
+    boxes3d_lidar_to_kitti_camera for the boxes of several frames at once
+    :param boxes3d_lidar: (N, 7) [x, y, z, dx, dy, dz, heading], (x, y, z) is the box center
+    :param V2R: (B, 4, 3) lidar to rect camera transform of each frame, V2C.T @ R0.T (see calib.lidar_to_rect)
+    :param batch_index: (N) frame index of each box
+    :return:
+        boxes3d_camera: (N, 7) [x, y, z, l, h, w, r] in rect camera coords
+    """
+    xyz_lidar = boxes3d_lidar[:, 0:3].copy()
+    l, w, h = boxes3d_lidar[:, 3:4], boxes3d_lidar[:, 4:5], boxes3d_lidar[:, 5:6]
+    r = boxes3d_lidar[:, 6:7]
+
+    xyz_lidar[:, 2] -= h.reshape(-1) / 2
+    xyz_lidar_hom = np.hstack((xyz_lidar, np.ones((xyz_lidar.shape[0], 1), dtype=np.float32)))
+    xyz_cam = np.matmul(xyz_lidar_hom[:, np.newaxis, :], V2R[batch_index])[:, 0, :]
+    r = -r - np.pi / 2
+    return np.concatenate([xyz_cam, l, h, w, r], axis=-1)
+
+
+def boxes3d_kitti_camera_to_imageboxes_batch(boxes3d, P2, batch_index, image_shape=None, projected_depth=False):
+    """
+    boxes3d_kitti_camera_to_imageboxes for the boxes of several frames at once
+    :param boxes3d: (N, 7) [x, y, z, l, h, w, r] in rect camera coords
+    :param P2: (B, 3, 4) camera projection matrix of each frame
+    :param batch_index: (N) frame index of each box
+    :param image_shape: (B, 2) image shape of each frame
+    :param projected_depth: normalize by the projected depth (calibration_waymokitti) instead of the rect depth
+        (calibration_kitti), as in calib.rect_to_img
+    :return:
+        box_2d_preds: (N, 4) [x1, y1, x2, y2]
+    """
+    corners3d = boxes3d_to_corners3d_kitti_camera(boxes3d)  # (N, 8, 3)
+    corners3d_hom = np.concatenate((corners3d, np.ones((corners3d.shape[0], 8, 1), dtype=np.float32)), axis=2)
+    pts_2d_hom = np.matmul(corners3d_hom, np.transpose(P2, (0, 2, 1))[batch_index])  # (N, 8, 3)
+    depth = pts_2d_hom[:, :, 2:3] if projected_depth else corners3d_hom[:, :, 2:3]
+    corners_in_image = pts_2d_hom[:, :, 0:2] / depth
+
+    min_uv = np.min(corners_in_image, axis=1)  # (N, 2)
+    max_uv = np.max(corners_in_image, axis=1)  # (N, 2)
+    boxes2d_image = np.concatenate([min_uv, max_uv], axis=1)
+    if image_shape is not None:
+        box_image_shape = image_shape[batch_index]
+        boxes2d_image[:, 0] = np.clip(boxes2d_image[:, 0], a_min=0, a_max=box_image_shape[:, 1] - 1)
+        boxes2d_image[:, 1] = np.clip(boxes2d_image[:, 1], a_min=0, a_max=box_image_shape[:, 0] - 1)
+        boxes2d_image[:, 2] = np.clip(boxes2d_image[:, 2], a_min=0, a_max=box_image_shape[:, 1] - 1)
+        boxes2d_image[:, 3] = np.clip(boxes2d_image[:, 3], a_min=0, a_max=box_image_shape[:, 0] - 1)
+
+    return boxes2d_image
+
+
 def boxes_iou_normal(boxes_a, boxes_b):
     """
     Args:
@@ -1,10 +1,14 @@
 #https://github.com/open-mmlab/OpenPCDet/blob/master/pcdet/utils/common_utils.py
+import atexit
 import logging
 import os
 import pickle
 import random
 import shutil
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import SharedArray
 
 import numpy as np
@@ -12,6 +16,8 @@ import torch
 import torch.distributed as dist
 import torch.multiprocessing as mp
 
+from . import commu_utils
+
 
 def check_numpy_to_torch(x):
     if isinstance(x, np.ndarray):
@@ -19,6 +25,11 @@ def check_numpy_to_torch(x):
     return x, False
 
 
+def cuda_if_available(x):
+    #constant tensors created when the model is built, kept on the cpu without a gpu (cpu benchmark)
+    return x.cuda() if torch.cuda.is_available() else x
+
+
 def limit_period(val, offset=0.5, period=np.pi):
     val, is_numpy = check_numpy_to_torch(val)
     ans = val - torch.floor(val / period + offset) * period
@@ -260,6 +271,78 @@ def merge_results_dist(result_part, size, tmpdir):
     return ordered_results
 
 
+def pack_annos(annos):
+    """
+    Packs a list of anno dicts for communication: the per-object numpy arrays of each key are concatenated,
+    so they are serialized as a few large buffers instead of thousands of small pickled arrays
+    Returns:
+        packed: dict, see unpack_annos
+    """
+    packed = {'num_annos': len(annos), 'arrays': {}, 'objects': {}}
+    if len(annos) == 0 or any([anno.keys() != annos[0].keys() for anno in annos]):
+        packed['objects'] = {None: annos}
+        return packed
+    for key in annos[0].keys():
+        values = [anno[key] for anno in annos]
+        is_array = all([isinstance(val, np.ndarray) and val.ndim > 0 for val in values])
+        non_empty = [val for val in values if is_array and val.shape[0] > 0]
+        if is_array and len(set([(val.dtype, val.shape[1:]) for val in non_empty])) <= 1:
+            packed['arrays'][key] = {
+                'data': np.concatenate(non_empty) if len(non_empty) > 0 else None,
+                'lengths': np.array([val.shape[0] for val in values], dtype=np.int64),
+                'empty': {i: val for i, val in enumerate(values) if val.shape[0] == 0},  # keeps their dtypes
+            }
+        else:
+            packed['objects'][key] = values
+    return packed
+
+
+def unpack_annos(packed):
+    """inverse of pack_annos, the arrays of the annos are views of the packed arrays"""
+    if None in packed['objects']:
+        return packed['objects'][None]
+    annos = [{} for _ in range(packed['num_annos'])]
+    for key, val in packed['arrays'].items():
+        offsets = np.concatenate([[0], np.cumsum(val['lengths'])])
+        for i, anno in enumerate(annos):
+            anno[key] = val['empty'][i] if i in val['empty'] else val['data'][offsets[i]:offsets[i + 1]]
+    for key, values in packed['objects'].items():
+        for anno, cur_val in zip(annos, values):
+            anno[key] = cur_val
+    return annos
+
+
+def merge_results_dist_gather(result_part, size, chunk_size=64 * 1024 * 1024, packed=False):
+    """
+    merge_results_dist over collective communication instead of pickle files in a shared tmpdir: the results
+    of each rank are serialized and gathered on rank 0 in chunks of chunk_size bytes (commu_utils.gather_bytes_chunked)
+    Args:
+        result_part: list of results of this rank
+        size: number of results kept after interleaving the ranks
+        chunk_size: bytes per rank and communication round
+        packed: result_part is a list of anno dicts, sent in the pack_annos format
+    Returns:
+        ordered_results on rank 0, None on the other ranks
+    """
+    rank, world_size = get_dist_info()
+    data = pack_annos(result_part) if packed else result_part
+    buffers = commu_utils.gather_bytes_chunked(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL), chunk_size)
+    if rank != 0:
+        return None
+
+    part_list = []
+    for i in range(world_size):
+        part = pickle.loads(buffers[i])
+        buffers[i] = None
+        part_list.append(unpack_annos(part) if packed else part)
+
+    ordered_results = []
+    for res in zip(*part_list):
+        ordered_results.extend(list(res))
+    ordered_results = ordered_results[:size]
+    return ordered_results
+
+
 def scatter_point_inds(indices, point_inds, shape):
     ret = -1 * torch.ones(*shape, dtype=point_inds.dtype, device=point_inds.device)
     ndim = indices.shape[-1]
@@ -302,4 +385,92 @@ class AverageMeter(object):
         self.val = val
         self.sum += val * n
         self.count += n
-        self.avg = self.sum / self.count
\ No newline at end of file
+        self.avg = self.sum / self.count
+
+
+class AsyncFileWriter(object):
+    """
+    Writes text files from a small thread pool, each file formatted in the worker and written with a single
+    buffered write, so the caller (e.g. the label files of generate_prediction_dicts) does not wait on the disk.
+    Call wait() before reading the files back.
+    """
+    def __init__(self, num_workers=4, max_pending=1024):
+        self.executor = ThreadPoolExecutor(max_workers=num_workers)
+        self.max_pending = max_pending
+        self.futures = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def write_file(path, func, args):
+        text = func(*args)
+        with open(path, 'w', buffering=max(len(text), 1)) as f:
+            f.write(text)
+
+    def submit(self, path, func, *args):
+        """writes the text returned by func(*args) to path"""
+        with self.lock:
+            #failed writes are kept, wait() re-raises their errors
+            self.futures = [future for future in self.futures if not future.done() or future.exception() is not None]
+            pending = self.futures[:-self.max_pending] if len(self.futures) >= self.max_pending else []
+            self.futures.append(self.executor.submit(self.write_file, path, func, args))
+        for future in pending: #backpressure when the disk falls behind
+            future.result()
+
+    def wait(self):
+        """blocks until the submitted files are written, re-raises the errors of the workers"""
+        with self.lock:
+            futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown()
+
+
+_async_file_writer = None
+
+
+def get_async_file_writer():
+    """process wide AsyncFileWriter, flushed at exit"""
+    global _async_file_writer
+    if _async_file_writer is None:
+        _async_file_writer = AsyncFileWriter()
+        atexit.register(_async_file_writer.close)
+    return _async_file_writer
+
+
+def wait_async_file_writes():
+    if _async_file_writer is not None:
+        _async_file_writer.wait()
+
+
+_process_map_func = None
+
+
+def _init_process_map(func):
+    global _process_map_func
+    _process_map_func = func
+
+
+def _run_process_map(item):
+    return _process_map_func(item)
+
+
+def process_map(func, items, num_workers=4, chunksize=1):
+    """
+    list(map(func, items)) on num_workers processes, the results keep the order of the items.
+    func reaches the workers once by fork instead of being pickled with every item, so it can be a closure over the
+    dataset, only the items and results are pickled. Runs in this process for num_workers <= 1 or without fork (Windows)
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    items = list(items)
+    if num_workers <= 1 or len(items) <= 2 or 'fork' not in multiprocessing.get_all_start_methods():
+        return [func(item) for item in items]
+    #the first item runs here before the fork, lazy state (Numba kernels compiled on first call) is inherited by the workers
+    results = [func(items[0])]
+    with ProcessPoolExecutor(min(num_workers, len(items) - 1), mp_context=multiprocessing.get_context('fork'),
+                             initializer=_init_process_map, initargs=(func,)) as executor:
+        return results + list(executor.map(_run_process_map, items[1:], chunksize=chunksize))
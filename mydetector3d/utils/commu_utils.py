@@ -8,6 +8,7 @@ deeply borrow from maskrcnn-benchmark and ST3D
 
 import pickle
 import time
+import warnings
 
 import torch
 import torch.distributed as dist
@@ -112,6 +113,60 @@ def all_gather(data):
         return data_list
 
 
+def get_comm_device():
+    # nccl only moves cuda tensors, gloo works on the cpu
+    if dist.is_available() and dist.is_initialized() and dist.get_backend() == 'nccl':
+        return torch.device('cuda', torch.cuda.current_device())
+    return torch.device('cpu')
+
+
+def gather_bytes_chunked(buffer, chunk_size=64 * 1024 * 1024, dst=0):
+    """
+    Gathers a bytes object of each rank on rank dst with all_gather rounds of at most chunk_size bytes per rank,
+    so the communication buffers stay at world_size * chunk_size whatever the size of the data
+    Args:
+        buffer: bytes, e.g. pickle.dumps of the results of this rank
+        chunk_size: bytes sent by each rank per round
+        dst: rank receiving the data
+    Returns:
+        list[bytes]: buffer of each rank on dst, None on the other ranks
+    """
+    world_size = get_world_size()
+    rank = get_rank()
+    if world_size == 1:
+        return [buffer]
+
+    device = get_comm_device()
+    local_size = torch.LongTensor([len(buffer)]).to(device)
+    size_list = [torch.LongTensor([0]).to(device) for _ in range(world_size)]
+    dist.all_gather(size_list, local_size)
+    size_list = [int(size.item()) for size in size_list]
+    #small payloads (e.g. the recall counters) only need buffers of their own size
+    chunk_size = max(min(chunk_size, max(size_list)), 1)
+    num_rounds = (max(size_list) + chunk_size - 1) // chunk_size
+
+    send_tensor = torch.zeros(chunk_size, dtype=torch.uint8, device=device)
+    recv_tensors = [torch.empty(chunk_size, dtype=torch.uint8, device=device) for _ in range(world_size)]
+    received = [bytearray() for _ in range(world_size)] if rank == dst else None
+    for cur_round in range(num_rounds):
+        start = cur_round * chunk_size
+        piece = buffer[start:start + chunk_size]
+        if len(piece) > 0:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')  # read-only bytes, only copied from
+                send_tensor[:len(piece)].copy_(torch.frombuffer(piece, dtype=torch.uint8))
+        dist.all_gather(recv_tensors, send_tensor)
+        if rank == dst:
+            for k in range(world_size):
+                num_bytes = min(chunk_size, size_list[k] - start)
+                if num_bytes > 0:
+                    received[k] += recv_tensors[k][:num_bytes].cpu().numpy().tobytes()
+
+    if rank != dst:
+        return None
+    return [bytes(data) for data in received]
+
+
 def reduce_dict(input_dict, average=True):
     """
     Args:
@@ -0,0 +1,226 @@
+#Chunked, resumable dataset preparation (infos and gt database of the kitti format datasets) on a process pool.
+#Each stage (infos of a split, gt database of the train split) has a shard dir with the index.json manifest of
+#eval_shard_utils: the frames are cut into chunks of chunk_size, a worker processes a whole chunk and writes
+#shard_%05d.pkl (and the packed object points shard_%05d_points for the gt database) followed by the shard_%05d.json
+#marker. A restart only runs the chunks without marker, the final pkl files are merged from the shards.
+#The gt objects go directly into the packed store of the dbinfos (DB_BACKEND: 'packed'), no object .bin files are written.
+import contextlib
+import hashlib
+import json
+import os
+import pickle
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+from ..ops.roiaware_pool3d import roiaware_pool3d_utils
+from . import common_utils, frame_store_utils
+from .eval_shard_utils import get_pending_shards, get_shard_name, get_shard_range, init_shard_dir, write_file_atomic
+
+
+#dataset config fields that change the infos or the object points (class mapping, DAIR early fusion of get_lidar)
+PREP_CFG_KEYS = ['POINT_FEATURE_ENCODING', 'MAP_CLASS_TO_KITTI', 'Early_Fusion', 'Lidar_Fusion',
+                 'InfrastructureLidar_path', 'I2Vmap_path']
+
+
+def get_keys_digest(keys):
+    return hashlib.md5('\n'.join([str(x) for x in keys]).encode()).hexdigest()
+
+
+def get_dataset_cfg_digest(dataset_cfg):
+    cfg_values = {key: dataset_cfg.get(key, None) for key in PREP_CFG_KEYS}
+    return hashlib.md5(json.dumps(cfg_values, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_num_point_features(dataset):
+    #columns of get_lidar, the raw points before the feature encoding
+    return len(dataset.point_feature_encoder.src_feature_list)
+
+
+def run_chunks(shard_dir, num_items, chunk_size, meta, process_chunk, num_workers=4, desc=''):
+    """
+    Runs process_chunk(shard_id, start, end) for the chunks without marker on num_workers processes and writes the marker
+    Args:
+        process_chunk: writes the shard files of items [start, end), returns a json serializable dict saved in the marker
+        meta: checked against the manifest of an existing shard dir (split, sample ids, options)
+    Returns:
+        index: manifest of the shard dir
+    """
+    shard_dir = Path(shard_dir)
+    index = init_shard_dir(shard_dir, num_items, chunk_size, meta=meta)
+    pending_shards = get_pending_shards(shard_dir, index)
+    print('%s: %d/%d chunks to process' % (desc, len(pending_shards), index['num_shards']))
+
+    def run_chunk(shard_id):
+        start, end = get_shard_range(index, shard_id)
+        with open(os.devnull, 'w') as f, contextlib.redirect_stdout(f): #per-frame prints of get_infos
+            stats = process_chunk(shard_id, start, end)
+        write_file_atomic(shard_dir / (get_shard_name(shard_id) + '.json'), json.dumps(stats), mode='w')
+        print('%s: chunk %d/%d done, frames %d-%d' % (desc, shard_id + 1, index['num_shards'], start, end - 1), flush=True)
+
+    common_utils.process_map(run_chunk, pending_shards, num_workers=num_workers)
+    return index
+
+
+def load_shard_pkls(shard_dir, index):
+    results = []
+    for shard_id in range(index['num_shards']):
+        with open(Path(shard_dir) / (get_shard_name(shard_id) + '.pkl'), 'rb') as f:
+            results.append(pickle.load(f))
+    return results
+
+
+def create_infos(dataset, split, info_path, shard_dir, has_label=True, count_inside_pts=True, chunk_size=256,
+                 num_workers=4):
+    """
+    dataset.get_infos of a split in chunks, merged into info_path
+    Returns:
+        infos: list of the frame infos in the order of the sample id list
+    """
+    dataset.set_split(split)
+    sample_id_list = list(dataset.sample_id_list) if dataset.sample_id_list is not None else []
+    meta = {'split': split, 'has_label': has_label, 'count_inside_pts': count_inside_pts,
+            'sample_ids': get_keys_digest(sample_id_list), 'dataset_cfg': get_dataset_cfg_digest(dataset.dataset_cfg)}
+
+    def process_chunk(shard_id, start, end):
+        infos = dataset.get_infos(num_workers=1, has_label=has_label, count_inside_pts=count_inside_pts,
+                                  sample_id_list=sample_id_list[start:end])
+        write_file_atomic(Path(shard_dir) / (get_shard_name(shard_id) + '.pkl'),
+                          pickle.dumps(infos, protocol=pickle.HIGHEST_PROTOCOL))
+        return {'num_frames': len(infos)}
+
+    index = run_chunks(shard_dir, len(sample_id_list), chunk_size, meta, process_chunk,
+                       num_workers=num_workers, desc='%s infos' % split)
+    infos = [info for chunk_infos in load_shard_pkls(shard_dir, index) for info in chunk_infos]
+    write_file_atomic(info_path, pickle.dumps(infos))
+    print('%s info file of %d frames is saved to %s' % (split, len(infos), info_path))
+    return infos
+
+
+def crop_gt_objects(dataset, info, database_dir, used_classes=None):
+    """
+    Points of the gt boxes of one frame, shifted to the box center (same content as the gt_database .bin files)
+    Returns:
+        db_infos: db_info of each object with a name in used_classes, 'path' is the key in the packed store
+        obj_points_list: (N_k, C) float32 points of each object
+    """
+    sample_idx = info['point_cloud']['lidar_idx']
+    annos = info['annos']
+    names, gt_boxes = annos['name'], annos['gt_boxes_lidar']
+    db_infos, obj_points_list = [], []
+    if gt_boxes.shape[0] == 0:
+        return db_infos, obj_points_list
+
+    points = dataset.get_lidar(sample_idx)
+    box_starts, point_idxs = roiaware_pool3d_utils.points_in_boxes_pairs_cpu(points[:, 0:3], gt_boxes[:, 0:7])
+    for i in range(gt_boxes.shape[0]):
+        if (used_classes is not None) and names[i] not in used_classes:
+            continue
+        gt_points = points[point_idxs[box_starts[i]:box_starts[i + 1]]].astype(np.float32, copy=False)
+        gt_points[:, :3] -= gt_boxes[i, :3]
+
+        db_path = '%s/%s_%s_%d.bin' % (database_dir, sample_idx, names[i], i)
+        db_infos.append({'name': names[i], 'path': db_path, 'image_idx': sample_idx, 'gt_idx': i,
+                         'box3d_lidar': gt_boxes[i], 'num_points_in_gt': gt_points.shape[0],
+                         'difficulty': annos['difficulty'][i], 'bbox': annos['bbox'][i], 'score': annos['score'][i]})
+        obj_points_list.append(gt_points)
+    return db_infos, obj_points_list
+
+
+def create_packed_gt_database(dataset, infos, db_info_path, shard_dir, database_dir='gt_database', used_classes=None,
+                              num_features=None, chunk_size=256, num_workers=4):
+    """
+    Crops the gt objects of infos in chunks and writes db_info_path and its packed store <stem>_packed
+    (the store that DataBaseSampler opens with DB_BACKEND: 'packed')
+    Args:
+        num_features: columns of the object points, default the source features of the dataset
+    """
+    db_info_path = Path(db_info_path)
+    num_features = num_features if num_features is not None else get_num_point_features(dataset)
+    meta = {'frames': get_keys_digest([info['point_cloud']['lidar_idx'] for info in infos]),
+            'used_classes': sorted(used_classes) if used_classes is not None else None,
+            'database_dir': database_dir, 'num_features': num_features,
+            'dataset_cfg': get_dataset_cfg_digest(dataset.dataset_cfg)}
+
+    def get_points_prefix(shard_id):
+        return Path(shard_dir) / (get_shard_name(shard_id) + '_points')
+
+    def process_chunk(shard_id, start, end):
+        db_infos, obj_points_list = [], []
+        for info in infos[start:end]:
+            cur_db_infos, cur_points_list = crop_gt_objects(dataset, info, database_dir, used_classes=used_classes)
+            db_infos += cur_db_infos
+            obj_points_list += cur_points_list
+        frame_store_utils.write_packed_points(
+            get_points_prefix(shard_id), [x['path'] for x in db_infos], obj_points_list, num_features)
+        write_file_atomic(Path(shard_dir) / (get_shard_name(shard_id) + '.pkl'),
+                          pickle.dumps(db_infos, protocol=pickle.HIGHEST_PROTOCOL))
+        return {'num_frames': end - start, 'num_objects': len(db_infos)}
+
+    index = run_chunks(shard_dir, len(infos), chunk_size, meta, process_chunk,
+                       num_workers=num_workers, desc='gt_database')
+    all_db_infos = {}
+    for db_infos in load_shard_pkls(shard_dir, index):
+        for db_info in db_infos:
+            if db_info['name'] in all_db_infos:
+                all_db_infos[db_info['name']].append(db_info)
+            else:
+                all_db_infos[db_info['name']] = [db_info]
+    for k, v in all_db_infos.items():
+        print('Database %s: %d' % (k, len(v)))
+
+    #the dbinfos first, DataBaseSampler repacks from the object files when the store is older than the dbinfos
+    write_file_atomic(db_info_path, pickle.dumps(all_db_infos))
+    frame_store_utils.merge_packed_frame_stores(
+        db_info_path.parent / (db_info_path.stem + '_packed'),
+        [get_points_prefix(shard_id) for shard_id in range(index['num_shards'])]
+    )
+    return all_db_infos
+
+
+def check_gt_database_backend(dataset_cfg):
+    """
+    The sharded prep only writes the packed gt database, warns when the gt_sampling config still reads the object files
+    """
+    aug_configs = dataset_cfg.get('DATA_AUGMENTOR', {}).get('AUG_CONFIG_LIST', [])
+    for aug_cfg in aug_configs:
+        if aug_cfg.get('NAME', None) == 'gt_sampling' and aug_cfg.get('DB_BACKEND', 'file') != 'packed':
+            print('WARNING: gt_sampling has DB_BACKEND: \'%s\' and reads the gt_database object files, the sharded prep '
+                  'only writes the packed store, set DB_BACKEND: \'packed\'' % aug_cfg.get('DB_BACKEND', 'file'))
+
+
+def create_kitti_format_infos(dataset, save_path, train_split='train', val_split='val', test_split='test',
+                              info_prefix='kitti', used_classes=None, chunk_size=256, num_workers=4, keep_shards=True):
+    """
+    Same outputs as create_kitti_infos (<info_prefix>_infos_<split>.pkl, trainval, <info_prefix>_dbinfos_train.pkl),
+    with the gt database packed. The chunks are kept in save_path/prep_shards until keep_shards=False.
+    """
+    save_path = Path(save_path)
+    prep_dir = save_path / 'prep_shards'
+    info_filenames = {split: save_path / ('%s_infos_%s.pkl' % (info_prefix, split))
+                      for split in [train_split, val_split, test_split]}
+
+    check_gt_database_backend(dataset.dataset_cfg)
+    print('---------------Start to generate data infos---------------')
+    infos_train = create_infos(dataset, train_split, info_filenames[train_split], prep_dir / ('infos_%s' % train_split),
+                               chunk_size=chunk_size, num_workers=num_workers)
+    infos_val = create_infos(dataset, val_split, info_filenames[val_split], prep_dir / ('infos_%s' % val_split),
+                             chunk_size=chunk_size, num_workers=num_workers)
+    trainval_filename = save_path / ('%s_infos_trainval.pkl' % info_prefix)
+    write_file_atomic(trainval_filename, pickle.dumps(infos_train + infos_val))
+    print('trainval info file is saved to %s' % trainval_filename)
+    create_infos(dataset, test_split, info_filenames[test_split], prep_dir / ('infos_%s' % test_split),
+                 has_label=False, count_inside_pts=False, chunk_size=chunk_size, num_workers=num_workers)
+
+    print('---------------Start create packed groundtruth database for data augmentation---------------')
+    dataset.set_split(train_split)
+    create_packed_gt_database(
+        dataset, infos_train, save_path / ('%s_dbinfos_%s.pkl' % (info_prefix, train_split)),
+        prep_dir / ('gt_database_%s' % train_split),
+        database_dir='gt_database' if train_split == 'train' else ('gt_database_%s' % train_split),
+        used_classes=used_classes, chunk_size=chunk_size, num_workers=num_workers
+    )
+    if not keep_shards:
+        shutil.rmtree(prep_dir)
+    print('---------------Data preparation Done---------------')
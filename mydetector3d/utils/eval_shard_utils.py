@@ -0,0 +1,291 @@
+#Chunked, resumable evaluation results: the det_annos of the dataset frames [k * shard_size, (k + 1) * shard_size) are
+#pickled to shard_%05d.pkl as soon as the shard is complete, followed by a small shard_%05d.json (frame ids, recall counts,
+#number of predicted objects) that marks the shard as done. index.json holds the layout (number of frames, shard size)
+#and the cfg / ckpt of the run, a restart with the same shard dir only runs the shards without json.
+#Shards are assigned round robin to shard workers (shard_id % num_workers == rank), so several processes on one machine
+#can share the shard dir; ShardedDetAnnos merges the finished shards lazily for dataset.evaluation.
+import copy
+import json
+import os
+import pickle
+from pathlib import Path
+
+import numpy as np
+import torch
+
+INDEX_FILE = 'index.json'
+
+
+def write_file_atomic(path, data, mode='wb'):
+    #the file either exists complete or not at all, a crash while writing leaves a tmp file
+    path = Path(path)
+    tmp_path = path.parent / ('%s.tmp%d' % (path.name, os.getpid()))
+    with open(tmp_path, mode) as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def get_shard_name(shard_id):
+    return 'shard_%05d' % shard_id
+
+
+def load_index(shard_dir):
+    index_file = Path(shard_dir) / INDEX_FILE
+    if not index_file.exists():
+        return None
+    with open(index_file, 'r') as f:
+        return json.load(f)
+
+
+def init_shard_dir(shard_dir, num_frames, shard_size, meta=None):
+    """
+    Creates the shard dir and its index.json, or checks that an existing index has the same layout and meta
+    Returns:
+        index: dict with num_frames, shard_size, num_shards and meta
+    """
+    shard_dir = Path(shard_dir)
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    meta = meta if meta is not None else {}
+    index = load_index(shard_dir)
+    if index is None:
+        index = {
+            'num_frames': int(num_frames), 'shard_size': int(shard_size),
+            'num_shards': int((num_frames + shard_size - 1) // shard_size), 'meta': meta
+        }
+        write_file_atomic(shard_dir / INDEX_FILE, json.dumps(index, indent=2), mode='w')
+        return index
+    if index['num_frames'] != num_frames or index['shard_size'] != shard_size:
+        raise ValueError('%s: shards of %d frames x %d, the run has %d frames x %d, use another shard dir' % (
+            shard_dir, index['num_frames'], index['shard_size'], num_frames, shard_size))
+    for key, val in meta.items():
+        if key in index['meta'] and index['meta'][key] != val:
+            raise ValueError('%s: shards were written with %s=%s, the run has %s=%s' % (
+                shard_dir, key, index['meta'][key], key, val))
+    return index
+
+
+def get_shard_range(index, shard_id):
+    start = shard_id * index['shard_size']
+    return start, min(start + index['shard_size'], index['num_frames'])
+
+
+def is_shard_done(shard_dir, shard_id):
+    return (Path(shard_dir) / (get_shard_name(shard_id) + '.json')).exists()
+
+
+def get_pending_shards(shard_dir, index, rank=0, num_workers=1):
+    return [k for k in range(index['num_shards'])
+            if k % num_workers == rank and not is_shard_done(shard_dir, k)]
+
+
+def load_shard_stats(shard_dir):
+    """
+    Returns:
+        stats: dict shard_id -> content of the shard json of the finished shards
+    """
+    shard_dir = Path(shard_dir)
+    index = load_index(shard_dir)
+    stats = {}
+    for k in range(index['num_shards'] if index is not None else 0):
+        stats_file = shard_dir / (get_shard_name(k) + '.json')
+        if stats_file.exists():
+            with open(stats_file, 'r') as f:
+                stats[k] = json.load(f)
+    return stats
+
+
+def merge_shard_metric(shard_dir):
+    """
+    Returns:
+        metric: summed recall counters (gt_num, recall_roi_*, recall_rcnn_*) of the finished shards
+        total_pred_objects, num_det_frames: summed over the finished shards
+    """
+    metric, total_pred_objects, num_det_frames = {}, 0, 0
+    for stats in load_shard_stats(shard_dir).values():
+        for key, val in stats['metric'].items():
+            metric[key] = metric.get(key, 0) + val
+        total_pred_objects += stats['total_pred_objects']
+        num_det_frames += stats['num_frames']
+    return metric, total_pred_objects, num_det_frames
+
+
+class ShardBatchSampler(object):
+    """
+    Batches of dataset indices that never cross a shard, over the given shards in order
+    (DataLoader(dataset, batch_sampler=...), the last batch of a shard can be smaller)
+    """
+    def __init__(self, shard_ranges, batch_size):
+        self.shard_ranges = shard_ranges
+        self.batch_size = batch_size
+
+    def __iter__(self):
+        for start, end in self.shard_ranges:
+            for batch_start in range(start, end, self.batch_size):
+                yield list(range(batch_start, min(batch_start + self.batch_size, end)))
+
+    def __len__(self):
+        return sum([(end - start + self.batch_size - 1) // self.batch_size for start, end in self.shard_ranges])
+
+
+class ShardedResultWriter(object):
+    """
+    Collects the annos of generate_prediction_dicts batch by batch and writes a shard as soon as all its frames
+    are there. The batches must come from get_batch_sampler (pending shards of this worker, in order).
+    Used in the evaluation loop:
+        writer = ShardedResultWriter(shard_dir, len(dataset), shard_size, meta={'ckpt': ...})
+        dataloader = DataLoader(dataset, batch_sampler=writer.get_batch_sampler(batch_size), ...)
+        for batch_dict in dataloader:
+            ...
+            writer.add_batch(annos, ret_dict)
+    """
+    METRIC_PREFIXES = ('roi_', 'rcnn_')
+
+    def __init__(self, shard_dir, num_frames, shard_size, meta=None, rank=0, num_workers=1):
+        """
+        Args:
+            shard_dir: directory of index.json and the shards
+            num_frames: len(dataset)
+            shard_size: frames per shard
+            meta: e.g. cfg file and checkpoint, a restart with different values is refused
+            rank, num_workers: this process handles the shards with shard_id % num_workers == rank
+        """
+        self.shard_dir = Path(shard_dir)
+        self.index = init_shard_dir(shard_dir, num_frames, shard_size, meta=meta)
+        self.rank = rank
+        self.num_workers = num_workers
+        self.pending_shards = get_pending_shards(self.shard_dir, self.index, rank=rank, num_workers=num_workers)
+        self.cur_pos = 0  #position in pending_shards
+        self.reset_buffer()
+
+    def reset_buffer(self):
+        self.annos = []
+        self.metric = {}
+        self.total_pred_objects = 0
+
+    @property
+    def num_shards(self):
+        return self.index['num_shards']
+
+    @property
+    def num_pending_frames(self):
+        return sum([end - start for start, end in self.get_pending_ranges()])
+
+    def get_pending_ranges(self):
+        return [get_shard_range(self.index, k) for k in self.pending_shards]
+
+    def get_batch_sampler(self, batch_size):
+        return ShardBatchSampler(self.get_pending_ranges(), batch_size)
+
+    @classmethod
+    def is_metric_item(cls, key, val):
+        #only the scalar recall counters 'gt', 'roi_<thr>', 'rcnn_<thr>', the ret_dict also holds gt_boxes / pred_dicts
+        if key != 'gt':
+            prefix = [p for p in cls.METRIC_PREFIXES if key.startswith(p)]
+            if len(prefix) == 0:
+                return False
+            try:
+                float(key[len(prefix[0]):])
+            except ValueError:
+                return False
+        if isinstance(val, torch.Tensor):
+            return val.numel() == 1
+        return isinstance(val, (int, float, np.number))
+
+    def add_batch(self, annos, ret_dict=None):
+        """
+        Args:
+            annos: list of the per-frame annos of generate_prediction_dicts
+            ret_dict: recall counters of the model ('gt', 'roi_0.3', 'rcnn_0.3', ...), summed per shard,
+                other entries (gt_boxes, pred_dicts, infer_time) are ignored
+        Returns:
+            shard_id of the written shard, or None
+        """
+        assert self.cur_pos < len(self.pending_shards), 'all shards of worker %d are written' % self.rank
+        self.annos += annos
+        self.total_pred_objects += sum([len(anno['name']) for anno in annos])
+        for key, val in (ret_dict if ret_dict is not None else {}).items():
+            if self.is_metric_item(key, val):
+                self.metric[key] = self.metric.get(key, 0) + float(val)
+
+        shard_id = self.pending_shards[self.cur_pos]
+        start, end = get_shard_range(self.index, shard_id)
+        assert len(self.annos) <= end - start, 'batch crosses the end of shard %d' % shard_id
+        if len(self.annos) < end - start:
+            return None
+        self.write_shard(shard_id)
+        self.cur_pos += 1
+        self.reset_buffer()
+        return shard_id
+
+    def write_shard(self, shard_id):
+        #pkl first, the json marks the shard as done
+        name = get_shard_name(shard_id)
+        write_file_atomic(self.shard_dir / (name + '.pkl'), pickle.dumps(self.annos, protocol=pickle.HIGHEST_PROTOCOL))
+        #metric keys in the naming of statistics_info
+        metric = {}
+        for key, val in self.metric.items():
+            metric['gt_num' if key == 'gt' else ('recall_' + key)] = val
+        stats = {
+            'shard_id': shard_id, 'num_frames': len(self.annos), 'total_pred_objects': self.total_pred_objects,
+            'metric': metric, 'frame_ids': [str(anno.get('frame_id', '')) for anno in self.annos]
+        }
+        write_file_atomic(self.shard_dir / (name + '.json'), json.dumps(stats), mode='w')
+
+
+class ShardedDetAnnos(object):
+    """
+    Read-only list of the det_annos of all shards, a shard is unpickled when one of its frames is accessed and
+    the last max_cached shards are kept. Sequential passes (kitti eval) load every shard once per pass.
+    Each access returns a copy of the frame anno, edits of a returned anno are not seen by later accesses
+    (the shard may have been evicted). copy.deepcopy materializes a plain list, the in-place transforms of
+    dataset.evaluation (e.g. waymo with eval_metric 'kitti') run on that list.
+    """
+    def __init__(self, shard_dir, max_cached=2):
+        self.shard_dir = Path(shard_dir)
+        self.index = load_index(self.shard_dir)
+        if self.index is None:
+            raise FileNotFoundError('%s has no %s' % (self.shard_dir, INDEX_FILE))
+        missing = self.get_missing_shards()
+        if len(missing) > 0:
+            raise RuntimeError('%s: %d/%d shards are not finished (%s...), rerun the detection to complete them' % (
+                self.shard_dir, len(missing), self.index['num_shards'], ', '.join(map(str, missing[:5]))))
+        self.max_cached = max_cached
+        self.cache = {}
+
+    def get_missing_shards(self):
+        return [k for k in range(self.index['num_shards']) if not is_shard_done(self.shard_dir, k)]
+
+    def load_shard(self, shard_id):
+        if shard_id not in self.cache:
+            if len(self.cache) >= self.max_cached:
+                self.cache.pop(next(iter(self.cache)))
+            with open(self.shard_dir / (get_shard_name(shard_id) + '.pkl'), 'rb') as f:
+                annos = pickle.load(f)
+            start, end = get_shard_range(self.index, shard_id)
+            assert len(annos) == end - start, 'shard %d has %d frames, expected %d' % (shard_id, len(annos), end - start)
+            self.cache[shard_id] = annos
+        return self.cache[shard_id]
+
+    def __len__(self):
+        return self.index['num_frames']
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[k] for k in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError(idx)
+        shard_id = idx // self.index['shard_size']
+        return copy.deepcopy(self.load_shard(shard_id)[idx - shard_id * self.index['shard_size']])
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+
+    def __deepcopy__(self, memo):
+        #dataset.evaluation deepcopies the det_annos before editing them in place, the copy has to hold the edits
+        return self.to_list()
+
+    def to_list(self):
+        return [anno for anno in self]
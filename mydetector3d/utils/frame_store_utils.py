@@ -0,0 +1,215 @@
+#Packed, memory-mapped point cloud storage
+#One flat float32 file per split (<prefix>.bin) plus an offset index (<prefix>_index.npz),
+#so that __getitem__ slices a shared page-cache mapping instead of opening one file per frame.
+#The index is removed before the data file is replaced and saved after it, a store without its index is incomplete.
+import os
+from pathlib import Path
+
+import numpy as np
+
+
+def get_store_files(store_prefix):
+    store_prefix = Path(store_prefix)
+    data_file = store_prefix.parent / (store_prefix.name + '.bin')
+    index_file = store_prefix.parent / (store_prefix.name + '_index.npz')
+    return data_file, index_file
+
+
+def replace_store_data_file(tmp_data_file, data_file, index_file):
+    """
+    Move the new data file in place, the index of the old data is removed first
+    """
+    if index_file.exists():
+        os.remove(index_file)
+    os.replace(tmp_data_file, data_file)
+
+
+def is_store_complete(store_prefix):
+    """
+    Returns:
+        True when the index exists and the size of the data file matches its offsets
+    """
+    data_file, index_file = get_store_files(store_prefix)
+    if not data_file.exists() or not index_file.exists():
+        return False
+    index = np.load(index_file)
+    num_bytes = int(index['offsets'][-1]) * int(index['num_features']) * np.dtype(np.float32).itemsize
+    return os.path.getsize(data_file) == num_bytes
+
+
+def load_points_file(points_file, num_features, num_points=None):
+    """
+    Args:
+        points_file: velodyne .bin (float32) or waymo .npy point file
+        num_features: number of columns stored in the file
+        num_points: optional expected number of points, a .bin file that does not match is read as float64
+            (some gt_database files were saved as float64)
+    Returns:
+        points: (N, num_features) float32
+    """
+    if str(points_file).endswith('.npy'):
+        points = np.load(points_file)
+    else:
+        points = np.fromfile(str(points_file), dtype=np.float32)
+        if num_points is not None and points.shape[0] != num_points * num_features:
+            points = np.fromfile(str(points_file), dtype=np.float64)
+    return points.reshape(-1, num_features).astype(np.float32, copy=False)
+
+
+def write_packed_frame_store(store_prefix, keys, points_files, num_features, num_points_list=None):
+    """
+    Append every points file to one flat data file and save the offset of each frame.
+    Args:
+        store_prefix: output path without suffix, e.g. kitti/kitti_packed_train
+        keys: frame keys used for the lookup, e.g. '000010' or 'segment-xxx___12'
+        points_files: raw point file of each key
+        num_features: number of columns of each point
+        num_points_list: optional expected number of points of each file, see load_points_file
+    Returns:
+        num_points_total
+    """
+    assert len(keys) == len(points_files)
+    data_file, index_file = get_store_files(store_prefix)
+    data_file.parent.mkdir(parents=True, exist_ok=True)
+
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    tmp_data_file = str(data_file) + '.tmp'
+    with open(tmp_data_file, 'wb') as f:
+        for k, points_file in enumerate(points_files):
+            num_points = num_points_list[k] if num_points_list is not None else None
+            points = load_points_file(points_file, num_features, num_points=num_points)
+            points.tofile(f)
+            offsets[k + 1] = offsets[k] + points.shape[0]
+            if (k + 1) % 1000 == 0:
+                print('packed frames: %d/%d' % (k + 1, len(keys)))
+    replace_store_data_file(tmp_data_file, data_file, index_file)
+
+    save_store_index(index_file, keys, offsets, num_features)
+    print('Packed %d frames (%d points) to %s' % (len(keys), offsets[-1], data_file))
+    return int(offsets[-1])
+
+
+def save_store_index(index_file, keys, offsets, num_features):
+    tmp_index_file = str(index_file) + '.tmp'
+    with open(tmp_index_file, 'wb') as f:
+        np.savez(f, keys=np.array(keys, dtype=str), offsets=offsets, num_features=np.array(num_features, dtype=np.int64))
+    os.replace(tmp_index_file, index_file)
+
+
+def write_packed_points(store_prefix, keys, points_list, num_features):
+    """
+    Same store as write_packed_frame_store from in-memory arrays (e.g. the cropped gt objects of a chunk)
+    Args:
+        keys: key of each array
+        points_list: (N_k, num_features) arrays
+    """
+    assert len(keys) == len(points_list)
+    data_file, index_file = get_store_files(store_prefix)
+    data_file.parent.mkdir(parents=True, exist_ok=True)
+
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    tmp_data_file = str(data_file) + '.tmp'
+    with open(tmp_data_file, 'wb') as f:
+        for k, points in enumerate(points_list):
+            assert points.shape[1] == num_features
+            points.astype(np.float32, copy=False).tofile(f)
+            offsets[k + 1] = offsets[k] + points.shape[0]
+    replace_store_data_file(tmp_data_file, data_file, index_file)
+    save_store_index(index_file, keys, offsets, num_features)
+    return int(offsets[-1])
+
+
+def merge_packed_frame_stores(store_prefix, part_prefixes, chunk_bytes=64 * 1024 * 1024):
+    """
+    Concatenate packed stores into one store, the data files are copied in chunks and the offsets shifted
+    Args:
+        store_prefix: output store
+        part_prefixes: input stores with the same num_features, the keys must be unique over all parts
+    Returns:
+        num_points_total
+    """
+    data_file, index_file = get_store_files(store_prefix)
+    data_file.parent.mkdir(parents=True, exist_ok=True)
+    keys, offsets_list, num_features = [], [np.zeros(1, dtype=np.int64)], None
+
+    tmp_data_file = str(data_file) + '.tmp'
+    with open(tmp_data_file, 'wb') as f:
+        for part_prefix in part_prefixes:
+            part_data_file, part_index_file = get_store_files(part_prefix)
+            index = np.load(part_index_file)
+            if num_features is None:
+                num_features = int(index['num_features'])
+            assert int(index['num_features']) == num_features, '%s: num_features do not match' % part_prefix
+            keys += index['keys'].tolist()
+            offsets_list.append(index['offsets'][1:] + offsets_list[-1][-1])
+            with open(part_data_file, 'rb') as part_f:
+                while True:
+                    data = part_f.read(chunk_bytes)
+                    if not data:
+                        break
+                    f.write(data)
+    replace_store_data_file(tmp_data_file, data_file, index_file)
+
+    assert len(set(keys)) == len(keys), 'duplicated keys in %s' % store_prefix
+    offsets = np.concatenate(offsets_list)
+    save_store_index(index_file, keys, offsets, num_features if num_features is not None else 0)
+    print('Merged %d stores (%d frames, %d points) to %s' % (len(part_prefixes), len(keys), offsets[-1], data_file))
+    return int(offsets[-1])
+
+
+class PackedFrameStore(object):
+    """
+    Read-only lookup of frames packed by write_packed_frame_store.
+    The data files are memory-mapped lazily in each process (DataLoader workers share the page cache),
+    get() returns a zero-copy view of the frame.
+    """
+    def __init__(self, store_prefixes):
+        self.store_prefixes = [Path(x) for x in store_prefixes]
+        self.key_to_frame = {} #key -> (store_id, start, end)
+        self.num_features = []
+        for store_id, store_prefix in enumerate(self.store_prefixes):
+            data_file, index_file = get_store_files(store_prefix)
+            assert data_file.exists() and index_file.exists(), 'packed frame store not found: %s' % store_prefix
+            assert is_store_complete(store_prefix), \
+                'the size of %s does not match %s, recreate the packed frame store' % (data_file, index_file)
+            index = np.load(index_file)
+            offsets = index['offsets']
+            for k, key in enumerate(index['keys'].tolist()):
+                self.key_to_frame[key] = (store_id, int(offsets[k]), int(offsets[k + 1]))
+            self.num_features.append(int(index['num_features']))
+        self.data_list = None
+
+    def __getstate__(self):
+        d = dict(self.__dict__)
+        d['data_list'] = None #re-map in the worker process
+        return d
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+
+    def __len__(self):
+        return len(self.key_to_frame)
+
+    def __contains__(self, key):
+        return key in self.key_to_frame
+
+    def open(self):
+        self.data_list = []
+        for store_prefix, num_features in zip(self.store_prefixes, self.num_features):
+            data_file, _ = get_store_files(store_prefix)
+            data = np.memmap(data_file, dtype=np.float32, mode='r')
+            self.data_list.append(data.reshape(-1, num_features))
+
+    def get(self, key, copy=False):
+        """
+        Args:
+            key: frame key
+            copy: the returned view is read-only, set copy=True when the points are modified in place
+        Returns:
+            points: (N, num_features)
+        """
+        if self.data_list is None:
+            self.open()
+        store_id, start, end = self.key_to_frame[key]
+        points = self.data_list[store_id][start:end]
+        return np.array(points) if copy else points
@@ -0,0 +1,233 @@
+#Indexed, memory-mapped replacement of the info pkl lists (kitti_infos_*.pkl, waymo sequence pkls)
+#Fixed-size leaf fields (lidar_idx, image_shape, calib matrices, pose...) are saved as one struct-of-arrays .npy per field,
+#the remaining variable-size fields (annos, ...) are pickled per frame into one blob and only decoded when the frame is accessed.
+#All files are memory-mapped read-only, so DataLoader workers share the pages instead of copying Python object graphs.
+import os
+import pickle
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+FIELD_SEP = '.'
+
+
+def get_info_store_dir(info_path):
+    info_path = Path(info_path)
+    return info_path.parent / (info_path.stem + '_store')
+
+
+def flatten_info(info, prefix=''):
+    fields = {}
+    for key, val in info.items():
+        path = prefix + str(key)
+        if isinstance(val, dict) and len(val) > 0:
+            fields.update(flatten_info(val, path + FIELD_SEP))
+        else:
+            fields[path] = val
+    return fields
+
+
+def get_field_kind(val):
+    #numpy values keep their full dtype (float32 / float64, <U5 / <U7 are different kinds), so the stacked fields round-trip
+    if isinstance(val, np.ndarray):
+        if val.dtype == object:
+            return None
+        return ('array', val.shape, val.dtype.str)
+    if isinstance(val, np.generic):
+        return ('numpy_scalar', (), val.dtype.str)
+    if isinstance(val, bool):
+        return ('scalar', (), 'b')
+    if isinstance(val, int):
+        return ('scalar', (), 'i')
+    if isinstance(val, float):
+        return ('scalar', (), 'f')
+    if isinstance(val, str):
+        return ('scalar', (), 'U')
+    return None
+
+
+def set_field(info, path, val):
+    keys = path.split(FIELD_SEP)
+    cur = info
+    for key in keys[:-1]:
+        cur = cur.setdefault(key, {})
+    cur[keys[-1]] = val
+
+
+def remove_field(info, path):
+    keys = path.split(FIELD_SEP)
+    parents = [info]
+    for key in keys[:-1]:
+        parents.append(parents[-1][key])
+    parents[-1].pop(keys[-1])
+    for k in range(len(keys) - 2, -1, -1): #remove the emptied parent dicts
+        if len(parents[k + 1]) == 0:
+            parents[k].pop(keys[k])
+
+
+def write_info_store(store_dir, infos):
+    """
+    Args:
+        store_dir: output folder of the store
+        infos: list of info dicts (content of the info pkl files)
+    """
+    store_dir = Path(store_dir)
+    store_dir.mkdir(parents=True, exist_ok=True)
+    num_infos = len(infos)
+    flat_infos = [flatten_info(info) for info in infos]
+
+    #a field goes to the struct-of-arrays part if every frame has it with the same kind, shape and dtype
+    field_kinds = {}
+    if num_infos > 0:
+        for path, val in flat_infos[0].items():
+            field_kinds[path] = get_field_kind(val)
+        for flat_info in flat_infos[1:]:
+            for path in list(field_kinds.keys()):
+                if field_kinds[path] is None or path not in flat_info \
+                        or get_field_kind(flat_info[path]) != field_kinds[path]:
+                    field_kinds.pop(path)
+    field_kinds = {path: kind for path, kind in field_kinds.items() if kind is not None}
+
+    fields = {}
+    for path, kind in field_kinds.items():
+        values = np.stack([np.asarray(flat_info[path]) for flat_info in flat_infos], axis=0)
+        np.save(store_dir / ('%s.npy' % path), values)
+        fields[path] = kind[0]
+
+    blob_offsets = np.zeros(num_infos + 1, dtype=np.int64)
+    with open(store_dir / 'blob.bin', 'wb') as f:
+        for k, info in enumerate(infos):
+            residual_info = pickle.loads(pickle.dumps(info))
+            for path in fields:
+                remove_field(residual_info, path)
+            data = pickle.dumps(residual_info, protocol=pickle.HIGHEST_PROTOCOL)
+            f.write(data)
+            blob_offsets[k + 1] = blob_offsets[k] + len(data)
+    np.save(store_dir / 'blob_offsets.npy', blob_offsets)
+
+    with open(store_dir / 'meta.pkl', 'wb') as f:
+        pickle.dump({'num_infos': num_infos, 'fields': fields}, f)
+    return store_dir
+
+
+def write_info_store_atomic(store_dir, infos, extra_files=None):
+    """
+    write_info_store to a temporary folder that replaces store_dir, so other processes never open a half written store
+    Args:
+        extra_files: dict file name -> text written into the store before it is moved in place
+    """
+    store_dir = Path(store_dir)
+    tmp_store_dir = store_dir.parent / ('%s.tmp%d' % (store_dir.name, os.getpid()))
+    write_info_store(tmp_store_dir, infos)
+    for name, text in (extra_files if extra_files is not None else {}).items():
+        (tmp_store_dir / name).write_text(text)
+    if store_dir.exists():
+        shutil.rmtree(store_dir, ignore_errors=True)
+    os.replace(tmp_store_dir, store_dir)
+    return store_dir
+
+
+def create_info_store_from_pkl(info_path, store_dir=None):
+    """
+    Convert an info pkl file to the indexed store once, the store is rebuilt when the pkl file is newer.
+    Call it on one process per machine (local rank 0), the other ranks open the store after a barrier.
+    """
+    info_path = Path(info_path)
+    store_dir = Path(store_dir) if store_dir is not None else get_info_store_dir(info_path)
+    meta_file = store_dir / 'meta.pkl'
+    if meta_file.exists() and os.path.getmtime(meta_file) >= os.path.getmtime(info_path):
+        return store_dir
+
+    with open(info_path, 'rb') as f:
+        infos = pickle.load(f)
+    return write_info_store_atomic(store_dir, infos)
+
+
+class InfoStore(object):
+    """
+    Sequence of info dicts backed by one or more store folders, infos[index] decodes a new dict for the frame.
+    Slicing (e.g. infos[::sampled_interval]) and take(indices) return views sharing the same memory maps.
+    """
+    def __init__(self, store_dirs, indices=None):
+        self.store_dirs = [Path(x) for x in store_dirs]
+        self.metas = []
+        for store_dir in self.store_dirs:
+            with open(store_dir / 'meta.pkl', 'rb') as f:
+                self.metas.append(pickle.load(f))
+        self.part_offsets = np.cumsum([0] + [meta['num_infos'] for meta in self.metas])
+        self.indices = indices #None: all frames in order
+        self.parts = None
+
+    def __getstate__(self):
+        d = dict(self.__dict__)
+        d['parts'] = None #re-map in the worker process
+        return d
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+
+    def open(self):
+        self.parts = []
+        for store_dir, meta in zip(self.store_dirs, self.metas):
+            part = {
+                'fields': {path: np.load(store_dir / ('%s.npy' % path), mmap_mode='r') for path in meta['fields']},
+                'blob_offsets': np.load(store_dir / 'blob_offsets.npy', mmap_mode='r'),
+                'blob': np.memmap(store_dir / 'blob.bin', dtype=np.uint8, mode='r')
+                if meta['num_infos'] > 0 and os.path.getsize(store_dir / 'blob.bin') > 0 else None,
+            }
+            self.parts.append(part)
+
+    def __len__(self):
+        return int(self.part_offsets[-1]) if self.indices is None else len(self.indices)
+
+    def get_global_indices(self):
+        return np.arange(self.part_offsets[-1]) if self.indices is None else self.indices
+
+    def take(self, indices):
+        indices = self.get_global_indices()[np.asarray(indices, dtype=np.int64)]
+        return InfoStore(self.store_dirs, indices=indices)
+
+    def decode(self, global_index):
+        if self.parts is None:
+            self.open()
+        part_id = int(np.searchsorted(self.part_offsets, global_index, side='right')) - 1
+        local_index = global_index - self.part_offsets[part_id]
+        part, meta = self.parts[part_id], self.metas[part_id]
+
+        start, end = part['blob_offsets'][local_index], part['blob_offsets'][local_index + 1]
+        info = pickle.loads(part['blob'][start:end].tobytes()) if end > start else {}
+        for path, kind in meta['fields'].items():
+            val = part['fields'][path][local_index]
+            if kind == 'array':
+                val = np.array(val)
+            elif kind == 'scalar':
+                val = val.item()
+            set_field(info, path, val)
+        return info
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(np.arange(len(self))[index])
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('info index out of range')
+        global_index = index if self.indices is None else int(self.indices[index])
+        return self.decode(global_index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def get_field(self, path):
+        """
+        Returns:
+            values of a fixed-size field for all frames of this view without decoding the infos, None if not indexed
+        """
+        if self.parts is None:
+            self.open()
+        if any(path not in meta['fields'] for meta in self.metas):
+            return None
+        values = np.concatenate([np.asarray(part['fields'][path]) for part in self.parts], axis=0)
+        return values if self.indices is None else values[self.indices]
@@ -3,7 +3,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-from . import box_utils
+from . import box_utils, common_utils
 from mydetector3d.ops.iou3d_nms import iou3d_nms_utils
 
 
@@ -95,7 +95,7 @@ class WeightedSmoothL1Loss(nn.Module):
         self.beta = beta
         if code_weights is not None:
             self.code_weights = np.array(code_weights, dtype=np.float32)
-            self.code_weights = torch.from_numpy(self.code_weights).cuda()
+            self.code_weights = common_utils.cuda_if_available(torch.from_numpy(self.code_weights))
 
     @staticmethod
     def smooth_l1_loss(diff, beta):
@@ -147,7 +147,7 @@ class WeightedL1Loss(nn.Module):
         super(WeightedL1Loss, self).__init__()
         if code_weights is not None:
             self.code_weights = np.array(code_weights, dtype=np.float32)
-            self.code_weights = torch.from_numpy(self.code_weights).cuda()
+            self.code_weights = common_utils.cuda_if_available(torch.from_numpy(self.code_weights))
 
     @torch.cuda.amp.custom_fwd(cast_inputs=torch.float16)
     def forward(self, input: torch.Tensor, target: torch.Tensor, weights: torch.Tensor = None):
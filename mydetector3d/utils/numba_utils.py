@@ -0,0 +1,29 @@
+#The parallel=True kernels (points_in_boxes_dense, CPU NMS, kitti eval overlaps) may run in the main process before the
+#DataLoader / common_utils.process_map workers are forked. With the TBB threading layer the interpreter then hangs at exit.
+#The workqueue layer is fork safe but not thread safe, so it is opt-in: the fork based tools (dataset prep,
+#benchmark_data_pipeline) select it in their main, processes launching kernels from several threads (DataPrefetcher) must not.
+import os
+
+import numba
+
+
+def set_fork_safe_threading_layer():
+    """
+    Selects the workqueue threading layer, called by the fork based tools before the first parallel kernel is launched.
+    A layer chosen with the NUMBA_THREADING_LAYER environment variable is kept
+    Returns:
+        True if workqueue was selected
+    """
+    if 'NUMBA_THREADING_LAYER' in os.environ:
+        return False
+    numba.config.THREADING_LAYER = 'workqueue'
+    return True
+
+
+def check_thread_safe_threading_layer():
+    """
+    Raises when the workqueue layer is selected, it aborts the process when kernels are launched from several threads
+    """
+    if numba.config.THREADING_LAYER == 'workqueue':
+        raise RuntimeError('the numba workqueue threading layer is not thread safe, do not use '
+                           'set_fork_safe_threading_layer / NUMBA_THREADING_LAYER=workqueue with background threads')
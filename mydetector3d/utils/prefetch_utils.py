@@ -0,0 +1,161 @@
+import queue
+import threading
+import time
+
+import numpy as np
+import torch
+
+from . import numba_utils
+
+
+def pin_batch_dict(batch_dict):
+    """
+    Copies the numeric numpy arrays of the batch that are not in pinned memory yet into pinned buffers (in place,
+    the values stay numpy). The batches of DataLoader workers are not pinned: the workers can not allocate CUDA host
+    memory and the pin_memory thread of the DataLoader leaves numpy arrays alone.
+    """
+    for key, val in batch_dict.items():
+        if isinstance(val, np.ndarray) and val.dtype.kind in 'biuf' and val.size > 0:
+            tensor = torch.from_numpy(np.ascontiguousarray(val))
+            if not tensor.is_pinned():
+                batch_dict[key] = tensor.pin_memory().numpy()
+    return batch_dict
+
+
+class DataPrefetcher(object):
+    """
+    Wraps a DataLoader: a background thread takes the next batch and runs load_func on it (e.g. load_data_to_gpu)
+    while the current batch is processed. On a CUDA device the copies are issued on a side stream and the
+    consumer stream waits on an event, on the CPU the conversion just runs in the thread. For cuda devices the
+    numpy arrays of the batch are pinned first (pin_batch_dict), so the non_blocking copies of load_func are async.
+    Used like the DataLoader (len, iter, dataset), load_func is a no-op on the already converted batches.
+    """
+    END = object()
+
+    def __init__(self, loader, load_func, device=None, num_prefetch=1):
+        """
+        Args:
+            loader: DataLoader (or any iterable of batch dicts)
+            load_func: load_func(batch_dict) converts / moves the batch in place
+            device: torch device of the model, a side CUDA stream is used for cuda devices
+            num_prefetch: batches prepared ahead of the current one
+        """
+        self.loader = loader
+        self.load_func = load_func
+        self.device = torch.device(device) if device is not None else torch.device('cpu')
+        self.num_prefetch = num_prefetch
+        self.stream = torch.cuda.Stream(device=self.device) if self.device.type == 'cuda' else None
+
+        self.queue = None
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.reset_stats()
+
+    @property
+    def dataset(self):
+        return self.loader.dataset
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        numba_utils.check_thread_safe_threading_layer() #the thread may run numba kernels (e.g. gt sampling NMS)
+        self.close()
+        self.queue = queue.Queue(maxsize=self.num_prefetch)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.prefetch_worker, args=(iter(self.loader), self.queue, self.stop_event))
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __next__(self):
+        if self.thread is None:
+            iter(self)
+        start_time = time.time()
+        item = self.queue.get()
+        self.wait_time += time.time() - start_time
+        if item is self.END:
+            self.close()
+            raise StopIteration
+        if isinstance(item, BaseException):
+            self.close()
+            raise item
+
+        batch_dict, event = item
+        if event is not None:
+            cur_stream = torch.cuda.current_stream(self.device)
+            cur_stream.wait_event(event)
+            for val in batch_dict.values():
+                if isinstance(val, torch.Tensor) and val.is_cuda:
+                    val.record_stream(cur_stream) #allocated on the side stream, used on the current one
+        self.num_batches += 1
+        return batch_dict
+
+    def prefetch_worker(self, loader_iter, batch_queue, stop_event):
+        if self.stream is not None:
+            torch.cuda.set_device(self.device) #the current device is per thread
+        while not stop_event.is_set():
+            start_time = time.time()
+            try:
+                batch_dict = next(loader_iter)
+                if self.stream is not None:
+                    pin_batch_dict(batch_dict)
+                    with torch.cuda.stream(self.stream):
+                        self.load_func(batch_dict)
+                        event = torch.cuda.Event()
+                        event.record(self.stream)
+                else:
+                    self.load_func(batch_dict)
+                    event = None
+                item = (batch_dict, event)
+            except StopIteration:
+                item = self.END
+            except Exception as e:
+                item = e
+            self.load_time += time.time() - start_time
+
+            while not stop_event.is_set():
+                try:
+                    batch_queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if not isinstance(item, tuple):
+                return
+
+    def close(self):
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        while self.thread.is_alive():
+            try:
+                self.queue.get_nowait() #unblock a pending put
+            except queue.Empty:
+                pass
+            self.thread.join(timeout=0.1)
+        self.thread = None
+
+    def reset_stats(self):
+        self.load_time = 0.0 #fetch + load_func time of the background thread
+        self.wait_time = 0.0 #time the consumer was blocked in __next__
+        self.num_batches = 0
+
+    def get_stats(self):
+        """
+        Returns:
+            load_time, wait_time and hidden_time (data time overlapped with the consumer) in seconds
+        """
+        hidden_time = max(self.load_time - self.wait_time, 0.0)
+        return {
+            'num_batches': self.num_batches,
+            'load_time': self.load_time,
+            'wait_time': self.wait_time,
+            'hidden_time': hidden_time,
+            'hidden_ratio': hidden_time / max(self.load_time, 1e-6),
+        }
+
+    def log_stats(self, logger, prefix='Prefetch'):
+        stats = self.get_stats()
+        logger.info('%s: %d batches, data time %.2fs, waited %.2fs, hidden %.2fs (%.1f%%)' % (
+            prefix, stats['num_batches'], stats['load_time'], stats['wait_time'], stats['hidden_time'],
+            stats['hidden_ratio'] * 100))
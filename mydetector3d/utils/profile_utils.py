@@ -0,0 +1,196 @@
+import json
+import time
+
+import numpy as np
+import torch
+
+
+class ModuleProfiler(object):
+    """
+    Per-stage latency of a Detector3DTemplate model: forward hooks on the modules of model.module_list (named
+    after module_topology: vfe, backbone_3d, map_to_bev_module, backbone_2d, dense_head, roi_head ...) and a wrapper
+    of model.post_processing, the model itself is not changed. On a CUDA device the stages are timed with cuda
+    events (one synchronize per batch) and the peak allocated memory of each stage is recorded.
+    Used around the forward call:
+        profiler.start_batch()
+        pred_dicts, ret_dict = model(batch_dict)
+        profiler.end_batch(batch_dict)
+    """
+    PERCENTILES = [50, 90, 99]
+
+    def __init__(self, model, device=None):
+        """
+        Args:
+            model: Detector3DTemplate, or a DistributedDataParallel wrapping one
+            device: torch device of the model, cuda events and memory stats are used for cuda devices
+        """
+        self.model = model.module if hasattr(model, 'module') else model
+        self.device = torch.device(device) if device is not None else next(self.model.parameters()).device
+        self.use_cuda = self.device.type == 'cuda'
+        self.stage_names = []
+        self.handles = []
+        self.post_processing = None
+        self.reset()
+
+    def reset(self):
+        self.times = {}  # stage -> list of ms per batch
+        self.peak_memory = {}  # stage -> max allocated bytes
+        self.num_points, self.num_voxels = [], []
+        self.cur_events = None
+        self.enabled = False
+
+    def get_stage_name(self, module):
+        for name in getattr(self.model, 'module_topology', []):
+            if getattr(self.model, name, None) is module:
+                return name
+        return module.__class__.__name__
+
+    def attach(self):
+        self.detach()
+        self.stage_names = []
+        for module in self.model.module_list:
+            name = self.get_stage_name(module)
+            self.stage_names.append(name)
+            self.handles.append(module.register_forward_pre_hook(self.get_pre_hook(name)))
+            self.handles.append(module.register_forward_hook(self.get_post_hook(name)))
+        self.stage_names.append('post_processing')
+        self.post_processing = self.model.post_processing
+
+        def post_processing(*args, **kwargs):
+            self.stage_start('post_processing')
+            ret = self.post_processing(*args, **kwargs)
+            self.stage_end('post_processing')
+            return ret
+
+        self.model.post_processing = post_processing  # instance attribute, removed in detach
+        return self
+
+    def detach(self):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+        if self.post_processing is not None:
+            del self.model.post_processing
+            self.post_processing = None
+
+    def get_pre_hook(self, name):
+        def hook(module, inputs):
+            self.stage_start(name)
+        return hook
+
+    def get_post_hook(self, name):
+        def hook(module, inputs, outputs):
+            self.stage_end(name)
+        return hook
+
+    def record(self):
+        if self.use_cuda:
+            event = torch.cuda.Event(enable_timing=True)
+            event.record()
+            return event
+        return time.perf_counter()
+
+    def stage_start(self, name):
+        if not self.enabled:
+            return
+        if self.use_cuda:
+            torch.cuda.reset_peak_memory_stats(self.device)
+        self.cur_events[name] = [self.record(), None]
+
+    def stage_end(self, name):
+        if not self.enabled or name not in self.cur_events:
+            return
+        self.cur_events[name][1] = self.record()
+        if self.use_cuda:
+            self.peak_memory[name] = max(self.peak_memory.get(name, 0), torch.cuda.max_memory_allocated(self.device))
+
+    def start_batch(self, enabled=True):
+        """enabled=False skips the batch, e.g. warm up iterations"""
+        self.enabled = enabled
+        self.cur_events = {}
+        if enabled:
+            self.cur_events['total'] = [self.record(), None]
+
+    def end_batch(self, batch_dict=None):
+        if not self.enabled:
+            return
+        self.cur_events['total'][1] = self.record()
+        if self.use_cuda:
+            torch.cuda.synchronize(self.device)
+        for name, (start, end) in self.cur_events.items():
+            if end is None:
+                continue
+            elapsed = start.elapsed_time(end) if self.use_cuda else (end - start) * 1000
+            self.times.setdefault(name, []).append(elapsed)
+        if batch_dict is not None:
+            if 'points' in batch_dict:
+                self.num_points.append(int(batch_dict['points'].shape[0]))
+            voxels = batch_dict.get('voxels', batch_dict.get('voxel_coords', None))
+            if voxels is not None:
+                self.num_voxels.append(int(voxels.shape[0]))
+        self.enabled = False
+
+    @property
+    def num_batches(self):
+        return len(self.times.get('total', []))
+
+    def summary(self):
+        """
+        Returns:
+            result: dict stage -> mean / p50 / p90 / p99 / max ms (and peak_memory_mb on cuda), and the
+                per-batch point / voxel counts
+        """
+        def get_stats(values):
+            values = np.array(values, dtype=np.float64)
+            stats = {'mean': float(values.mean()), 'max': float(values.max())}
+            for p in self.PERCENTILES:
+                stats['p%d' % p] = float(np.percentile(values, p))
+            return stats
+
+        stages = {}
+        for name in self.stage_names + ['total']:
+            if len(self.times.get(name, [])) == 0:
+                continue
+            stages[name] = get_stats(self.times[name])
+            if name in self.peak_memory:
+                stages[name]['peak_memory_mb'] = self.peak_memory[name] / 1024 ** 2
+        result = {'num_batches': self.num_batches, 'device': str(self.device), 'stages': stages}
+        if len(self.num_points) > 0:
+            result['num_points'] = get_stats(self.num_points)
+        if len(self.num_voxels) > 0:
+            result['num_voxels'] = get_stats(self.num_voxels)
+        return result
+
+    def get_result_str(self):
+        result = self.summary()
+        lines = ['Module latency (%d batches, %s), ms:' % (result['num_batches'], result['device'])]
+        lines.append('%-20s %9s %9s %9s %9s %12s' % ('stage', 'mean', 'p50', 'p90', 'p99', 'peak mem MB'))
+        for name, stats in result['stages'].items():
+            lines.append('%-20s %9.2f %9.2f %9.2f %9.2f %12s' % (
+                name, stats['mean'], stats['p50'], stats['p90'], stats['p99'],
+                '%.1f' % stats['peak_memory_mb'] if 'peak_memory_mb' in stats else '-'))
+        for key in ['num_points', 'num_voxels']:
+            if key in result:
+                lines.append('%s per batch: mean %.0f, p50 %.0f, p99 %.0f, max %.0f' % (
+                    key, result[key]['mean'], result[key]['p50'], result[key]['p99'], result[key]['max']))
+        return '\n'.join(lines)
+
+    def save_json(self, path, meta=None):
+        """meta: e.g. cfg file and checkpoint, stored with the summary to compare runs"""
+        result = self.summary()
+        result['batch_times_ms'] = self.times
+        result['meta'] = meta if meta is not None else {}
+        with open(path, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    def add_to_tensorboard(self, tb_log, step=0, prefix='profile'):
+        result = self.summary()
+        for name, stats in result['stages'].items():
+            for key, val in stats.items():
+                tb_log.add_scalar('%s/%s_%s' % (prefix, name, key), val, step)
+        for key in ['num_points', 'num_voxels']:
+            if key in result:
+                tb_log.add_scalar('%s/%s_mean' % (prefix, key), result[key]['mean'], step)
+        for name, values in self.times.items():
+            for i, val in enumerate(values):
+                tb_log.add_scalar('%s_batch/%s' % (prefix, name), val, i)